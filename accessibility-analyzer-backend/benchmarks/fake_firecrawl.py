@@ -0,0 +1,79 @@
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response
+from urllib.parse import urlsplit
+from benchmarks.fixtures import FixtureSet
+import asyncio
+import random
+import socket
+import threading
+import time
+import uvicorn
+
+# Stand-in for the Firecrawl v2 scrape API (as called by the firecrawl-py SDK). The scraped URL selects the fixture by its
+# first path segment (https://bench.test/<fixture>/<id>); the id is written into the page
+# so that every URL has its own content and report cache entry. Screenshots are served
+# from this server, like the screenshot URLs the real API returns. The same pages are
+# also served as a plain website under /pages/<fixture>/<id>, for the direct-fetch path.
+
+
+def create_fake_firecrawl(fixtures: FixtureSet, latency_seconds: float = 0.0, error_rate: float = 0.0) -> FastAPI:
+    app = FastAPI()
+    app.state.scrapes = 0
+    app.state.page_fetches = 0
+
+    def page_html(url_path: str) -> tuple:
+        segments = [segment for segment in url_path.split("/") if segment]
+        if segments[:1] == ["pages"]:
+            segments = segments[1:]
+        name = segments[0] if segments and segments[0] in fixtures.html else fixtures.names[0]
+        page_id = segments[1] if len(segments) > 1 else "0"
+        return name, fixtures.html[name].replace("<body>", f"<body><p>Benchmark page {page_id}</p>", 1)
+
+    @app.post("/v2/scrape")
+    async def scrape(request: Request):
+        body = await request.json()
+        app.state.scrapes += 1
+        if latency_seconds:
+            await asyncio.sleep(latency_seconds * random.uniform(0.5, 1.5))
+        if error_rate and random.random() < error_rate:
+            raise HTTPException(status_code=500, detail="Simulated scrape failure.")
+
+        name, html = page_html(urlsplit(body["url"]).path)
+        data = {"rawHtml": html}
+        if "screenshot" in body.get("formats", []) and name in fixtures.screenshots:
+            data["screenshot"] = f"{request.base_url}screenshots/{name}.png"
+        return {"success": True, "data": data}
+
+    @app.get("/pages/{name}/{page_id}")
+    async def page(request: Request):
+        app.state.page_fetches += 1
+        if latency_seconds:
+            await asyncio.sleep(latency_seconds * random.uniform(0.05, 0.15))  # a plain page load, no browser rendering
+        return Response(content=page_html(request.url.path)[1], media_type="text/html; charset=utf-8")
+
+    @app.get("/screenshots/{name}.png")
+    async def screenshot(name: str):
+        if name not in fixtures.screenshots:
+            raise HTTPException(status_code=404, detail="Unknown fixture.")
+        return Response(content=fixtures.screenshots[name], media_type="image/png")
+
+    return app
+
+
+def start_fake_firecrawl(app: FastAPI) -> tuple:
+    """
+    Serves `app` on a free local port from a background thread, so its work does not
+    run on (and distort the measurements of) the event loop under test.
+    Returns (base URL, uvicorn server); set `server.should_exit = True` to stop it.
+    """
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError("Fake Firecrawl server did not start.")
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}", server
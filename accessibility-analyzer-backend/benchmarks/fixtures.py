@@ -0,0 +1,100 @@
+from io import BytesIO
+from typing import Dict, Optional
+from PIL import Image, ImageDraw
+import os
+import random
+
+# Page fixtures served by the fake Firecrawl. Recorded fixtures are `<name>.html` files
+# (with an optional `<name>.png` full-page screenshot) in a fixtures directory; without
+# one, pages of three sizes are generated: a landing page, a category page and a very
+# large catalogue/documentation page that exceeds the HTML token budget.
+
+# name -> (product cards, documentation sections, screenshot height in pixels)
+GENERATED_SIZES = {
+    "small": (12, 2, 2400),
+    "medium": (150, 12, 6000),
+    "large": (900, 60, 12000),
+}
+SCREENSHOT_WIDTH = 1280
+
+
+def _generate_html(cards: int, sections: int, seed: int) -> str:
+    rng = random.Random(seed)
+    words = ["accessible", "product", "quality", "design", "premium", "delivery", "support", "colour", "size", "review"]
+
+    def text(count: int) -> str:
+        return " ".join(rng.choice(words) for _ in range(count))
+
+    parts = [
+        "<!DOCTYPE html><html><head><title>Benchmark page</title><style>body{font-family:sans-serif}</style>",
+        "<script>window.__STATE__ = {};</script></head><body>",
+        '<header class="site-header"><a href="/"><img src="/logo.png"></a><nav class="main-nav"><ul>',
+        "".join(f'<li><a href="/c/{index}">{text(2)}</a></li>' for index in range(12)),
+        '</ul></nav><form class="search"><input type="search" name="q"><button>Go</button></form></header>',
+        '<div id="content"><h1>Benchmark catalogue</h1><h3>Featured</h3><div class="grid">',
+    ]
+    for index in range(cards):
+        # Varying classes keep neighbouring cards from collapsing into one repeated run.
+        parts.append(
+            f'<div class="card variant-{index % 7}"><img src="/p/{index}.jpg" alt="{"IMG_" + str(index) + ".jpg" if index % 5 == 0 else text(4)}">'
+            f'<h4>{text(3)}</h4><p>{text(rng.randint(10, 40))}</p><span class="price">{rng.randint(5, 500)}.99</span>'
+            f'<a href="/p/{index}">{"Read more" if index % 3 == 0 else text(3)}</a></div>'
+        )
+    parts.append("</div>")
+    for index in range(sections):
+        parts.append(f'<section id="doc-{index}" class="doc-{index % 4}"><h2>{text(3)}</h2>')
+        parts.extend(f'<p class="para-{paragraph % 3}">{text(rng.randint(40, 120))}</p>' for paragraph in range(rng.randint(8, 20)))
+        parts.append('<form><label>Email <input type="email" name="email"></label><input type="text" name="name"><button>Subscribe</button></form></section>')
+    parts.append('</div><footer class="site-footer"><p>Footer</p><a href="/privacy">click here</a></footer></body></html>')
+    return "".join(parts)
+
+
+def _generate_screenshot(height: int, seed: int) -> bytes:
+    rng = random.Random(seed)
+    image = Image.new("RGB", (SCREENSHOT_WIDTH, height), "white")
+    draw = ImageDraw.Draw(image)
+    top = 0
+    while top < height - 40:
+        # Rows of "text" bars in varying greys, some of them low contrast.
+        grey = rng.choice([30, 60, 110, 170, 200])
+        for line in range(rng.randint(2, 6)):
+            y = top + line * 22
+            draw.rectangle((40, y, 40 + rng.randint(300, 1100), y + 12), fill=(grey, grey, grey))
+        top += 160
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class FixtureSet:
+    """
+    HTML and screenshot bytes per fixture name, loaded or generated once.
+    """
+
+    def __init__(self, fixtures_dir: Optional[str] = None, seed: int = 0):
+        self.html: Dict[str, str] = {}
+        self.screenshots: Dict[str, bytes] = {}
+        if fixtures_dir:
+            for filename in sorted(os.listdir(fixtures_dir)):
+                name, extension = os.path.splitext(filename)
+                path = os.path.join(fixtures_dir, filename)
+                if extension == ".html":
+                    with open(path, encoding="utf-8", errors="replace") as handle:
+                        self.html[name] = handle.read()
+                elif extension == ".png":
+                    with open(path, "rb") as handle:
+                        self.screenshots[name] = handle.read()
+        if not self.html:
+            for name, (cards, sections, height) in GENERATED_SIZES.items():
+                self.html[name] = _generate_html(cards, sections, seed)
+                self.screenshots[name] = _generate_screenshot(height, seed)
+
+    @property
+    def names(self):
+        return list(self.html)
+
+    def describe(self) -> str:
+        return ", ".join(
+            f"{name} ({len(self.html[name]) // 1024} KB HTML{', screenshot' if name in self.screenshots else ''})"
+            for name in self.names
+        )
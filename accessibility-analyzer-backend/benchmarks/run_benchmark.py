@@ -0,0 +1,304 @@
+"""
+Offline end-to-end benchmark of the analysis API.
+
+The app runs in-process behind httpx's ASGI transport, with the fake Firecrawl (served
+from a background thread) and the fake chat model (MODEL_PROVIDER=fake) in place of
+the real services, so no API keys or money are needed. Reports latency percentiles,
+throughput, event-loop lag (a blocking call in an async path shows up here) and peak
+RSS. With --max-loop-lag-ms / --max-p95-ms it exits non-zero when a limit is exceeded.
+
+Run from accessibility-analyzer-backend/:
+    python -m benchmarks.run_benchmark --endpoint analyze --requests 40 --concurrency 8
+    python -m benchmarks.run_benchmark --endpoint stream --fixture large --llm-first-token 1.0
+    python -m benchmarks.run_benchmark --endpoint batch --requests 200 --concurrency 16 --json results.json
+    python -m benchmarks.run_benchmark --offline --direct-fetch
+"""
+from contextlib import redirect_stdout
+from typing import List, Optional
+from benchmarks.fixtures import FixtureSet
+from benchmarks.fake_firecrawl import create_fake_firecrawl, start_fake_firecrawl
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import uuid
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline benchmark of the accessibility analysis API.")
+    parser.add_argument("--endpoint", choices=["analyze", "stream", "batch"], default="analyze", help="POST /analyze, GET /analyze-stream or POST /analyze/batch")
+    parser.add_argument("--requests", type=int, default=40, help="URLs to analyze (each one unique, so caches do not hide the work)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight (batch: the batch's concurrency)")
+    parser.add_argument("--warmup", type=int, default=2, help="Unmeasured requests before the run")
+    parser.add_argument("--fixture", default="mixed", help="Fixture name, or 'mixed' to cycle through all of them")
+    parser.add_argument("--fixtures-dir", help="Directory of recorded <name>.html (+ <name>.png) fixtures; generated pages if omitted")
+    parser.add_argument("--no-screenshots", action="store_true", help="Scrape HTML only")
+    parser.add_argument("--offline", action="store_true", help="Rules-only analysis (no LLM stages)")
+    parser.add_argument("--direct-fetch", action="store_true", help="Analyze pages served by the local fake site, so their HTML is fetched directly and Firecrawl is only asked for screenshots")
+    parser.add_argument("--firecrawl-latency", type=float, default=0.5, help="Mean fake scrape latency in seconds")
+    parser.add_argument("--firecrawl-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-first-token", type=float, default=0.5, help="Fake model time to first token in seconds")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--llm-rate-limit-rate", type=float, default=0.0, help="Fraction of fake model calls failing with 429")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Fraction of fake model calls failing with 500")
+    parser.add_argument("--llm-low-confidence-rate", type=float, default=0.0, help="Fraction of fake HTML analyses stating low confidence (escalated to the large model)")
+    parser.add_argument("--json", dest="json_path", help="Also write the results to this file")
+    parser.add_argument("--max-loop-lag-ms", type=float, help="Fail if the worst event-loop lag exceeds this")
+    parser.add_argument("--max-p95-ms", type=float, help="Fail if p95 latency exceeds this")
+    parser.add_argument("--verbose", action="store_true", help="Show the service's own log output")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args: argparse.Namespace, firecrawl_url: str):
+    """
+    Points the services at the fakes. Must run before the app is imported, since the
+    services read their configuration at import time (and .env never overrides these).
+    """
+    os.environ.update({
+        "FIRECRAWL_API_URL": firecrawl_url,
+        "FIRECRAWL_API_KEY": "benchmark",
+        "MODEL_PROVIDER": "fake",
+        "LLM_PROVIDER": "fake",
+        "LLM_MODEL": "fake",
+        "LLM_FALLBACK_PROVIDER": "",
+        "CACHE_SQLITE_PATH": "",
+        # A fresh report store per run, so its bulk writes are part of what is measured
+        "REPORT_STORE_PATH": os.path.join(tempfile.mkdtemp(prefix="benchmark-"), "reports.sqlite3"),
+        "FAKE_LLM_FIRST_TOKEN_SECONDS": str(args.llm_first_token),
+        "FAKE_LLM_TOKENS_PER_SECOND": str(args.llm_tokens_per_second),
+        "FAKE_LLM_RATE_LIMIT_RATE": str(args.llm_rate_limit_rate),
+        "FAKE_LLM_ERROR_RATE": str(args.llm_error_rate),
+        "FAKE_LLM_LOW_CONFIDENCE_RATE": str(args.llm_low_confidence_rate),
+        "DIRECT_FETCH": "true" if args.direct_fetch else "false",
+        # The fake site is served from this machine (and bench.test does not resolve)
+        "ALLOW_PRIVATE_ADDRESSES": "true",
+    })
+
+
+class LoopLagMonitor:
+    """
+    Measures how late a short sleep wakes up on the running event loop.
+    """
+
+    def __init__(self, interval_seconds: float = 0.01):
+        self.interval = interval_seconds
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - started - self.interval))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)  # bytes on macOS, KB on Linux
+
+
+async def request_analyze(client, url: str, offline: bool) -> Optional[str]:
+    response = await client.post("/analyze", json={"url": url, "offline": offline})
+    return None if response.status_code == 200 else f"HTTP {response.status_code}: {response.text[:200]}"
+
+
+async def request_stream(client, url: str, offline: bool) -> Optional[str]:
+    report, error = None, None
+    async with client.stream("GET", "/analyze-stream", params={"url": url, "offline": str(offline).lower()}) as response:
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            event = json.loads(line[len("data: "):])
+            if event.get("error"):
+                error = event.get("message")
+            if event.get("type") == "report":
+                report = event
+    if error or report is None:
+        return error or "Stream ended without a report."
+    return None
+
+
+async def run_requests(client, endpoint: str, urls: List[str], concurrency: int, offline: bool) -> tuple:
+    """
+    Sends one request per URL, at most `concurrency` at a time. Returns (latencies, errors).
+    """
+    request = request_analyze if endpoint == "analyze" else request_stream
+    slots = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors: List[str] = []
+
+    async def one(url: str):
+        async with slots:
+            started = time.perf_counter()
+            try:
+                error = await request(client, url, offline)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            latencies.append(time.perf_counter() - started)
+            if error:
+                errors.append(error)
+
+    await asyncio.gather(*(one(url) for url in urls))
+    return latencies, errors
+
+
+async def run_batch(client, urls: List[str], concurrency: int, offline: bool) -> tuple:
+    """
+    Sends all URLs as one batch. Latencies are per URL as reported by the batch
+    (from the start of its analysis, so queueing inside the batch is excluded).
+    """
+    latencies: List[float] = []
+    errors: List[str] = []
+    body = {"urls": urls, "concurrency": concurrency, "offline": offline, "include_reports": False}
+    async with client.stream("POST", "/analyze/batch", json=body) as response:
+        async for line in response.aiter_lines():
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if event["type"] == "result":
+                latencies.append(event["elapsed_ms"] / 1000)
+                if event["status"] != "ok":
+                    errors.append(event["error"])
+            elif event["type"] == "error":
+                errors.append(event["message"])
+    return latencies, errors
+
+
+def benchmark_urls(fixtures: FixtureSet, fixture: str, count: int, run_id: str, site_url: str = "https://bench.test") -> List[str]:
+    names = fixtures.names if fixture == "mixed" else [fixture]
+    return [f"{site_url}/{names[index % len(names)]}/{run_id}-{index}" for index in range(count)]
+
+
+async def run(args: argparse.Namespace) -> dict:
+    fixtures = FixtureSet(args.fixtures_dir)
+    if args.fixture != "mixed" and args.fixture not in fixtures.html:
+        raise SystemExit(f"Unknown fixture '{args.fixture}'. Available: {', '.join(fixtures.names)}")
+    if args.no_screenshots:
+        fixtures.screenshots.clear()
+    fake_firecrawl = create_fake_firecrawl(fixtures, args.firecrawl_latency, args.firecrawl_error_rate)
+    firecrawl_url, firecrawl_server = start_fake_firecrawl(fake_firecrawl)
+    configure_environment(args, firecrawl_url)
+
+    import httpx
+    import main as service  # Imported only now, so it picks up the fake configuration
+
+    run_id = uuid.uuid4().hex[:8]
+    site_url = f"{firecrawl_url}/pages" if args.direct_fetch else "https://bench.test"
+    warmup_urls = benchmark_urls(fixtures, args.fixture, args.warmup, f"{run_id}-warmup", site_url)
+    urls = benchmark_urls(fixtures, args.fixture, args.requests, run_id, site_url)
+    monitor = LoopLagMonitor()
+    rss_before = peak_rss_mb()
+    try:
+        async with service.app.router.lifespan_context(service.app):
+            transport = httpx.ASGITransport(app=service.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+                if warmup_urls:
+                    await run_requests(client, "analyze", warmup_urls, args.concurrency, args.offline)
+                monitor.start()
+                started = time.perf_counter()
+                if args.endpoint == "batch":
+                    latencies, errors = await run_batch(client, urls, args.concurrency, args.offline)
+                else:
+                    latencies, errors = await run_requests(client, args.endpoint, urls, args.concurrency, args.offline)
+                wall_seconds = time.perf_counter() - started
+                await monitor.stop()
+            llm_stats = service.get_llm_stats()
+    finally:
+        firecrawl_server.should_exit = True
+
+    milliseconds = [latency * 1000 for latency in latencies]
+    lag_ms = [lag * 1000 for lag in monitor.samples]
+    return {
+        "endpoint": args.endpoint,
+        "requests": len(urls),
+        "concurrency": args.concurrency,
+        "fixtures": fixtures.describe(),
+        "succeeded": len(latencies) - len(errors),
+        "failed": len(errors),
+        "errors": sorted(set(errors))[:5],
+        "wall_seconds": round(wall_seconds, 2),
+        "requests_per_second": round(len(urls) / wall_seconds, 2) if wall_seconds else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(milliseconds, 0.50), 1),
+            "p95": round(percentile(milliseconds, 0.95), 1),
+            "p99": round(percentile(milliseconds, 0.99), 1),
+            "max": round(max(milliseconds, default=0.0), 1),
+        },
+        "event_loop_lag_ms": {
+            "p50": round(percentile(lag_ms, 0.50), 2),
+            "p99": round(percentile(lag_ms, 0.99), 2),
+            "max": round(max(lag_ms, default=0.0), 2),
+        },
+        "rss_mb": {"before_run": rss_before, "peak": peak_rss_mb()},
+        "scrapes": fake_firecrawl.state.scrapes,
+        "direct_fetches": fake_firecrawl.state.page_fetches,
+        "llm": llm_stats,
+    }
+
+
+def print_results(results: dict):
+    latency, lag = results["latency_ms"], results["event_loop_lag_ms"]
+    print(f"Endpoint:        {results['endpoint']} ({results['requests']} requests, concurrency {results['concurrency']})")
+    print(f"Fixtures:        {results['fixtures']}")
+    print(f"Succeeded:       {results['succeeded']}, failed: {results['failed']}")
+    for error in results["errors"]:
+        print(f"  error: {error}")
+    print(f"Wall time:       {results['wall_seconds']} s ({results['requests_per_second']} requests/s)")
+    print(f"Latency:         p50 {latency['p50']} ms, p95 {latency['p95']} ms, p99 {latency['p99']} ms, max {latency['max']} ms")
+    print(f"Event-loop lag:  p50 {lag['p50']} ms, p99 {lag['p99']} ms, max {lag['max']} ms")
+    print(f"Page loads:      {results['scrapes']} Firecrawl scrape(s), {results['direct_fetches']} direct fetch(es)")
+    print(f"Peak RSS:        {results['rss_mb']['peak']} MB (before run: {results['rss_mb']['before_run']} MB)")
+    for model in results["llm"]["models"]:
+        print(f"LLM {model['model']}: {model['calls']} call(s), {model['retries']} retried, {model['errors']} error(s)")
+
+
+def check_limits(args: argparse.Namespace, results: dict) -> List[str]:
+    failures = []
+    if args.max_loop_lag_ms is not None and results["event_loop_lag_ms"]["max"] > args.max_loop_lag_ms:
+        failures.append(f"event-loop lag {results['event_loop_lag_ms']['max']} ms exceeds {args.max_loop_lag_ms} ms")
+    if args.max_p95_ms is not None and results["latency_ms"]["p95"] > args.max_p95_ms:
+        failures.append(f"p95 latency {results['latency_ms']['p95']} ms exceeds {args.max_p95_ms} ms")
+    return failures
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if args.verbose:
+        results = asyncio.run(run(args))
+    else:
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            results = asyncio.run(run(args))
+    print_results(results)
+    if args.json_path:
+        with open(args.json_path, "w") as handle:
+            json.dump(results, handle, indent=2)
+    failures = check_limits(args, results)
+    for failure in failures:
+        print(f"BENCHMARK_FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
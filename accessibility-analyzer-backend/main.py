@@ -1,13 +1,55 @@
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import StreamingResponse
+import time
+_import_started = time.perf_counter()
+
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from models.analysis import AnalysisRequest, AnalysisReport
-from services.firecrawl_service import scrape_website
-from services.langchain_service import analyze_accessibility
+from contextlib import asynccontextmanager
+from typing import Optional
+from models.analysis import AnalysisRequest, AnalysisReport, BatchAnalysisRequest, JobCreated, CrawlRequest, SiteReport, RunHistory, WorstPages, ScoreTrends
+from services.analysis_pipeline import shared_analysis_events, run_analysis, normalize_viewports, AnalysisError, in_flight_analyses
+from services.cache_service import get_cache_stats
+from services.job_service import JobQueue, QueueFullError, JOB_WORKERS, JOB_QUEUE_MAX_SIZE
+from services.crawl_service import crawl_site_events
+from services.batch_service import batch_analysis_events, BATCH_MAX_URLS
+from services.template_service import template_registry
+from services.http_client_service import close_http_clients
+from services.firecrawl_service import close_firecrawl_app
+from services.langchain_service import close_llm_clients, warm_up_llms, get_llm_stats
+from services.metrics_service import render_metrics
+from services.report_store_service import open_report_store, close_report_store, get_report_store, query_store, TREND_BUCKETS, REPORT_STORE_MAX_PAGE_SIZE
+from services.startup_service import record_phase, timed_phase, get_startup_report, print_startup_report
 import json
-import asyncio # Added for SSE
+import os
+
+record_phase("app_import", time.perf_counter() - _import_started)
+
+# Create the LLM clients (and import their SDKs) during startup instead of on the first request.
+LLM_WARMUP = os.getenv("LLM_WARMUP", "false").lower() == "true"
+
+job_queue = JobQueue(shared_analysis_events, JOB_WORKERS, JOB_QUEUE_MAX_SIZE)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    open_report_store()
+    job_queue.start()
+    if LLM_WARMUP:
+        with timed_phase("llm_warmup"):
+            await warm_up_llms()
+    record_phase("ready", time.perf_counter() - _import_started)
+    print_startup_report()
+    yield
+    await job_queue.stop()
+    await close_report_store()
+    await close_llm_clients()
+    await close_firecrawl_app()
+    await close_http_clients()
+
+app = FastAPI(lifespan=lifespan)
 
-app = FastAPI()
+# Each SSE event is flushed as soon as it is yielded; these headers stop proxies
+# (e.g. nginx) and browsers from buffering or caching the stream.
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
 
 # CORS middleware for frontend communication
 app.add_middleware(
@@ -16,83 +58,38 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
+def check_viewports(viewports: Optional[list]) -> Optional[list]:
+    """
+    Validates requested viewport names up front, so an unknown name is a 400 instead of a failed analysis.
+    """
+    try:
+        return normalize_viewports(viewports)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.post("/analyze", response_model=AnalysisReport)
 async def analyze(request: AnalysisRequest):
     """
     Endpoint to analyze a website's accessibility.
+    With `offline: true` only the deterministic rule checks run and no model is called.
+    With `incremental: true` only what changed since the last incremental analysis of
+    the URL is re-analyzed, and the report's `regression` has the score deltas.
+    With `viewports` (e.g. ["desktop", "mobile"]) the page is screenshotted and visually
+    analyzed at each viewport; the HTML is scraped and analyzed once.
     """
+    viewports = check_viewports(request.viewports)
     try:
-        print(f"MAIN_PY: Received request for URL: {request.url}")
-        scraped_data = await scrape_website(request.url)
-        if not scraped_data or not scraped_data.get("html"): # Check if HTML is present
-            print(f"MAIN_PY_ERROR: Failed to scrape website or HTML content missing. URL: {request.url}")
-            raise HTTPException(status_code=500, detail="Failed to scrape the website or critical content (HTML) is missing.")
-
-        html_content = scraped_data.get("html")
-        screenshot_base64 = scraped_data.get("screenshot") # This can be None if screenshot failed
-
-        if not html_content: # Redundant if checked above, but good for safety
-             print(f"MAIN_PY_ERROR: HTML content is None after scraping. URL: {request.url}")
-             raise HTTPException(status_code=500, detail="HTML content could not be retrieved.")
-        
-        # Screenshot can be optional for Langchain if handled there
-        if screenshot_base64 is None:
-            print(f"MAIN_PY_WARNING: Screenshot data is None. Proceeding with analysis, Langchain service might adapt.")
-
-
-        print("MAIN_PY: Calling analyze_accessibility...")
-        raw_report_str_from_llm = analyze_accessibility(html_content, screenshot_base64)
-        print(f"MAIN_PY: Received raw report string from Langchain: {raw_report_str_from_llm[:250]}...") # Log more
-
-        if not raw_report_str_from_llm:
-            print("MAIN_PY_ERROR: analyze_accessibility returned None or empty string.")
-            raise HTTPException(status_code=500, detail="Analysis service returned no data.")
-
-        # Strip markdown fences if present
-        clean_report_str = raw_report_str_from_llm.strip()
-        if clean_report_str.startswith("```json"):
-            clean_report_str = clean_report_str[7:] # Remove ```json
-        if clean_report_str.startswith("```"): # Handle if just ```
-            clean_report_str = clean_report_str[3:]
-        if clean_report_str.endswith("```"):
-            clean_report_str = clean_report_str[:-3]
-        clean_report_str = clean_report_str.strip() # Clean up any surrounding whitespace
-
-        print(f"MAIN_PY: Cleaned report string for JSON parsing: {clean_report_str[:250]}...")
-
-        try:
-            report_dict = json.loads(clean_report_str)
-            # Check if the loaded dict indicates an error from Langchain service itself
-            if isinstance(report_dict.get("scores"), list) and \
-               len(report_dict["scores"]) > 0 and \
-               report_dict["scores"][0].get("category") == "Error":
-                print(f"MAIN_PY_ERROR: Langchain service reported an error: {report_dict['scores'][0].get('feedback')}")
-                # Propagate a generic error or the specific one if safe
-                raise HTTPException(status_code=500, detail=f"Analysis service error: {report_dict['scores'][0].get('feedback')}")
-            
-            print("MAIN_PY: Successfully parsed report string to dict. Creating AnalysisReport model...")
-            # Before creating the model, ensure 'feedback' key exists in each score item,
-            # as the LLM might still omit it. If missing, add a default value.
-            if "scores" in report_dict and isinstance(report_dict["scores"], list):
-                for score_item in report_dict["scores"]:
-                    if "feedback" not in score_item:
-                        score_item["feedback"] = "No specific feedback provided for this category."
-                        print(f"MAIN_PY_WARNING: Added default feedback for category '{score_item.get('category', 'Unknown')}'.")
-            
-            analysis_report_model = AnalysisReport(**report_dict)
-            print("MAIN_PY: AnalysisReport model created successfully.")
-            return analysis_report_model
-        except json.JSONDecodeError as e:
-            print(f"MAIN_PY_ERROR: Failed to parse JSON from Langchain service. Error: {e}. Data: {clean_report_str}")
-            raise HTTPException(status_code=500, detail=f"Failed to parse the analysis report from AI service. Raw output: {clean_report_str}")
-        except Exception as e_model: # Catch errors during Pydantic model instantiation
-            print(f"MAIN_PY_ERROR: Failed to create AnalysisReport model. Error: {e_model}. Dict: {report_dict if 'report_dict' in locals() else 'N/A'}")
-            raise HTTPException(status_code=500, detail=f"Failed to structure the analysis report. Error: {e_model}")
-
-    except HTTPException as e: # Re-raise HTTPExceptions to let FastAPI handle them
-        raise e 
+        print(f"MAIN_PY: Received request for URL: {request.url} (offline={request.offline})")
+        report_dict = await run_analysis(request.url, offline=request.offline, incremental=request.incremental, viewports=viewports)
+        analysis_report_model = AnalysisReport(**report_dict)
+        print("MAIN_PY: AnalysisReport model created successfully.")
+        return analysis_report_model
+    except AnalysisError as e:
+        print(f"MAIN_PY_ERROR: Analysis failed for URL {request.url}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
         print(f"MAIN_PY_ERROR: An unexpected error occurred in /analyze endpoint: {e}")
         import traceback
@@ -100,169 +97,274 @@ async def analyze(request: AnalysisRequest):
         raise HTTPException(status_code=500, detail=f"An unexpected server error occurred: {str(e)}")
 
 
-async def stream_analysis_progress(url: str):
-    """
-    Generator function to stream analysis progress.
-    """
-    current_step = 0
-    total_steps = 6 # Define total steps for progress calculation
-
-    async def send_progress(message: str, step_name: str, progress_override: int = -1, error: bool = False, data: dict = None):
-        nonlocal current_step
-        current_step += 1
-        progress = progress_override if progress_override != -1 else int((current_step / total_steps) * 100)
-        if error:
-            current_step -=1 # Don't count error step in progress
-        
-        payload = {
-            "type": "progress" if not data else "report",
-            "message": message,
-            "step_name": step_name,
-            "progress": min(progress, 100), # Cap progress at 100
-            "error": error
-        }
-        if data:
-            payload["data"] = data
-        
-        yield f"data: {json.dumps(payload)}\n\n"
-        await asyncio.sleep(0.1) # Small delay to ensure messages are sent
-
+async def stream_analysis_progress(url: str, offline: bool = False, incremental: bool = False, viewports: Optional[list] = None):
+    """
+    Generator function to stream analysis progress as server-sent events.
+    """
     try:
-        yield f"data: {json.dumps({'type': 'progress', 'message': 'Initializing analysis...', 'step_name': 'Initialization', 'progress': 0, 'error': False})}\n\n"
-        await asyncio.sleep(0.1)
-
-        # Step 1: Scrape website
-        await asyncio.sleep(0.1) # give time for first message to be sent
-        async for update in send_progress("Taking Screenshot and Structure of your website...", "Scraping Website"):
-            yield update
-        
-        print(f"STREAM_PY: Scraping URL: {url}")
-        scraped_data = await scrape_website(url)
-        if not scraped_data or not scraped_data.get("html"):
-            print(f"STREAM_PY_ERROR: Failed to scrape website or HTML content missing. URL: {url}")
-            async for update in send_progress("Failed to scrape the website or critical content (HTML) is missing.", "Scraping", error=True):
-                yield update
-            # yield f"data: {json.dumps({'type': 'error', 'message': 'Failed to scrape the website or critical content (HTML) is missing.'})}\n\n"
-            return # Stop further processing
-
-        html_content = scraped_data.get("html")
-        screenshot_base64 = scraped_data.get("screenshot")
-
-        async for update in send_progress("Website scraped. HTML and screenshot (if available) retrieved.", "Scraping Complete"):
-            yield update
-
-        if not html_content:
-            print(f"STREAM_PY_ERROR: HTML content is None after scraping. URL: {url}")
-            async for update in send_progress("HTML content could not be retrieved after scraping.", "Data Validation", error=True):
-                yield update
-            # yield f"data: {json.dumps({'type': 'error', 'message': 'HTML content could not be retrieved after scraping.'})}\n\n"
-            return
-
-        if screenshot_base64 is None:
-            print(f"STREAM_PY_WARNING: Screenshot data is None. Proceeding with analysis, Langchain service might adapt.")
-            async for update in send_progress("Screenshot not available, proceeding with HTML-only analysis.", "Screenshot Status"): # Not an error, but an update
-                yield update
-        else:
-            async for update in send_progress("Screenshot captured successfully.", "Screenshot Status"):
-                 yield update
-
-
-        # Step 2: Analyze accessibility (Langchain service)
-        # This is a single call, but Langchain itself has sub-steps. We'll treat it as one major step here for simplicity.
-        # For more granular updates from Langchain, Langchain service would need to be a generator too.
-        async for update in send_progress("Accessibility is beeing analyzed carefully...", "AI Analysis"):
-            yield update
-        
-        print("STREAM_PY: Calling analyze_accessibility...")
-        raw_report_str_from_llm = analyze_accessibility(html_content, screenshot_base64) # This is a sync call
-        
-        if not raw_report_str_from_llm:
-            print("STREAM_PY_ERROR: analyze_accessibility returned None or empty string.")
-            async for update in send_progress("Analysis service returned no data.", "AI Analysis", error=True):
-                yield update
-            # yield f"data: {json.dumps({'type': 'error', 'message': 'Analysis service returned no data.'})}\n\n"
-            return
-
-        # Strip markdown fences
-        clean_report_str = raw_report_str_from_llm.strip()
-        if clean_report_str.startswith("```json"):
-            clean_report_str = clean_report_str[7:]
-        if clean_report_str.startswith("```"):
-            clean_report_str = clean_report_str[3:]
-        if clean_report_str.endswith("```"):
-            clean_report_str = clean_report_str[:-3]
-        clean_report_str = clean_report_str.strip()
-
-        async for update in send_progress("AI analysis complete. Processing report...", "Report Processing"):
-            yield update
-
-        try:
-            report_dict = json.loads(clean_report_str)
-            if isinstance(report_dict.get("scores"), list) and \
-               len(report_dict["scores"]) > 0 and \
-               report_dict["scores"][0].get("category") == "Error":
-                error_message = f"Analysis service error: {report_dict['scores'][0].get('feedback')}"
-                print(f"STREAM_PY_ERROR: Langchain service reported an error: {error_message}")
-                async for update in send_progress(error_message, "AI Analysis", error=True):
-                    yield update
-                # yield f"data: {json.dumps({'type': 'error', 'message': error_message})}\n\n"
-                return
-
-            if "scores" in report_dict and isinstance(report_dict["scores"], list):
-                for score_item in report_dict["scores"]:
-                    if "feedback" not in score_item:
-                        score_item["feedback"] = "No specific feedback provided for this category."
-            
-            analysis_report_model = AnalysisReport(**report_dict)
-            
-            async for update in send_progress("Report processed successfully. Creating final report.", "Finalizing", progress_override=99):
-                yield update
-            
-            # Send the final report
-            # yield f"data: {json.dumps({'type': 'report', 'data': analysis_report_model.model_dump()})}\n\n"
-            async for update in send_progress("Analysis complete!", "Complete", progress_override=100, data=analysis_report_model.model_dump()):
-                yield update
-
-
-        except json.JSONDecodeError as e:
-            error_message = f"Failed to parse the analysis report from AI service. Raw output: {clean_report_str}"
-            print(f"STREAM_PY_ERROR: Failed to parse JSON. Error: {e}. Data: {clean_report_str}")
-            async for update in send_progress(error_message, "Report Processing", error=True):
-                yield update
-            # yield f"data: {json.dumps({'type': 'error', 'message': error_message})}\n\n"
-        except Exception as e_model:
-            error_message = f"Failed to structure the analysis report. Error: {e_model}"
-            print(f"STREAM_PY_ERROR: Failed to create AnalysisReport model. Error: {e_model}")
-            async for update in send_progress(error_message, "Report Processing", error=True):
-                yield update
-            # yield f"data: {json.dumps({'type': 'error', 'message': error_message})}\n\n"
-
+        async for payload in shared_analysis_events(url, offline=offline, incremental=incremental, viewports=viewports):
+            yield f"data: {json.dumps(payload)}\n\n"
     except Exception as e:
-        error_message = f"An unexpected server error occurred during streaming: {str(e)}"
-        print(f"STREAM_PY_ERROR: An unexpected error occurred: {e}")
-        import traceback
-        traceback.print_exc()
-        # Ensure a final error message is sent to the client if an unexpected exception occurs
-        # Need to be careful here as the generator might already be closed.
-        # This yield might not reach the client if the connection is broken.
-        try:
-            # yield f"data: {json.dumps({'type': 'error', 'message': error_message})}\n\n"
-            async for update in send_progress(error_message, "System Error", error=True): # Try to send one last message
-                yield update
-        except Exception: # Catch if yield fails
-            pass
+        # The client most likely disconnected; nothing more can be sent.
+        print(f"STREAM_PY_ERROR: Streaming stopped: {e}")
 
 
 @app.get("/analyze-stream") # Changed from POST to GET
-async def analyze_stream_endpoint(url: str): # URL from query param
+async def analyze_stream_endpoint(url: str, offline: bool = False, incremental: bool = False, viewports: Optional[str] = None): # URL from query param
     """
     Endpoint to analyze a website's accessibility and stream progress.
-    Accepts URL as a query parameter.
+    Accepts URL as a query parameter; `viewports` is comma-separated (e.g. "desktop,mobile").
     """
     if not url:
         raise HTTPException(status_code=400, detail="URL query parameter is required.")
+    viewport_names = check_viewports(viewports.split(",") if viewports else None)
     print(f"STREAM_PY: Received stream request for URL: {url}")
-    return StreamingResponse(stream_analysis_progress(url), media_type="text/event-stream")
+    return StreamingResponse(stream_analysis_progress(url, offline, incremental, viewport_names), media_type="text/event-stream", headers=SSE_HEADERS)
+
+async def stream_batch_results(request: BatchAnalysisRequest, urls: list):
+    """
+    Generator function to stream batch results as newline-delimited JSON, one line per URL.
+    """
+    try:
+        async for payload in batch_analysis_events(urls, request.concurrency, request.offline, request.include_reports, request.incremental, request.viewports):
+            yield json.dumps(payload) + "\n"
+    except Exception as e:
+        print(f"STREAM_PY_ERROR: Batch streaming stopped: {e}")
+        yield json.dumps({"type": "error", "message": f"Batch failed: {str(e)}", "error": True}) + "\n"
+
+
+@app.post("/analyze/batch")
+async def analyze_batch(request: BatchAnalysisRequest):
+    """
+    Analyzes a list of URLs concurrently (`concurrency` at a time) and streams NDJSON:
+    one `result` line per URL as soon as it finishes (completion order, with its `index`
+    in the request), then a `summary` line. A failing URL gets an error line and does
+    not affect the others.
+    """
+    urls = [url.strip() for url in request.urls if url.strip()]
+    if not urls:
+        raise HTTPException(status_code=400, detail="At least one URL is required.")
+    if len(urls) > BATCH_MAX_URLS:
+        raise HTTPException(status_code=413, detail=f"A batch can contain at most {BATCH_MAX_URLS} URLs.")
+    request.viewports = check_viewports(request.viewports)
+    print(f"MAIN_PY: Received batch request for {len(urls)} URL(s) (concurrency={request.concurrency}, offline={request.offline})")
+    return StreamingResponse(stream_batch_results(request, urls), media_type="application/x-ndjson", headers=SSE_HEADERS)
+
+
+@app.post("/crawl", response_model=SiteReport)
+async def crawl(request: CrawlRequest):
+    """
+    Analyzes up to `max_pages` same-origin pages of a site and returns the aggregated site report.
+    Responds 400 for sites on non-public addresses and for a `sitemap_url` on another origin.
+    """
+    print(f"MAIN_PY: Received crawl request for {request.url} (max_pages={request.max_pages})")
+    async for event in crawl_site_events(request.url, request.max_pages, request.concurrency, request.offline, request.sitemap_url):
+        if event["type"] == "error":
+            raise HTTPException(status_code=400, detail=event["message"])
+        if event["type"] == "site_report":
+            return SiteReport(**event["data"])
+    raise HTTPException(status_code=500, detail="Crawl finished without producing a site report.")
+
+
+async def stream_crawl_progress(request: CrawlRequest):
+    """
+    Generator function to stream crawl events (discovery, each page, site report) as server-sent events.
+    """
+    try:
+        async for payload in crawl_site_events(request.url, request.max_pages, request.concurrency, request.offline, request.sitemap_url):
+            yield f"data: {json.dumps(payload)}\n\n"
+    except Exception as e:
+        print(f"STREAM_PY_ERROR: Crawl streaming stopped: {e}")
+        yield f"data: {json.dumps({'type': 'error', 'message': f'Crawl failed: {str(e)}', 'error': True})}\n\n"
+
+
+@app.get("/crawl-stream")
+async def crawl_stream_endpoint(request: CrawlRequest = Depends()):
+    """
+    Same as POST /crawl, but streams per-page results as they finish.
+    Parameters are passed in the query string (EventSource only supports GET).
+    """
+    print(f"STREAM_PY: Received crawl stream request for {request.url} (max_pages={request.max_pages})")
+    return StreamingResponse(stream_crawl_progress(request), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@app.post("/jobs", response_model=JobCreated, status_code=202)
+async def create_job(request: AnalysisRequest):
+    """
+    Queues an analysis and returns its job id immediately.
+    Responds 429 with Retry-After when the queue is full.
+    """
+    try:
+        job = job_queue.submit(request.url, offline=request.offline, incremental=request.incremental, viewports=check_viewports(request.viewports))
+    except QueueFullError as e:
+        print(f"MAIN_PY_WARNING: Rejected job for {request.url}: {e}")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    return JobCreated(job_id=job.id, status=job.status, events_url=f"/jobs/{job.id}/events")
+
+
+@app.get("/jobs/stats")
+def jobs_stats():
+    """
+    Worker pool size, queue depth and job counts per status.
+    Declared before /jobs/{job_id} so "stats" is not taken for a job id.
+    """
+    return job_queue.get_stats()
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """
+    Current status of a job, including the report once it has completed.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job.to_dict()
+
+
+async def stream_job_events(job, last_event_id: int):
+    """
+    Replays a job's buffered events after `last_event_id`, then follows live events.
+    Each event carries an `id:` so the browser's EventSource resumes where it left off.
+    """
+    yield "retry: 3000\n\n"
+    async for event_id, payload in job.events_since(last_event_id):
+        yield f"id: {event_id}\ndata: {json.dumps(payload)}\n\n"
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events_endpoint(job_id: str, request: Request, last_event_id: Optional[int] = None):
+    """
+    SSE stream of a job's progress. Honors the Last-Event-ID header (or the
+    `last_event_id` query parameter) to resume without repeating the analysis.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    header_value = request.headers.get("last-event-id")
+    if header_value is not None and header_value.strip().lstrip("-").isdigit():
+        last_event_id = int(header_value)
+    if last_event_id is None:
+        last_event_id = -1
+    return StreamingResponse(stream_job_events(job, last_event_id), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+def require_report_store():
+    if get_report_store() is None:
+        raise HTTPException(status_code=503, detail="The report store is disabled (REPORT_STORE_PATH is not set).")
+
+
+@app.get("/reports/history", response_model=RunHistory, dependencies=[Depends(require_report_store)])
+async def report_history(url: str, limit: int = Query(default=20, ge=1, le=REPORT_STORE_MAX_PAGE_SIZE), cursor: Optional[int] = None):
+    """
+    Stored analyses of one page, newest first, with per-category scores and run metadata.
+    Pass `next_cursor` back as `cursor` for the next (older) page.
+    """
+    runs, next_cursor = await query_store("url_history", url, limit, before=cursor)
+    return RunHistory(url=url, runs=runs, next_cursor=str(next_cursor) if next_cursor is not None else None)
+
+
+@app.get("/reports/worst", response_model=WorstPages, dependencies=[Depends(require_report_store)])
+async def worst_pages(
+    category: str,
+    origin: Optional[str] = None,
+    max_score: Optional[int] = Query(default=None, ge=0, le=100),
+    limit: int = Query(default=50, ge=1, le=REPORT_STORE_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+):
+    """
+    Pages by their latest score in `category` (e.g. "Forms & Inputs"), lowest first,
+    optionally limited to one `origin` (e.g. https://example.com) and to scores of at
+    most `max_score`. Pass `next_cursor` back as `cursor` for the next page.
+    """
+    after = None
+    if cursor:
+        score, _, page_url = cursor.partition(":")
+        if not score.isdigit() or not page_url:
+            raise HTTPException(status_code=400, detail="Invalid cursor.")
+        after = (int(score), page_url)
+    pages, next_after = await query_store("worst_pages", category, limit, origin=origin, max_score=max_score, after=after)
+    return WorstPages(category=category, pages=pages, next_cursor=f"{next_after[0]}:{next_after[1]}" if next_after else None)
+
+
+@app.get("/reports/trends", response_model=ScoreTrends, dependencies=[Depends(require_report_store)])
+async def score_trends(
+    url: Optional[str] = None,
+    origin: Optional[str] = None,
+    category: Optional[str] = None,
+    days: int = Query(default=30, ge=1, le=3650),
+    bucket: str = "day",
+):
+    """
+    Mean, minimum and maximum score per category and day (or `bucket=week`) over the
+    last `days` days, for one page (`url`) or every stored page of an `origin`.
+    """
+    if bool(url) == bool(origin):
+        raise HTTPException(status_code=400, detail="Pass exactly one of url and origin.")
+    if bucket not in TREND_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket must be one of: {', '.join(TREND_BUCKETS)}.")
+    points = await query_store("trends", days, bucket, url=url, origin=origin, category=category)
+    return ScoreTrends(url=url, origin=origin, days=days, bucket=bucket, points=points)
+
+
+@app.get("/reports/stats", dependencies=[Depends(require_report_store)])
+async def report_store_stats():
+    """
+    Stored runs and pages, and the report store's write counters (runs recorded,
+    written in bulk, batches, errors, runs waiting for the next write).
+    """
+    return {**await query_store("counts"), **get_report_store().get_stats()}
+
+
+@app.get("/reports/{run_id}", response_model=AnalysisReport, dependencies=[Depends(require_report_store)])
+async def stored_report(run_id: int):
+    """
+    The full report of a stored analysis (ids are in /reports/history).
+    """
+    report = await query_store("get_report", run_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Report not found.")
+    return AnalysisReport(**report)
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    """
+    Hit/miss counters and memory usage of the scrape, report and template caches,
+    how many requests were coalesced onto an in-flight analysis, and how many
+    shared site template components are known.
+    """
+    return {
+        **get_cache_stats(),
+        "coalescing": in_flight_analyses.get_stats(),
+        "templates": template_registry.get_stats(),
+    }
+
+@app.get("/llm/stats")
+def llm_stats():
+    """
+    Per-model LLM scheduler counters: calls, retries, errors, hedges won, time spent
+    waiting for rate budget and median time to first token per stage, and the model
+    that serves each stage.
+    """
+    return get_llm_stats()
+
+@app.get("/startup/stats")
+def startup_stats():
+    """
+    Startup cost of this worker: application import time, provider SDK imports and
+    client creation (lazy, or during warm-up), time until ready, loaded modules and peak RSS.
+    """
+    return get_startup_report()
+
+@app.get("/metrics")
+def metrics():
+    """
+    Prometheus metrics: per-stage duration and size histograms, stage errors, end-to-end
+    analysis duration by outcome, LLM calls, tokens and estimated cost per model, and
+    the cache and coalescing counters.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 @app.get("/")
 def read_root():
@@ -1,14 +1,210 @@
-from pydantic import BaseModel
-from typing import List, Dict
+from pydantic import BaseModel, Field
+from typing import List, Dict, Optional
 
 class AnalysisRequest(BaseModel):
     url: str
+    offline: bool = False  # Rules-only report from the HTML, no LLM calls
+    incremental: bool = False  # Re-analyze only what changed since the last incremental analysis of the URL
+    viewports: Optional[List[str]] = None  # e.g. ["desktop", "mobile"]: one screenshot and visual pass per viewport
+
+class BatchAnalysisRequest(BaseModel):
+    urls: List[str] = Field(min_length=1)
+    concurrency: int = Field(default=8, ge=1, le=64)
+    offline: bool = False
+    include_reports: bool = True  # False: each result line carries only the category scores
+    incremental: bool = False
+    viewports: Optional[List[str]] = None
 
 class AccessibilityFeedback(BaseModel):
     category: str
     score: int
     feedback: str
 
+class Finding(BaseModel):
+    """A single exact finding from the local checks (not from the LLM)."""
+    guideline: str
+    severity: str
+    issue: str
+    path: str = ""
+    snippet: str = ""
+    line: Optional[int] = None
+    source: str = "rules"
+
+class HtmlStats(BaseModel):
+    """Size of the page HTML before and after condensation for the LLM prompt."""
+    original_bytes: int
+    condensed_bytes: int
+    original_tokens_estimate: int
+    condensed_tokens_estimate: int
+    token_budget: Optional[int] = None
+    collapsed_groups: int = 0
+    collapsed_elements: int = 0
+    truncated: bool = False
+    chunks: int = 1  # > 1 when the page was split into sections analyzed separately
+
+class TemplateComponent(BaseModel):
+    """A site chrome component shared across pages, analyzed once per site."""
+    fingerprint: str
+    tag: str
+    label: str
+    pages_seen: int
+    feedback: str
+
+class StageTiming(BaseModel):
+    """One timed pipeline stage (offsets in ms from the start of the analysis)."""
+    stage: str
+    start_ms: float
+    duration_ms: float
+    detail: Optional[str] = None
+    bytes_in: Optional[int] = None
+    bytes_out: Optional[int] = None
+    model: Optional[str] = None  # LLM stages: "provider:model" that served the call
+    prompt_tokens: Optional[int] = None
+    cached_prompt_tokens: Optional[int] = None  # Part of prompt_tokens read from the provider's prompt cache
+    completion_tokens: Optional[int] = None
+    cost_usd: Optional[float] = None
+    error: Optional[bool] = None
+
+class TimingBreakdown(BaseModel):
+    """Where the time and LLM spend of one analysis went."""
+    outcome: str  # computed, report_cache_hit, carried_over or offline
+    total_ms: float
+    stages: List[StageTiming]
+    prompt_tokens: int = 0
+    cached_prompt_tokens: int = 0
+    completion_tokens: int = 0
+    estimated_cost_usd: float = 0.0
+
+class ScoreDelta(BaseModel):
+    category: str
+    previous: Optional[int] = None  # None for a category the previous run did not have
+    current: int
+    delta: Optional[int] = None
+
+class RegressionReport(BaseModel):
+    """Changes since the previous incremental analysis of the same URL."""
+    previous_analyzed_at: str
+    sections_total: int
+    sections_reanalyzed: int
+    sections_changed: List[str]  # Ancestor paths of the changed/added/removed sections
+    sections_added: List[str]
+    sections_removed: List[str]
+    screenshot_changed: bool
+    score_deltas: List[ScoreDelta]
+    regressed_categories: List[str]
+    improved_categories: List[str]
+    new_findings_count: int
+    new_findings: List[Finding]
+    resolved_findings_count: int
+
+class ModelAttribution(BaseModel):
+    """Which model produced a part of the report (see model_cascade_service)."""
+    part: str  # html, template, screenshot, report or report_completion
+    model: Optional[str] = None  # "provider:model"; None for output carried over from the previous run
+    detail: Optional[str] = None  # e.g. "chunk=3" or "tile=1, viewport=mobile"
+    confidence: Optional[str] = None  # HTML stage: the confidence the model stated
+    escalated_from: Optional[str] = None  # HTML stage: the triage model whose output was redone by `model`
+    escalation_reason: Optional[str] = None
+    carried_over: bool = False
+
 class AnalysisReport(BaseModel):
     scores: List[AccessibilityFeedback]
     implementation_plan: str
+    html_stats: Optional[HtmlStats] = None
+    findings: Optional[List[Finding]] = None
+    template_components: Optional[List[TemplateComponent]] = None
+    timings: Optional[TimingBreakdown] = None
+    regression: Optional[RegressionReport] = None
+    models: Optional[List[ModelAttribution]] = None
+
+class JobCreated(BaseModel):
+    job_id: str
+    status: str
+    events_url: str
+
+class CrawlRequest(BaseModel):
+    url: str
+    sitemap_url: Optional[str] = None  # Discover pages from this sitemap (same origin as `url`) instead of following links
+    max_pages: int = Field(default=20, ge=1, le=500)
+    concurrency: int = Field(default=4, ge=1, le=32)
+    offline: bool = False
+
+class CategoryDistribution(BaseModel):
+    category: str
+    pages: int
+    mean: float
+    median: float
+    min: int
+    max: int
+    p25: float
+    p75: float
+    histogram: Dict[str, int]  # Pages per rubric band, e.g. "90-100"
+
+class RecurringIssue(BaseModel):
+    guideline: str
+    severity: str
+    issue: str
+    pages_affected: int
+    occurrences: int
+    example_urls: List[str]
+
+class SiteReport(BaseModel):
+    root_url: str
+    pages_discovered: int
+    pages_analyzed: int
+    pages_failed: int
+    categories: List[CategoryDistribution]
+    recurring_issues: List[RecurringIssue]
+
+class StoredRun(BaseModel):
+    """One analysis in the report store (see report_store_service)."""
+    id: int
+    url: str
+    origin: str
+    analyzed_at: str
+    outcome: str  # computed, report_cache_hit, carried_over or offline
+    mode: str  # full, incremental or offline
+    viewports: Optional[List[str]] = None
+    scores: Dict[str, int]
+    mean_score: Optional[float] = None
+    findings_count: int
+    total_ms: Optional[float] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    cost_usd: Optional[float] = None
+    models: List[str] = []
+
+class RunHistory(BaseModel):
+    url: str
+    runs: List[StoredRun]
+    next_cursor: Optional[str] = None  # Pass as `cursor` for the next (older) page
+
+class PageScore(BaseModel):
+    url: str
+    origin: str
+    category: str
+    score: int
+    run_id: int
+    analyzed_at: str
+
+class WorstPages(BaseModel):
+    """Pages by their latest score in a category, lowest first."""
+    category: str
+    pages: List[PageScore]
+    next_cursor: Optional[str] = None
+
+class TrendPoint(BaseModel):
+    category: str
+    period_start: str  # First day of the day or week (ISO date, UTC)
+    mean_score: float
+    min_score: int
+    max_score: int
+    runs: int
+    pages: int
+
+class ScoreTrends(BaseModel):
+    url: Optional[str] = None
+    origin: Optional[str] = None
+    days: int
+    bucket: str
+    points: List[TrendPoint]
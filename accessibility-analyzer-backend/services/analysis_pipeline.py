@@ -0,0 +1,519 @@
+from models.analysis import AnalysisReport
+from services.firecrawl_service import scrape_website, VIEWPORTS
+from services.fetch_service import fetch_page
+from services.langchain_service import analyze_accessibility_async, analyze_template_component_async, LLM_PROVIDER, LLM_MODEL, CASCADE_KEY
+from services.prompt_service import PROMPT_VERSION
+from services.html_rules_service import analyze_html_rules, build_offline_report
+from services.html_condenser_service import condense_html, chunk_html, get_html_token_budget, estimate_tokens
+from services.cache_service import scrape_cache, report_cache, template_cache, snapshot_cache, normalize_url, content_hash
+from services.coalescing_service import SingleFlight
+from services.template_service import template_registry
+from services.report_parser_service import decode_report, IMPLEMENTATION_PLAN
+from services.metrics_service import span, start_trace, finish_trace, register_collector
+from services.model_cascade_service import collect_model_parts
+from services.report_store_service import record_report
+from services.url_safety_service import check_public_url, UnsafeURLError
+from services.snapshot_service import split_sections, load_snapshot, save_snapshot, plan_reanalysis, build_snapshot, regression_report
+from typing import AsyncIterator, Dict, List, Optional
+import asyncio
+import os
+
+
+class AnalysisError(Exception):
+    """
+    Raised when a pipeline step fails. The message is safe to show to the user.
+    """
+
+
+# Concurrent requests for the same normalized URL share one running analysis.
+in_flight_analyses = SingleFlight("analysis")
+
+# Per-stage concurrency limits, shared by every entry point (endpoints and job workers),
+# so bursts queue up here instead of piling onto Firecrawl and the LLM provider.
+SCRAPE_CONCURRENCY = int(os.getenv("SCRAPE_CONCURRENCY", "8"))
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+scrape_slots = asyncio.Semaphore(SCRAPE_CONCURRENCY)
+llm_slots = asyncio.Semaphore(LLM_CONCURRENCY)
+
+# Cut shared site chrome out of pages and analyze it once per site (see template_service).
+TEMPLATE_DEDUP = os.getenv("TEMPLATE_DEDUP", "true").lower() == "true"
+_template_analyses: Dict[str, asyncio.Task] = {}
+
+# Pages that do not fit the HTML token budget at full detail are split into chunks that
+# are analyzed in parallel, instead of being condensed harder and truncated.
+HTML_CHUNKING = os.getenv("HTML_CHUNKING", "true").lower() == "true"
+HTML_MAX_CHUNKS = int(os.getenv("HTML_MAX_CHUNKS", "12"))
+
+
+def _cache_metrics() -> List[tuple]:
+    caches = (scrape_cache, report_cache, template_cache, snapshot_cache)
+    return [
+        ("analyzer_cache_lookups_total", "counter", "Cache lookups by cache and result (memory_hit, disk_hit, miss).", [
+            ({"cache": cache.name, "result": result[:-1]}, cache.stats[result])
+            for cache in caches for result in ("memory_hits", "disk_hits", "misses")
+        ]),
+        ("analyzer_coalesced_analyses_total", "counter", "Analyses started, and requests that joined one already running.", [
+            ({"kind": kind}, in_flight_analyses.stats[kind]) for kind in ("started", "joined")
+        ]),
+    ]
+
+
+register_collector(_cache_metrics)
+
+
+async def get_scraped_data(url: str, include_screenshot: bool = True) -> Optional[dict]:
+    """
+    Scrapes a URL through the scrape cache (keyed by normalized URL, with TTL).
+    An HTML-only request is also satisfied by a cached full scrape. Screenshot tiles
+    are sized for the configured provider, so full scrapes are cached per provider.
+    """
+    normalized = normalize_url(url)
+    full_key, html_key = f"{normalized}|full|{LLM_PROVIDER}", f"{normalized}|html"
+    with span("scrape", detail="cache_hit") as record:
+        for key in ([full_key] if include_screenshot else [full_key, html_key]):
+            cached = await scrape_cache.get(key)
+            if cached is not None:
+                print(f"PIPELINE: Scrape cache hit for {normalized}")
+                return cached
+
+        record["detail"] = "cache_miss"
+        async with scrape_slots:
+            scraped_data = await fetch_page(url, include_screenshot=include_screenshot, provider=LLM_PROVIDER)
+        if scraped_data and scraped_data.get("html"):
+            await scrape_cache.set(full_key if include_screenshot else html_key, scraped_data)
+        return scraped_data
+
+
+async def get_viewport_screenshot(url: str, viewport: str) -> Optional[dict]:
+    """
+    Screenshot of a URL at one of VIEWPORTS (a screenshot-only scrape), through the
+    scrape cache. Used for the viewports other than the default (desktop) scrape.
+    """
+    key = f"{normalize_url(url)}|screenshot|{viewport}|{LLM_PROVIDER}"
+    with span("scrape", detail=f"{viewport} cache_hit") as record:
+        cached = await scrape_cache.get(key)
+        if cached is not None:
+            return cached
+
+        record["detail"] = f"{viewport} cache_miss"
+        async with scrape_slots:
+            scraped_data = await scrape_website(url, provider=LLM_PROVIDER, include_html=False, scrape_options=VIEWPORTS[viewport]["options"])
+        screenshot = (scraped_data or {}).get("screenshot")
+        if screenshot:
+            await scrape_cache.set(key, screenshot)
+        return screenshot
+
+
+def normalize_viewports(viewports: Optional[List[str]]) -> Optional[List[str]]:
+    """
+    Lowercased, de-duplicated viewport names in request order, or None for the default
+    single (desktop) screenshot. Raises ValueError for names not in VIEWPORTS.
+    """
+    names = list(dict.fromkeys(name.strip().lower() for name in viewports or [] if name.strip()))
+    unknown = [name for name in names if name not in VIEWPORTS]
+    if unknown:
+        raise ValueError(f"Unknown viewport(s): {', '.join(unknown)}. Available viewports: {', '.join(VIEWPORTS)}.")
+    return names if names and names != ["desktop"] else None
+
+
+def report_cache_key(condensed_html: str, screenshot: Optional[dict], template_fingerprints: List[str] = (), viewport_screenshots: Optional[List[dict]] = None) -> str:
+    """
+    Content-addressed key for a final report: what the LLM would see plus the model and prompt version.
+    """
+    if viewport_screenshots:
+        digest = ",".join(f"{shot['viewport']}:{shot['digest']}" for shot in viewport_screenshots)
+    else:
+        digest = screenshot["digest"] if screenshot else None
+    return content_hash(condensed_html, digest, ",".join(template_fingerprints), LLM_PROVIDER, LLM_MODEL, CASCADE_KEY, PROMPT_VERSION)
+
+
+async def _analyze_template_component(component: dict) -> str:
+    key = content_hash(component["fingerprint"], LLM_PROVIDER, LLM_MODEL, CASCADE_KEY, PROMPT_VERSION)
+    cached = await template_cache.get(key)
+    if cached is not None:
+        return cached
+    condensed_component, _ = await asyncio.to_thread(condense_html, component["html"], get_html_token_budget(LLM_PROVIDER))
+    async with llm_slots:
+        feedback = await analyze_template_component_async(condensed_component)
+    await template_cache.set(key, feedback)
+    return feedback
+
+
+async def analyze_template_components(components: List[dict]) -> List[dict]:
+    """
+    Returns the findings for each shared template component, analyzing each fingerprint
+    at most once: results are cached, and concurrent pages wait on the same analysis.
+    """
+    async def feedback_for(component: dict) -> str:
+        task = _template_analyses.get(component["fingerprint"])
+        if task is None:
+            task = asyncio.create_task(_analyze_template_component(component))
+            _template_analyses[component["fingerprint"]] = task
+            task.add_done_callback(lambda _: _template_analyses.pop(component["fingerprint"], None))
+        return await asyncio.shield(task)
+
+    feedbacks = await asyncio.gather(*(feedback_for(component) for component in components))
+    return [
+        {
+            "fingerprint": component["fingerprint"],
+            "tag": component["tag"],
+            "label": component["label"],
+            "pages_seen": component["pages_seen"],
+            "feedback": feedback,
+        }
+        for component, feedback in zip(components, feedbacks)
+    ]
+
+
+async def relay_events(task: asyncio.Task, events: asyncio.Queue) -> AsyncIterator[dict]:
+    """
+    Yields events put on `events` while `task` runs, then any left over once it is done.
+    The task is cancelled if the consumer stops early (e.g. the client disconnected).
+    """
+    try:
+        while not task.done():
+            getter = asyncio.ensure_future(events.get())
+            await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+            if getter.done():
+                yield getter.result()
+            else:
+                getter.cancel()
+        while not events.empty():
+            yield events.get_nowait()
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+def parse_report_output(raw_report_str_from_llm: str) -> dict:
+    """
+    Turns the report string from the analysis service into a validated report dict,
+    using the shared report decoder (fence/prose stripping, JSON repair, defaults).
+    """
+    if not raw_report_str_from_llm:
+        print("PIPELINE_ERROR: analyze_accessibility returned None or empty string.")
+        raise AnalysisError("Analysis service returned no data.")
+
+    report_dict, missing = decode_report(raw_report_str_from_llm)
+    if report_dict is None:
+        print(f"PIPELINE_ERROR: Failed to decode report. Data: {raw_report_str_from_llm[:2000]}")
+        raise AnalysisError(f"Failed to parse the analysis report from AI service. Start of output: {raw_report_str_from_llm[:300]}")
+
+    # Check if the loaded dict indicates an error from Langchain service itself
+    if report_dict["scores"] and report_dict["scores"][0].get("category") == "Error":
+        error_message = f"Analysis service error: {report_dict['scores'][0].get('feedback')}"
+        print(f"PIPELINE_ERROR: Langchain service reported an error: {error_message}")
+        raise AnalysisError(error_message)
+
+    if missing:
+        print(f"PIPELINE_WARNING: Report is still missing {missing} after completion; returning the partial report.")
+    if not report_dict["scores"]:
+        raise AnalysisError("The analysis report from AI service contains no scores.")
+    if not report_dict[IMPLEMENTATION_PLAN]:
+        report_dict[IMPLEMENTATION_PLAN] = "The implementation plan could not be generated for this report."
+
+    try:
+        return AnalysisReport(**report_dict).model_dump()
+    except Exception as e_model:
+        print(f"PIPELINE_ERROR: Failed to create AnalysisReport model. Error: {e_model}")
+        raise AnalysisError(f"Failed to structure the analysis report. Error: {e_model}")
+
+
+async def analysis_events(url: str, offline: bool = False, incremental: bool = False, viewports: Optional[List[str]] = None) -> AsyncIterator[dict]:
+    """
+    Runs the full analysis for one URL and yields progress event payloads.
+
+    Progress payloads have `type`, `message`, `step_name`, `progress` and `error`. While
+    the model runs, `llm_stream` payloads (stage, partial text `delta`, `tokens`, `done`)
+    and `score` payloads (one per report category, as soon as it is complete) are
+    interleaved. The last payload is either an error event or a `report` event
+    carrying the report in `data`. The report's `timings` break the run down by stage
+    (durations, sizes, LLM tokens and estimated cost; see metrics_service).
+
+    With `incremental`, the page is analyzed in sections and diffed against the URL's
+    previous incremental analysis: only changed sections (and the screenshot, if the
+    page looks different) go to the model, and the report's `regression` has the score
+    deltas against that run. The snapshot replaces the report cache in this mode.
+
+    With `viewports` (see normalize_viewports) a screenshot is taken at every viewport,
+    concurrently with the HTML scrape, and each gets its own visual pass; the HTML is
+    scraped and analyzed once.
+    """
+    trace = start_trace()
+    outcome = "error"
+    current_step = 0
+    total_steps = 7 # Define total steps for progress calculation
+
+    def progress_event(message: str, step_name: str, progress_override: int = -1, error: bool = False, data: dict = None) -> dict:
+        nonlocal current_step
+        current_step += 1
+        progress = progress_override if progress_override != -1 else int((current_step / total_steps) * 100)
+        if error:
+            current_step -= 1 # Don't count error step in progress
+
+        payload = {
+            "type": "progress" if not data else "report",
+            "message": message,
+            "step_name": step_name,
+            "progress": min(progress, 100), # Cap progress at 100
+            "error": error
+        }
+        if data:
+            payload["data"] = data
+        return payload
+
+    try:
+        yield {"type": "progress", "message": "Initializing analysis...", "step_name": "Initialization", "progress": 0, "error": False}
+
+        # Step 1: Scrape website
+        yield progress_event("Taking Screenshot and Structure of your website...", "Scraping Website")
+
+        print(f"PIPELINE: Scraping URL: {url} (offline={offline}, viewports={viewports or 'default'})")
+        viewports = viewports if not offline else None
+        extra_viewports = [viewport for viewport in viewports or [] if viewport != "desktop"]
+        try:
+            await check_public_url(normalize_url(url))
+            scraped_data, *extra_screenshots = await asyncio.gather(
+                get_scraped_data(url, include_screenshot=not offline and (not viewports or "desktop" in viewports)),
+                *(get_viewport_screenshot(url, viewport) for viewport in extra_viewports)
+            )
+        except UnsafeURLError as e:
+            print(f"PIPELINE_ERROR: Refusing to scrape {url}: {e}")
+            yield progress_event(str(e), "Scraping", error=True)
+            return
+        if not scraped_data or not scraped_data.get("html"):
+            print(f"PIPELINE_ERROR: Failed to scrape website or HTML content missing. URL: {url}")
+            yield progress_event("Failed to scrape the website or critical content (HTML) is missing.", "Scraping", error=True)
+            return
+
+        html_content = scraped_data.get("html")
+        screenshot = scraped_data.get("screenshot") if not offline else None
+
+        viewport_screenshots = None
+        if viewports:
+            # Measured findings are labelled with their viewport; the first captured viewport stands in for `screenshot`.
+            captured = {"desktop": screenshot, **dict(zip(extra_viewports, extra_screenshots))}
+            viewport_screenshots = [
+                {
+                    **captured[name],
+                    "viewport": name,
+                    "viewport_description": VIEWPORTS[name]["description"],
+                    "visual_findings": [{**finding, "path": f"{name} {finding['path']}"} for finding in captured[name].get("visual_findings") or []],
+                }
+                for name in viewports if captured.get(name)
+            ] or None
+            screenshot = viewport_screenshots[0] if viewport_screenshots else None
+
+        yield progress_event("Website scraped. HTML and screenshot (if available) retrieved.", "Scraping Complete")
+
+        if not offline:
+            if viewport_screenshots:
+                missing = [name for name in viewports if name not in {shot["viewport"] for shot in viewport_screenshots}]
+                yield progress_event(
+                    f"Screenshots captured at {len(viewport_screenshots)} viewport(s): "
+                    + ", ".join(f"{shot['viewport']} ({len(shot['tiles'])} section(s))" for shot in viewport_screenshots)
+                    + (f". Not available: {', '.join(missing)}." if missing else "."),
+                    "Screenshot Status"
+                )
+            elif screenshot is None:
+                print("PIPELINE_WARNING: Screenshot data is None. Proceeding with analysis, Langchain service might adapt.")
+                yield progress_event("Screenshot not available, proceeding with HTML-only analysis.", "Screenshot Status") # Not an error, but an update
+            else:
+                yield progress_event(f"Screenshot captured successfully ({len(screenshot['tiles'])} section(s) to analyze).", "Screenshot Status")
+
+        # Run the exact rule checks on the full HTML, then condense it for the LLM prompt
+        with span("rules", bytes_in=len(html_content)):
+            rule_results = await asyncio.to_thread(analyze_html_rules, html_content)
+        if offline:
+            print("PIPELINE: Offline mode, returning rules-only report.")
+            outcome = "offline"
+            report = AnalysisReport(**build_offline_report(rule_results), findings=rule_results["findings"], timings=trace.summary(outcome)).model_dump()
+            yield progress_event("Rules-only analysis complete!", "Complete", progress_override=100, data=report)
+            return
+
+        page_html, shared_components = html_content, []
+        if TEMPLATE_DEDUP:
+            with span("template_split", bytes_in=len(html_content)) as record:
+                page_html, shared_components = await asyncio.to_thread(template_registry.split_page, url, html_content)
+                record["bytes_out"] = len(page_html)
+            if shared_components:
+                print(f"PIPELINE: {len(shared_components)} shared template component(s) cut out of {url}")
+
+        html_budget = get_html_token_budget(LLM_PROVIDER)
+        with span("condense", bytes_in=len(page_html)) as record:
+            condensed_html, html_stats = await asyncio.to_thread(condense_html, page_html, html_budget)
+            record.update(bytes_out=len(condensed_html), detail=f"pass {html_stats['condense_pass']}")
+        html_chunks = None
+        if incremental:
+            with span("sections", bytes_in=len(page_html)) as record:
+                html_chunks, chunks_dropped = await asyncio.to_thread(split_sections, page_html, html_budget)
+                record["detail"] = f"{len(html_chunks)} section(s)"
+            condensed_html = "".join(section["html"] for section in html_chunks)
+            html_stats.update(condensed_bytes=len(condensed_html.encode("utf-8")), condensed_tokens_estimate=estimate_tokens(condensed_html), truncated=chunks_dropped, chunks=len(html_chunks))
+        elif HTML_CHUNKING and html_stats["condense_pass"] > 0:
+            with span("chunk", bytes_in=len(page_html)) as record:
+                html_chunks, chunks_dropped = await asyncio.to_thread(chunk_html, page_html, html_budget, HTML_MAX_CHUNKS)
+                record["detail"] = f"{len(html_chunks)} chunk(s)"
+            if len(html_chunks) > 1:
+                # The chunks replace the reduced-detail version, in the prompt and in the cache key.
+                condensed_html = "".join(chunk["html"] for chunk in html_chunks)
+                html_stats.update(condensed_bytes=len(condensed_html.encode("utf-8")), condensed_tokens_estimate=estimate_tokens(condensed_html), truncated=chunks_dropped, chunks=len(html_chunks))
+                print(f"PIPELINE: HTML exceeds the token budget, split into {len(html_chunks)} chunk(s){' (truncated)' if chunks_dropped else ''}.")
+            else:
+                html_chunks = None
+        # Report sizes against the full page, not just its page-unique part
+        html_stats["original_bytes"] = len(html_content.encode("utf-8"))
+        html_stats["original_tokens_estimate"] = estimate_tokens(html_content)
+        print(f"PIPELINE: Condensed HTML from {html_stats['original_bytes']} to {html_stats['condensed_bytes']} bytes.")
+        yield progress_event(
+            f"Found {len(rule_results['findings'])} issue(s) with rule checks. HTML condensed from "
+            f"{html_stats['original_bytes'] // 1024} KB to {html_stats['condensed_bytes'] // 1024} KB"
+            f"{f', split into {len(html_chunks)} sections analyzed in parallel' if html_chunks and len(html_chunks) > 1 else ''}.",
+            "HTML Preprocessing"
+        )
+
+        visual_shots = viewport_screenshots or ([screenshot] if screenshot else [])
+        findings = rule_results["findings"] + [finding for shot in visual_shots for finding in shot.get("visual_findings") or []]
+        template_fingerprints = [component["fingerprint"] for component in shared_components]
+        model_key = content_hash(LLM_PROVIDER, LLM_MODEL, CASCADE_KEY, PROMPT_VERSION)
+        # What the page looks like, for the snapshot: one fingerprint per viewport
+        visual_state = screenshot
+        if viewport_screenshots:
+            fingerprints = [shot.get("fingerprint") for shot in viewport_screenshots]
+            visual_state = {"fingerprint": " ".join(f"{shot['viewport']}={shot['fingerprint']}" for shot in viewport_screenshots) if all(fingerprints) else None}
+        previous_snapshot, reanalysis = None, None
+        if incremental:
+            previous_snapshot = await load_snapshot(url)
+        if previous_snapshot is not None:
+            reanalysis = plan_reanalysis(previous_snapshot, html_chunks, visual_state, template_fingerprints, findings, model_key)
+            diff = reanalysis["diff"]
+            print(
+                f"PIPELINE: Incremental analysis of {url}: {diff['unchanged']} unchanged, {len(diff['changed'])} changed, "
+                f"{len(diff['added'])} added, {len(diff['removed'])} removed section(s); screenshot {'changed' if reanalysis['screenshot_changed'] else 'unchanged'}."
+            )
+
+        # Identical page content, screenshot, model and prompts give an identical report
+        cache_key = report_cache_key(condensed_html, screenshot, template_fingerprints, viewport_screenshots)
+        cached_report = await report_cache.get(cache_key) if not incremental else None
+        if cached_report is not None:
+            print(f"PIPELINE: Report cache hit for {url}")
+            outcome = "report_cache_hit"
+            cached_report = {**cached_report, "timings": trace.summary(outcome)}
+            yield progress_event("Page content unchanged since the last analysis. Using cached report.", "Complete", progress_override=100, data=cached_report)
+            return
+
+        # Step 2: Analyze accessibility (Langchain service)
+        # The HTML and screenshot stages run concurrently inside the service; we treat the whole pipeline as one step here.
+        if reanalysis is None:
+            yield progress_event("Accessibility is beeing analyzed carefully...", "AI Analysis")
+        elif reanalysis["unchanged"]:
+            yield progress_event("Nothing changed since the last analysis. Carrying over its results.", "AI Analysis")
+        else:
+            yield progress_event(
+                f"Re-analyzing {reanalysis['sections_to_analyze']} of {len(html_chunks)} section(s) that changed since the last analysis"
+                f"{' and the screenshot' if 'screenshot' not in reanalysis['carried'] else ''}...",
+                "AI Analysis"
+            )
+
+        # Which model produced which part of the report, recorded by the LLM stages
+        model_parts = collect_model_parts()
+        with span("template_analysis", detail=f"{len(shared_components)} component(s)"):
+            template_components = await analyze_template_components(shared_components)
+        template_feedback = "\n\n".join(
+            f"Component <{component['label']}> (shared by {component['pages_seen']} pages):\n{component['feedback']}"
+            for component in template_components
+        )
+
+        stage_feedback: dict = {}
+        if reanalysis is not None and reanalysis["unchanged"]:
+            stage_feedback = reanalysis["carried"]
+            report = {"scores": previous_snapshot["scores"], "implementation_plan": previous_snapshot["implementation_plan"]}
+        else:
+            print("PIPELINE: Calling analyze_accessibility_async...")
+            # Partial LLM output and completed score categories are relayed as they stream in.
+            stream_events: asyncio.Queue = asyncio.Queue()
+            with span("llm_slot_wait"):
+                await llm_slots.acquire()
+            try:
+                with span("llm_analysis", bytes_in=len(condensed_html)) as record:
+                    # The task copies the current context, so the LLM stage spans nest under this analysis.
+                    analysis = asyncio.create_task(analyze_accessibility_async(
+                        condensed_html, screenshot, rule_results, template_feedback or None, on_event=stream_events.put_nowait, html_chunks=html_chunks,
+                        carried_feedback=reanalysis["carried"] if reanalysis else None, stage_feedback=stage_feedback, viewport_screenshots=viewport_screenshots,
+                    ))
+                    async for stream_event in relay_events(analysis, stream_events):
+                        yield stream_event
+                    raw_report_str_from_llm = analysis.result()
+                    record["bytes_out"] = len(raw_report_str_from_llm or "")
+            finally:
+                llm_slots.release()
+
+            yield progress_event("AI analysis complete. Processing report...", "Report Processing")
+
+            try:
+                with span("report_parse", bytes_in=len(raw_report_str_from_llm or "")):
+                    report = parse_report_output(raw_report_str_from_llm)
+            except AnalysisError as e:
+                yield progress_event(str(e), "Report Processing", error=True)
+                return
+        report["html_stats"] = html_stats
+        report["findings"] = findings
+        report["models"] = model_parts or None
+        report["template_components"] = template_components or None
+        if incremental:
+            if previous_snapshot is not None:
+                report["regression"] = regression_report(previous_snapshot, report, reanalysis, len(html_chunks))
+            await save_snapshot(url, build_snapshot(url, model_key, html_chunks, stage_feedback, visual_state, template_fingerprints, report))
+        else:
+            await report_cache.set(cache_key, report)
+        # Timings describe this run only, so they are attached after the report is cached.
+        outcome = "carried_over" if reanalysis is not None and reanalysis["unchanged"] else "computed"
+        report = {**report, "timings": trace.summary(outcome)}
+
+        yield progress_event("Report processed successfully. Creating final report.", "Finalizing", progress_override=99)
+        yield progress_event("Analysis complete!", "Complete", progress_override=100, data=report)
+
+    except Exception as e:
+        error_message = f"An unexpected server error occurred during analysis: {str(e)}"
+        print(f"PIPELINE_ERROR: An unexpected error occurred: {e}")
+        import traceback
+        traceback.print_exc()
+        yield progress_event(error_message, "System Error", error=True)
+    finally:
+        finish_trace(trace, outcome)
+
+
+async def stored_analysis_events(url: str, offline: bool = False, incremental: bool = False, viewports: Optional[List[str]] = None) -> AsyncIterator[dict]:
+    """
+    `analysis_events`, recording the finished report in the report store.
+    """
+    async for event in analysis_events(url, offline=offline, incremental=incremental, viewports=viewports):
+        if event["type"] == "report":
+            record_report(url, event["data"], "offline" if offline else "incremental" if incremental else "full", viewports)
+        yield event
+
+
+async def shared_analysis_events(url: str, offline: bool = False, incremental: bool = False, viewports: Optional[List[str]] = None) -> AsyncIterator[dict]:
+    """
+    Same events as `analysis_events`, but concurrent callers for the same normalized
+    URL and mode share a single underlying analysis (one scrape, one set of LLM calls),
+    which is recorded in the report store once.
+    """
+    incremental = incremental and not offline
+    viewports = normalize_viewports(viewports) if not offline else None
+    key = f"{normalize_url(url)}|{'offline' if offline else 'incremental' if incremental else 'full'}|{','.join(viewports or [])}"
+    async for event in in_flight_analyses.subscribe(key, lambda: stored_analysis_events(url, offline=offline, incremental=incremental, viewports=viewports)):
+        yield event
+
+
+async def run_analysis(url: str, offline: bool = False, incremental: bool = False, viewports: Optional[List[str]] = None) -> dict:
+    """
+    Runs the analysis to completion and returns the report dict.
+    Raises AnalysisError with the failing step's message.
+    """
+    async for event in shared_analysis_events(url, offline=offline, incremental=incremental, viewports=viewports):
+        if event.get("error"):
+            raise AnalysisError(event["message"])
+        if event["type"] == "report":
+            return event["data"]
+    raise AnalysisError("Analysis finished without producing a report.")
@@ -0,0 +1,73 @@
+from typing import AsyncIterator, Dict, List, Optional
+from services.analysis_pipeline import run_analysis, AnalysisError
+import asyncio
+import os
+import statistics
+import time
+
+# Batch mode: analyze a caller-supplied list of URLs concurrently under a cap and
+# report each one as soon as it finishes. One URL failing never affects the others.
+
+BATCH_MAX_URLS = int(os.getenv("BATCH_MAX_URLS", "1000"))
+
+
+async def batch_analysis_events(urls: List[str], concurrency: int, offline: bool = False, include_reports: bool = True, incremental: bool = False, viewports: Optional[List[str]] = None) -> AsyncIterator[dict]:
+    """
+    Analyzes `urls` (at most `concurrency` at a time) and yields one `result` event per
+    URL in completion order, then a `summary` event. `index` is the URL's position in
+    the request. Without `include_reports` a result carries only the category scores
+    (and, for incremental analyses, the categories that regressed since the last run).
+    """
+    started = time.monotonic()
+    slots = asyncio.Semaphore(concurrency)
+
+    async def analyze_url(index: int, url: str) -> dict:
+        async with slots:
+            url_started = time.monotonic()
+            try:
+                report = await run_analysis(url, offline=offline, incremental=incremental, viewports=viewports)
+                result = {"status": "ok", "report": report}
+            except AnalysisError as e:
+                result = {"status": "error", "error": str(e)}
+            except Exception as e:
+                print(f"BATCH_SERVICE_ERROR: Unexpected error analyzing {url}: {e}")
+                result = {"status": "error", "error": f"An unexpected server error occurred: {str(e)}"}
+            return {"index": index, "url": url, **result, "elapsed_ms": round((time.monotonic() - url_started) * 1000)}
+
+    print(f"BATCH_SERVICE: Analyzing {len(urls)} URL(s), {concurrency} at a time (offline={offline}).")
+    tasks = [asyncio.create_task(analyze_url(index, url)) for index, url in enumerate(urls)]
+    category_scores: Dict[str, List[int]] = {}
+    failed: List[str] = []
+    completed = 0
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            result = await next_result
+            completed += 1
+            if result["status"] == "ok":
+                scores = {score["category"]: score["score"] for score in result["report"].get("scores", [])}
+                for category, score in scores.items():
+                    category_scores.setdefault(category, []).append(score)
+                if not include_reports:
+                    report = result.pop("report")
+                    result["scores"] = scores
+                    if report.get("regression"):
+                        result["regressed_categories"] = report["regression"]["regressed_categories"]
+            else:
+                failed.append(result["url"])
+            yield {"type": "result", "completed": completed, "total": len(urls), **result}
+    finally:
+        # If the client goes away mid-batch, do not leave analyses running.
+        for task in tasks:
+            task.cancel()
+
+    elapsed = time.monotonic() - started
+    print(f"BATCH_SERVICE: Batch of {len(urls)} URL(s) finished in {elapsed:.1f}s, {len(failed)} failed.")
+    yield {
+        "type": "summary",
+        "total": len(urls),
+        "succeeded": len(urls) - len(failed),
+        "failed": len(failed),
+        "failed_urls": failed,
+        "elapsed_seconds": round(elapsed, 1),
+        "mean_scores": {category: round(statistics.mean(scores), 1) for category, scores in category_scores.items()},
+    }
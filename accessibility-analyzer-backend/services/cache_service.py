@@ -0,0 +1,282 @@
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from dotenv import load_dotenv
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+load_dotenv()
+
+# Two-level cache for scrape results and final reports.
+# Level 1 is an in-process LRU bounded by total bytes; level 2 is an optional SQLite
+# file (CACHE_SQLITE_PATH) that all uvicorn workers on the host share.
+
+CACHE_MEMORY_MAX_BYTES = int(os.getenv("CACHE_MEMORY_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH")  # Disk level disabled if unset
+CACHE_SQLITE_MAX_BYTES = int(os.getenv("CACHE_SQLITE_MAX_BYTES", str(512 * 1024 * 1024)))
+# The store's total size is summed from the table at most every this many writes (or
+# sooner when this process's own writes could have reached the limit), not on every write.
+CACHE_SQLITE_SIZE_CHECK_WRITES = int(os.getenv("CACHE_SQLITE_SIZE_CHECK_WRITES", "50"))
+SCRAPE_CACHE_TTL_SECONDS = int(os.getenv("SCRAPE_CACHE_TTL_SECONDS", "600"))
+REPORT_CACHE_TTL_SECONDS = int(os.getenv("REPORT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+SNAPSHOT_TTL_SECONDS = int(os.getenv("SNAPSHOT_TTL_SECONDS", str(30 * 24 * 3600)))
+
+# Query parameters that never change page content.
+IGNORED_QUERY_PARAMS = {"fbclid", "gclid", "mc_cid", "mc_eid"}
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normalizes a URL for use as a cache key: lowercase scheme and host, no default
+    port, no fragment, sorted query without tracking parameters, and no trailing slash.
+    """
+    url = (url or "").strip()
+    if "://" not in url:
+        url = "https://" + url
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    port = parts.port
+    if port and not ((scheme == "http" and port == 80) or (scheme == "https" and port == 443)):
+        host = f"{host}:{port}"
+    path = parts.path or "/"
+    if len(path) > 1 and path.endswith("/"):
+        path = path.rstrip("/")
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in IGNORED_QUERY_PARAMS
+    ))
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+def content_hash(*parts: Optional[str]) -> str:
+    """
+    SHA-256 over several strings (None-safe), used for content-addressed keys.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        data = (part or "").encode("utf-8")
+        digest.update(len(data).to_bytes(8, "big"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class MemoryLRU:
+    """
+    Thread-safe LRU of serialized values bounded by total byte size, with per-entry expiry.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, payload bytes)
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, payload = entry
+            if expires_at < time.time():
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return payload
+
+    def set(self, key: str, payload: bytes, ttl_seconds: int):
+        if len(payload) > self.max_bytes:
+            return  # Never let one entry flush the whole cache
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (time.time() + ttl_seconds, payload)
+            self.total_bytes += len(payload)
+            while self.total_bytes > self.max_bytes and self.entries:
+                oldest_key = next(iter(self.entries))
+                self._remove(oldest_key)
+
+    def _remove(self, key: str):
+        _, payload = self.entries.pop(key)
+        self.total_bytes -= len(payload)
+
+
+class SQLiteStore:
+    """
+    On-disk cache level shared between worker processes. WAL mode lets readers and a
+    writer work concurrently; eviction drops least recently used rows past max_bytes.
+
+    The total size is tracked as the last summed total plus the bytes this process has
+    written since; the table is only summed again when that estimate passes max_bytes
+    or every CACHE_SQLITE_SIZE_CHECK_WRITES writes (other workers write to it too).
+    """
+
+    def __init__(self, path: str, max_bytes: int, size_check_writes: int = CACHE_SQLITE_SIZE_CHECK_WRITES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.size_check_writes = max(1, size_check_writes)
+        self.local = threading.local()
+        self.size_lock = threading.Lock()
+        self.size_checks = 0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    payload BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_last_access ON cache(last_access)")
+            self.known_bytes = self._total_size(conn)
+        self.writes_since_check = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute("SELECT payload, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] < now:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            return None
+        conn.execute("UPDATE cache SET last_access = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def set(self, key: str, payload: bytes, ttl_seconds: int):
+        conn = self._connect()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, payload, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+            (key, payload, len(payload), now + ttl_seconds, now)
+        )
+        with self.size_lock:
+            # A replaced row is counted again, so the estimate only errs on the high side.
+            self.known_bytes += len(payload)
+            self.writes_since_check += 1
+            if self.known_bytes <= self.max_bytes and self.writes_since_check < self.size_check_writes:
+                return
+            self.writes_since_check = 0
+        self._enforce_limit(conn, now)
+
+    def _total_size(self, conn: sqlite3.Connection) -> int:
+        self.size_checks += 1
+        return conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+
+    def _enforce_limit(self, conn: sqlite3.Connection, now: float):
+        total = self._total_size(conn)
+        if total > self.max_bytes:
+            conn.execute("DELETE FROM cache WHERE expires_at < ?", (now,))
+            total = self._total_size(conn)
+            excess = total - self.max_bytes
+            rows = conn.execute("SELECT key, size FROM cache ORDER BY last_access").fetchall()
+            for row_key, size in rows:
+                if excess <= 0:
+                    break
+                conn.execute("DELETE FROM cache WHERE key = ?", (row_key,))
+                excess -= size
+                total -= size
+        with self.size_lock:
+            self.known_bytes = total
+
+
+def _encode(value: Any) -> bytes:
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+
+class TwoLevelCache:
+    """
+    Namespaced JSON-value cache over the memory LRU and the optional SQLite store.
+    Disk hits are promoted into memory. Hit/miss counters are kept per cache.
+    Values (scrapes with screenshots run to several MB) are encoded and decoded in a
+    worker thread so they do not block the event loop.
+    """
+
+    def __init__(self, name: str, ttl_seconds: int, memory: MemoryLRU, disk: Optional[SQLiteStore]):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.memory = memory
+        self.disk = disk
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0}
+
+    def _key(self, key: str) -> str:
+        return f"{self.name}:{key}"
+
+    async def get(self, key: str) -> Optional[Any]:
+        full_key = self._key(key)
+        payload = self.memory.get(full_key)
+        if payload is not None:
+            self.stats["memory_hits"] += 1
+            return await asyncio.to_thread(json.loads, payload)
+        if self.disk is not None:
+            try:
+                payload = await asyncio.to_thread(self.disk.get, full_key)
+            except sqlite3.Error as e:
+                print(f"CACHE_SERVICE_ERROR: SQLite read failed for {self.name}: {e}")
+                payload = None
+            if payload is not None:
+                self.stats["disk_hits"] += 1
+                self.memory.set(full_key, payload, self.ttl_seconds)
+                return await asyncio.to_thread(json.loads, payload)
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: Any):
+        full_key = self._key(key)
+        payload = await asyncio.to_thread(_encode, value)
+        self.stats["writes"] += 1
+        self.memory.set(full_key, payload, self.ttl_seconds)
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.set, full_key, payload, self.ttl_seconds)
+            except sqlite3.Error as e:
+                print(f"CACHE_SERVICE_ERROR: SQLite write failed for {self.name}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"]
+        hits = lookups - self.stats["misses"]
+        return {**self.stats, "hit_ratio": round(hits / lookups, 3) if lookups else 0.0}
+
+
+_memory = MemoryLRU(CACHE_MEMORY_MAX_BYTES)
+_disk = SQLiteStore(CACHE_SQLITE_PATH, CACHE_SQLITE_MAX_BYTES) if CACHE_SQLITE_PATH else None
+
+scrape_cache = TwoLevelCache("scrape", SCRAPE_CACHE_TTL_SECONDS, _memory, _disk)
+report_cache = TwoLevelCache("report", REPORT_CACHE_TTL_SECONDS, _memory, _disk)
+# Findings for shared site template components, keyed by component fingerprint
+template_cache = TwoLevelCache("template", REPORT_CACHE_TTL_SECONDS, _memory, _disk)
+# Last incremental analysis per URL (sections, screenshot fingerprint, findings), see snapshot_service
+snapshot_cache = TwoLevelCache("snapshot", SNAPSHOT_TTL_SECONDS, _memory, _disk)
+
+
+def get_cache_stats() -> Dict[str, Any]:
+    """
+    Hit/miss counters for both caches plus memory usage, for the /cache/stats endpoint.
+    """
+    return {
+        "scrape": scrape_cache.get_stats(),
+        "report": report_cache.get_stats(),
+        "template": template_cache.get_stats(),
+        "snapshot": snapshot_cache.get_stats(),
+        "memory": {
+            "entries": len(_memory.entries),
+            "bytes": _memory.total_bytes,
+            "max_bytes": _memory.max_bytes,
+        },
+        "disk_enabled": _disk is not None,
+    }
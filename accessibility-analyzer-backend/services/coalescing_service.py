@@ -0,0 +1,97 @@
+from typing import AsyncIterator, Callable, Dict
+from services.event_buffer_service import EventBuffer
+import asyncio
+
+# Single-flight coalescing of identical analyses. The first request for a key starts
+# the job as a background task; later requests for the same key while it is running
+# subscribe to it. Every subscriber replays the job's events from the beginning, so
+# each client sees the sequence it would have seen on its own (with streamed LLM
+# deltas compacted for late subscribers; a subscriber that lags behind the job only
+# receives the part of a compacted delta it has not seen, see event_buffer_service).
+
+
+class _Flight:
+    """
+    One running job: its buffered events and a condition that wakes subscribers.
+    """
+
+    def __init__(self):
+        self.events = EventBuffer()
+        self.done = False
+        self.condition = asyncio.Condition()
+        self.subscribers = 0
+        self.task = None
+
+
+class SingleFlight:
+    """
+    Registry of in-flight jobs keyed by a caller-chosen string (e.g. a normalized URL).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.flights: Dict[str, _Flight] = {}
+        self.stats = {"started": 0, "joined": 0}
+
+    async def _run(self, key: str, flight: _Flight, event_source: AsyncIterator[dict]):
+        try:
+            async for event in event_source:
+                async with flight.condition:
+                    flight.events.append(event)
+                    flight.condition.notify_all()
+        except Exception as e:
+            print(f"COALESCING_ERROR: {self.name} job for {key} failed: {e}")
+            async with flight.condition:
+                flight.events.append({
+                    "type": "progress",
+                    "message": f"An unexpected server error occurred during analysis: {str(e)}",
+                    "step_name": "System Error",
+                    "progress": 0,
+                    "error": True
+                })
+        finally:
+            async with flight.condition:
+                flight.done = True
+                flight.condition.notify_all()
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+
+    async def subscribe(self, key: str, start_job: Callable[[], AsyncIterator[dict]]) -> AsyncIterator[dict]:
+        """
+        Yields all events of the job for `key`, starting it with `start_job()` if none is running.
+        """
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            self.flights[key] = flight
+            # The job runs independently of this subscriber, so a client disconnect
+            # does not cancel it for everyone else.
+            flight.task = asyncio.create_task(self._run(key, flight, start_job()))
+            self.stats["started"] += 1
+            print(f"COALESCING: Started {self.name} job for {key}")
+        else:
+            self.stats["joined"] += 1
+            print(f"COALESCING: Joined in-flight {self.name} job for {key} ({flight.subscribers} other subscriber(s))")
+
+        flight.subscribers += 1
+        position = -1
+        try:
+            while True:
+                async with flight.condition:
+                    await flight.condition.wait_for(lambda: position + 1 < len(flight.events) or flight.done)
+                    pending = flight.events.since(position)
+                    position = len(flight.events) - 1
+                    finished = flight.done
+                for _, event in pending:
+                    yield event
+                if finished:
+                    return
+        finally:
+            flight.subscribers -= 1
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "in_flight": len(self.flights),
+            "subscribers": sum(flight.subscribers for flight in self.flights.values()),
+        }
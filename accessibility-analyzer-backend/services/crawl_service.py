@@ -0,0 +1,325 @@
+from html.parser import HTMLParser
+from typing import AsyncIterator, Dict, List, Optional
+from urllib.parse import urljoin, urlsplit
+from xml.etree import ElementTree
+from services.analysis_pipeline import run_analysis, get_scraped_data, AnalysisError, TEMPLATE_DEDUP
+from services.cache_service import normalize_url
+from services.template_service import template_registry, find_components
+from services.http_client_service import get_http_client
+from services.url_safety_service import check_public_url, stream_public, UnsafeURLError
+import asyncio
+import httpx
+import statistics
+
+# Multi-page "site" mode: discover same-origin pages from a sitemap or by following
+# links, analyze them concurrently under a cap, and aggregate the per-page reports.
+# Discovery requests go through url_safety_service like direct page fetches, so a
+# crawl cannot be pointed at (or redirected to) internal hosts.
+
+DISCOVERY_CONCURRENCY = 8
+DISCOVERY_TIMEOUT_SECONDS = 10.0
+DISCOVERY_MAX_BYTES = 5 * 1024 * 1024
+MAX_SITEMAPS = 20  # Nested sitemaps followed from a sitemap index
+
+SKIPPED_EXTENSIONS = (
+    ".pdf", ".jpg", ".jpeg", ".png", ".gif", ".svg", ".webp", ".zip", ".gz",
+    ".mp4", ".mp3", ".css", ".js", ".json", ".xml", ".ico", ".woff", ".woff2",
+)
+
+SCORE_BANDS = [(90, 100, "90-100"), (70, 89, "70-89"), (50, 69, "50-69"), (30, 49, "30-49"), (0, 29, "0-29")]
+
+
+class _LinkExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.links: List[str] = []
+        self.base_href: Optional[str] = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            href = dict(attrs).get("href")
+            if href:
+                self.links.append(href)
+        elif tag == "base" and self.base_href is None:
+            self.base_href = dict(attrs).get("href")
+
+
+def _origin(url: str) -> str:
+    parts = urlsplit(normalize_url(url))
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _same_origin_page(url: str, origin: str) -> Optional[str]:
+    """
+    Normalized URL if it is an http(s) page on the same origin, otherwise None.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https"):
+        return None
+    if parts.path.lower().endswith(SKIPPED_EXTENSIONS):
+        return None
+    normalized = normalize_url(url)
+    return normalized if _origin(normalized) == origin else None
+
+
+async def _fetch_text(client: httpx.AsyncClient, url: str) -> Optional[str]:
+    try:
+        async with stream_public(client, "GET", url, timeout=DISCOVERY_TIMEOUT_SECONDS) as response:
+            if response.status_code != 200:
+                return None
+            chunks = []
+            size = 0
+            async for chunk in response.aiter_bytes():
+                size += len(chunk)
+                if size > DISCOVERY_MAX_BYTES:
+                    break
+                chunks.append(chunk)
+            return b"".join(chunks).decode(response.encoding or "utf-8", errors="replace")
+    except (httpx.HTTPError, UnsafeURLError) as e:
+        print(f"CRAWL_SERVICE_WARNING: Could not fetch {url}: {e}")
+        return None
+
+
+def _parse_sitemap(xml_text: str) -> tuple:
+    """
+    Returns (page_urls, nested_sitemap_urls) from a sitemap or sitemap index.
+    """
+    try:
+        root = ElementTree.fromstring(xml_text.encode("utf-8"))
+    except ElementTree.ParseError:
+        return [], []
+    locs = [el.text.strip() for el in root.iter() if el.tag.endswith("loc") and el.text]
+    if root.tag.endswith("sitemapindex"):
+        return [], locs
+    return locs, []
+
+
+async def _discover_from_sitemap(client: httpx.AsyncClient, sitemap_url: str, origin: str, max_pages: int) -> List[str]:
+    pages: List[str] = []
+    seen = set()
+    pending = [sitemap_url]
+    fetched = 0
+    while pending and len(pages) < max_pages and fetched < MAX_SITEMAPS:
+        xml_text = await _fetch_text(client, pending.pop(0))
+        fetched += 1
+        if not xml_text:
+            continue
+        page_urls, nested = _parse_sitemap(xml_text)
+        pending.extend(nested)
+        for url in page_urls:
+            page = _same_origin_page(url, origin)
+            if page and page not in seen:
+                seen.add(page)
+                pages.append(page)
+                if len(pages) >= max_pages:
+                    break
+    return pages
+
+
+async def _discover_by_links(client: httpx.AsyncClient, root_url: str, origin: str, max_pages: int) -> List[str]:
+    """
+    Breadth-first crawl of same-origin links, one level at a time, fetching each level concurrently.
+    """
+    root = normalize_url(root_url)
+    pages = [root]
+    seen = {root}
+    frontier = [root]
+    slots = asyncio.Semaphore(DISCOVERY_CONCURRENCY)
+
+    async def links_of(url: str) -> List[str]:
+        async with slots:
+            html = await _fetch_text(client, url)
+        if not html:
+            return []
+        extractor = _LinkExtractor()
+        extractor.feed(html)
+        base = urljoin(url, extractor.base_href) if extractor.base_href else url
+        return [urljoin(base, href) for href in extractor.links]
+
+    while frontier and len(pages) < max_pages:
+        next_frontier = []
+        for links in await asyncio.gather(*(links_of(url) for url in frontier)):
+            for link in links:
+                page = _same_origin_page(link, origin)
+                if page and page not in seen:
+                    seen.add(page)
+                    pages.append(page)
+                    next_frontier.append(page)
+                    if len(pages) >= max_pages:
+                        return pages
+        frontier = next_frontier
+    return pages
+
+
+async def discover_pages(root_url: str, max_pages: int, sitemap_url: Optional[str] = None) -> List[str]:
+    """
+    Discovers up to `max_pages` same-origin page URLs for a site.
+
+    Uses `sitemap_url` if given; otherwise tries /sitemap.xml on the root's origin and
+    falls back to following links from the root page. The root page is always first.
+    Raises UnsafeURLError if the root does not resolve to public addresses or the
+    sitemap is on another origin.
+    """
+    origin = _origin(root_url)
+    root = normalize_url(root_url)
+    await check_public_url(root)
+    if sitemap_url and _origin(sitemap_url) != origin:
+        raise UnsafeURLError(f"The sitemap must be on the same origin as the site ({origin}).")
+    client = get_http_client()
+    pages = await _discover_from_sitemap(client, sitemap_url or f"{origin}/sitemap.xml", origin, max_pages)
+    if not pages:
+        if sitemap_url:
+            print(f"CRAWL_SERVICE_WARNING: Sitemap {sitemap_url} had no usable pages, following links instead.")
+        pages = await _discover_by_links(client, root_url, origin, max_pages)
+    if root in pages:
+        pages.remove(root)
+    pages = [root] + pages
+    return pages[:max_pages]
+
+
+def _percentile(sorted_values: List[int], fraction: float) -> float:
+    if len(sorted_values) == 1:
+        return float(sorted_values[0])
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def aggregate_site_report(root_url: str, pages_discovered: int, page_results: List[dict], max_issues: int = 20) -> dict:
+    """
+    Builds the site-level report: score distribution per category and the issues
+    that recur on the most pages. `page_results` items have `url` and `report` or `error`.
+    """
+    reports = [(result["url"], result["report"]) for result in page_results if result.get("report")]
+
+    category_scores: Dict[str, List[int]] = {}
+    for _, report in reports:
+        for score in report.get("scores", []):
+            category_scores.setdefault(score["category"], []).append(int(score["score"]))
+
+    categories = []
+    for category, scores in category_scores.items():
+        ordered = sorted(scores)
+        histogram = {label: 0 for _, _, label in SCORE_BANDS}
+        for value in ordered:
+            for low, high, label in SCORE_BANDS:
+                if low <= value <= high:
+                    histogram[label] += 1
+                    break
+        categories.append({
+            "category": category,
+            "pages": len(ordered),
+            "mean": round(statistics.mean(ordered), 1),
+            "median": float(statistics.median(ordered)),
+            "min": ordered[0],
+            "max": ordered[-1],
+            "p25": round(_percentile(ordered, 0.25), 1),
+            "p75": round(_percentile(ordered, 0.75), 1),
+            "histogram": histogram,
+        })
+    categories.sort(key=lambda item: item["mean"])
+
+    issues: Dict[tuple, dict] = {}
+    for url, report in reports:
+        for finding in report.get("findings") or []:
+            key = (finding["guideline"], finding["issue"])
+            entry = issues.setdefault(key, {
+                "guideline": finding["guideline"],
+                "severity": finding["severity"],
+                "issue": finding["issue"],
+                "pages": [],
+                "occurrences": 0,
+            })
+            entry["occurrences"] += 1
+            if not entry["pages"] or entry["pages"][-1] != url:
+                entry["pages"].append(url)
+
+    recurring = sorted(issues.values(), key=lambda item: (len(item["pages"]), item["occurrences"]), reverse=True)
+    recurring_issues = [
+        {
+            "guideline": item["guideline"],
+            "severity": item["severity"],
+            "issue": item["issue"],
+            "pages_affected": len(item["pages"]),
+            "occurrences": item["occurrences"],
+            "example_urls": item["pages"][:5],
+        }
+        for item in recurring[:max_issues]
+    ]
+
+    return {
+        "root_url": root_url,
+        "pages_discovered": pages_discovered,
+        "pages_analyzed": len(reports),
+        "pages_failed": len(page_results) - len(reports),
+        "categories": categories,
+        "recurring_issues": recurring_issues,
+    }
+
+
+async def crawl_site_events(root_url: str, max_pages: int, concurrency: int, offline: bool = False, sitemap_url: Optional[str] = None) -> AsyncIterator[dict]:
+    """
+    Discovers pages, analyzes them concurrently (at most `concurrency` at a time) and
+    yields events: one `discovery` event, one `page` event per page in completion
+    order, and a final `site_report` event with the aggregate.
+    """
+    print(f"CRAWL_SERVICE: Discovering up to {max_pages} page(s) for {root_url}")
+    try:
+        pages = await discover_pages(root_url, max_pages, sitemap_url)
+    except UnsafeURLError as e:
+        print(f"CRAWL_SERVICE_ERROR: Refusing to crawl {root_url}: {e}")
+        yield {"type": "error", "message": str(e), "error": True}
+        return
+    yield {"type": "discovery", "message": f"Discovered {len(pages)} page(s).", "pages": pages}
+
+    slots = asyncio.Semaphore(concurrency)
+
+    if TEMPLATE_DEDUP and not offline and len(pages) > 1:
+        # Fingerprint every page before analysis starts, so shared site chrome is
+        # recognized (and analyzed once) from the very first page. Scrapes are cached
+        # and reused by the analyses below.
+        async def observe_page(url: str):
+            async with slots:
+                try:
+                    scraped_data = await get_scraped_data(url)
+                except UnsafeURLError as e:
+                    print(f"CRAWL_SERVICE_WARNING: Skipping {url}: {e}")
+                    return
+            if scraped_data and scraped_data.get("html"):
+                components = await asyncio.to_thread(find_components, scraped_data["html"])
+                template_registry.observe(url, components)
+
+        await asyncio.gather(*(observe_page(url) for url in pages))
+        yield {"type": "templates", "message": "Fingerprinted shared site template components.", **template_registry.get_stats()}
+
+    async def analyze_page(url: str) -> dict:
+        async with slots:
+            try:
+                return {"url": url, "report": await run_analysis(url, offline=offline)}
+            except AnalysisError as e:
+                return {"url": url, "error": str(e)}
+            except Exception as e:
+                print(f"CRAWL_SERVICE_ERROR: Unexpected error analyzing {url}: {e}")
+                return {"url": url, "error": f"An unexpected server error occurred: {str(e)}"}
+
+    tasks = [asyncio.create_task(analyze_page(url)) for url in pages]
+    page_results = []
+    try:
+        for completed in asyncio.as_completed(tasks):
+            result = await completed
+            page_results.append(result)
+            yield {
+                "type": "page",
+                "url": result["url"],
+                "completed": len(page_results),
+                "total": len(pages),
+                "error": result.get("error"),
+                "report": result.get("report"),
+            }
+    finally:
+        # If the client goes away mid-crawl, do not leave page analyses running.
+        for task in tasks:
+            task.cancel()
+
+    yield {"type": "site_report", "data": aggregate_site_report(root_url, len(pages), page_results)}
@@ -0,0 +1,80 @@
+from bisect import bisect_right
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+# Replay buffer for the events of one analysis (background jobs and coalesced
+# requests). Events keep their sequential ids for Last-Event-ID resumption, but the
+# many small `llm_stream` deltas are compacted as they arrive: per stream (stage plus
+# labels) only the newest STREAM_REPLAY_DELTAS deltas stay as they were sent, and all
+# older ones are joined into one event at the id of the newest delta joined. The
+# joined event remembers where each original delta starts in its text, so a client
+# resuming from an id inside the joined range (it already saw part of it) gets only
+# the text it has not seen yet, and a client replaying from the start still receives
+# the full partial text, in far fewer events. Milestones, scores and the report are
+# kept unchanged.
+
+STREAM_REPLAY_DELTAS = int(os.getenv("STREAM_REPLAY_DELTAS", "10"))
+
+# Fields of an llm_stream event that change from delta to delta (the rest identify the stream)
+STREAM_FIELDS = {"delta", "tokens", "done", "error"}
+
+
+class EventBuffer:
+    """
+    Events with stable sequential ids, compacting llm_stream deltas per stream.
+    """
+
+    def __init__(self, max_stream_deltas: int = STREAM_REPLAY_DELTAS):
+        self.max_stream_deltas = max(1, max_stream_deltas)
+        self.slots: List[Optional[dict]] = []  # None where a delta was joined into a later event
+        self.streams: Dict[tuple, Deque[int]] = {}  # stream key -> ids of its events still in the buffer
+        # Joined event id -> (ids of the deltas joined into it, where each one's text starts)
+        self.joined: Dict[int, Tuple[List[int], List[int]]] = {}
+        self.compacted = 0
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def append(self, event: dict) -> int:
+        """
+        Adds an event and returns its id.
+        """
+        event_id = len(self.slots)
+        self.slots.append(event)
+        if event.get("type") == "llm_stream" and not event.get("error"):
+            key = tuple(sorted((name, str(value)) for name, value in event.items() if name not in STREAM_FIELDS))
+            ids = self.streams.setdefault(key, deque())
+            ids.append(event_id)
+            # Keep the newest deltas as sent; join the oldest kept event into the next one.
+            if len(ids) > self.max_stream_deltas + 1:
+                oldest_id = ids.popleft()
+                next_id = ids[0]
+                oldest, following = self.slots[oldest_id], self.slots[next_id]
+                source_ids, starts = self.joined.pop(oldest_id, ([oldest_id], [0]))
+                self.joined[next_id] = (source_ids + [next_id], starts + [len(oldest["delta"])])
+                # A new dict, so subscribers holding the old one are not affected.
+                self.slots[next_id] = {**following, "delta": oldest["delta"] + following["delta"]}
+                self.slots[oldest_id] = None
+                self.compacted += 1
+        return event_id
+
+    def since(self, event_id: int) -> List[Tuple[int, dict]]:
+        """
+        (id, event) for the buffered events after `event_id` (-1 for all). A joined
+        event that starts at or before `event_id` only carries the text after it.
+        """
+        start = event_id + 1
+        pending = []
+        for offset, event in enumerate(self.slots[start:]):
+            if event is None:
+                continue
+            joined = self.joined.get(start + offset)
+            if joined and joined[0][0] <= event_id:
+                source_ids, starts = joined
+                event = {**event, "delta": event["delta"][starts[bisect_right(source_ids, event_id)]:]}
+            pending.append((start + offset, event))
+        return pending
@@ -0,0 +1,184 @@
+from typing import Any, AsyncIterator, Iterator, List, Optional, Sequence
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from dotenv import load_dotenv
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+
+load_dotenv()
+
+# Local stand-in for a chat model provider (MODEL_PROVIDER / LLM_PROVIDER "fake"), so
+# the pipeline, the scheduler and the streaming endpoints can be exercised offline and
+# without API keys. Responses are canned but shaped like the real stages' output: the
+# report stage gets a valid report JSON, every other stage gets a short feedback text.
+# Latency, token rate and rates of simulated 429 and 500 errors are configurable.
+# Like Anthropic, it caches the prompt prefix up to a `cache_control` marker (reported
+# as cache_read/cache_creation input token details), and with bound tools it answers
+# with a call of the first tool, streamed as tool call chunks.
+
+FAKE_LLM_FIRST_TOKEN_SECONDS = float(os.getenv("FAKE_LLM_FIRST_TOKEN_SECONDS", "0.2"))
+FAKE_LLM_TOKENS_PER_SECOND = float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "200"))
+FAKE_LLM_RATE_LIMIT_RATE = float(os.getenv("FAKE_LLM_RATE_LIMIT_RATE", "0"))  # Fraction of calls failing with 429
+FAKE_LLM_ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))  # Fraction of calls failing with 500
+FAKE_LLM_LOW_CONFIDENCE_RATE = float(os.getenv("FAKE_LLM_LOW_CONFIDENCE_RATE", "0"))  # Fraction of HTML analyses stating low confidence
+
+FAKE_REPORT = {
+    "scores": [
+        {"category": "Structure & Semantics", "score": 72, "feedback": "Landmarks are partly missing and one heading level is skipped."},
+        {"category": "Readability & Visual Clarity", "score": 64, "feedback": "Some secondary text has low contrast against its background."},
+        {"category": "Navigability & Interactivity", "score": 81, "feedback": "Most links are descriptive; a few generic 'Read more' links remain."},
+        {"category": "Forms & Inputs", "score": 58, "feedback": "Two inputs have no programmatically associated label."},
+        {"category": "Media Accessibility", "score": 77, "feedback": "Several informative images have filename alt text."},
+    ],
+    "implementation_plan": "1. Label every form control.\n2. Raise the contrast of secondary text to 4.5:1.\n3. Add a <main> landmark and fix the heading order.\n4. Replace filename alt text with descriptions.",
+}
+
+FAKE_FEEDBACK = (
+    "- **Guideline Violated:** Semantic HTML Structure\n"
+    "- **Severity:** Medium\n"
+    "- **Issue Description:** The primary content is not wrapped in a <main> landmark.\n"
+    "- **Recommendation:** Wrap the main content in <main>.\n\n"
+    "No further issues found."
+)
+# Present in prompts that ask for a stated confidence (the HTML stage)
+CONFIDENCE_PROMPT_MARKER = "Confidence: high"
+
+
+class FakeRateLimitError(Exception):
+    """
+    Mimics a provider SDK's 429 error (`status_code` attribute), for the scheduler's retry path.
+    """
+
+    status_code = 429
+
+
+class FakeServerError(Exception):
+    """
+    Mimics a provider SDK's 500 error.
+    """
+
+    status_code = 500
+
+
+# Hashes of the marked prompt prefixes seen so far, shared by all fake models like a provider-side cache.
+_cached_prefixes = set()
+
+
+def _cached_prefix(messages: List[BaseMessage]) -> Optional[str]:
+    """
+    The prompt text up to and including the last content block with a cache marker.
+    """
+    parts, prefix = [], None
+    for message in messages:
+        if isinstance(message.content, str):
+            parts.append(message.content)
+            continue
+        for part in message.content:
+            if isinstance(part, dict):
+                parts.append(part.get("text", ""))
+                if part.get("cache_control"):
+                    prefix = "\n".join(parts)
+    return prefix
+
+
+def _prompt_text(messages: List[BaseMessage]) -> str:
+    parts = []
+    for message in messages:
+        if isinstance(message.content, str):
+            parts.append(message.content)
+        else:
+            parts.extend(part.get("text", "") for part in message.content if isinstance(part, dict))
+    return "\n".join(parts)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Offline chat model returning canned, stage-shaped responses with simulated latency.
+    """
+
+    model: str = "fake"
+    first_token_seconds: float = FAKE_LLM_FIRST_TOKEN_SECONDS
+    tokens_per_second: float = FAKE_LLM_TOKENS_PER_SECOND
+    rate_limit_rate: float = FAKE_LLM_RATE_LIMIT_RATE
+    error_rate: float = FAKE_LLM_ERROR_RATE
+    low_confidence_rate: float = FAKE_LLM_LOW_CONFIDENCE_RATE
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def bind_tools(self, tools: Sequence[Any], tool_choice: Optional[str] = None, **kwargs: Any):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], tool_choice=tool_choice, **kwargs)
+
+    def _respond(self, messages: List[BaseMessage]) -> tuple:
+        if self.rate_limit_rate and random.random() < self.rate_limit_rate:
+            raise FakeRateLimitError("Simulated rate limit (429) from the fake provider.")
+        if self.error_rate and random.random() < self.error_rate:
+            raise FakeServerError("Simulated server error (500) from the fake provider.")
+        prompt = _prompt_text(messages)
+        text = json.dumps(FAKE_REPORT, indent=2) if "implementation_plan" in prompt else FAKE_FEEDBACK
+        if CONFIDENCE_PROMPT_MARKER in prompt:
+            text += "\n\nConfidence: " + ("low" if random.random() < self.low_confidence_rate else "high")
+        usage = {"input_tokens": len(prompt) // 4, "output_tokens": len(text) // 4, "total_tokens": (len(prompt) + len(text)) // 4}
+        prefix = _cached_prefix(messages)
+        if prefix is not None:
+            key = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+            kind = "cache_read" if key in _cached_prefixes else "cache_creation"
+            _cached_prefixes.add(key)
+            usage["input_token_details"] = {kind: len(prefix) // 4}
+        return text, usage
+
+    def _message(self, text: str, usage: dict, tools: Optional[list]) -> AIMessage:
+        if not tools:
+            return AIMessage(content=text, usage_metadata=usage)
+        call = {"name": tools[0]["function"]["name"], "args": json.loads(text) if text.startswith("{") else {}, "id": "call_fake"}
+        return AIMessage(content="", tool_calls=[call], usage_metadata=usage)
+
+    def _chunks(self, text: str, tools: Optional[list]) -> Iterator[AIMessageChunk]:
+        """
+        The response in pieces: text, or the tool call's arguments (a text answer
+        becomes empty arguments, like a model that ignored the tool).
+        """
+        if not tools:
+            for piece in _pieces(text):
+                yield AIMessageChunk(content=piece)
+            return
+        name = tools[0]["function"]["name"]
+        for index, piece in enumerate(_pieces(text if text.startswith("{") else "{}")):
+            first = index == 0
+            yield AIMessageChunk(content="", tool_call_chunks=[{"name": name if first else None, "args": piece, "id": "call_fake" if first else None, "index": 0}])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, tools: Optional[list] = None, **kwargs: Any) -> ChatResult:
+        text, usage = self._respond(messages)
+        time.sleep(self.first_token_seconds + usage["output_tokens"] / self.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=self._message(text, usage, tools))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, tools: Optional[list] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        text, usage = self._respond(messages)
+        time.sleep(self.first_token_seconds)
+        for chunk in self._chunks(text, tools):
+            time.sleep(len(_chunk_payload(chunk)) / 4 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=chunk)
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=usage))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, tools: Optional[list] = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        text, usage = self._respond(messages)
+        await asyncio.sleep(self.first_token_seconds)
+        for chunk in self._chunks(text, tools):
+            await asyncio.sleep(len(_chunk_payload(chunk)) / 4 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=chunk)
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=usage))
+
+
+def _chunk_payload(chunk: AIMessageChunk) -> str:
+    return chunk.content or "".join(tool_chunk["args"] for tool_chunk in chunk.tool_call_chunks)
+
+
+def _pieces(text: str, size: int = 16) -> List[str]:
+    return [text[index:index + size] for index in range(0, len(text), size)]
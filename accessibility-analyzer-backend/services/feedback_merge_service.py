@@ -0,0 +1,122 @@
+from typing import Dict, List, Tuple
+import re
+
+# Merging of HTML-stage feedback from the chunks of a large page (see chunk_html in
+# html_condenser_service). Every chunk is analyzed with the same prompt, so its feedback
+# is a list of issues in the prompt's output format ("Guideline Violated", "Severity",
+# "Issue Description", "Code Snippet", "Recommendation"). The issues are regrouped per
+# guideline, and issues reported by several chunks (the same snippet or description,
+# typically shared markup or page-level problems) are kept once with the chunks they
+# were seen in. The visual feedback of a viewport matrix analysis (one screenshot per
+# viewport) is merged the same way, labelled by viewport.
+
+_ISSUE_START = re.compile(r"^[ \t>*_-]*(?:\*\*)?Guideline Violated:?(?:\*\*)?:?", re.IGNORECASE | re.MULTILINE)
+_FIELD_PATTERN = re.compile(r"^[ \t>*_-]*(?:\*\*)?(Severity|Issue Description|Code Snippet|Recommendation):?(?:\*\*)?:?\s*", re.IGNORECASE | re.MULTILINE)
+_BLANK_LINE = re.compile(r"\n[ \t]*\n")
+NO_ISSUES_PATTERN = re.compile(r"no (?:significant )?issues found", re.IGNORECASE)
+
+
+def _normalize(text: str) -> str:
+    return " ".join(re.sub(r"[`*\"'<>/=]", " ", text).lower().split())
+
+
+def parse_feedback_issues(feedback: str) -> List[dict]:
+    """
+    Splits stage feedback into issues: {"guideline", "text", "key"}. `text` is the
+    issue's original markdown, `key` identifies the same issue reported by another chunk.
+    """
+    starts = [match.start() for match in _ISSUE_START.finditer(feedback or "")]
+    issues = []
+    for position, start in enumerate(starts):
+        block = feedback[start:starts[position + 1] if position + 1 < len(starts) else len(feedback)].strip()
+        header, _, rest = block.partition("\n")
+        guideline = _ISSUE_START.sub("", header).strip(" *:_")
+        fields: Dict[str, str] = {}
+        matches = list(_FIELD_PATTERN.finditer(rest))
+        if matches:
+            # The issue ends with the paragraph of its last field; what follows is the next heading or prose.
+            blank = _BLANK_LINE.search(rest, matches[-1].end())
+            if blank:
+                rest = rest[:blank.start()]
+                block = f"{header}\n{rest}".strip()
+        for index, match in enumerate(matches):
+            end = matches[index + 1].start() if index + 1 < len(matches) else len(rest)
+            fields[match.group(1).lower()] = rest[match.end():end].strip()
+        identity = fields.get("code snippet") or fields.get("issue description") or rest
+        issues.append({
+            "guideline": guideline or "Other",
+            "text": block,
+            "key": (_normalize(guideline), _normalize(identity)[:200]),
+        })
+    return issues
+
+
+def _merge_issues(labelled_feedbacks: List[Tuple[str, str, str]]) -> Tuple[Dict[str, List[dict]], List[str], int, int]:
+    """
+    Regroups (label, title, feedback) triples per guideline, keeping duplicate issues
+    once with every label they were seen under. Feedback that does not follow the issue
+    format is kept as-is under its title. Returns (issues by guideline, unstructured
+    blocks, distinct issues, duplicates removed).
+    """
+    grouped: Dict[str, List[dict]] = {}
+    seen: Dict[tuple, dict] = {}
+    unstructured = []
+    duplicates = 0
+    for label, title, feedback in labelled_feedbacks:
+        issues = parse_feedback_issues(feedback)
+        if not issues:
+            if feedback and not NO_ISSUES_PATTERN.search(feedback[:200]):
+                unstructured.append(f"**{title}:**\n{feedback.strip()}")
+            continue
+        for issue in issues:
+            if issue["key"] in seen:
+                seen[issue["key"]]["labels"].append(label)
+                duplicates += 1
+                continue
+            issue["labels"] = [label]
+            seen[issue["key"]] = issue
+            grouped.setdefault(issue["guideline"], []).append(issue)
+    return grouped, unstructured, len(seen), duplicates
+
+
+def _format_merged(intro: str, grouped: Dict[str, List[dict]], unstructured: List[str], seen_in: str) -> str:
+    lines = [intro]
+    for guideline, issues in grouped.items():
+        lines.append(f"### {guideline}")
+        for issue in issues:
+            lines.append(f"{issue['text']}\n({seen_in}{'s' if len(issue['labels']) > 1 else ''} {', '.join(issue['labels'])})")
+    lines.extend(unstructured)
+    return "\n\n".join(lines)
+
+
+def merge_chunk_feedback(chunk_feedbacks: List[Tuple[dict, str]]) -> str:
+    """
+    Merges (chunk, feedback) pairs into one feedback text grouped by guideline, with
+    duplicate issues kept once. Feedback that does not follow the issue format is
+    passed on as-is under its chunk's label.
+    """
+    grouped, unstructured, distinct, duplicates = _merge_issues([
+        (f"{chunk['index'] + 1}", f"Page section {chunk['index'] + 1} ({chunk['path']})", feedback)
+        for chunk, feedback in chunk_feedbacks
+    ])
+    if not grouped and not unstructured:
+        return "No issues found in any section of the page."
+    print(f"FEEDBACK_MERGE: Merged {len(chunk_feedbacks)} section(s) into {distinct} issue(s), {duplicates} duplicate(s) removed.")
+    intro = f"The page was analyzed in {len(chunk_feedbacks)} sections; issues are grouped by guideline and listed once with the sections they appear in."
+    return _format_merged(intro, grouped, unstructured, "Seen in page section")
+
+
+def merge_viewport_feedback(viewport_feedbacks: List[Tuple[str, str]]) -> str:
+    """
+    Merges the visual feedback of several viewports (name, feedback) into one text
+    grouped by guideline, each issue labelled with the viewport(s) it was seen at.
+    """
+    grouped, unstructured, distinct, duplicates = _merge_issues([
+        (name, f"Viewport {name}", feedback) for name, feedback in viewport_feedbacks
+    ])
+    names = ", ".join(name for name, _ in viewport_feedbacks)
+    if not grouped and not unstructured:
+        return f"No visual issues found at any viewport ({names})."
+    print(f"FEEDBACK_MERGE: Merged {len(viewport_feedbacks)} viewport(s) into {distinct} issue(s), {duplicates} duplicate(s) removed.")
+    intro = f"The page was screenshotted and analyzed at {len(viewport_feedbacks)} viewports ({names}); issues are grouped by guideline and labelled with the viewports they appear at."
+    return _format_merged(intro, grouped, unstructured, "Seen at viewport")
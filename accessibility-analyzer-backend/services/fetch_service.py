@@ -0,0 +1,226 @@
+from html.parser import HTMLParser
+from typing import Dict, Optional, Tuple
+from dotenv import load_dotenv
+from services.http_client_service import get_http_client
+from services.firecrawl_service import scrape_website
+from services.url_safety_service import check_public_url, stream_public, UnsafeURLError
+from services.metrics_service import span, register_collector
+import codecs
+import os
+import re
+
+load_dotenv()
+
+# Fetch strategy for HTML. Most pages are served as complete HTML, so the page is first
+# fetched directly over the shared HTTP client, which takes a fraction of a Firecrawl
+# round trip (no browser rendering, no queueing at Firecrawl). A cheap check of the
+# response decides whether the page only renders with JavaScript; only then, or when the
+# direct fetch fails, does the HTML come from Firecrawl. Screenshots need a browser, so
+# when one is wanted the page is scraped by Firecrawl alone: its one call returns the
+# HTML with the screenshot, and a direct fetch in front of it would only add latency.
+# Direct fetches only go to public addresses (see url_safety_service).
+
+DIRECT_FETCH = os.getenv("DIRECT_FETCH", "true").lower() == "true"
+DIRECT_FETCH_MAX_BYTES = int(os.getenv("DIRECT_FETCH_MAX_BYTES", str(5 * 1024 * 1024)))
+DIRECT_FETCH_TIMEOUT_SECONDS = float(os.getenv("DIRECT_FETCH_TIMEOUT_SECONDS", "15"))
+# A body with less visible text than this, next to scripts, is treated as a JS-rendered shell
+JS_SHELL_MIN_TEXT_CHARS = int(os.getenv("JS_SHELL_MIN_TEXT_CHARS", "200"))
+
+DIRECT_FETCH_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (compatible; AccessibilityAnalyzer/1.0; +https://www.w3.org/WAI/)",
+    "Accept": "text/html,application/xhtml+xml;q=0.9,*/*;q=0.1",
+}
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+# Mount points of client-rendered frameworks (React, Vue, Next.js, Nuxt, Gatsby, Angular)
+FRAMEWORK_ROOT_IDS = {"root", "app", "__next", "__nuxt", "___gatsby"}
+FRAMEWORK_ROOT_TAGS = {"app-root"}
+NOSCRIPT_JS_WARNING = re.compile(r"(enable|turn on|requires?)\s+javascript|javascript\s+(is\s+)?(required|disabled)", re.IGNORECASE)
+META_CHARSET = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([\w.:-]+)""", re.IGNORECASE)
+HEADER_CHARSET = re.compile(r"charset\s*=\s*[\"']?([\w.:-]+)", re.IGNORECASE)
+
+fetch_stats: Dict[str, int] = {"direct": 0, "js_rendering_needed": 0, "direct_failed": 0, "firecrawl": 0}
+
+
+def _known_encoding(name: Optional[str]) -> Optional[str]:
+    if not name:
+        return None
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return None
+
+
+def detect_encoding(content: bytes, content_type: str = "") -> str:
+    """
+    Encoding of an HTML response: a byte order mark, then the Content-Type charset,
+    then a <meta charset> (or http-equiv) declaration near the start of the document,
+    then UTF-8.
+    """
+    for bom, encoding in ((codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16")):
+        if content.startswith(bom):
+            return encoding
+    header = HEADER_CHARSET.search(content_type or "")
+    encoding = _known_encoding(header.group(1) if header else None)
+    if encoding:
+        return encoding
+    meta = META_CHARSET.search(content[:4096])
+    encoding = _known_encoding(meta.group(1).decode("ascii", "ignore") if meta else None)
+    return encoding or "utf-8"
+
+
+class _ShellInspector(HTMLParser):
+    """
+    Collects what needs_js_rendering looks at in one pass: visible body text, scripts,
+    empty framework mount points and noscript text.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.text_chars = 0
+        self.scripts = 0
+        self.noscript_text = []
+        self.open_roots = []  # [tag, depth, has_content] of framework mount points being parsed
+        self.empty_roots = []
+        self._skip = 0  # inside <script>/<style>/<template>
+        self._noscript = 0
+        self._in_body = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "body":
+            self._in_body = True
+        if tag == "script":
+            self.scripts += 1
+        if tag in ("script", "style", "template"):
+            self._skip += 1
+        if tag == "noscript":
+            self._noscript += 1
+        for root in self.open_roots:
+            if root[0] == tag:
+                root[1] += 1
+            root[2] = root[2] or tag not in ("script", "noscript", "link", "style")
+        element_id = dict(attrs).get("id") or ""
+        if (tag == "div" and element_id in FRAMEWORK_ROOT_IDS) or tag in FRAMEWORK_ROOT_TAGS:
+            self.open_roots.append([tag, 1, False])
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style", "template") and self._skip:
+            self._skip -= 1
+        if tag == "noscript" and self._noscript:
+            self._noscript -= 1
+        for root in list(self.open_roots):
+            if root[0] == tag:
+                root[1] -= 1
+                if root[1] == 0:
+                    self.open_roots.remove(root)
+                    if not root[2]:
+                        self.empty_roots.append(tag)
+
+    def handle_data(self, data):
+        if self._skip:
+            return
+        text = data.strip()
+        if not text:
+            return
+        if self._noscript:
+            self.noscript_text.append(text)
+            return
+        if self._in_body:
+            self.text_chars += len(text)
+        for root in self.open_roots:
+            root[2] = True
+
+
+def needs_js_rendering(page_html: str) -> Optional[str]:
+    """
+    Cheap check whether a directly fetched page only renders its content with
+    JavaScript. Returns the reason (an empty body shell, an empty framework mount
+    point or a noscript warning) or None if the HTML can be analyzed as served.
+    """
+    inspector = _ShellInspector()
+    try:
+        inspector.feed(page_html)
+        inspector.close()
+    except Exception as e:
+        return f"unparseable HTML ({e})"
+    if inspector.empty_roots:
+        return f"empty framework root <{inspector.empty_roots[0]}>"
+    if any(NOSCRIPT_JS_WARNING.search(text) for text in inspector.noscript_text):
+        return "noscript asks to enable JavaScript"
+    if inspector.scripts and inspector.text_chars < JS_SHELL_MIN_TEXT_CHARS:
+        return f"near-empty body ({inspector.text_chars} text characters) with scripts"
+    return None
+
+
+async def direct_fetch(url: str) -> Tuple[Optional[str], str]:
+    """
+    Fetches a page directly over the shared HTTP client, streaming the body so that
+    oversized responses are cut off at DIRECT_FETCH_MAX_BYTES. Returns the decoded HTML
+    (or None) and what happened, for logging. Raises UnsafeURLError if the URL or a
+    redirect points at a non-public address.
+    """
+    async with stream_public(get_http_client(), "GET", url, headers=DIRECT_FETCH_HEADERS, timeout=DIRECT_FETCH_TIMEOUT_SECONDS) as response:
+        if response.status_code >= 400:
+            return None, f"HTTP {response.status_code}"
+        content_type = response.headers.get("content-type", "")
+        if content_type and content_type.split(";")[0].strip().lower() not in HTML_CONTENT_TYPES:
+            return None, f"not HTML ({content_type})"
+        if int(response.headers.get("content-length") or 0) > DIRECT_FETCH_MAX_BYTES:
+            return None, f"too large ({response.headers['content-length']} bytes)"
+        body = bytearray()
+        async for data in response.aiter_bytes():
+            body.extend(data)
+            if len(body) > DIRECT_FETCH_MAX_BYTES:
+                return None, f"too large (over {DIRECT_FETCH_MAX_BYTES} bytes)"
+    encoding = detect_encoding(bytes(body), content_type)
+    return bytes(body).decode(encoding, errors="replace"), f"{len(body)} bytes, {encoding}"
+
+
+async def fetch_page(url: str, include_screenshot: bool = True, provider: str = "anthropic") -> Optional[dict]:
+    """
+    Scrapes a page with the cheapest strategy that works. Without a screenshot the HTML
+    is fetched directly and used unless the page needs JavaScript rendering or the fetch
+    fails; then it comes from an HTML-only Firecrawl scrape. With a screenshot the whole
+    scrape goes through Firecrawl in one call.
+    Returns the same shape as scrape_website. Raises UnsafeURLError for URLs that
+    resolve to non-public addresses.
+    """
+    url = url if "://" in url else f"https://{url}"
+    if include_screenshot:
+        await check_public_url(url)
+    elif DIRECT_FETCH:
+        with span("direct_fetch") as record:
+            try:
+                page_html, outcome = await direct_fetch(url)
+            except UnsafeURLError:
+                record["detail"] = "unsafe_url"
+                raise
+            except Exception as e:
+                page_html, outcome = None, f"{type(e).__name__}: {e}"
+            reason = needs_js_rendering(page_html) if page_html else None
+            if page_html and not reason:
+                fetch_stats["direct"] += 1
+                record["detail"], record["bytes_out"] = "static", len(page_html)
+                print(f"FETCH_SERVICE: Fetched {url} directly ({outcome}).")
+            elif reason:
+                fetch_stats["js_rendering_needed"] += 1
+                record["detail"] = "js_rendering_needed"
+                print(f"FETCH_SERVICE: {url} needs JavaScript rendering ({reason}); using Firecrawl.")
+            else:
+                fetch_stats["direct_failed"] += 1
+                record["detail"] = "failed"
+                print(f"FETCH_SERVICE: Direct fetch of {url} failed ({outcome}); using Firecrawl.")
+        if page_html and not reason:
+            return {"html": page_html, "screenshot": None}
+    fetch_stats["firecrawl"] += 1
+    return await scrape_website(url, include_screenshot=include_screenshot, provider=provider)
+
+
+def _fetch_metrics():
+    return [
+        ("analyzer_fetch_total", "counter", "Page fetches by strategy (direct, js_rendering_needed, direct_failed, firecrawl).", [
+            ({"strategy": strategy}, count) for strategy, count in fetch_stats.items()
+        ]),
+    ]
+
+
+register_collector(_fetch_metrics)
@@ -1,87 +1,112 @@
 import asyncio
-from firecrawl import AsyncFirecrawlApp
+import json
 import os
-import base64 # Add base64 import
-import httpx  # Add httpx import
+import httpx
+from firecrawl.v2.client_async import AsyncFirecrawlClient
 from dotenv import load_dotenv
+from services.http_client_service import get_http_client, CLIENT_READ_TIMEOUTS
+from services.screenshot_service import prepare_screenshot
+from services.metrics_service import span
 
 load_dotenv()
 
-async def scrape_website(url: str):
+FIRECRAWL_API_URL = os.getenv("FIRECRAWL_API_URL", "https://api.firecrawl.dev").rstrip("/")
+# How old (ms) a page Firecrawl serves from its own index may be; 0 always renders it fresh.
+FIRECRAWL_MAX_AGE_MS = int(os.getenv("FIRECRAWL_MAX_AGE_MS", "0"))
+
+# One SDK client for the whole process, created on first use and closed from the FastAPI
+# lifespan, instead of a new client (and HTTP session) for every scrape. The SDK builds
+# its own httpx client without keep-alive, so its requests are sent through the shared
+# pooled "firecrawl" client instead (keep-alive, HTTP/2, HTTP_MAX_CONNECTIONS). It makes
+# a single attempt per request: a failed scrape falls back or is reported by the caller
+# rather than being retried inside the SDK as well.
+_firecrawl_app = None
+
+
+def get_firecrawl_app() -> AsyncFirecrawlClient:
+    global _firecrawl_app
+    if _firecrawl_app is None:
+        app = AsyncFirecrawlClient(api_key=os.getenv("FIRECRAWL_API_KEY"), api_url=FIRECRAWL_API_URL, timeout=CLIENT_READ_TIMEOUTS["firecrawl"], max_retries=1)
+        unpooled = app.async_http_client._client  # Never used, so it holds no connections
+        app.async_http_client._client = get_http_client("firecrawl", base_url=FIRECRAWL_API_URL, headers=unpooled.headers)
+        _firecrawl_app = app
+        print(f"FIRECRAWL_SERVICE: Created the Firecrawl client for {FIRECRAWL_API_URL}.")
+    return _firecrawl_app
+
+
+async def close_firecrawl_app():
     """
-    Asynchronously scrapes a website to get its HTML and a screenshot using the Firecrawl API.
+    Drops the shared Firecrawl client. Called once on application shutdown; its pooled
+    HTTP client is closed with the others by close_http_clients.
     """
-    api_key = os.getenv("FIRECRAWL_API_KEY")
-    app = AsyncFirecrawlApp(api_key=api_key)
+    global _firecrawl_app
+    _firecrawl_app = None
 
+# Viewports for viewport matrix analyses: name -> extra Firecrawl scrape options and how the
+# viewport is described to the visual stage. The default scrape is the desktop viewport.
+# Firecrawl's scrape API only distinguishes desktop and mobile emulation; more viewports
+# (e.g. a tablet profile on a self-hosted Firecrawl that supports one) can be added with
+# VIEWPORTS='{"tablet": {"options": {...}, "description": "..."}}'.
+VIEWPORTS = {
+    "desktop": {"options": {}, "description": "desktop browser window, about 1280px wide"},
+    "mobile": {"options": {"mobile": True}, "description": "mobile phone emulation, about 390px wide with touch input"},
+}
+VIEWPORTS.update(json.loads(os.getenv("VIEWPORTS", "{}")))
+
+async def scrape_website(url: str, include_screenshot: bool = True, provider: str = "anthropic", include_html: bool = True, scrape_options: dict = None):
+    """
+    Asynchronously scrapes a website to get its HTML and a screenshot using the Firecrawl API.
+    With include_screenshot=False only the HTML is requested (no screenshot capture or download),
+    with include_html=False only the screenshot. `scrape_options` are added to the request
+    (e.g. a viewport's options from VIEWPORTS).
+    The screenshot is returned as tiles sized for `provider` (see screenshot_service).
+    """
     try:
         # Scrape for both HTML and a standard screenshot
-        response = await app.scrape_url(
-            url=url,
-            formats=['rawHtml', 'screenshot'] 
-        )
-        
-        html_content = None
-        screenshot_data_for_langchain = None # This should be base64
-
-        # Try to get HTML content, prioritizing 'html', then 'rawHtml'
-        if hasattr(response, 'html') and response.html:
-            html_content = response.html
-        elif hasattr(response, 'rawHtml') and response.rawHtml: # Check for rawHtml
-            html_content = response.rawHtml
-        elif hasattr(response, 'data') and isinstance(response.data, dict):
-            html_content = response.data.get('html') or response.data.get('rawHtml')
-        elif isinstance(response, dict): # If ScrapeResponse acts like a dict
-            html_content = response.get('html') or response.get('rawHtml')
-
-        # If html_content is a dict (e.g. from some nested structure), try to get 'content' or 'html' key
-        if isinstance(html_content, dict):
-            html_content = html_content.get('content', html_content.get('html', str(html_content)))
-        
-        if not html_content:
-            print(f"DEV_NOTE: Could not extract HTML using 'html' or 'rawHtml' from Firecrawl ScrapeResponse. Object: {vars(response) if hasattr(response, '__dict__') else response}")
-
-        screenshot_url = None
-        if hasattr(response, 'screenshot') and response.screenshot:
-            screenshot_url = response.screenshot
-            if isinstance(screenshot_url, dict): # If response.screenshot is {'url': '...'}
-                screenshot_url = screenshot_url.get('url', str(screenshot_url))
-        elif hasattr(response, 'data') and isinstance(response.data, dict) and response.data.get('screenshot'):
-            screenshot_url = response.data['screenshot']
-            if isinstance(screenshot_url, dict):
-                screenshot_url = screenshot_url.get('url', str(screenshot_url))
-        elif isinstance(response, dict) and response.get('screenshot'): # If ScrapeResponse acts like a dict
-            screenshot_url = response['screenshot']
-            if isinstance(screenshot_url, dict):
-                screenshot_url = screenshot_url.get('url', str(screenshot_url))
-        else:
-             print(f"DEV_NOTE: Could not extract screenshot URL from Firecrawl ScrapeResponse. Object: {vars(response) if hasattr(response, '__dict__') else response}")
+        formats = (['rawHtml'] if include_html else []) + (['screenshot'] if include_screenshot else [])
+        with span("firecrawl_request", detail=",".join(formats)) as record:
+            response = await get_firecrawl_app().scrape(url, formats=formats, max_age=FIRECRAWL_MAX_AGE_MS, **(scrape_options or {}))
+            record["bytes_out"] = len(response.raw_html or response.html or "")
+
+        html_content = response.html or response.raw_html
+        screenshot = None
+
+        if not html_content and include_html:
+            print(f"DEV_NOTE: Could not extract HTML using 'html' or 'rawHtml' from Firecrawl response. Fields: {sorted(response.model_dump(exclude_none=True))}")
+
+        screenshot_url = response.screenshot
 
         if html_content:
             print("DEV_NOTE: HTML content extracted successfully.")
-        
+
         if screenshot_url:
-            print(f"DEV_NOTE: Screenshot URL received: {screenshot_url}. Fetching and encoding to base64.")
+            print(f"DEV_NOTE: Screenshot URL received: {screenshot_url}. Fetching and tiling.")
             try:
-                async with httpx.AsyncClient() as client:
-                    img_response = await client.get(screenshot_url)
+                with span("screenshot_download") as record:
+                    img_response = await get_http_client().get(screenshot_url)
                     img_response.raise_for_status() # Raise an exception for bad status codes
-                    screenshot_data_for_langchain = base64.b64encode(img_response.content).decode('utf-8')
-                print("DEV_NOTE: Screenshot fetched and base64 encoded successfully.")
+                    record["bytes_out"] = len(img_response.content)
+                # Decoding and resizing are CPU-bound; the raw bytes are dropped right after.
+                with span("screenshot_processing", bytes_in=len(img_response.content)) as record:
+                    screenshot = await asyncio.to_thread(prepare_screenshot, img_response.content, provider)
+                    if screenshot:
+                        record["detail"] = f"{len(screenshot['tiles'])} tile(s)"
+                del img_response
+                print("DEV_NOTE: Screenshot fetched and tiled successfully.")
             except httpx.HTTPStatusError as http_err:
                 print(f"HTTP error occurred while fetching screenshot: {http_err}")
-                screenshot_data_for_langchain = None
+                screenshot = None
             except Exception as fetch_err:
-                print(f"An error occurred while fetching or encoding screenshot: {fetch_err}")
-                screenshot_data_for_langchain = None
-        else:
-            print("DEV_NOTE: Screenshot URL not found in Firecrawl ScrapeResponse.")
-            
+                print(f"An error occurred while fetching or processing screenshot: {fetch_err}")
+                screenshot = None
+        elif include_screenshot:
+            print("DEV_NOTE: Screenshot URL not found in Firecrawl response.")
+
         return {
             "html": html_content,
-            "screenshot": screenshot_data_for_langchain
+            "screenshot": screenshot
         }
-    
+
     except Exception as e:
         print(f"An error occurred during scraping: {e}")
         return None
@@ -0,0 +1,459 @@
+from html import escape
+from html.parser import HTMLParser
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import os
+import re
+
+# Condenses raw page HTML down to what the accessibility analysis needs before it
+# is put into an LLM prompt: the DOM skeleton, semantic/ARIA attributes, alt/label/
+# lang, link text and form controls. Scripts, styles, SVG path data, data URIs and
+# hydration blobs are dropped, and long runs of identical sibling structures are
+# collapsed into a few counted samples. Pages that do not fit the budget even at full
+# detail can instead be split into chunks along element boundaries (see `chunk_html`).
+
+# Rough characters-per-token ratio used for budgeting (both providers land close to 4).
+CHARS_PER_TOKEN = 4
+
+# Per-provider token budget for the HTML placed in the prompt.
+DEFAULT_HTML_TOKEN_BUDGETS = {
+    "openai": 30000,
+    "anthropic": 50000,
+}
+
+# Elements whose whole content is irrelevant for accessibility analysis.
+DROPPED_CONTENT_ELEMENTS = {"script", "style", "template", "noscript", "canvas", "object"}
+# Head elements that carry nothing the analysis needs.
+DROPPED_ELEMENTS = {"meta", "link", "base"}
+# Elements whose children are replaced by a placeholder (only the element and its name survive).
+OPAQUE_ELEMENTS = {"svg", "math"}
+
+VOID_ELEMENTS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input",
+    "link", "meta", "param", "source", "track", "wbr",
+}
+
+KEPT_ATTRIBUTES = {
+    "id", "class", "role", "alt", "title", "lang", "href", "src", "for", "name",
+    "type", "value", "placeholder", "label", "tabindex", "scope", "headers",
+    "dir", "hidden", "disabled", "required", "autocomplete", "summary",
+    "checked", "selected", "multiple", "colspan", "rowspan", "action", "method",
+}
+
+# Comments with this prefix are markers inserted by the pipeline (see template_service) and are kept.
+PRESERVED_COMMENT_PREFIX = "shared site template component"
+
+MAX_ATTRIBUTE_CHARS = 120
+MAX_CLASSES = 3
+MIN_REPEATED_RUN = 4  # Sibling runs shorter than this are kept as-is
+
+
+class _Node:
+    __slots__ = ("tag", "attrs", "children", "text", "_signature")
+
+    def __init__(self, tag: Optional[str], attrs: Optional[List[Tuple[str, str]]] = None, text: Optional[str] = None):
+        self.tag = tag  # None for text nodes
+        self.attrs = attrs or []
+        self.children: List["_Node"] = []
+        self.text = text
+        self._signature = None
+
+    def signature(self) -> str:
+        """
+        Structural hash of the subtree: tags, attribute names and classes, but not text.
+        Two product cards with different titles and prices share a signature.
+        """
+        if self._signature is None:
+            if self.tag is None:
+                self._signature = "#text"
+            else:
+                attr_names = sorted(name if name != "class" else f"class={value}" for name, value in self.attrs)
+                child_signatures = ",".join(child.signature() for child in self.children if child.tag is not None)
+                raw = f"{self.tag}|{';'.join(attr_names)}|{child_signatures}"
+                self._signature = hashlib.md5(raw.encode("utf-8")).hexdigest()
+        return self._signature
+
+
+def _clean_attribute(name: str, value: Optional[str]) -> Optional[str]:
+    if value is None:
+        return None  # Boolean attribute
+    value = " ".join(value.split())
+    if name in ("src", "href") and value.startswith("data:"):
+        return "data:…"
+    if name == "class":
+        value = " ".join(value.split()[:MAX_CLASSES])
+    if len(value) > MAX_ATTRIBUTE_CHARS:
+        value = value[:MAX_ATTRIBUTE_CHARS] + "…"
+    return escape(value)
+
+
+def _is_tracking_pixel(attrs: Dict[str, Optional[str]]) -> bool:
+    return attrs.get("width") in ("0", "1") and attrs.get("height") in ("0", "1")
+
+
+class _TreeBuilder(HTMLParser):
+    """
+    Builds a reduced DOM tree containing only what the condensed output keeps.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = _Node("#root")
+        self.stack: List[_Node] = [self.root]
+        self.skip_depth = 0  # > 0 while inside a dropped/opaque element
+        self.skip_tag: Optional[str] = None
+
+    def handle_starttag(self, tag, attrs_list):
+        if self.skip_depth:
+            if tag == self.skip_tag:
+                self.skip_depth += 1
+            return
+
+        attrs = {name.lower(): value for name, value in attrs_list}
+        if tag in DROPPED_ELEMENTS or (tag == "img" and _is_tracking_pixel(attrs)):
+            return
+
+        kept = []
+        for name, value in attrs_list:
+            name = name.lower()
+            if name in KEPT_ATTRIBUTES or name.startswith("aria-"):
+                kept.append((name, _clean_attribute(name, value)))
+
+        if tag in DROPPED_CONTENT_ELEMENTS:
+            if tag not in VOID_ELEMENTS:
+                self.skip_depth, self.skip_tag = 1, tag
+            return
+
+        node = _Node(tag, kept)
+        self.stack[-1].children.append(node)
+        if tag in OPAQUE_ELEMENTS:
+            node.children.append(_Node(None, text="…"))
+            self.skip_depth, self.skip_tag = 1, tag
+            return
+        if tag not in VOID_ELEMENTS:
+            self.stack.append(node)
+
+    def handle_startendtag(self, tag, attrs_list):
+        self.handle_starttag(tag, attrs_list)
+        if tag not in VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if self.skip_depth:
+            if tag == self.skip_tag:
+                self.skip_depth -= 1
+                if not self.skip_depth:
+                    self.skip_tag = None
+            return
+        for index in range(len(self.stack) - 1, 0, -1):
+            if self.stack[index].tag == tag:
+                del self.stack[index:]
+                break
+
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        text = " ".join(data.split())
+        if text:
+            self.stack[-1].children.append(_Node(None, text=text))
+
+    def handle_comment(self, data):
+        if not self.skip_depth and data.strip().startswith(PRESERVED_COMMENT_PREFIX):
+            self.stack[-1].children.append(_Node("#comment", text=data.strip()))
+
+
+class _Serializer:
+    """
+    Serializes the reduced tree, collapsing repeated siblings and stopping at the character limit.
+    """
+
+    def __init__(self, samples_per_run: int, max_text_chars: int, char_limit: Optional[int]):
+        self.samples_per_run = samples_per_run
+        self.max_text_chars = max_text_chars
+        self.char_limit = char_limit
+        self.parts: List[str] = []
+        self.length = 0
+        self.collapsed_groups = 0
+        self.collapsed_elements = 0
+        self.truncated = False
+
+    def _emit(self, text: str) -> bool:
+        if self.char_limit is not None and self.length + len(text) > self.char_limit:
+            self.truncated = True
+            return False
+        self.parts.append(text)
+        self.length += len(text)
+        return True
+
+    @staticmethod
+    def _open_tag(node: _Node) -> str:
+        attrs = "".join(f' {name}="{value}"' if value is not None else f" {name}" for name, value in node.attrs)
+        return f"<{node.tag}{attrs}>"
+
+    def serialize(self, node: _Node):
+        if self.truncated:
+            return
+        if node.tag == "#comment":
+            self._emit(f"<!-- {node.text} -->")
+            return
+        if node.tag is None:
+            text = node.text
+            if len(text) > self.max_text_chars:
+                text = text[:self.max_text_chars] + "…"
+            self._emit(escape(text, quote=False))
+            return
+        if node.tag != "#root":
+            if not self._emit(self._open_tag(node)):
+                return
+            if node.tag in VOID_ELEMENTS:
+                return
+        self._serialize_children(node.children)
+        if node.tag != "#root" and not self.truncated:
+            self._emit(f"</{node.tag}>")
+
+    def _serialize_children(self, children: List[_Node]):
+        index = 0
+        while index < len(children) and not self.truncated:
+            child = children[index]
+            run_end = index + 1
+            if child.tag is not None:
+                while run_end < len(children) and children[run_end].tag is not None \
+                        and children[run_end].signature() == child.signature():
+                    run_end += 1
+            run_length = run_end - index
+            if run_length >= MIN_REPEATED_RUN:
+                for sample in children[index:index + self.samples_per_run]:
+                    self.serialize(sample)
+                omitted = run_length - self.samples_per_run
+                self.collapsed_groups += 1
+                self.collapsed_elements += omitted
+                self._emit(f"<!-- {omitted} more <{child.tag}> siblings with identical structure omitted ({run_length} total) -->")
+            else:
+                for sibling in children[index:run_end]:
+                    self.serialize(sibling)
+            index = run_end
+
+    def result(self) -> str:
+        html = "".join(self.parts)
+        if self.truncated:
+            html += "\n<!-- condensed HTML truncated to fit the token budget -->"
+        return html
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate used for budgeting prompt input.
+    """
+    return (len(text or "") + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def get_html_token_budget(provider: Optional[str]) -> int:
+    """
+    Token budget for condensed HTML for a provider.
+    Overridable per provider with HTML_TOKEN_BUDGET_<PROVIDER> (e.g. HTML_TOKEN_BUDGET_OPENAI).
+    """
+    provider = (provider or "openai").lower()
+    default = DEFAULT_HTML_TOKEN_BUDGETS.get(provider, DEFAULT_HTML_TOKEN_BUDGETS["openai"])
+    return int(os.getenv(f"HTML_TOKEN_BUDGET_{provider.upper()}", default))
+
+
+# Successively more aggressive passes: (samples kept per repeated run, max chars per text node)
+CONDENSE_PASSES = [(2, 300), (1, 120), (1, 60)]
+
+
+def _build_tree(html: str) -> _Node:
+    builder = _TreeBuilder()
+    builder.feed(html or "")
+    builder.close()
+    return builder.root
+
+
+def condense_html(html: str, token_budget: Optional[int] = None) -> Tuple[str, dict]:
+    """
+    Condenses HTML for the LLM prompt and enforces the token budget.
+
+    Passes get progressively more aggressive (fewer repeated samples, shorter text)
+    until the output fits; if even the last pass is too large it is cut at an element
+    boundary with a note. Returns the condensed HTML and a stats dict with before/after
+    sizes.
+    """
+    html = html or ""
+    root = _build_tree(html)
+
+    char_limit = token_budget * CHARS_PER_TOKEN if token_budget else None
+    serializer = None
+    for pass_index, (samples, max_text) in enumerate(CONDENSE_PASSES):
+        is_last_pass = pass_index == len(CONDENSE_PASSES) - 1
+        serializer = _Serializer(samples, max_text, char_limit if is_last_pass else None)
+        serializer.serialize(root)
+        if char_limit is None or serializer.length <= char_limit:
+            break
+
+    condensed = re.sub(r">\s+<", "><", serializer.result())
+    stats = {
+        "original_bytes": len(html.encode("utf-8")),
+        "condensed_bytes": len(condensed.encode("utf-8")),
+        "original_tokens_estimate": estimate_tokens(html),
+        "condensed_tokens_estimate": estimate_tokens(condensed),
+        "token_budget": token_budget,
+        "collapsed_groups": serializer.collapsed_groups,
+        "collapsed_elements": serializer.collapsed_elements,
+        "truncated": serializer.truncated,
+        "condense_pass": pass_index,  # > 0 when the page only fit with reduced detail (or not at all)
+    }
+    return condensed, stats
+
+
+def _node_label(node: _Node) -> str:
+    attrs = dict(node.attrs)
+    label = node.tag
+    if attrs.get("id"):
+        label += f"#{attrs['id']}"
+    elif attrs.get("role"):
+        label += f"[role={attrs['role']}]"
+    elif attrs.get("class"):
+        label += "." + attrs["class"].split()[0]
+    return label
+
+
+def _units(children: List[_Node]) -> List[List[_Node]]:
+    """
+    Groups children into the units a chunk is packed from: single nodes, and runs of
+    repeated siblings (which serialize collapsed, as in `condense_html`).
+    """
+    units, index = [], 0
+    while index < len(children):
+        child, run_end = children[index], index + 1
+        if child.tag is not None:
+            while run_end < len(children) and children[run_end].tag is not None \
+                    and children[run_end].signature() == child.signature():
+                run_end += 1
+        if run_end - index >= MIN_REPEATED_RUN:
+            units.append(children[index:run_end])
+        else:
+            units.extend([node] for node in children[index:run_end])
+        index = run_end
+    return units
+
+
+def _context_tags(ancestors: List[_Node], opening: bool) -> str:
+    if opening:
+        return "".join(_Serializer._open_tag(node) for node in ancestors)
+    return "".join(f"</{node.tag}>" for node in reversed(ancestors))
+
+
+class _Chunker:
+    """
+    Splits the reduced tree top-down into chunks of at most `char_limit` characters.
+    Boundaries always fall between elements, at the highest level possible: a subtree
+    that fits (a whole landmark or section) is never split, and only an oversized one
+    is split into its children. Small content next to a split subtree (a header before
+    a huge <main>, the footer after it) is folded into the neighbouring chunk at its own
+    nesting level instead of becoming a chunk of its own. Each chunk keeps its
+    ancestors' opening tags (with their attributes) around it for context.
+    """
+
+    def __init__(self, char_limit: int, samples_per_run: int, max_text_chars: int):
+        self.char_limit = char_limit
+        self.samples_per_run = samples_per_run
+        self.max_text_chars = max_text_chars
+        self.chunks: List[dict] = []
+        self.carry: Optional[Tuple[int, List[str]]] = None  # (depth, parts) waiting to lead the next chunk
+        self.carry_size = 0
+
+    def _serialize(self, nodes: List[_Node], char_limit: Optional[int] = None) -> str:
+        serializer = _Serializer(self.samples_per_run, self.max_text_chars, char_limit)
+        serializer._serialize_children(nodes)
+        return serializer.result()
+
+    def _flush(self, ancestors: List[_Node], parts: List[str], size: int):
+        if not parts:
+            return
+        chunk = {"ancestors": ancestors, "lead": {}, "body": list(parts), "trail": {}, "size": size}
+        if self.carry is not None:
+            depth, carried = self.carry
+            chunk["lead"][depth] = carried
+            self.carry, self.carry_size = None, 0
+        self.chunks.append(chunk)
+        parts.clear()
+
+    def _limit(self, ancestors: List[_Node]) -> int:
+        context_chars = len(_context_tags(ancestors, opening=True)) + len(_context_tags(ancestors, opening=False))
+        return max(self.char_limit // 4, self.char_limit - context_chars)
+
+    def split(self, node: _Node, ancestors: List[_Node]):
+        limit = self._limit(ancestors)
+        depth = len(ancestors)
+        parts: List[str] = []
+        size = self.carry_size  # Carried content goes into the first chunk emitted from here
+        previous = None  # Last chunk of a just-split sibling, which small trailing content can join
+        for unit in _units(node.children):
+            html = self._serialize(unit)
+            if len(html) > limit:
+                single = unit[0] if len(unit) == 1 else None
+                if single is not None and single.tag not in (None, "#comment") and single.tag not in VOID_ELEMENTS and single.children:
+                    self._close_parts(ancestors, parts, size, previous, limit)
+                    if parts and size <= limit // 4:
+                        self.carry, self.carry_size = (depth, list(parts)), size
+                        parts.clear()
+                    self._flush(ancestors, parts, size)
+                    self.split(single, ancestors + [single])
+                    previous = self.chunks[-1] if self.chunks else None
+                else:
+                    # A single text node or a collapsed run that is still too large: cut it at the limit.
+                    self._close_parts(ancestors, parts, size, previous, limit)
+                    self._flush(ancestors, parts, size)
+                    self._flush(ancestors, [self._serialize(unit, limit)], limit)
+                    previous = None
+                size = 0
+                continue
+            if parts and size + len(html) > limit:
+                self._close_parts(ancestors, parts, size, previous, limit)
+                self._flush(ancestors, parts, size)
+                previous, size = None, 0
+            parts.append(html)
+            size += len(html)
+        self._close_parts(ancestors, parts, size, previous, limit)
+        self._flush(ancestors, parts, size)
+
+    def _close_parts(self, ancestors: List[_Node], parts: List[str], size: int, previous: Optional[dict], limit: int):
+        """
+        Folds pending parts into the previous (deeper) chunk as trailing content when they fit there.
+        """
+        if parts and previous is not None and previous["size"] + size <= limit:
+            previous["trail"].setdefault(len(ancestors), []).extend(parts)
+            previous["size"] += size
+            parts.clear()
+
+    def result(self) -> List[dict]:
+        chunks = []
+        for index, chunk in enumerate(self.chunks):
+            ancestors = chunk["ancestors"]
+            out: List[str] = []
+            for depth, node in enumerate(ancestors):
+                out.extend(chunk["lead"].get(depth, []))
+                out.append(_Serializer._open_tag(node))
+            out.extend(chunk["body"])
+            for depth in range(len(ancestors) - 1, -1, -1):
+                out.append(f"</{ancestors[depth].tag}>")
+                out.extend(chunk["trail"].get(depth, []))
+            chunks.append({
+                "index": index,
+                "path": " > ".join(_node_label(node) for node in ancestors) or "document",
+                "html": re.sub(r">\s+<", "><", "".join(out)),
+            })
+        return chunks
+
+
+def chunk_html(html: str, token_budget: int, max_chunks: int) -> Tuple[List[dict], bool]:
+    """
+    Splits a page that does not fit `token_budget` at full detail into chunks of at most
+    `token_budget` tokens each, along element boundaries (see `_Chunker`), condensed like
+    the first `condense_html` pass. Returns the chunks (`index`, ancestor `path`, `html`)
+    and whether chunks beyond `max_chunks` had to be dropped.
+    """
+    samples, max_text = CONDENSE_PASSES[0]
+    chunker = _Chunker(token_budget * CHARS_PER_TOKEN, samples, max_text)
+    chunker.split(_build_tree(html), [])
+    chunks = chunker.result()
+    return chunks[:max_chunks], len(chunks) > max_chunks
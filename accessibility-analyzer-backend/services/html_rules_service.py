@@ -0,0 +1,370 @@
+from html.parser import HTMLParser
+from typing import Dict, List, Optional
+import re
+
+# Deterministic, single-pass checks for the six HTML guidelines used by the LLM
+# HTML prompt. Everything here is exact and cheap, so it runs before any model
+# call and its findings are handed to the LLM instead of being rediscovered.
+
+GUIDELINE_SEMANTICS = "Semantic HTML Structure"
+GUIDELINE_IMAGES = "Image Accessibility"
+GUIDELINE_HEADINGS = "Heading Hierarchy"
+GUIDELINE_FORMS = "Form Labeling and Accessibility"
+GUIDELINE_LINKS = "Link Text Clarity"
+GUIDELINE_LANGUAGE = "Language Specification"
+
+GUIDELINES = [
+    GUIDELINE_SEMANTICS,
+    GUIDELINE_IMAGES,
+    GUIDELINE_HEADINGS,
+    GUIDELINE_FORMS,
+    GUIDELINE_LINKS,
+    GUIDELINE_LANGUAGE,
+]
+
+# Report categories (as used by the report prompt) fed by each guideline.
+GUIDELINE_CATEGORIES = {
+    GUIDELINE_SEMANTICS: "Structure & Semantics",
+    GUIDELINE_HEADINGS: "Structure & Semantics",
+    GUIDELINE_LANGUAGE: "Structure & Semantics",
+    GUIDELINE_LINKS: "Navigability & Interactivity",
+    GUIDELINE_FORMS: "Forms & Inputs",
+    GUIDELINE_IMAGES: "Media Accessibility",
+}
+
+SEVERITY_PENALTIES = {"Critical": 25, "High": 12, "Medium": 6, "Low": 2}
+
+VOID_ELEMENTS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input",
+    "link", "meta", "param", "source", "track", "wbr",
+}
+
+GENERIC_LINK_TEXT = {
+    "click here", "click", "here", "more", "read more", "learn more",
+    "link", "this link", "details", "more info", "more information",
+    "continue", "go", "this", "see more", "view more",
+}
+
+PLACEHOLDER_ALT_TEXT = {"image", "img", "photo", "picture", "graphic", "icon", "logo", "spacer", "banner"}
+
+UNLABELLED_INPUT_TYPES_EXEMPT = {"hidden", "submit", "button", "reset", "image"}
+
+LANG_TAG_PATTERN = re.compile(r"^[a-zA-Z]{2,3}(-[a-zA-Z0-9]{1,8})*$")
+FILENAME_ALT_PATTERN = re.compile(r"\.(png|jpe?g|gif|svg|webp|avif|bmp)$", re.IGNORECASE)
+
+SNIPPET_MAX_CHARS = 200
+PARSE_CHUNK_SIZE = 64 * 1024
+
+
+class _RuleParser(HTMLParser):
+    """
+    Streaming HTML parser that collects rule findings while it walks the document once.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.findings: List[Dict] = []
+        # Open element stack: [tag, selector, child tag counts]
+        self.stack: List[list] = []
+        self.root_child_counts: Dict[str, int] = {}
+
+        self.seen_html_tag = False
+        self.landmarks = set()
+        self.h1_count = 0
+        self.last_heading_level = 0
+
+        self.label_for_ids = set()
+        self.label_depth = 0
+        self.form_controls: List[Dict] = []
+
+        self.open_links: List[Dict] = []
+        self.counts = {"images": 0, "links": 0, "form_controls": 0, "headings": 0, "elements": 0}
+
+    # -- helpers -----------------------------------------------------------------
+
+    def _path(self, selector: Optional[str] = None) -> str:
+        parts = [entry[1] for entry in self.stack]
+        if selector:
+            parts.append(selector)
+        return " > ".join(parts)
+
+    def _snippet(self) -> str:
+        text = self.get_starttag_text() or ""
+        text = " ".join(text.split())
+        if len(text) > SNIPPET_MAX_CHARS:
+            text = text[:SNIPPET_MAX_CHARS - 3] + "..."
+        return text
+
+    def _add(self, guideline: str, severity: str, issue: str, path: str = "", snippet: str = "", line: Optional[int] = None):
+        self.findings.append({
+            "guideline": guideline,
+            "severity": severity,
+            "issue": issue,
+            "path": path,
+            "snippet": snippet,
+            "line": line,
+        })
+
+    def _selector(self, tag: str, attrs: Dict[str, Optional[str]]) -> str:
+        counts = self.stack[-1][2] if self.stack else self.root_child_counts
+        counts[tag] = counts.get(tag, 0) + 1
+        if attrs.get("id"):
+            return f"{tag}#{attrs['id']}"
+        selector = tag
+        if attrs.get("class"):
+            first_class = attrs["class"].split()[0] if attrs["class"].split() else ""
+            if first_class:
+                selector += f".{first_class}"
+        if counts[tag] > 1:
+            selector += f":nth-of-type({counts[tag]})"
+        return selector
+
+    # -- HTMLParser callbacks ----------------------------------------------------
+
+    def handle_starttag(self, tag, attrs_list):
+        attrs = {name.lower(): value for name, value in attrs_list}
+        self.counts["elements"] += 1
+        selector = self._selector(tag, attrs)
+        path = self._path(selector)
+        line = self.getpos()[0]
+
+        if tag == "html":
+            self.seen_html_tag = True
+            lang = (attrs.get("lang") or "").strip()
+            if not lang:
+                self._add(GUIDELINE_LANGUAGE, "High", "The <html> element has no lang attribute.", path, self._snippet(), line)
+            elif not LANG_TAG_PATTERN.match(lang):
+                self._add(GUIDELINE_LANGUAGE, "Medium", f"The lang value '{lang}' is not a valid IETF language tag.", path, self._snippet(), line)
+
+        role = (attrs.get("role") or "").lower()
+        if tag in ("main", "nav", "header", "footer", "aside"):
+            self.landmarks.add(tag)
+        if role == "main":
+            self.landmarks.add("main")
+        elif role == "navigation":
+            self.landmarks.add("nav")
+
+        if tag == "img":
+            self._check_image(attrs, path, line)
+
+        if len(tag) == 2 and tag[0] == "h" and tag[1] in "123456":
+            self._check_heading(int(tag[1]), path, line)
+
+        if tag == "label":
+            if attrs.get("for"):
+                self.label_for_ids.add(attrs["for"])
+            self.label_depth += 1
+
+        if tag in ("input", "textarea", "select"):
+            self._record_form_control(tag, attrs, path, line)
+
+        if tag == "a" and attrs.get("href") is not None:
+            self.counts["links"] += 1
+            self.open_links.append({
+                "text": [],
+                "aria_label": (attrs.get("aria-label") or "").strip(),
+                "has_labelledby": bool(attrs.get("aria-labelledby")),
+                "path": path,
+                "snippet": self._snippet(),
+                "line": line,
+            })
+
+        if tag not in VOID_ELEMENTS:
+            self.stack.append([tag, selector, {}])
+
+    def handle_startendtag(self, tag, attrs_list):
+        # <img ... /> or <a ... />: treat as an element that opens and closes immediately.
+        self.handle_starttag(tag, attrs_list)
+        if tag not in VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag == "label" and self.label_depth > 0:
+            self.label_depth -= 1
+        if tag == "a" and self.open_links:
+            self._check_link(self.open_links.pop())
+
+        # Tolerate unclosed/mis-nested markup: pop up to the matching open element.
+        for index in range(len(self.stack) - 1, -1, -1):
+            if self.stack[index][0] == tag:
+                del self.stack[index:]
+                break
+
+    def handle_data(self, data):
+        if self.open_links and data.strip():
+            self.open_links[-1]["text"].append(data)
+
+    # -- individual checks -------------------------------------------------------
+
+    def _check_image(self, attrs, path, line):
+        self.counts["images"] += 1
+        if self.open_links and attrs.get("alt"):
+            # An image inside a link provides that link's accessible name.
+            self.open_links[-1]["text"].append(attrs["alt"])
+        if (attrs.get("aria-hidden") or "").lower() == "true":
+            return
+        if "alt" not in attrs:
+            severity = "Critical" if self.open_links else "High"
+            self._add(GUIDELINE_IMAGES, severity, "Image is missing an alt attribute.", path, self._snippet(), line)
+            return
+        alt = (attrs.get("alt") or "").strip()
+        if alt and (alt.lower() in PLACEHOLDER_ALT_TEXT or FILENAME_ALT_PATTERN.search(alt)):
+            self._add(GUIDELINE_IMAGES, "Medium", f"Alt text '{alt}' is a placeholder or filename, not a description.", path, self._snippet(), line)
+
+    def _check_heading(self, level, path, line):
+        self.counts["headings"] += 1
+        if level == 1:
+            self.h1_count += 1
+            if self.h1_count == 2:
+                self._add(GUIDELINE_HEADINGS, "Medium", "The page has more than one <h1>.", path, self._snippet(), line)
+        if self.last_heading_level and level > self.last_heading_level + 1:
+            self._add(
+                GUIDELINE_HEADINGS, "Medium",
+                f"Heading level skips from <h{self.last_heading_level}> to <h{level}>.",
+                path, self._snippet(), line
+            )
+        self.last_heading_level = level
+
+    def _record_form_control(self, tag, attrs, path, line):
+        input_type = (attrs.get("type") or "text").lower() if tag == "input" else tag
+        if input_type in UNLABELLED_INPUT_TYPES_EXEMPT:
+            return
+        self.counts["form_controls"] += 1
+        self.form_controls.append({
+            "id": attrs.get("id"),
+            "wrapped": self.label_depth > 0,
+            "aria": bool(attrs.get("aria-label") or attrs.get("aria-labelledby") or attrs.get("title")),
+            "path": path,
+            "snippet": self._snippet(),
+            "line": line,
+        })
+
+    def _check_link(self, link):
+        text = " ".join(" ".join(link["text"]).split())
+        name = link["aria_label"] or text
+        if not name and not link["has_labelledby"]:
+            self._add(GUIDELINE_LINKS, "High", "Link has no accessible text.", link["path"], link["snippet"], link["line"])
+        elif name.lower().strip(" .!:>»→") in GENERIC_LINK_TEXT:
+            self._add(GUIDELINE_LINKS, "Medium", f"Link text '{name}' does not describe its destination.", link["path"], link["snippet"], link["line"])
+
+    # -- document-level checks ---------------------------------------------------
+
+    def finish(self):
+        for control in self.form_controls:
+            labelled = control["wrapped"] or control["aria"] or (control["id"] and control["id"] in self.label_for_ids)
+            if not labelled:
+                self._add(GUIDELINE_FORMS, "High", "Form control has no associated <label>.", control["path"], control["snippet"], control["line"])
+
+        if not self.seen_html_tag:
+            self._add(GUIDELINE_LANGUAGE, "High", "No <html> element with a lang attribute was found.")
+        if "main" not in self.landmarks:
+            self._add(GUIDELINE_SEMANTICS, "High", "The page has no <main> landmark.")
+        if "nav" not in self.landmarks and self.counts["links"] > 0:
+            self._add(GUIDELINE_SEMANTICS, "Medium", "The page has links but no <nav> landmark.")
+        if self.counts["headings"] and not self.h1_count:
+            self._add(GUIDELINE_HEADINGS, "Medium", "The page has headings but no <h1>.")
+
+
+def analyze_html_rules(html: str) -> dict:
+    """
+    Runs the deterministic guideline checks over the HTML in a single streaming pass.
+
+    Returns a dict with the list of `findings` (guideline, severity, issue, element
+    path, snippet, line), per-guideline issue counts under `summary`, and element
+    `counts` for the page.
+    """
+    parser = _RuleParser()
+    for start in range(0, len(html or ""), PARSE_CHUNK_SIZE):
+        parser.feed(html[start:start + PARSE_CHUNK_SIZE])
+    parser.close()
+    parser.finish()
+
+    summary = {guideline: 0 for guideline in GUIDELINES}
+    for finding in parser.findings:
+        summary[finding["guideline"]] += 1
+
+    return {
+        "findings": parser.findings,
+        "summary": summary,
+        "counts": parser.counts,
+        "landmarks": sorted(parser.landmarks),
+    }
+
+
+def format_findings_for_prompt(rule_results: dict, max_per_guideline: int = 15) -> str:
+    """
+    Renders rule findings as a compact, per-guideline text block for the LLM prompts.
+    Long lists are truncated with a count of the remaining occurrences.
+    """
+    if not rule_results:
+        return "No deterministic findings available."
+
+    by_guideline: Dict[str, List[Dict]] = {guideline: [] for guideline in GUIDELINES}
+    for finding in rule_results["findings"]:
+        by_guideline[finding["guideline"]].append(finding)
+
+    counts = rule_results.get("counts", {})
+    lines = [
+        f"Page totals: {counts.get('images', 0)} images, {counts.get('links', 0)} links, "
+        f"{counts.get('form_controls', 0)} form controls, {counts.get('headings', 0)} headings. "
+        f"Landmarks present: {', '.join(rule_results.get('landmarks') or []) or 'none'}."
+    ]
+    for guideline in GUIDELINES:
+        findings = by_guideline[guideline]
+        if not findings:
+            lines.append(f"[{guideline}] No issues detected by rules.")
+            continue
+        lines.append(f"[{guideline}] {len(findings)} issue(s):")
+        for finding in findings[:max_per_guideline]:
+            location = f" at {finding['path']}" if finding["path"] else ""
+            snippet = f" `{finding['snippet']}`" if finding["snippet"] else ""
+            lines.append(f"- ({finding['severity']}) {finding['issue']}{location}{snippet}")
+        if len(findings) > max_per_guideline:
+            lines.append(f"- ... and {len(findings) - max_per_guideline} more of the same kind.")
+    return "\n".join(lines)
+
+
+def build_offline_report(rule_results: dict) -> dict:
+    """
+    Builds a rules-only report (same shape as the LLM report) without any model call.
+
+    Categories are scored from 100 down by severity-weighted penalties. The visual
+    category cannot be assessed without a screenshot pass and is left out.
+    """
+    category_findings: Dict[str, List[Dict]] = {}
+    for category in GUIDELINE_CATEGORIES.values():
+        category_findings.setdefault(category, [])
+    for finding in rule_results["findings"]:
+        category_findings[GUIDELINE_CATEGORIES[finding["guideline"]]].append(finding)
+
+    scores = []
+    for category, findings in category_findings.items():
+        penalty = sum(SEVERITY_PENALTIES.get(f["severity"], 0) for f in findings)
+        score = max(0, 100 - penalty)
+        if findings:
+            issues = {}
+            for f in findings:
+                issues[f["issue"]] = issues.get(f["issue"], 0) + 1
+            feedback = "Rule checks found: " + "; ".join(
+                f"{issue} (x{count})" if count > 1 else issue for issue, count in issues.items()
+            )
+        else:
+            feedback = "No issues detected by the automated rule checks."
+        scores.append({"category": category, "score": score, "feedback": feedback})
+
+    severity_order = list(SEVERITY_PENALTIES.keys())
+    ordered = sorted(rule_results["findings"], key=lambda f: severity_order.index(f["severity"]))
+    plan_lines = []
+    seen = set()
+    for finding in ordered:
+        key = (finding["guideline"], finding["issue"])
+        if key in seen:
+            continue
+        seen.add(key)
+        plan_lines.append(f"{len(plan_lines) + 1}. **({finding['severity']}) {finding['guideline']}:** {finding['issue']}")
+    if not plan_lines:
+        plan_lines.append("No rule-detectable issues were found. Run a full analysis for visual and qualitative checks.")
+    else:
+        plan_lines.append(f"{len(plan_lines) + 1}. Run a full analysis to cover visual checks (contrast, typography, target size).")
+
+    return {"scores": scores, "implementation_plan": "\n".join(plan_lines)}
@@ -0,0 +1,62 @@
+from typing import Dict, Mapping, Optional
+from dotenv import load_dotenv
+import httpx
+import importlib.util
+import os
+
+load_dotenv()
+
+# Application-scoped HTTP clients. Each named client keeps one connection pool with
+# keep-alive (and HTTP/2 when the `h2` package is installed) for the lifetime of the
+# process, instead of paying for a new TCP+TLS handshake on every request. Clients are
+# created lazily on first use and closed from the FastAPI lifespan on shutdown.
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SECONDS", "30"))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "10"))
+HTTP2_ENABLED = importlib.util.find_spec("h2") is not None
+
+# Read timeouts per client: Firecrawl renders pages before answering, LLM calls are slower still.
+CLIENT_READ_TIMEOUTS = {
+    "default": float(os.getenv("HTTP_READ_TIMEOUT_SECONDS", "30")),
+    "firecrawl": float(os.getenv("FIRECRAWL_TIMEOUT_SECONDS", "120")),
+    "llm": float(os.getenv("LLM_TIMEOUT_SECONDS", "300")),
+}
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def get_http_client(name: str = "default", base_url: str = "", headers: Optional[Mapping[str, str]] = None) -> httpx.AsyncClient:
+    """
+    Returns the shared client for `name` ("default", "firecrawl" or "llm"), creating it on
+    first use. `base_url` and `headers` only apply when the client is created.
+    """
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            http2=HTTP2_ENABLED,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS,
+            ),
+            timeout=httpx.Timeout(CLIENT_READ_TIMEOUTS.get(name, CLIENT_READ_TIMEOUTS["default"]), connect=HTTP_CONNECT_TIMEOUT_SECONDS),
+            follow_redirects=True,
+        )
+        _clients[name] = client
+        print(f"HTTP_CLIENT_SERVICE: Created '{name}' client (http2={HTTP2_ENABLED}).")
+    return client
+
+
+async def close_http_clients():
+    """
+    Closes every shared client. Called once on application shutdown.
+    """
+    for name, client in list(_clients.items()):
+        if not client.is_closed:
+            await client.aclose()
+        del _clients[name]
+    print("HTTP_CLIENT_SERVICE: All HTTP clients closed.")
@@ -0,0 +1,192 @@
+from typing import AsyncIterator, Callable, Dict, List, Optional
+from dotenv import load_dotenv
+from services.event_buffer_service import EventBuffer
+import asyncio
+import os
+import time
+import uuid
+
+load_dotenv()
+
+# Background analysis jobs. Jobs are queued in a bounded queue and run by a fixed
+# pool of worker tasks; their progress events are buffered with sequential ids so a
+# reconnecting EventSource can resume from Last-Event-ID instead of starting over
+# (streamed LLM deltas are compacted in the buffer, see event_buffer_service).
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_MAX_SIZE = int(os.getenv("JOB_QUEUE_MAX_SIZE", "100"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+DEFAULT_JOB_DURATION_SECONDS = 30.0  # Used for Retry-After until real durations are known
+
+
+class QueueFullError(Exception):
+    """
+    Raised when the job queue is at capacity. `retry_after` is a suggested delay in seconds.
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Job queue is full. Retry after {retry_after} seconds.")
+        self.retry_after = retry_after
+
+
+class Job:
+    """
+    One queued analysis and its buffered progress events.
+    """
+
+    def __init__(self, url: str, offline: bool, incremental: bool = False, viewports: Optional[List[str]] = None):
+        self.id = uuid.uuid4().hex
+        self.url = url
+        self.offline = offline
+        self.incremental = incremental
+        self.viewports = viewports
+        self.status = "queued"  # queued -> running -> completed | failed
+        self.events = EventBuffer()
+        self.report: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.condition = asyncio.Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    async def add_event(self, event: dict):
+        async with self.condition:
+            self.events.append(event)
+            if event.get("error"):
+                self.error = event.get("message")
+            elif event.get("type") == "report":
+                self.report = event.get("data")
+            self.condition.notify_all()
+
+    async def finish(self):
+        async with self.condition:
+            self.status = "completed" if self.report is not None else "failed"
+            if self.status == "failed" and not self.error:
+                self.error = "Analysis finished without producing a report."
+            self.finished_at = time.time()
+            self.condition.notify_all()
+
+    async def events_since(self, last_event_id: int) -> AsyncIterator[tuple]:
+        """
+        Yields (event_id, event) for all events after `last_event_id` (-1 for all),
+        waiting for new ones until the job is done.
+        """
+        position = last_event_id
+        while True:
+            async with self.condition:
+                await self.condition.wait_for(lambda: position + 1 < len(self.events) or self.done)
+                pending = self.events.since(position)
+                position = len(self.events) - 1
+                finished = self.done
+            for event_id, event in pending:
+                yield event_id, event
+            if finished:
+                return
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "url": self.url,
+            "offline": self.offline,
+            "incremental": self.incremental,
+            "viewports": self.viewports,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "events": len(self.events),
+            "report": self.report,
+            "error": self.error,
+        }
+
+
+class JobQueue:
+    """
+    Bounded queue of analysis jobs served by a fixed pool of worker tasks.
+    """
+
+    def __init__(self, run_job: Callable[[str, bool, bool, Optional[List[str]]], AsyncIterator[dict]], workers: int, max_size: int):
+        self.run_job = run_job
+        self.worker_count = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self.jobs: Dict[str, Job] = {}
+        self.workers: List[asyncio.Task] = []
+        self.recent_durations: List[float] = []
+
+    def start(self):
+        if self.workers:
+            return
+        self.workers = [asyncio.create_task(self._worker(index)) for index in range(self.worker_count)]
+        print(f"JOB_SERVICE: Started {self.worker_count} worker(s), queue size {self.queue.maxsize}.")
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        print("JOB_SERVICE: Workers stopped.")
+
+    def _retry_after(self) -> int:
+        durations = self.recent_durations or [DEFAULT_JOB_DURATION_SECONDS]
+        average = sum(durations) / len(durations)
+        return max(1, int(average * self.queue.qsize() / max(1, self.worker_count)))
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.done and job.finished_at < cutoff]:
+            del self.jobs[job_id]
+
+    def submit(self, url: str, offline: bool = False, incremental: bool = False, viewports: Optional[List[str]] = None) -> Job:
+        """
+        Enqueues a job. Raises QueueFullError instead of waiting when the queue is full.
+        """
+        self._prune()
+        job = Job(url, offline, incremental, viewports)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFullError(self._retry_after())
+        self.jobs[job.id] = job
+        print(f"JOB_SERVICE: Queued job {job.id} for {url} ({self.queue.qsize()} waiting).")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    async def _worker(self, index: int):
+        while True:
+            job = await self.queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+            print(f"JOB_SERVICE: Worker {index} running job {job.id}")
+            try:
+                async for event in self.run_job(job.url, job.offline, job.incremental, job.viewports):
+                    await job.add_event(event)
+            except Exception as e:
+                print(f"JOB_SERVICE_ERROR: Job {job.id} failed: {e}")
+                await job.add_event({
+                    "type": "progress",
+                    "message": f"An unexpected server error occurred during analysis: {str(e)}",
+                    "step_name": "System Error",
+                    "progress": 0,
+                    "error": True
+                })
+            finally:
+                await job.finish()
+                self.recent_durations = (self.recent_durations + [job.finished_at - job.started_at])[-50:]
+                self.queue.task_done()
+
+    def get_stats(self) -> dict:
+        statuses: Dict[str, int] = {}
+        for job in self.jobs.values():
+            statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {
+            "workers": self.worker_count,
+            "queued": self.queue.qsize(),
+            "max_queue_size": self.queue.maxsize,
+            "jobs": statuses,
+        }
@@ -1,324 +1,634 @@
-from langchain_openai import ChatOpenAI
-from langchain_anthropic import ChatAnthropic
-from langchain.prompts import ChatPromptTemplate
-from langchain.schema.output_parser import StrOutputParser
-import base64
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.messages import BaseMessage
+import asyncio
+import json
 import os
 from dotenv import load_dotenv
-from typing import Optional
+from typing import Callable, Dict, List, Optional
+from services.html_rules_service import analyze_html_rules, format_findings_for_prompt
+from services.http_client_service import get_http_client, CLIENT_READ_TIMEOUTS
+from services.visual_metrics_service import format_visual_findings_for_prompt
+from services.report_parser_service import ReportDecoder, merge_report_completion, missing_report_fields, IMPLEMENTATION_PLAN
+from services.llm_scheduler_service import LLMScheduler, ScheduledModel
+from services.feedback_merge_service import merge_chunk_feedback, merge_viewport_feedback
+from services.metrics_service import span
+from services.startup_service import timed_phase
+from services.model_cascade_service import split_confidence, section_rule_guidelines, escalation_reason, record_model_part
+from services.prompt_service import HTML_PROMPT, SCREENSHOT_PROMPT, REPORT_PROMPT, REPORT_STRUCTURED_OUTPUT, REPORT_TOOL_NAME, PROMPT_CACHE, PROMPTS_BY_STAGE, cached_prefix_tokens, image_block, min_cache_prefix_tokens, report_tool
 
 load_dotenv()
 
 # Configuration for model selection
-MODEL_PROVIDER = os.getenv("MODEL_PROVIDER", "openai").lower()  # "openai" or "anthropic"
+MODEL_PROVIDER = os.getenv("MODEL_PROVIDER", "openai").lower()  # "openai", "anthropic" or "fake" (offline)
+
+_llm_clients = {}  # (provider, model) -> chat model instance
 
 def get_llm(provider: Optional[str] = None, model: Optional[str] = None):
     """
     Factory function to get the appropriate LLM based on provider.
     
     Args:
-        provider: "openai" or "anthropic" (defaults to MODEL_PROVIDER env var)
+        provider: "openai", "anthropic" or "fake" (defaults to MODEL_PROVIDER env var)
         model: Specific model name (defaults to recommended model for each provider)
         temperature: Temperature for generation (default: 0)
         max_tokens: Maximum tokens to generate (default: 1024)
     
     Returns:
-        LLM instance (ChatOpenAI or ChatAnthropic)
+        LLM instance (ChatOpenAI, ChatAnthropic or FakeChatModel). Instances are cached per (provider, model)
+        so their HTTP connection pools live for the whole application. The provider's SDK is
+        only imported when its first client is created, so workers never load SDKs they do not use.
     """
     if provider is None:
         provider = MODEL_PROVIDER
-    
+
+    cache_key = (provider, model)
+    if cache_key not in _llm_clients:
+        _llm_clients[cache_key] = _create_llm(provider, model)
+    return _llm_clients[cache_key]
+
+
+def _create_llm(provider: str, model: Optional[str]):
+    # SDK-level retries are disabled: llm_scheduler retries with backoff and rate budgets.
+    if provider == "fake":
+        with timed_phase("import_fake"):
+            from services.fake_llm_service import FakeChatModel
+        return FakeChatModel(model=model or "fake")
     if provider == "anthropic":
+        with timed_phase("import_anthropic"):
+            from langchain_anthropic import ChatAnthropic
         if model is None:
             model = os.getenv("ANTHROPIC_MODEL")
         
         return ChatAnthropic(
             model=model,
-            api_key=os.getenv("ANTHROPIC_API_KEY")
+            api_key=os.getenv("ANTHROPIC_API_KEY"),
+            default_request_timeout=CLIENT_READ_TIMEOUTS["llm"],
+            max_retries=0
         )
     else:  # Default to OpenAI
+        with timed_phase("import_openai"):
+            from langchain_openai import ChatOpenAI
         if model is None:
             model = os.getenv("OPENAI_MODEL", "gpt-4o")
         
         return ChatOpenAI(
             model=model,
-            api_key=os.getenv("OPENAI_API_KEY")
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_async_client=get_http_client("llm"),
+            max_retries=0
         )
 
-# Initialize the default LLM
-llm = get_llm("anthropic", "claude-3-5-sonnet-20241022")
 
-def analyze_accessibility(html: str, screenshot_base64: str) -> dict:
+async def close_llm_clients():
     """
-    Analyzes website accessibility from HTML and a screenshot using a multi-step AI workflow.
+    Closes the HTTP connections held by cached LLM clients. Called once on application shutdown.
+    OpenAI clients share the pooled "llm" HTTP client (closed with the other HTTP clients);
+    the Anthropic SDK owns its connection pool, so it is closed here.
     """
-    try:
-        # 1. HTML Analysis
-        print("LANGCHAIN_SERVICE: Starting HTML analysis...")
-        if not html:
-            print("LANGCHAIN_SERVICE_ERROR: HTML content is missing or empty.")
-            return {"error": "HTML content is missing for analysis."}
-
-        html_analysis_prompt = ChatPromptTemplate.from_template(
-            """
-    **Your Role:** You are an expert Web Accessibility Specialist. Your task is to conduct a thorough analysis of the provided HTML code based on the core principles of the Web Content Accessibility Guidelines (WCAG).
-
-    **Your Goal:** Identify accessibility violations and provide clear, actionable feedback with code examples to help a developer fix the issues.
-
-    **Analyze the following HTML content based on these 6 critical accessibility guidelines:**
-
-    **1. Semantic HTML Structure:**
-    - **Description:** A well-structured document uses semantic HTML tags to define roles for different parts of the page. This is crucial for screen reader navigation.
-    - **Analysis Criteria:**
-        - Does the page use landmark tags like `<header>`, `<nav>`, `<main>`, `<footer>`, and `<aside>` correctly?
-        - Is content structured into logical sections using `<section>` or `<article>` tags?
-        - Is the main content of the page enclosed within a `<main>` tag?
-
-    **2. Image Accessibility (Alternative Text):**
-    - **Description:** All informative images must have descriptive alternative (alt) text. Decorative images should have an empty alt attribute (`alt=""`). This ensures that users of screen readers can understand the content and purpose of images.
-    - **Analysis Criteria:**
-        - Do all `<img>` tags have an `alt` attribute?
-        - For `<img>` tags with `alt` attributes, is the text descriptive and meaningful, or is it a non-helpful placeholder like "image" or a filename?
-        - Are purely decorative images correctly marked with `alt=""`?
-
-    **3. Heading Hierarchy:**
-    - **Description:** Headings must be structured in a logical, hierarchical order (`<h1>` followed by `<h2>`, `<h2>` by `<h3>`, etc.) without skipping levels. This is one of the primary ways screen reader users navigate a page.
-    - **Analysis Criteria:**
-        - Is there only one `<h1>` per page?
-        - Do the heading levels follow a logical order (e.g., no `<h4>` directly after an `<h2>`)?
-        - Are headings used to create an outline of the page content, or are they used just for styling text?
-
-    **4. Form Labeling and Accessibility:**
-    - **Description:** Every form control (`<input>`, `<textarea>`, `<select>`) needs a programmatically associated `<label>`. This allows screen reader users to know what information each field is asking for.
-    - **Analysis Criteria:**
-        - Does every `<input>`, `<textarea>`, and `<select>` element have an associated `<label>`?
-        - Is the `for` attribute of the `<label>` correctly matched with the `id` of the corresponding form element?
-        - Do related form elements (like a group of checkboxes or radio buttons) get grouped using `<fieldset>` and described with a `<legend>`?
-
-    **5. Link Text Clarity:**
-    - **Description:** The purpose of every link should be clear from its text alone. Using generic, non-descriptive phrases like "Click Here," "Read More," or "Learn More" is a common accessibility failure.
-    - **Analysis Criteria:**
-        - Identify links with ambiguous text (e.g., "click here," "more," "link").
-        - Does the link text accurately describe the destination or action? For example, instead of "Click here to download the report," the link text should be "Download the 2024 Accessibility Report."
-
-    **6. Language Specification:**
-    - **Description:** The primary language of the page must be declared in the `<html>` tag using the `lang` attribute. This allows screen readers to switch to the correct language profile to pronounce the content correctly.
-    - **Analysis Criteria:**
-        - Does the `<html>` tag have a `lang` attribute (e.g., `<html lang="en">`)?
-        - Is the value of the `lang` attribute a valid IETF language tag (e.g., "en", "es", "fr-CA")?
-
-    ---
-
-    **Output Format:**
-    For each guideline where you find an issue, provide the following:
-    - **Guideline Violated:** The name of the guideline (e.g., "Image Accessibility").
-    - **Severity:** (Critical, High, Medium, Low).
-    - **Issue Description:** A clear explanation of *why* it's an issue.
-    - **Code Snippet:** The exact line(s) of HTML causing the issue.
-    - **Recommendation:** A specific, actionable suggestion for how to fix the code.
-
-    If no issues are found for a guideline, simply state: "No issues found."
-
-    Begin your analysis now on the HTML content provided below:
-
-    ```html
-    {html_content}
-    ```
+    for (provider, _), llm_client in list(_llm_clients.items()):
+        sdk_client = getattr(llm_client, "_async_client", None)
+        if provider == "anthropic" and sdk_client is not None:
+            try:
+                await sdk_client.close()
+            except Exception as e:
+                print(f"LANGCHAIN_SERVICE_WARNING: Could not close LLM client: {e}")
+    _llm_clients.clear()
+    _report_models.clear()
+
+
+# The default LLM. Its client is created on first use (or by the startup warm-up), so a
+# missing API key or SDK fails that analysis instead of the whole process.
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "anthropic").lower()
+LLM_MODEL = os.getenv("LLM_MODEL", "claude-3-5-sonnet-20241022")
+
+# Optional second provider that slow calls are hedged to (see llm_scheduler_service).
+LLM_FALLBACK_PROVIDER = os.getenv("LLM_FALLBACK_PROVIDER", "").lower()
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL") or None
+
+# Model cascade (see model_cascade_service): stages of the "small" tier run on the small
+# model, the others on LLM_MODEL. With the HTML triage stage on the small tier, HTML is
+# analyzed there first and only escalated to LLM_MODEL when the triage output calls for it.
+LLM_CASCADE = os.getenv("LLM_CASCADE", "true").lower() == "true"
+SMALL_MODEL_DEFAULTS = {"anthropic": "claude-3-5-haiku-20241022", "openai": "gpt-4o-mini", "fake": "fake-small"}
+LLM_SMALL_PROVIDER = os.getenv("LLM_SMALL_PROVIDER", LLM_PROVIDER).lower()
+LLM_SMALL_MODEL = os.getenv("LLM_SMALL_MODEL") or SMALL_MODEL_DEFAULTS.get(LLM_SMALL_PROVIDER, LLM_MODEL)
+# Stage -> "small" or "large"; override with LLM_STAGE_TIERS='{"report": "large"}'
+STAGE_TIERS = {"html_triage": "small", "html": "large", "screenshot": "large", "report": "small", "report_completion": "small"}
+STAGE_TIERS.update(json.loads(os.getenv("LLM_STAGE_TIERS", "{}")))
+
+# Every stage goes through a scheduler: per-model rate budgets, retries with backoff, hedging.
+llm_scheduler = LLMScheduler(
+    ScheduledModel(LLM_PROVIDER, LLM_MODEL, lambda: get_llm(LLM_PROVIDER, LLM_MODEL)),
+    ScheduledModel(LLM_FALLBACK_PROVIDER, LLM_FALLBACK_MODEL or "default", lambda: get_llm(LLM_FALLBACK_PROVIDER, LLM_FALLBACK_MODEL)) if LLM_FALLBACK_PROVIDER else None,
+)
+small_llm_scheduler = (
+    LLMScheduler(ScheduledModel(LLM_SMALL_PROVIDER, LLM_SMALL_MODEL, lambda: get_llm(LLM_SMALL_PROVIDER, LLM_SMALL_MODEL)))
+    if LLM_CASCADE and (LLM_SMALL_PROVIDER, LLM_SMALL_MODEL) != (LLM_PROVIDER, LLM_MODEL) else None
+)
+HTML_TRIAGE = small_llm_scheduler is not None and STAGE_TIERS.get("html_triage") == "small"
+
+# Part of every report cache key, next to LLM_PROVIDER/LLM_MODEL: reports from another cascade setup are not reused.
+CASCADE_KEY = f"{LLM_SMALL_PROVIDER}:{LLM_SMALL_MODEL}|{json.dumps(STAGE_TIERS, sort_keys=True)}" if small_llm_scheduler else "single"
+
+
+def scheduler_for(stage: str) -> LLMScheduler:
+    if small_llm_scheduler is not None and STAGE_TIERS.get(stage) == "small":
+        return small_llm_scheduler
+    return llm_scheduler
+
+
+def uncached_prompt_stages() -> dict:
     """
-    )
-        html_chain = html_analysis_prompt | llm | StrOutputParser()
-        html_feedback = html_chain.invoke({"html_content": html})
-        print(f"LANGCHAIN_SERVICE: HTML analysis feedback received: {html_feedback[:100]}...")
+    Stages whose static prompt prefix is shorter than the serving model caches (so it
+    is processed in full on every call): stage -> (prefix tokens, the model's minimum).
+    """
+    uncached = {}
+    for stage, prompt in PROMPTS_BY_STAGE.items():
+        if stage == "html_triage" and not HTML_TRIAGE:
+            continue
+        target = scheduler_for(stage).primary
+        if target.provider not in ("anthropic", "openai"):
+            continue
+        tokens, minimum = cached_prefix_tokens(prompt), min_cache_prefix_tokens(target.model)
+        if PROMPT_CACHE and tokens < minimum:
+            uncached[stage] = (tokens, minimum)
+    return uncached
 
-        # 2. Screenshot Analysis
-        print("LANGCHAIN_SERVICE: Starting screenshot analysis...")
-        if not screenshot_base64:
-            print("LANGCHAIN_SERVICE_ERROR: Screenshot data is missing or empty.")
-            screenshot_feedback = "Screenshot data was not provided or was invalid."
-        else:
-            # For Claude API, we need to use HumanMessage with proper content structure
-            from langchain_core.messages import HumanMessage
-            
-            screenshot_message = HumanMessage(
-                content=[
-                    {
-                        "type": "text",
-                        "text": """**Your Role:** You are an expert UI/UX Accessibility Analyst. Your task is to perform a visual accessibility audit of the provided webpage screenshot based on key visual design and accessibility principles from WCAG.
-
-**Your Goal:** Identify visual design choices that negatively impact accessibility for users with visual impairments, motor difficulties, or cognitive disabilities. Provide clear, actionable feedback to help a designer or developer address these issues.
-
-**Analyze the provided screenshot based on these 5 critical visual accessibility guidelines:**
-
-**1. Color Contrast:**
-- **Description:** Text and meaningful graphical elements (like icons or input borders) must have sufficient color contrast against their background to be readable by people with low vision or color blindness. The WCAG AA standard requires a ratio of at least 4.5:1 for normal text and 3:1 for large text.
-- **Analysis Criteria:**
-    - Visually scan the page for text or UI elements that appear to have low contrast. Point out specific examples (e.g., "The light gray text on the white background in the footer appears to have low contrast.").
-    - Check if text placed over images or gradients has a consistent, readable contrast level.
-
-**2. Typography and Readability:**
-- **Description:** Text should be easy to read. This is affected by font size, weight, and spacing.
-- **Analysis Criteria:**
-    - Is the primary body text a reasonable size (typically at least 16px)?
-    - Is there adequate spacing between lines of text (line-height, typically ~1.5) and between paragraphs?
-    - Are font choices clear and legible? Avoid overly decorative or thin fonts for body text.
-
-**3. Interactive Element Clarity & Target Size:**
-- **Description:** Users need to be able to identify interactive elements (like links and buttons) and physically interact with them easily.
-- **Analysis Criteria:**
-    - **Clarity:** Are links and buttons visually distinct from non-interactive text? Do they have clear indicators like underlines or a button shape?
-    - **Target Size:** Are buttons, links, and other interactive controls large enough to be easily tapped or clicked? Small targets can be difficult for users with motor impairments. Identify elements that appear too small or too close together.
-
-**4. Layout and Spacing (White Space):**
-- **Description:** A cluttered layout can be overwhelming and make it difficult to distinguish between different sections of content. Good use of white space improves clarity and focus.
-- **Analysis Criteria:**
-    - Does the layout feel cramped or cluttered?
-    - Is there sufficient spacing between major content blocks, such as the navigation, main content, and footer?
-    - Are interactive elements spaced far enough apart to prevent accidental clicks?
-
-**5. Information Conveyed Solely by Color:**
-- **Description:** Color should not be the *only* method used to convey important information. This is critical for users who are colorblind.
-- **Analysis Criteria:**
-    - Look for instances where information is indicated only by a change in color. For example, is an error message for a form field shown *only* by turning the label red?
-    - A pass/fail status, link states, or selected items should use a secondary indicator, such as an icon, an underline, bold text, or another visual cue in addition to color.
-
----
-
-**Output Format:**
-For each guideline where you find an issue, provide the following:
-- **Guideline Violated:** The name of the guideline (e.g., "Color Contrast").
-- **Severity:** (Critical, High, Medium, Low).
-- **Issue Description:** A clear explanation of the visual issue and where it appears on the page.
-- **Recommendation:** A specific suggestion for how to fix the visual design (e.g., "Increase the font color contrast to meet the WCAG AA 4.5:1 ratio," or "Add an underline to all inline links to distinguish them from plain text.").
-
-If no issues are found for a guideline, simply state: "No significant issues found."
-
-Begin your analysis now."""
-                    },
-                    {
-                        "type": "image",
-                        "source": {
-                            "type": "base64",
-                            "media_type": "image/png",
-                            "data": screenshot_base64
-                        }
-                    }
-                ]
-            )
-            
-            # Invoke the LLM with the message
-            screenshot_feedback = llm.invoke([screenshot_message]).content
-        print(f"LANGCHAIN_SERVICE: Screenshot analysis feedback received: {screenshot_feedback[:100]}...")
-
-        # 3. Aggregated Report and Scoring
-        print("LANGCHAIN_SERVICE: Starting aggregated report and scoring...")
-        report_prompt = ChatPromptTemplate.from_template(
-    """
-    **Your Role:** You are a Lead Web Accessibility Consultant. Your task is to synthesize the detailed technical findings from an HTML code analysis and a visual screenshot analysis into a single, client-ready accessibility report.
-
-    **Your Goal:** Create a clear, insightful, and actionable report that helps a website owner understand their site's accessibility strengths and weaknesses. The report must include scores for key categories and a prioritized implementation plan.
-
-    ---
-
-    **Input Data:**
-
-    **1. HTML Analysis Feedback:**
+
+def warn_uncached_prompts():
+    for stage, (tokens, minimum) in uncached_prompt_stages().items():
+        print(f"LANGCHAIN_SERVICE_WARNING: The {stage} prompt prefix (~{tokens} tokens) is under the {minimum}-token minimum of {scheduler_for(stage).primary.name} and will not be cached.")
+
+
+warn_uncached_prompts()
+
+
+async def warm_up_llms():
+    for scheduler in filter(None, (llm_scheduler, small_llm_scheduler)):
+        await scheduler.warm_up()
+
+
+def get_llm_stats() -> dict:
+    stats = llm_scheduler.get_stats()
+    if small_llm_scheduler is not None:
+        stats["models"] += small_llm_scheduler.get_stats()["models"]
+    stats["stage_models"] = {stage: scheduler_for(stage).primary.name for stage in STAGE_TIERS}
+    stats["html_triage"] = HTML_TRIAGE
+    stats["uncached_prompt_stages"] = sorted(uncached_prompt_stages())
+    return stats
+
+# How often a report with missing fields is completed by asking for only those fields.
+REPORT_COMPLETION_ATTEMPTS = int(os.getenv("REPORT_COMPLETION_ATTEMPTS", "1"))
+
+report_completion_prompt = ChatPromptTemplate.from_template(
+    """
+    **Your Role:** You are a Lead Web Accessibility Consultant completing an accessibility report.
+
+    The report below was produced from the analysis inputs that follow, but some of its fields are missing. Write ONLY the missing fields: {missing_fields}. Do not repeat or change anything that is already in the report. Use the same five categories, the same 0-100 scoring rubric, and keep the feedback consistent with the existing report.
+
+    **Report so far:**
+    ```json
+    {partial_report}
+    ```
+
+    **1. HTML Code Analysis Feedback:**
     ```
     {html_feedback}
     ```
 
-    **2. Screenshot Analysis Feedback:**
+    **2. Visual Screenshot Analysis Feedback:**
     ```
     {screenshot_feedback}
     ```
 
-    ---
+    **3. Deterministic Rule Findings:**
+    ```
+    {rule_findings}
+    ```
 
-    **Your Task (Follow these steps carefully):**
+    **Output Format: CRITICAL**
+    Produce a single, valid JSON object and nothing else, containing only the missing keys: `scores` (a list of objects with exactly `category`, `score` and `feedback`) and/or `implementation_plan` (a single string).
+    """
+)
 
-    **Step 1: Synthesize Findings**
-    Review both sets of feedback. Map each identified issue (e.g., "Missing alt text," "Low contrast text," "Skipped heading level") to one of the five categories below.
+MEASURED_VISUAL_NOTE = """**Measured Visual Checks:**
+Text contrast has already been measured from the screenshot pixels with the WCAG relative-luminance formula (coordinates are in full-page screenshot pixels). These measurements are authoritative: do not estimate contrast ratios by eye or re-list these regions. Spend your analysis on what a measurement cannot judge (typography, clarity of interactive elements, layout and spacing, colour as the only means of conveying information, visible focus indicators).
 
-    **Step 2: Score Each Category**
-    For each category, provide a score from 0 to 100 based on the number and severity of the issues you mapped to it. Use this rubric as a guide:
-    - **90-100:** Excellent. No significant issues found, or only minor best-practice suggestions.
-    - **70-89:** Good. Some moderate issues were found that should be addressed but don't block core functionality.
-    - **50-69:** Fair. Several notable issues exist that can create barriers for some users.
-    - **30-49:** Poor. Serious accessibility issues were found that significantly impact usability for people with disabilities.
-    - **0-29:** Critical. The site has critical blockers in this category, making key content or functions unusable for some user groups.
+```
+{visual_findings}
+```"""
 
-    **Step 3: Write Category Feedback & Implementation Plan**
-    - For each category, write a concise `feedback` summary. Explain the score by highlighting the key issues found (both from the HTML and screenshot analysis).
-    - Create a single, prioritized `implementation_plan`. Start with the most critical, highest-impact fixes (from the lowest-scoring categories) and move to minor improvements. Make it a clear, step-by-step guide for a developer.
+SCREENSHOT_TILE_NOTE = (
+    "**Note:** This image is section {number} of {count} of a full-page screenshot, covering "
+    "vertical pixels {top} to {bottom} of {height}. Neighbouring sections overlap slightly. "
+    "Only report issues visible in this section and say where in the section they appear."
+)
 
-    ---
 
-    **Categories for Analysis:**
+def build_screenshot_messages(tile_base64: str, media_type: str = "image/png", notes: Optional[str] = None, provider: str = "anthropic") -> List[BaseMessage]:
+    """
+    Builds the multimodal messages for the visual audit: the cached instructions, then
+    `notes` (measured findings, tile position) and the image block in the provider's format.
+    """
+    return SCREENSHOT_PROMPT.messages(provider, image=image_block(tile_base64, media_type, provider), notes=notes or "")
 
-    1.  **Structure & Semantics:** How well the HTML is structured for navigation.
-        *(Considers: Heading hierarchy, use of `<main>`, `<nav>`, etc., ARIA roles)*
-    2.  **Readability & Visual Clarity:** How easy it is to read and visually parse the content.
-        *(Considers: Font sizes, color contrast, typography, layout, and spacing from the screenshot)*
-    3.  **Navigability & Interactivity:** How easy it is for users to navigate and interact with controls.
-        *(Considers: Link text clarity, visual distinction of links/buttons, target sizes)*
-    4.  **Forms & Inputs:** The accessibility of all user input fields.
-        *(Considers: Form labels, input grouping (`fieldset`), and visual clarity of form elements)*
-    5.  **Media Accessibility:** The accessibility of images, videos, and other media.
-        *(Considers: `alt` text for all images)*
 
-    ---
+# Streamed partial text is forwarded at most this often per stage, so a fast model
+# does not turn into one SSE event per token.
+STREAM_EMIT_INTERVAL_SECONDS = float(os.getenv("STREAM_EMIT_INTERVAL_SECONDS", "0.1"))
 
-    **Output Format: CRITICAL**
-    You MUST produce a single, valid JSON object and nothing else. Do not wrap it in markdown backticks or any other text. The JSON object must have exactly two top-level keys: `scores` and `implementation_plan`.
+# Callback receiving streaming events (partial stage output, scores as they appear).
+EventCallback = Optional[Callable[[dict], None]]
 
-    -   The `scores` key must be a JSON list of objects.
-    -   Each object in the `scores` list MUST have exactly three keys: `category` (string), `score` (integer 0-100), and `feedback` (string).
-    -   The `implementation_plan` key must be a single string containing the prioritized, step-by-step plan.
 
-    **Example of the required final JSON structure:**
-    ```json
-    {{
-        "scores": [
-            {{
-                "category": "Structure & Semantics",
-                "score": 75,
-                "feedback": "The site uses some semantic tags like `<header>` but is missing a `<main>` landmark, and the heading structure skips from an H2 to an H4. This makes navigation for screen reader users less efficient."
-            }},
-            {{
-                "category": "Readability & Visual Clarity",
-                "score": 45,
-                "feedback": "Critical issue: The light gray text on a white background in the user testimonial section has a very low contrast ratio, making it unreadable for users with low vision. Body text font size is also small."
-            }}
-        ],
-        "implementation_plan": "1. **(Critical) Fix Color Contrast:** Immediately change the light gray text color in the testimonial section to a darker shade, ensuring a contrast ratio of at least 4.5:1.\\n2. **(High) Correct Heading Structure:** Restructure the page headings to follow a logical order without skipping levels.\\n3. **(High) Add a `<main>` Landmark:** Wrap the primary content of the page in a `<main>` tag to improve navigation."
-    }}
-    ```
+def _chunk_text(chunk) -> str:
+    """
+    The text of a streamed chunk. For a tool call (the structured report) this is the
+    streamed JSON of its arguments, so it is decoded like a report written as text.
     """
-    )
-        report_chain = report_prompt | llm | StrOutputParser()
-        report_str_output = report_chain.invoke({
-            "html_feedback": html_feedback,
-            "screenshot_feedback": screenshot_feedback
-        })
-        print(f"LANGCHAIN_SERVICE: Raw report string from LLM: {report_str_output[:200]}...") # Log raw output
+    content = chunk.content if hasattr(chunk, "content") else chunk
+    text = content if isinstance(content, str) else "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    tool_args = "".join(tool_chunk.get("args") or "" for tool_chunk in getattr(chunk, "tool_call_chunks", None) or [])
+    return text + tool_args
 
-        # The function is typed to return a dict, but the chain returns a string.
-        # The parsing to dict is handled in main.py.
-        # This function should ideally return the string as produced by the LLM.
-        return report_str_output # Return the string for main.py to parse
+
+async def _stream_stage(build: Callable, stage: str, on_event: EventCallback = None, on_text: Optional[Callable[[str], None]] = None, part: Optional[str] = None, served: Optional[dict] = None, **labels) -> str:
+    """
+    Runs one LLM stage through the stage's scheduler (see scheduler_for). `build(target)` returns the (runnable, input)
+    for the model that serves the call (see llm_scheduler_service). Forwards partial text and token counts to
+    `on_event` as `llm_stream` events (batched every STREAM_EMIT_INTERVAL_SECONDS).
+    `on_text` sees every text delta as it arrives. With `part`, the model that served
+    the call is recorded as that part's producer; `served` gets it as its "model".
+    Returns the full output text.
+    """
+    loop = asyncio.get_running_loop()
+    parts: List[str] = []
+    pending: List[str] = []
+    chunks = 0
+    usage = None
+    last_emit = loop.time()
+
+    def emit(done: bool):
+        if on_event is not None:
+            tokens = usage["output_tokens"] if done and usage and usage.get("output_tokens") else chunks
+            on_event({"type": "llm_stream", "stage": stage, **labels, "delta": "".join(pending), "tokens": tokens, "done": done, "error": False})
+
+    detail = ", ".join(f"{name}={value}" for name, value in labels.items()) or None
+    with span(f"llm_{stage}", detail=detail) as record:
+        async for chunk in scheduler_for(stage).astream(build, stage):
+            if getattr(chunk, "usage_metadata", None):
+                usage = chunk.usage_metadata
+            text = _chunk_text(chunk)
+            if not text:
+                continue
+            chunks += 1
+            parts.append(text)
+            pending.append(text)
+            if on_text is not None:
+                on_text(text)
+            if loop.time() - last_emit >= STREAM_EMIT_INTERVAL_SECONDS:
+                emit(done=False)
+                pending.clear()
+                last_emit = loop.time()
+        output = "".join(parts)
+        record["bytes_out"] = len(output.encode("utf-8"))
+    emit(done=True)
+    if part is not None:
+        record_model_part(part, record.get("model"), detail)
+    if served is not None:
+        served["model"] = record.get("model")
+    return output
+
+
+async def _analyze_html_section(html: str, rule_findings: str, rule_guidelines: set, on_event: EventCallback = None, part: str = "html", **labels) -> str:
+    """
+    Runs the HTML stage on a page or section. With HTML_TRIAGE it runs on the small
+    model first and is repeated on the large model only if escalation_reason finds the
+    triage output lacking. The stated confidence line is removed from the feedback, and
+    the model that produced it is recorded as the producer of `part`.
+    """
+    build = lambda target: (target.llm, HTML_PROMPT.messages(target.provider, html_content=html, rule_findings=rule_findings))
+    detail = ", ".join(f"{name}={value}" for name, value in labels.items()) or None
+    served: dict = {}
+    if HTML_TRIAGE:
+        feedback, confidence = split_confidence(await _stream_stage(build, "html_triage", on_event, served=served, **labels))
+        reason = escalation_reason(feedback, confidence, rule_guidelines)
+        if reason is None:
+            record_model_part(part, served["model"], detail, confidence=confidence)
+            return feedback
+        triage_model = served["model"]
+        print(f"LANGCHAIN_SERVICE: Escalating HTML analysis{f' ({detail})' if detail else ''} from {triage_model}: {reason}.")
+        feedback, confidence = split_confidence(await _stream_stage(build, "html", on_event, served=served, **labels))
+        record_model_part(part, served["model"], detail, confidence=confidence, escalated_from=triage_model, escalation_reason=reason)
+        return feedback
+    feedback, confidence = split_confidence(await _stream_stage(build, "html", on_event, served=served, **labels))
+    record_model_part(part, served["model"], detail, confidence=confidence)
+    return feedback
+
+
+async def analyze_html_async(html: str, rule_findings: str, on_event: EventCallback = None, rule_guidelines: Optional[set] = None) -> str:
+    """
+    Runs the HTML guideline analysis stage, seeded with the pre-computed rule findings.
+    `rule_guidelines` are the guidelines those findings cover (see model_cascade_service).
+    """
+    print("LANGCHAIN_SERVICE: Starting HTML analysis...")
+    html_feedback = await _analyze_html_section(html, rule_findings, rule_guidelines or set(), on_event)
+    print(f"LANGCHAIN_SERVICE: HTML analysis feedback received: {html_feedback[:100]}...")
+    return html_feedback
+
+
+# Chunks of a page too large for one prompt (see chunk_html) analyzed at the same time, per page.
+HTML_CHUNK_CONCURRENCY = int(os.getenv("HTML_CHUNK_CONCURRENCY", "4"))
+
+HTML_CHUNK_NOTE = (
+    "**Note:** The HTML below is section {number} of {count} of a page that is too large to analyze "
+    "at once (location: {path}). Its ancestor elements are included as opening tags for context; the "
+    "rest of the page is analyzed separately. Only report issues in this section's content. Page-level "
+    "checks (the lang attribute, a single <h1>, the <main> landmark) are covered by the rule findings above."
+)
+
+
+async def analyze_html_chunks_async(chunks: List[dict], rule_findings: str, on_event: EventCallback = None, carried: Optional[Dict[str, str]] = None, outputs: Optional[Dict[str, str]] = None, rule_results: Optional[dict] = None) -> str:
+    """
+    Map-reduce variant of the HTML stage for pages split into chunks: every chunk is
+    analyzed with the regular HTML prompt (at most HTML_CHUNK_CONCURRENCY at a time),
+    then the per-chunk issues are merged and deduplicated per guideline. Each chunk is
+    triaged and escalated on its own, against the `rule_results` found in it.
+    Chunks with a `hash` found in `carried` reuse that feedback instead of calling the
+    model; `outputs` collects every chunk's feedback by hash.
+    """
+    rule_results = rule_results or {}
+    carried = carried or {}
+    to_analyze = sum(1 for chunk in chunks if chunk.get("hash") not in carried)
+    print(f"LANGCHAIN_SERVICE: Starting chunked HTML analysis of {len(chunks)} section(s), {to_analyze} to analyze...")
+    chunk_slots = asyncio.Semaphore(HTML_CHUNK_CONCURRENCY)
+
+    async def analyze_chunk(chunk: dict) -> str:
+        if chunk.get("hash") in carried:
+            record_model_part("html", None, f"chunk={chunk['index']}", carried_over=True)
+            return carried[chunk["hash"]]
+        # A page that fits in one section is analyzed like an unsplit page.
+        if len(chunks) == 1:
+            note, rule_guidelines = "", section_rule_guidelines(rule_results)
+        else:
+            note = "\n\n" + HTML_CHUNK_NOTE.format(number=chunk["index"] + 1, count=len(chunks), path=chunk["path"])
+            rule_guidelines = section_rule_guidelines(rule_results, chunk["html"])
+        async with chunk_slots:
+            return await _analyze_html_section(chunk["html"], rule_findings + note, rule_guidelines, on_event, chunk=chunk["index"])
+
+    feedbacks = await asyncio.gather(*(analyze_chunk(chunk) for chunk in chunks))
+    if outputs is not None:
+        outputs.update((chunk["hash"], feedback) for chunk, feedback in zip(chunks, feedbacks) if chunk.get("hash"))
+    if len(chunks) == 1:
+        return feedbacks[0]
+    html_feedback = merge_chunk_feedback(list(zip(chunks, feedbacks)))
+    print(f"LANGCHAIN_SERVICE: Chunked HTML analysis merged: {html_feedback[:100]}...")
+    return html_feedback
+
+
+async def analyze_screenshot_async(screenshot: Optional[dict], on_event: EventCallback = None, note: Optional[str] = None, **labels) -> str:
+    """
+    Runs the visual analysis stage on the screenshot tiles (see screenshot_service).
+    Tiles of a tall page are analyzed in parallel and their feedback is merged,
+    labelled by page section. `note` is added to the instructions and `labels` to the
+    stream events. Returns a placeholder note when no screenshot is available.
+    """
+    print("LANGCHAIN_SERVICE: Starting screenshot analysis...")
+    if not screenshot or not screenshot.get("tiles"):
+        print("LANGCHAIN_SERVICE_ERROR: Screenshot data is missing or empty.")
+        return "Screenshot data was not provided or was invalid."
+
+    tiles = screenshot["tiles"]
+    measured_note = MEASURED_VISUAL_NOTE.format(visual_findings=format_visual_findings_for_prompt(screenshot.get("visual_findings")))
+    if note:
+        measured_note = f"{note}\n\n{measured_note}"
+    if len(tiles) == 1:
+        screenshot_feedback = await _stream_stage(
+            lambda target: (target.llm, build_screenshot_messages(tiles[0]["data"], screenshot["media_type"], measured_note, target.provider)),
+            "screenshot", on_event, part="screenshot", **labels
+        )
+    else:
+        def tile_stage(tile: dict) -> Callable:
+            notes = measured_note + "\n\n" + SCREENSHOT_TILE_NOTE.format(number=tile["index"] + 1, count=len(tiles), top=tile["top"], bottom=tile["bottom"], height=screenshot["height"])
+            return lambda target: (target.llm, build_screenshot_messages(tile["data"], screenshot["media_type"], notes, target.provider))
+
+        feedbacks = await asyncio.gather(*(
+            _stream_stage(tile_stage(tile), "screenshot", on_event, part="screenshot", tile=tile["index"], **labels)
+            for tile in tiles
+        ))
+        screenshot_feedback = "\n\n".join(
+            f"**Screenshot section {tile['index'] + 1} of {len(tiles)} (pixels {tile['top']}-{tile['bottom']}):**\n{feedback}"
+            for tile, feedback in zip(tiles, feedbacks)
+        )
+        if screenshot.get("truncated"):
+            screenshot_feedback += "\n\n(The page continues below the last analyzed section.)"
+    print(f"LANGCHAIN_SERVICE: Screenshot analysis feedback received ({len(tiles)} tile(s)): {screenshot_feedback[:100]}...")
+    return screenshot_feedback
+
+
+VIEWPORT_NOTE = (
+    "**Note:** This screenshot was taken at the {viewport} viewport ({description}). Judge target "
+    "sizes, spacing and reflow (content that is cut off, overlaps or needs horizontal scrolling) "
+    "for this viewport, and name the viewport when an issue is specific to it."
+)
+
+
+async def analyze_viewports_async(screenshots: List[dict], on_event: EventCallback = None) -> str:
+    """
+    Viewport matrix variant of the visual stage: the screenshot of every viewport
+    (`viewport`, `viewport_description`) gets its own visual pass, all in parallel,
+    and the issues are merged per guideline with the viewports they were seen at.
+    """
+    print(f"LANGCHAIN_SERVICE: Starting screenshot analysis at {len(screenshots)} viewport(s)...")
+    feedbacks = await asyncio.gather(*(
+        analyze_screenshot_async(
+            screenshot, on_event,
+            note=VIEWPORT_NOTE.format(viewport=screenshot["viewport"], description=screenshot["viewport_description"]),
+            viewport=screenshot["viewport"],
+        )
+        for screenshot in screenshots
+    ))
+    return merge_viewport_feedback([(screenshot["viewport"], feedback) for screenshot, feedback in zip(screenshots, feedbacks)])
+
+
+_report_models = {}  # (provider, model) -> the chat model bound to the report tool
+
+
+def report_model(target):
+    """
+    The report stage's model: with REPORT_STRUCTURED_OUTPUT, bound to the report tool
+    (see prompt_service.report_tool) and made to call it, so the report arrives as
+    schema-shaped tool arguments instead of free text.
+    """
+    if not REPORT_STRUCTURED_OUTPUT:
+        return target.llm
+    key = (target.provider, target.model)
+    if key not in _report_models:
+        _report_models[key] = target.llm.bind_tools([report_tool()], tool_choice=REPORT_TOOL_NAME)
+    return _report_models[key]
+
+
+async def generate_report_async(html_feedback: str, screenshot_feedback: str, rule_findings: str, on_event: EventCallback = None) -> str:
+    """
+    Runs the aggregated report and scoring stage and returns the report as a JSON string.
+
+    The output is decoded as it streams: each score category is sent to `on_event` as a
+    `score` event as soon as it is complete. With REPORT_STRUCTURED_OUTPUT the report
+    arrives as the arguments of a tool call, which stream and decode the same way.
+    Malformed JSON is repaired, and if fields are still missing afterwards only those
+    are requested again (see report_parser_service).
+    """
+    print("LANGCHAIN_SERVICE: Starting aggregated report and scoring...")
+    decoder = ReportDecoder()
+
+    def on_text(text: str):
+        for score in decoder.feed(text):
+            if on_event is not None:
+                on_event({"type": "score", **score, "error": False})
+
+    stage_input = {
+        "html_feedback": html_feedback,
+        "screenshot_feedback": screenshot_feedback,
+        "rule_findings": rule_findings
+    }
+    report_str_output = await _stream_stage(lambda target: (report_model(target), REPORT_PROMPT.messages(target.provider, **stage_input)), "report", on_event, on_text, part="report")
+    print(f"LANGCHAIN_SERVICE: Raw report string from LLM: {report_str_output[:200]}...") # Log raw output
+
+    report, missing = decoder.finish()
+    for attempt in range(REPORT_COMPLETION_ATTEMPTS):
+        if not missing:
+            break
+        print(f"LANGCHAIN_SERVICE: Report is missing {missing}, requesting only those fields (attempt {attempt + 1}).")
+        completion_input = {
+            **stage_input,
+            "partial_report": json.dumps(report or {}, indent=2),
+            "missing_fields": _describe_missing_fields(missing),
+        }
+        completion_output = await _stream_stage(lambda target: (report_completion_prompt | target.llm, completion_input), "report_completion", on_event, part="report_completion")
+        before = {score["category"] for score in (report or {}).get("scores", [])}
+        report = merge_report_completion(report, completion_output)
+        for score in report["scores"]:
+            if score["category"] not in before and on_event is not None:
+                on_event({"type": "score", **score, "error": False})
+        missing = missing_report_fields(report)
+
+    if report is None:
+        # Nothing usable: hand the raw output on so the caller can report it.
+        return report_str_output
+    return json.dumps(report)
+
+
+def _describe_missing_fields(missing: List[str]) -> str:
+    categories = [field for field in missing if field != IMPLEMENTATION_PLAN]
+    parts = []
+    if categories:
+        parts.append("`scores` entries for these categories only: " + ", ".join(f'"{category}"' for category in categories))
+    if IMPLEMENTATION_PLAN in missing:
+        parts.append("the `implementation_plan` string (covering all categories)")
+    return " and ".join(parts)
+
+
+TEMPLATE_COMPONENT_NOTE = (
+    "This HTML is a shared site template component (such as the header, navigation, footer or "
+    "cookie banner) that appears on every page of the site. It is not a full page: page-level "
+    "checks (the lang attribute, the <main> landmark, a single <h1>) do not apply to it."
+)
+
+
+async def analyze_template_component_async(component_html: str) -> str:
+    """
+    Runs the HTML analysis stage on one shared template component.
+    """
+    return await _analyze_html_section(component_html, TEMPLATE_COMPONENT_NOTE, set(), part="template")
+
+
+def _error_report_json(e: Exception) -> str:
+    """
+    Serializes an internal error into the report shape main.py knows how to detect.
+    """
+    error_report = {
+        "scores": [{"category": "Error", "score": 0, "feedback": f"An internal error occurred in Langchain service: {str(e)}"}],
+        "implementation_plan": "Analysis could not be completed due to an internal error."
+    }
+    return json.dumps(error_report)
+
+
+async def analyze_accessibility_async(html: str, screenshot: Optional[dict], rule_results: Optional[dict] = None, template_feedback: Optional[str] = None, on_event: EventCallback = None, html_chunks: Optional[List[dict]] = None, carried_feedback: Optional[dict] = None, stage_feedback: Optional[dict] = None, viewport_screenshots: Optional[List[dict]] = None) -> str:
+    """
+    Asynchronous multi-step accessibility analysis.
+
+    The deterministic rule checks run first (or are taken from `rule_results` if the
+    caller already has them) and their compact findings are given to the LLM stages.
+    `screenshot` is the tiled screenshot from screenshot_service, or None; its measured
+    visual findings are given to the screenshot and report stages.
+    The HTML and screenshot stages are independent, so they run concurrently and
+    both results are fed into the report stage. `template_feedback` is the already
+    computed analysis of shared site template components that were cut out of `html`;
+    it is added to the HTML feedback for the report stage. Every stage streams with
+    `astream`; partial output and completed score categories are passed to `on_event`.
+    When the page was split into `html_chunks` (see chunk_html), the HTML stage analyzes
+    the chunks instead of `html` and merges their findings.
+    For an incremental re-analysis (see snapshot_service), `carried_feedback` holds stage
+    outputs of the previous run that are still valid (`html`: feedback by chunk hash,
+    `screenshot`: the visual feedback) and are used instead of calling the model; if
+    `stage_feedback` is given, it is filled the same way with this run's stage outputs.
+    With `viewport_screenshots` (one screenshot per viewport) the visual stage analyzes
+    each of them instead of `screenshot`; the HTML stage runs once either way.
+
+    Returns the raw report string produced by the LLM (parsed to JSON in main.py),
+    or a JSON error report string if any stage fails.
+    """
+    try:
+        if not html:
+            print("LANGCHAIN_SERVICE_ERROR: HTML content is missing or empty.")
+            return _error_report_json(ValueError("HTML content is missing for analysis."))
+
+        if rule_results is None:
+            # Parsing is CPU-bound; keep it off the event loop for large pages.
+            rule_results = await asyncio.to_thread(analyze_html_rules, html)
+        rule_findings = format_findings_for_prompt(rule_results)
+        print(f"LANGCHAIN_SERVICE: Rule engine found {len(rule_results['findings'])} issue(s).")
+        report_findings = rule_findings
+        if viewport_screenshots:
+            report_findings = f"{rule_findings}\n{format_visual_findings_for_prompt([finding for shot in viewport_screenshots for finding in shot.get('visual_findings') or []])}"
+        elif screenshot:
+            # Measured contrast/target-size failures go to the report stage with the rule findings.
+            report_findings = f"{rule_findings}\n{format_visual_findings_for_prompt(screenshot.get('visual_findings'))}"
+
+        carried_feedback = carried_feedback or {}
+        section_feedback: Dict[str, str] = {}
+        html_stage = (
+            analyze_html_chunks_async(html_chunks, rule_findings, on_event, carried_feedback.get("html"), section_feedback, rule_results)
+            if html_chunks else analyze_html_async(html, rule_findings, on_event, section_rule_guidelines(rule_results))
+        )
+        if "screenshot" in carried_feedback:
+            print("LANGCHAIN_SERVICE: Page looks unchanged, reusing the previous screenshot analysis.")
+            record_model_part("screenshot", None, carried_over=True)
+            html_feedback, screenshot_feedback = await html_stage, carried_feedback["screenshot"]
+        else:
+            visual_stage = analyze_viewports_async(viewport_screenshots, on_event) if viewport_screenshots else analyze_screenshot_async(screenshot, on_event)
+            html_feedback, screenshot_feedback = await asyncio.gather(html_stage, visual_stage)
+        if stage_feedback is not None:
+            stage_feedback.update(html=section_feedback, screenshot=screenshot_feedback)
+        if template_feedback:
+            html_feedback = f"{html_feedback}\n\n**Shared site template components (analyzed once for the whole site):**\n{template_feedback}"
+
+        # The report string is parsed to a dict in main.py.
+        return await generate_report_async(html_feedback, screenshot_feedback, report_findings, on_event)
 
     except Exception as e:
         print(f"LANGCHAIN_SERVICE_ERROR: An error occurred during accessibility analysis: {e}")
         import traceback
         traceback.print_exc()
-        # Return a structured error that main.py can check for
-        # Or, re-raise to be caught by a global handler if FastAPI is configured for that.
-        # For now, let's return a dict that indicates an error.
-        # The calling function in main.py expects a string that it tries to json.loads().
-        # So, we should return a string that represents a JSON error object, or handle this differently.
-        # Let's return a JSON string representing an error.
-        error_report = {
-            "scores": [{"category": "Error", "score": 0, "feedback": f"An internal error occurred in Langchain service: {str(e)}"}],
-            "implementation_plan": "Analysis could not be completed due to an internal error."
-        }
-        import json
-        return json.dumps(error_report) # Return as JSON string
+        # main.py expects a string that it can json.loads(), so the error is
+        # returned as a JSON error report instead of being raised.
+        return _error_report_json(e)
+
+
+def analyze_accessibility(html: str, screenshot: Optional[dict]) -> str:
+    """
+    Synchronous wrapper around `analyze_accessibility_async` for scripts and other
+    non-async callers. Do not call this from inside a running event loop; await
+    `analyze_accessibility_async` instead.
+    """
+    return asyncio.run(analyze_accessibility_async(html, screenshot))
@@ -0,0 +1,366 @@
+from collections import deque
+from typing import AsyncIterator, Callable, Deque, Dict, Optional, Tuple
+from dotenv import load_dotenv
+from services.metrics_service import record_llm_call, record_llm_usage
+import asyncio
+import os
+import random
+import time
+
+load_dotenv()
+
+# Scheduler in front of every LLM call. Each (provider, model) gets request-per-minute
+# and token-per-minute budgets; calls wait for budget instead of running into provider
+# 429s. Rate-limit and transient errors are retried with jittered exponential backoff
+# (honouring Retry-After, which also pauses the model's budget for other callers).
+# Optionally, a call whose first token is slower than the recent latency percentile is
+# hedged to a fallback provider and whichever responds first is used.
+
+DEFAULT_REQUESTS_PER_MINUTE = {"anthropic": 50, "openai": 500, "fake": 6000}
+DEFAULT_TOKENS_PER_MINUTE = {"anthropic": 40000, "openai": 300000, "fake": 10000000}
+
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "1.0"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "30.0"))
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+EXPECTED_OUTPUT_TOKENS = 1024  # Reserved per call until the real usage is known
+IMAGE_TOKEN_ESTIMATE = 1600  # Roughly one provider-sized screenshot tile
+LATENCY_SAMPLES = 200
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+RETRYABLE_ERROR_NAMES = {"RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError", "OverloadedError"}
+
+
+def get_rate_limits(provider: str) -> Tuple[int, int]:
+    """
+    Requests and tokens per minute for a provider's models, from LLM_RPM_<PROVIDER>
+    and LLM_TPM_<PROVIDER>, or the provider's default tier.
+    """
+    requests = int(os.getenv(f"LLM_RPM_{provider.upper()}", str(DEFAULT_REQUESTS_PER_MINUTE.get(provider, 60))))
+    tokens = int(os.getenv(f"LLM_TPM_{provider.upper()}", str(DEFAULT_TOKENS_PER_MINUTE.get(provider, 100000))))
+    return requests, tokens
+
+
+def estimate_input_tokens(stage_input) -> int:
+    """
+    Rough prompt size: characters/4 for text, a fixed estimate per image block.
+    """
+    if isinstance(stage_input, dict):
+        return sum(len(str(value)) for value in stage_input.values()) // 4
+    tokens = 0
+    for message in stage_input if isinstance(stage_input, list) else [stage_input]:
+        content = getattr(message, "content", message)
+        if isinstance(content, str):
+            tokens += len(content) // 4
+            continue
+        for part in content:
+            if isinstance(part, dict) and part.get("type") in ("image", "image_url"):
+                tokens += IMAGE_TOKEN_ESTIMATE
+            elif isinstance(part, dict):
+                tokens += len(part.get("text", "")) // 4
+    return tokens
+
+
+class TokenBucket:
+    """
+    Continuously refilling bucket holding up to `per_minute` units.
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+
+class RateBudget:
+    """
+    Request and token budgets for one (provider, model). Callers are admitted in order.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.lock = asyncio.Lock()
+        self.paused_until = 0.0
+        self.waited_seconds = 0.0
+
+    async def acquire(self, tokens: int):
+        async with self.lock:
+            while True:
+                delay = max(
+                    self.paused_until - time.monotonic(),
+                    self.requests.wait_time(1),
+                    self.tokens.wait_time(tokens),
+                )
+                if delay <= 0:
+                    break
+                self.waited_seconds += delay
+                await asyncio.sleep(delay)
+            self.requests.take(1)
+            self.tokens.take(tokens)
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int):
+        # Correct the reservation once the provider reports the real usage.
+        self.tokens.take(actual_tokens - estimated_tokens)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class ScheduledModel:
+    """
+    A chat model with its own rate budget and first-token latency history. The client
+    is created by `create_llm` on first use (see `resolve`), off the event loop.
+    """
+
+    def __init__(self, provider: str, model: str, create_llm: Callable[[], object]):
+        self.provider = provider
+        self.model = model
+        self.create_llm = create_llm
+        self._llm = None
+        self._resolving: Optional[asyncio.Lock] = None
+        self.budget = RateBudget(*get_rate_limits(provider))
+        self.latencies: Dict[str, Deque[float]] = {}
+        self.stats = {"calls": 0, "retries": 0, "errors": 0, "hedges_won": 0}
+
+    @property
+    def name(self) -> str:
+        return f"{self.provider}:{self.model}"
+
+    @property
+    def llm(self):
+        if self._llm is None:
+            self._llm = self.create_llm()
+        return self._llm
+
+    async def resolve(self):
+        """
+        Creates the client (importing the provider SDK) in a worker thread, once.
+        """
+        if self._llm is not None:
+            return
+        if self._resolving is None:
+            self._resolving = asyncio.Lock()
+        async with self._resolving:
+            if self._llm is None:
+                self._llm = await asyncio.to_thread(self.create_llm)
+
+    def record_latency(self, stage: str, seconds: float):
+        self.latencies.setdefault(stage, deque(maxlen=LATENCY_SAMPLES)).append(seconds)
+
+    def latency_percentile(self, stage: str, fraction: float) -> Optional[float]:
+        samples = self.latencies.get(stage)
+        if not samples or len(samples) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class AttemptError(Exception):
+    """
+    A failed attempt to start a stream, with the model it failed on (the primary or
+    the hedge's fallback), so errors, retries and 429 pauses go to that model.
+    """
+
+    def __init__(self, target: ScheduledModel, error: Exception):
+        super().__init__(f"{target.name}: {error}")
+        self.target = target
+        self.error = error
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    return getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+
+
+def retry_delay(error: Exception, attempt: int) -> Optional[float]:
+    """
+    Backoff before retrying `error` (full jitter, at least Retry-After), or None if it is not retryable.
+    """
+    status = _status_code(error)
+    if status not in RETRYABLE_STATUS_CODES and type(error).__name__ not in RETRYABLE_ERROR_NAMES and not isinstance(error, asyncio.TimeoutError):
+        return None
+    retry_after = 0.0
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        retry_after = float(headers.get("retry-after", 0))
+    except (TypeError, ValueError):
+        pass
+    return max(retry_after, random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** attempt)))
+
+
+async def _prepend(first, iterator: AsyncIterator) -> AsyncIterator:
+    yield first
+    async for item in iterator:
+        yield item
+
+
+# Builds (runnable, input) for a stage on a given model, so prompts and message
+# formats can follow the provider that actually serves the call.
+StageBuilder = Callable[[ScheduledModel], tuple]
+
+
+class LLMScheduler:
+    """
+    Runs streamed LLM calls against a primary model under its rate budget, with
+    retries and optional hedging to a fallback model.
+    """
+
+    def __init__(self, primary: ScheduledModel, fallback: Optional[ScheduledModel] = None):
+        self.primary = primary
+        self.fallback = fallback
+
+    async def _open(self, target: ScheduledModel, build: StageBuilder, stage: str, estimated_tokens: int) -> tuple:
+        """
+        Waits for budget, starts the stream and returns (target, iterator, first chunk or None).
+        Failures are raised as AttemptError.
+        """
+        try:
+            await target.resolve()
+            await target.budget.acquire(estimated_tokens)
+            target.stats["calls"] += 1
+            started = time.monotonic()
+            runnable, stage_input = build(target)
+            iterator = runnable.astream(stage_input).__aiter__()
+            try:
+                first = await iterator.__anext__()
+            except StopAsyncIteration:
+                first = None
+        except Exception as e:
+            raise AttemptError(target, e) from e
+        target.record_latency(stage, time.monotonic() - started)
+        return target, iterator, first
+
+    @staticmethod
+    def _count_errors(failures: list):
+        """
+        Counts failed attempts that were not retried (the other hedged call answered),
+        pausing a rate-limited model's budget like a retried 429 would.
+        """
+        for failure in failures:
+            failure.target.stats["errors"] += 1
+            record_llm_call(failure.target.provider, failure.target.model, "error")
+            if _status_code(failure.error) == 429:
+                failure.target.budget.pause(retry_delay(failure.error, 0))
+
+    async def _open_hedged(self, build: StageBuilder, stage: str, estimated_tokens: int) -> tuple:
+        primary = asyncio.create_task(self._open(self.primary, build, stage, estimated_tokens))
+        threshold = self.primary.latency_percentile(stage, LLM_HEDGE_PERCENTILE) if LLM_HEDGE_ENABLED and self.fallback else None
+        if threshold is None:
+            return await primary
+
+        done, _ = await asyncio.wait({primary}, timeout=threshold)
+        if done:
+            return primary.result()
+        print(f"LLM_SCHEDULER: {stage} on {self.primary.name} passed p{int(LLM_HEDGE_PERCENTILE * 100)} ({threshold:.1f}s), hedging to {self.fallback.name}.")
+        hedge = asyncio.create_task(self._open(self.fallback, build, stage, estimated_tokens))
+        pending = {primary, hedge}
+        failures = []
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    # The other call failed first but this one made up for it.
+                    self._count_errors(failures)
+                    winner = task.result()
+                    if task is hedge:
+                        self.fallback.stats["hedges_won"] += 1
+                        record_llm_call(self.fallback.provider, self.fallback.model, "hedge_won")
+                    return winner
+                failures.append(task.exception())
+        # Both failed: the last failure is handled (and counted) by the caller.
+        self._count_errors(failures[:-1])
+        raise failures[-1]
+
+    async def astream(self, build: StageBuilder, stage: str) -> AsyncIterator:
+        """
+        Streams the stage's output chunks. Failures before the first chunk are retried
+        with backoff; once output has been yielded an error is raised to the caller.
+        """
+        await self.primary.resolve()
+        estimated_tokens = estimate_input_tokens(build(self.primary)[1]) + EXPECTED_OUTPUT_TOKENS
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            try:
+                target, iterator, first = await self._open_hedged(build, stage, estimated_tokens)
+            except AttemptError as failure:
+                failed, e = failure.target, failure.error
+                delay = retry_delay(e, attempt)
+                failed.stats["errors"] += 1
+                if delay is None or attempt == LLM_MAX_RETRIES:
+                    record_llm_call(failed.provider, failed.model, "error")
+                    raise e
+                failed.stats["retries"] += 1
+                record_llm_call(failed.provider, failed.model, "retry")
+                if _status_code(e) == 429:
+                    # The provider's own limit is tighter than our budget: hold back every caller of that model.
+                    failed.budget.pause(delay)
+                print(f"LLM_SCHEDULER: {stage} failed on attempt {attempt + 1} on {failed.name} ({type(e).__name__}), retrying in {delay:.1f}s.")
+                await asyncio.sleep(delay)
+                continue
+
+            # Providers report usage in pieces (Anthropic: prompt tokens first, completion tokens last), so it is summed.
+            prompt_tokens = completion_tokens = output_chars = cache_read_tokens = cache_write_tokens = 0
+            if first is not None:
+                async for chunk in _prepend(first, iterator):
+                    usage = getattr(chunk, "usage_metadata", None) or {}
+                    prompt_tokens += usage.get("input_tokens", 0)
+                    completion_tokens += usage.get("output_tokens", 0)
+                    cache_details = usage.get("input_token_details") or {}
+                    cache_read_tokens += cache_details.get("cache_read") or 0
+                    cache_write_tokens += cache_details.get("cache_creation") or 0
+                    content = getattr(chunk, "content", "")
+                    output_chars += len(content) if isinstance(content, str) else 0
+                    yield chunk
+            if not prompt_tokens and not completion_tokens:
+                prompt_tokens, completion_tokens = estimated_tokens - EXPECTED_OUTPUT_TOKENS, output_chars // 4
+            target.budget.record_usage(estimated_tokens, prompt_tokens + completion_tokens)
+            record_llm_call(target.provider, target.model, "ok")
+            record_llm_usage(target.provider, target.model, stage, prompt_tokens, completion_tokens, cache_read_tokens, cache_write_tokens)
+            return
+
+    async def warm_up(self):
+        """
+        Creates the clients of both models ahead of the first request. A model that
+        cannot be created is reported and left to fail (and be retried) on first use.
+        """
+        for target in [self.primary] + ([self.fallback] if self.fallback else []):
+            try:
+                await target.resolve()
+                print(f"LLM_SCHEDULER: {target.name} client ready.")
+            except Exception as e:
+                print(f"LLM_SCHEDULER_ERROR: Could not create the {target.name} client: {e}")
+
+    def get_stats(self) -> dict:
+        models = [self.primary] + ([self.fallback] if self.fallback else [])
+        return {
+            "hedging_enabled": LLM_HEDGE_ENABLED and self.fallback is not None,
+            "models": [
+                {
+                    "model": target.name,
+                    "client_loaded": target._llm is not None,
+                    **target.stats,
+                    "budget_wait_seconds": round(target.budget.waited_seconds, 2),
+                    "first_token_p50": {stage: round(sorted(samples)[len(samples) // 2], 3) for stage, samples in target.latencies.items() if samples},
+                }
+                for target in models
+            ],
+        }
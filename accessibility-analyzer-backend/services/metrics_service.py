@@ -0,0 +1,250 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import bisect
+import json
+import os
+import time
+
+# Instrumentation for the analysis pipeline: spans around every stage (duration, input/
+# output bytes, LLM tokens and estimated cost) feed Prometheus-style counters and
+# histograms served on /metrics, and the spans of one analysis are collected into the
+# timing breakdown attached to its report. The current analysis and stage are tracked
+# in context variables, so spans opened in concurrent tasks and worker threads end up
+# in the right analysis without passing anything around.
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BYTES_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 ** 2, 10 * 1024 ** 2, 100 * 1024 ** 2)
+
+# USD per million (prompt, completion) tokens, matched by the longest model-name prefix.
+# Extend or override with LLM_PRICES='{"model-prefix": [prompt, completion]}'.
+MODEL_PRICES = {
+    "claude-3-5-sonnet": (3.0, 15.0),
+    "claude-3-7-sonnet": (3.0, 15.0),
+    "claude-sonnet-4": (3.0, 15.0),
+    "claude-3-5-haiku": (0.8, 4.0),
+    "claude-3-haiku": (0.25, 1.25),
+    "claude-3-opus": (15.0, 75.0),
+    "gpt-4o-mini": (0.15, 0.6),
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4.1-mini": (0.4, 1.6),
+    "gpt-4.1": (2.0, 8.0),
+    "fake": (0.0, 0.0),
+}
+MODEL_PRICES.update({prefix: tuple(prices) for prefix, prices in json.loads(os.getenv("LLM_PRICES", "{}")).items()})
+# Price of cached prompt tokens relative to the prompt price: (cache reads, cache writes).
+CACHE_PRICE_FACTORS = {"anthropic": (0.1, 1.25), "openai": (0.5, 1.0)}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{_format_labels(key)} {value:g}" for key, value in self.values.items())
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...]):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self.values: Dict[LabelKey, list] = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        series = self.values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', f'{bound:g}'))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]:g}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+
+STAGE_DURATION = Histogram("analyzer_stage_duration_seconds", "Duration of each pipeline stage.", DURATION_BUCKETS)
+STAGE_BYTES = Histogram("analyzer_stage_bytes", "Input and output size of each pipeline stage.", BYTES_BUCKETS)
+STAGE_ERRORS = Counter("analyzer_stage_errors_total", "Pipeline stages that raised an exception.")
+ANALYSIS_DURATION = Histogram("analyzer_analysis_duration_seconds", "End-to-end duration of an analysis, by outcome.", DURATION_BUCKETS)
+ANALYSES = Counter("analyzer_analyses_total", "Finished analyses by outcome (computed, report_cache_hit, carried_over, offline, error).")
+LLM_TOKENS = Counter("analyzer_llm_tokens_total", "LLM tokens by provider, model, stage and kind (prompt, completion; cache_read and cache_write are the cached part of prompt).")
+LLM_COST = Counter("analyzer_llm_cost_usd_total", "Estimated LLM cost in USD by provider and model.")
+LLM_CALLS = Counter("analyzer_llm_calls_total", "LLM calls by provider, model and outcome (ok, retry, error, hedge_won).")
+
+_metrics = [STAGE_DURATION, STAGE_BYTES, STAGE_ERRORS, ANALYSIS_DURATION, ANALYSES, LLM_TOKENS, LLM_COST, LLM_CALLS]
+# Callables returning (name, type, help, [(labels, value), ...]) for state kept elsewhere (cache counters etc.)
+_collectors: List[Callable[[], List[tuple]]] = []
+
+
+def register_collector(collector: Callable[[], List[tuple]]):
+    _collectors.append(collector)
+
+
+def render_metrics() -> str:
+    """
+    All metrics in the Prometheus text exposition format.
+    """
+    lines: List[str] = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        for name, kind, help_text, samples in collector():
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"])
+            lines.extend(f"{name}{_format_labels(_label_key(labels))} {value:g}" for labels, value in samples)
+    return "\n".join(lines) + "\n"
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, cache_read_tokens: int = 0, cache_write_tokens: int = 0, provider: str = "") -> float:
+    """
+    Estimated USD cost of a call. `prompt_tokens` include the cached ones, which are
+    priced by the provider's CACHE_PRICE_FACTORS.
+    """
+    prefix = max((prefix for prefix in MODEL_PRICES if model.startswith(prefix)), key=len, default=None)
+    if prefix is None:
+        return 0.0
+    prompt_price, completion_price = MODEL_PRICES[prefix]
+    read_factor, write_factor = CACHE_PRICE_FACTORS.get(provider, (1.0, 1.0))
+    uncached_tokens = max(prompt_tokens - cache_read_tokens - cache_write_tokens, 0)
+    prompt_cost = (uncached_tokens + cache_read_tokens * read_factor + cache_write_tokens * write_factor) * prompt_price
+    return (prompt_cost + completion_tokens * completion_price) / 1_000_000
+
+
+class Trace:
+    """
+    The spans and LLM usage of one analysis.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: List[dict] = []
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = 0.0
+
+    def summary(self, outcome: str) -> dict:
+        """
+        Timing breakdown for the report: every finished span in start order, plus totals.
+        """
+        return {
+            "outcome": outcome,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "stages": sorted(self.spans, key=lambda span: span["start_ms"]),
+            "prompt_tokens": self.prompt_tokens,
+            "cached_prompt_tokens": self.cached_prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "estimated_cost_usd": round(self.cost_usd, 6),
+        }
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("analysis_trace", default=None)
+_current_span: ContextVar[Optional[dict]] = ContextVar("analysis_span", default=None)
+
+
+def start_trace() -> Trace:
+    """
+    Starts collecting spans for the analysis running in the current task (and the tasks it starts).
+    """
+    trace = Trace()
+    _current_trace.set(trace)
+    return trace
+
+
+def finish_trace(trace: Trace, outcome: str):
+    ANALYSES.inc(outcome=outcome)
+    ANALYSIS_DURATION.observe(time.perf_counter() - trace.started, outcome=outcome)
+
+
+@contextmanager
+def span(stage: str, detail: Optional[str] = None, bytes_in: Optional[int] = None) -> Iterator[dict]:
+    """
+    Times a pipeline stage. The yielded dict can be given `bytes_out` (and `bytes_in`,
+    `detail`) while the stage runs; LLM usage recorded inside the span is added to it.
+    """
+    record = {"stage": stage, "detail": detail, "bytes_in": bytes_in, "bytes_out": None}
+    token = _current_span.set(record)
+    started = time.perf_counter()
+    try:
+        yield record
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        record["error"] = True
+        raise
+    finally:
+        _current_span.reset(token)
+        elapsed = time.perf_counter() - started
+        STAGE_DURATION.observe(elapsed, stage=stage)
+        for direction in ("in", "out"):
+            if record[f"bytes_{direction}"] is not None:
+                STAGE_BYTES.observe(record[f"bytes_{direction}"], stage=stage, direction=direction)
+        trace = _current_trace.get()
+        if trace is not None:
+            record["start_ms"] = round((started - trace.started) * 1000, 1)
+            record["duration_ms"] = round(elapsed * 1000, 1)
+            trace.spans.append({key: value for key, value in record.items() if value is not None})
+
+
+def record_llm_call(provider: str, model: str, outcome: str):
+    LLM_CALLS.inc(provider=provider, model=model, outcome=outcome)
+
+
+def record_llm_usage(provider: str, model: str, stage: str, prompt_tokens: int, completion_tokens: int, cache_read_tokens: int = 0, cache_write_tokens: int = 0):
+    """
+    Counts the tokens and estimated cost of one LLM call, on the metrics and on the
+    current span and analysis. Cache reads and writes are part of `prompt_tokens`.
+    """
+    cost = estimate_cost(model, prompt_tokens, completion_tokens, cache_read_tokens, cache_write_tokens, provider)
+    LLM_TOKENS.inc(prompt_tokens, provider=provider, model=model, stage=stage, kind="prompt")
+    LLM_TOKENS.inc(completion_tokens, provider=provider, model=model, stage=stage, kind="completion")
+    if cache_read_tokens:
+        LLM_TOKENS.inc(cache_read_tokens, provider=provider, model=model, stage=stage, kind="cache_read")
+    if cache_write_tokens:
+        LLM_TOKENS.inc(cache_write_tokens, provider=provider, model=model, stage=stage, kind="cache_write")
+    LLM_COST.inc(cost, provider=provider, model=model)
+    current = _current_span.get()
+    if current is not None:
+        current["model"] = f"{provider}:{model}"
+        current["prompt_tokens"] = current.get("prompt_tokens", 0) + prompt_tokens
+        if cache_read_tokens:
+            current["cached_prompt_tokens"] = current.get("cached_prompt_tokens", 0) + cache_read_tokens
+        current["completion_tokens"] = current.get("completion_tokens", 0) + completion_tokens
+        current["cost_usd"] = round(current.get("cost_usd", 0.0) + cost, 6)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.prompt_tokens += prompt_tokens
+        trace.cached_prompt_tokens += cache_read_tokens
+        trace.completion_tokens += completion_tokens
+        trace.cost_usd += cost
@@ -0,0 +1,101 @@
+from contextvars import ContextVar
+from typing import List, Optional, Set, Tuple
+from services.feedback_merge_service import parse_feedback_issues, NO_ISSUES_PATTERN
+from services.html_rules_service import GUIDELINES
+import os
+import re
+
+# Tiered model cascade. The HTML stage first runs on a small, fast model (triage); its
+# output is kept unless it states low confidence or contradicts the rule engine (it
+# says "no issues" for a guideline the parser found violations of), in which case the
+# section is analyzed again on the large model. The report stage, which turns already
+# structured findings into scores, runs on the small model; the visual stage always
+# runs on the large (vision) model. Which model produced each part of a report is
+# recorded with it. Stage-to-tier mapping and models are configured in langchain_service.
+
+# Stated confidence levels that send an HTML section to the large model
+LLM_ESCALATE_CONFIDENCE = {level.strip().lower() for level in os.getenv("LLM_ESCALATE_CONFIDENCE", "low").split(",") if level.strip()}
+
+_CONFIDENCE_LINE = re.compile(r"^[ \t>*_-]*(?:\*\*)?Confidence:?(?:\*\*)?:?\s*\**\s*(high|medium|low)\b.*$", re.IGNORECASE | re.MULTILINE)
+# Text between a guideline's name and a "no issues" statement that still counts as about that guideline
+_NO_ISSUES_WINDOW = 200
+_SNIPPET_PREFIX_CHARS = 60
+
+_model_parts: ContextVar[Optional[List[dict]]] = ContextVar("model_parts", default=None)
+
+
+def split_confidence(feedback: str) -> Tuple[str, Optional[str]]:
+    """
+    Removes the "Confidence: high|medium|low" line the HTML prompt asks for and returns
+    (feedback without it, the stated level or None).
+    """
+    matches = list(_CONFIDENCE_LINE.finditer(feedback or ""))
+    if not matches:
+        return feedback, None
+    return _CONFIDENCE_LINE.sub("", feedback).strip(), matches[-1].group(1).lower()
+
+
+def section_rule_guidelines(rule_results: dict, section_html: Optional[str] = None) -> Set[str]:
+    """
+    Guidelines the rule engine found violations of, on the whole page or, with
+    `section_html`, only for elements whose snippet appears in that section.
+    """
+    guidelines = set()
+    for finding in rule_results.get("findings") or []:
+        snippet = (finding.get("snippet") or "").rstrip(".")[:_SNIPPET_PREFIX_CHARS]
+        if section_html is None or (snippet and snippet in section_html):
+            guidelines.add(finding["guideline"])
+    return guidelines
+
+
+def _states_no_issues(feedback: str, guideline: str) -> bool:
+    lowered = feedback.lower()
+    start = lowered.find(guideline.lower())
+    while start >= 0:
+        window = lowered[start:start + len(guideline) + _NO_ISSUES_WINDOW]
+        following = [lowered.find(other.lower(), start + len(guideline)) for other in GUIDELINES if other != guideline]
+        following = [position for position in following if position >= 0]
+        if following:
+            window = window[:min(following) - start]
+        if NO_ISSUES_PATTERN.search(window):
+            return True
+        start = lowered.find(guideline.lower(), start + 1)
+    return False
+
+
+def escalation_reason(feedback: str, confidence: Optional[str], rule_guidelines: Set[str]) -> Optional[str]:
+    """
+    Why triage output should be redone on the large model, or None to keep it.
+    """
+    if confidence is None:
+        return "no confidence stated"
+    if confidence in LLM_ESCALATE_CONFIDENCE:
+        return f"{confidence} confidence"
+    reported = " ".join(issue["guideline"].lower() for issue in parse_feedback_issues(feedback))
+    conflicts = [
+        guideline for guideline in GUIDELINES
+        if guideline in rule_guidelines and guideline.lower() not in reported and _states_no_issues(feedback, guideline)
+    ]
+    if conflicts:
+        return f"contradicts rule findings ({', '.join(conflicts)})"
+    return None
+
+
+def collect_model_parts() -> List[dict]:
+    """
+    Starts recording model attributions for the analysis running in the current task
+    (and the tasks it starts). Returns the list they are appended to.
+    """
+    parts: List[dict] = []
+    _model_parts.set(parts)
+    return parts
+
+
+def record_model_part(part: str, model: Optional[str], detail: Optional[str] = None, **attribution):
+    """
+    Records that `model` ("provider:model", None for output carried over from a previous
+    run) produced `part` of the current analysis's report. See ModelAttribution.
+    """
+    parts = _model_parts.get()
+    if parts is not None:
+        parts.append({"part": part, "model": model, "detail": detail, **{key: value for key, value in attribution.items() if value is not None}})
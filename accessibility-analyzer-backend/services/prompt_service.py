@@ -0,0 +1,431 @@
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from typing import List, Optional
+from dotenv import load_dotenv
+from models.analysis import AnalysisReport
+from services.report_parser_service import REPORT_CATEGORIES
+from services.html_condenser_service import estimate_tokens
+import hashlib
+import json
+import os
+
+load_dotenv()
+
+# Versioned prompt templates for the three LLM stages. Each prompt is split into its
+# static instructions, sent first as the system message and identical on every call,
+# and the small per-page input that follows. Providers cache a repeated prompt prefix:
+# Anthropic when the prefix ends in a `cache_control` marker (which is added here),
+# OpenAI automatically for any prefix of 1024+ tokens. Either way the instructions are
+# processed once per cache lifetime instead of on every call, which lowers input cost
+# and time to first token. Prefixes under the serving model's minimum are not cached at
+# all (CACHE_MIN_PREFIX_TOKENS: 2048 tokens for the Claude Haiku models the cascade runs
+# HTML triage and the report on, 1024 for the other Claude and the OpenAI models), so
+# each set of instructions is sized to clear the minimum of every model that serves
+# its stages by default; the report stage's tool definition is part of its cached
+# prefix. Bump a template's version whenever its text changes.
+
+PROMPT_CACHE = os.getenv("PROMPT_CACHE", "true").lower() == "true"
+# Providers that cache a prefix only when it is marked (the fake model simulates this)
+CACHE_MARKER_PROVIDERS = {"anthropic", "fake"}
+CACHE_CONTROL = {"type": "ephemeral"}
+# Shortest prefix (tokens) a model caches, by model name prefix; DEFAULT_CACHE_MIN_PREFIX_TOKENS otherwise
+CACHE_MIN_PREFIX_TOKENS = {"claude-3-5-haiku": 2048, "claude-3-haiku": 2048}
+DEFAULT_CACHE_MIN_PREFIX_TOKENS = 1024
+
+# The report stage answers by calling a tool whose parameters are the report schema,
+# instead of writing JSON as free text. Set to false for models without tool calling.
+REPORT_STRUCTURED_OUTPUT = os.getenv("REPORT_STRUCTURED_OUTPUT", "true").lower() == "true"
+REPORT_TOOL_NAME = "submit_accessibility_report"
+
+
+class StagePrompt:
+    """
+    One stage's prompt: static `instructions` and an `input_template` (str.format
+    placeholders) for the per-call part.
+    """
+
+    def __init__(self, name: str, version: str, instructions: str, input_template: str):
+        self.name = name
+        self.version = version
+        self.instructions = instructions
+        self.input_template = input_template
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}@{self.version}"
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Hash of the static prefix, to check that it stays byte-identical between calls.
+        """
+        return hashlib.sha256(self.instructions.encode("utf-8")).hexdigest()[:12]
+
+    def system_message(self, provider: str) -> SystemMessage:
+        """
+        The static instructions, with a cache marker for providers that need one.
+        """
+        if PROMPT_CACHE and provider in CACHE_MARKER_PROVIDERS:
+            return SystemMessage(content=[{"type": "text", "text": self.instructions, "cache_control": CACHE_CONTROL}])
+        return SystemMessage(content=self.instructions)
+
+    def messages(self, provider: str, image: Optional[dict] = None, **inputs) -> List[BaseMessage]:
+        """
+        The chat messages for one call: the cached system prefix, then the filled-in
+        input (followed by `image`, a content block, if given).
+        """
+        text = self.input_template.format(**inputs).strip()
+        content = [{"type": "text", "text": text}, image] if image is not None else text
+        return [self.system_message(provider), HumanMessage(content=content)]
+
+
+HTML_PROMPT = StagePrompt("html", "5", """**Your Role:** You are an expert Web Accessibility Specialist. Your task is to conduct a thorough analysis of the provided HTML code based on the core principles of the Web Content Accessibility Guidelines (WCAG).
+
+**Your Goal:** Identify accessibility violations and provide clear, actionable feedback with code examples to help a developer fix the issues.
+
+**Analyze the following HTML content based on these 6 critical accessibility guidelines:**
+
+**1. Semantic HTML Structure:**
+- **Description:** A well-structured document uses semantic HTML tags to define roles for different parts of the page. This is crucial for screen reader navigation.
+- **Analysis Criteria:**
+    - Does the page use landmark tags like `<header>`, `<nav>`, `<main>`, `<footer>`, and `<aside>` correctly?
+    - Is content structured into logical sections using `<section>` or `<article>` tags?
+    - Is the main content of the page enclosed within a `<main>` tag?
+
+**2. Image Accessibility (Alternative Text):**
+- **Description:** All informative images must have descriptive alternative (alt) text. Decorative images should have an empty alt attribute (`alt=""`). This ensures that users of screen readers can understand the content and purpose of images.
+- **Analysis Criteria:**
+    - Do all `<img>` tags have an `alt` attribute?
+    - For `<img>` tags with `alt` attributes, is the text descriptive and meaningful, or is it a non-helpful placeholder like "image" or a filename?
+    - Are purely decorative images correctly marked with `alt=""`?
+
+**3. Heading Hierarchy:**
+- **Description:** Headings must be structured in a logical, hierarchical order (`<h1>` followed by `<h2>`, `<h2>` by `<h3>`, etc.) without skipping levels. This is one of the primary ways screen reader users navigate a page.
+- **Analysis Criteria:**
+    - Is there only one `<h1>` per page?
+    - Do the heading levels follow a logical order (e.g., no `<h4>` directly after an `<h2>`)?
+    - Are headings used to create an outline of the page content, or are they used just for styling text?
+
+**4. Form Labeling and Accessibility:**
+- **Description:** Every form control (`<input>`, `<textarea>`, `<select>`) needs a programmatically associated `<label>`. This allows screen reader users to know what information each field is asking for.
+- **Analysis Criteria:**
+    - Does every `<input>`, `<textarea>`, and `<select>` element have an associated `<label>`?
+    - Is the `for` attribute of the `<label>` correctly matched with the `id` of the corresponding form element?
+    - Do related form elements (like a group of checkboxes or radio buttons) get grouped using `<fieldset>` and described with a `<legend>`?
+
+**5. Link Text Clarity:**
+- **Description:** The purpose of every link should be clear from its text alone. Using generic, non-descriptive phrases like "Click Here," "Read More," or "Learn More" is a common accessibility failure.
+- **Analysis Criteria:**
+    - Identify links with ambiguous text (e.g., "click here," "more," "link").
+    - Does the link text accurately describe the destination or action? For example, instead of "Click here to download the report," the link text should be "Download the 2024 Accessibility Report."
+
+**6. Language Specification:**
+- **Description:** The primary language of the page must be declared in the `<html>` tag using the `lang` attribute. This allows screen readers to switch to the correct language profile to pronounce the content correctly.
+- **Analysis Criteria:**
+    - Does the `<html>` tag have a `lang` attribute (e.g., `<html lang="en">`)?
+    - Is the value of the `lang` attribute a valid IETF language tag (e.g., "en", "es", "fr-CA")?
+
+---
+
+**WCAG Success Criteria per Guideline (cite them in the Issue Description):**
+- Semantic HTML Structure: 1.3.1 Info and Relationships, 2.4.1 Bypass Blocks.
+- Image Accessibility: 1.1.1 Non-text Content.
+- Heading Hierarchy: 1.3.1 Info and Relationships, 2.4.6 Headings and Labels.
+- Form Labeling and Accessibility: 1.3.1 Info and Relationships, 3.3.2 Labels or Instructions, 4.1.2 Name, Role, Value.
+- Link Text Clarity: 2.4.4 Link Purpose (In Context).
+- Language Specification: 3.1.1 Language of Page, 3.1.2 Language of Parts.
+
+**Severity Levels:**
+- **Critical:** Blocks a task for some users entirely, e.g. an unlabeled login field, or an image-only link or button without any text alternative.
+- **High:** Makes a key part of the page hard to use or understand, e.g. a long page without a `<main>` landmark, informative images without `alt`, or several skipped heading levels.
+- **Medium:** Causes friction but has a workaround, e.g. a single skipped heading level, vague alt text on secondary images, or repeated "Read more" links inside clearly separated cards.
+- **Low:** Best-practice improvements, e.g. redundant `title` attributes or landmark roles repeated on native elements (`<nav role="navigation">`).
+
+**Avoid False Positives:**
+- A form control is labeled if it has an associated `<label>` (by `for`/`id` or by wrapping it), an `aria-label`, or an `aria-labelledby` that points to existing text. Inputs of type `hidden`, `submit`, `reset` and `button` need no `<label>`; buttons take their name from their content or `value`.
+- `alt=""` is correct for decorative images, and images with `role="presentation"` or `aria-hidden="true"` are hidden on purpose. Only ask for alt text on them when the surrounding markup shows that they carry information.
+- A link's accessible name also comes from `aria-label`, `aria-labelledby`, visually hidden text (such as a `.sr-only` span) or the `alt` of an image inside it. Judge the accessible name, not only the visible text.
+- Elements with the landmark roles `main`, `navigation`, `banner` and `contentinfo` are equivalent to the native `<main>`, `<nav>`, `<header>` and `<footer>` elements.
+- The HTML may have been condensed before you see it: long runs of similar elements are sampled, long text is shortened, and comments mark what was cut out. Do not report the condensation itself, missing CSS or scripts, or shortened text as accessibility issues.
+- Several `<h1>` elements are a Low-severity best-practice issue unless they make the page outline misleading.
+- Content inside `<template>` or `<noscript>`, or in elements with the `hidden` attribute, is not shown to most users. Do not report issues in it unless the markup shows that it is displayed.
+- Only report an issue when the code shown supports it. If a guideline cannot be judged from the HTML provided, say so instead of guessing, and lower your stated confidence.
+
+**Example of one issue in the expected format:**
+- **Guideline Violated:** Form Labeling and Accessibility
+- **Severity:** Critical
+- **Issue Description:** The e-mail field of the newsletter form has only a placeholder and no label, so screen readers announce it as an unnamed edit field (WCAG 3.3.2, 4.1.2). The placeholder also disappears as soon as the user starts typing.
+- **Code Snippet:** `<input type="email" name="email" placeholder="Your e-mail">`
+- **Recommendation:** Add a visible label and associate it with the field: `<label for="newsletter-email">E-mail address</label><input type="email" id="newsletter-email" name="email">`.
+
+---
+
+**Output Format:**
+For each guideline where you find an issue, provide the following:
+- **Guideline Violated:** The name of the guideline (e.g., "Image Accessibility").
+- **Severity:** (Critical, High, Medium, Low).
+- **Issue Description:** A clear explanation of *why* it's an issue.
+- **Code Snippet:** The exact line(s) of HTML causing the issue.
+- **Recommendation:** A specific, actionable suggestion for how to fix the code.
+
+If no issues are found for a guideline, simply state: "No issues found."
+
+Finally, end your answer with a single line `Confidence: high`, `Confidence: medium` or `Confidence: low`: how sure you are that the analysis is complete and correct. Say low when the HTML is ambiguous (for example mostly scripts or templating placeholders) or a guideline could not be judged from it.
+
+---
+
+**Pre-computed Rule Findings:**
+An HTML parser has already run exact checks for missing `lang`, images without `alt`, heading level skips and multiple `<h1>`, form controls without labels, generic or empty link text, and missing `<main>`/`<nav>` landmarks. These findings are authoritative: do not search for or re-list these issues one by one. Summarize them per guideline and spend your analysis on what a parser cannot judge (quality of alt text, whether headings describe the content, `<fieldset>`/`<legend>` grouping, meaning of link text in context, correct use of landmarks and ARIA roles).""", """**Rule findings for this page:**
+```
+{rule_findings}
+```
+
+Begin your analysis now on the HTML content provided below:
+
+```html
+{html_content}
+```""")
+
+SCREENSHOT_PROMPT = StagePrompt("screenshot", "4", """**Your Role:** You are an expert UI/UX Accessibility Analyst. Your task is to perform a visual accessibility audit of the provided webpage screenshot based on key visual design and accessibility principles from WCAG.
+
+**Your Goal:** Identify visual design choices that negatively impact accessibility for users with visual impairments, motor difficulties, or cognitive disabilities. Provide clear, actionable feedback to help a designer or developer address these issues.
+
+**Analyze the provided screenshot based on these 5 critical visual accessibility guidelines:**
+
+**1. Color Contrast:**
+- **Description:** Text and meaningful graphical elements (like icons or input borders) must have sufficient color contrast against their background to be readable by people with low vision or color blindness. The WCAG AA standard requires a ratio of at least 4.5:1 for normal text and 3:1 for large text.
+- **Analysis Criteria:**
+    - Visually scan the page for text or UI elements that appear to have low contrast. Point out specific examples (e.g., "The light gray text on the white background in the footer appears to have low contrast.").
+    - Check if text placed over images or gradients has a consistent, readable contrast level.
+
+**2. Typography and Readability:**
+- **Description:** Text should be easy to read. This is affected by font size, weight, and spacing.
+- **Analysis Criteria:**
+    - Is the primary body text a reasonable size (typically at least 16px)?
+    - Is there adequate spacing between lines of text (line-height, typically ~1.5) and between paragraphs?
+    - Are font choices clear and legible? Avoid overly decorative or thin fonts for body text.
+
+**3. Interactive Element Clarity & Target Size:**
+- **Description:** Users need to be able to identify interactive elements (like links and buttons) and physically interact with them easily.
+- **Analysis Criteria:**
+    - **Clarity:** Are links and buttons visually distinct from non-interactive text? Do they have clear indicators like underlines or a button shape?
+    - **Target Size:** Are buttons, links, and other interactive controls large enough to be easily tapped or clicked? Small targets can be difficult for users with motor impairments. Identify elements that appear too small or too close together.
+
+**4. Layout and Spacing (White Space):**
+- **Description:** A cluttered layout can be overwhelming and make it difficult to distinguish between different sections of content. Good use of white space improves clarity and focus.
+- **Analysis Criteria:**
+    - Does the layout feel cramped or cluttered?
+    - Is there sufficient spacing between major content blocks, such as the navigation, main content, and footer?
+    - Are interactive elements spaced far enough apart to prevent accidental clicks?
+
+**5. Information Conveyed Solely by Color:**
+- **Description:** Color should not be the *only* method used to convey important information. This is critical for users who are colorblind.
+- **Analysis Criteria:**
+    - Look for instances where information is indicated only by a change in color. For example, is an error message for a form field shown *only* by turning the label red?
+    - A pass/fail status, link states, or selected items should use a secondary indicator, such as an icon, an underline, bold text, or another visual cue in addition to color.
+
+---
+
+**Severity Levels:**
+- **Critical:** Text or controls that some users cannot read or operate at all, e.g. body text barely distinguishable from its background, or a primary button without any visible boundary or label.
+- **High:** A key part of the page that is hard to read or use, e.g. low-contrast navigation links, or small, tightly packed controls in the main content.
+- **Medium:** Friction with a workaround, e.g. low-contrast secondary text, or dense but still readable sections.
+- **Low:** Visual polish that would help some users, e.g. slightly tight line spacing.
+
+**Limits of a Screenshot:**
+- The screenshot is one static frame, and it may be one tile of a taller page. Do not report focus indicators, hover states, animations or keyboard behavior, which cannot be seen in it, and do not treat content cut off at the edges of the image as a layout issue.
+- Do not guess exact pixel sizes or contrast ratios. Describe what you see and where it is. When measured contrast ratios are provided with the screenshot, rely on them instead of visual estimates.
+
+---
+
+**Output Format:**
+For each guideline where you find an issue, provide the following:
+- **Guideline Violated:** The name of the guideline (e.g., "Color Contrast").
+- **Severity:** (Critical, High, Medium, Low).
+- **Issue Description:** A clear explanation of the visual issue and where it appears on the page.
+- **Recommendation:** A specific suggestion for how to fix the visual design (e.g., "Increase the font color contrast to meet the WCAG AA 4.5:1 ratio," or "Add an underline to all inline links to distinguish them from plain text.").
+
+If no issues are found for a guideline, simply state: "No significant issues found.\"""", """{notes}
+
+Begin your analysis now on the screenshot below.""")
+
+REPORT_PROMPT = StagePrompt("report", "4", """**Your Role:** You are a Lead Web Accessibility Consultant. Your task is to synthesize the detailed technical findings from an HTML code analysis and a visual screenshot analysis into a single, client-ready accessibility report.
+
+**Your Goal:** Create a clear, insightful, and actionable report that helps a website owner understand their site's accessibility strengths and weaknesses. The report must include scores for key categories and a prioritized implementation plan.
+
+---
+
+**Your Task (Follow these steps carefully):**
+
+**Step 1: Synthesize Findings**
+Review all three inputs. Map each identified issue (e.g., "Missing alt text," "Low contrast text," "Skipped heading level") to one of the five categories below.
+
+**Step 2: Score Each Category**
+For each category, provide a score from 0 to 100 based on the number and severity of the issues you mapped to it. Use this rubric as a guide:
+- **90-100:** Excellent. No significant issues found, or only minor best-practice suggestions.
+- **70-89:** Good. Some moderate issues were found that should be addressed but don't block core functionality.
+- **50-69:** Fair. Several notable issues exist that can create barriers for some users.
+- **30-49:** Poor. Serious accessibility issues were found that significantly impact usability for people with disabilities.
+- **0-29:** Critical. The site has critical blockers in this category, making key content or functions unusable for some user groups.
+
+**Step 3: Write Category Feedback & Implementation Plan**
+- For each category, write a concise `feedback` summary. Explain the score by highlighting the key issues found (both from the HTML and screenshot analysis).
+- Create a single, prioritized `implementation_plan`. Start with the most critical, highest-impact fixes (from the lowest-scoring categories) and move to minor improvements. Make it a clear, step-by-step guide for a developer.
+
+---
+
+**Categories for Analysis:**
+
+1.  **Structure & Semantics:** How well the HTML is structured for navigation.
+    *(Considers: Heading hierarchy, use of `<main>`, `<nav>`, etc., ARIA roles)*
+2.  **Readability & Visual Clarity:** How easy it is to read and visually parse the content.
+    *(Considers: Font sizes, color contrast, typography, layout, and spacing from the screenshot)*
+3.  **Navigability & Interactivity:** How easy it is for users to navigate and interact with controls.
+    *(Considers: Link text clarity, visual distinction of links/buttons, target sizes)*
+4.  **Forms & Inputs:** The accessibility of all user input fields.
+    *(Considers: Form labels, input grouping (`fieldset`), and visual clarity of form elements)*
+5.  **Media Accessibility:** The accessibility of images, videos, and other media.
+    *(Considers: `alt` text for all images)*
+
+**Mapping Guide (guideline in the inputs -> report category):**
+- Semantic HTML Structure, Heading Hierarchy and Language Specification -> Structure & Semantics.
+- Color Contrast, Typography and Readability, and Layout and Spacing -> Readability & Visual Clarity.
+- Link Text Clarity and Interactive Element Clarity & Target Size -> Navigability & Interactivity.
+- Form Labeling and Accessibility -> Forms & Inputs. Visual issues of form elements (such as low-contrast input borders or tiny checkboxes) count here as well.
+- Image Accessibility -> Media Accessibility.
+- Information Conveyed Solely by Color -> Readability & Visual Clarity, or Forms & Inputs when it concerns form errors or required fields.
+
+**Scoring Consistency:**
+- Start each category at 100 and lower it for every issue according to its severity: roughly 25-40 points for a Critical issue, 10-20 for High, 5-10 for Medium and 0-5 for Low. Repeated instances of one issue lower the score less than the same number of distinct issues.
+- The deterministic rule findings are exact. A category with rule findings should not score 90 or above unless all of them are minor; a category without any can still be lowered by issues from the two analyses.
+- When the inputs disagree (for example, the HTML analysis reports no form issues but the rule findings list unlabeled inputs), trust the rule findings and mention the issue.
+- If an input says a guideline could not be judged, or the screenshot analysis is missing or failed, score the affected categories from the remaining evidence and say in their feedback which evidence was missing. Never invent issues to justify a score.
+- A category with nothing to assess (for example, a page without any forms or media) scores 100, and its feedback says so.
+
+**Writing the Feedback and Plan:**
+- Write for a website owner who is not an accessibility expert. Name the concrete element and where it is on the page ("the search field in the header"), who is affected, and how to fix it, in a sentence or two each.
+- Every category's feedback must mention the most serious issue behind its score. Do not pad it with generic advice.
+- Keep each category's feedback to at most four sentences; the implementation plan carries the details.
+- Refer to WCAG success criteria by number where the inputs name them (for example "WCAG 1.1.1"), so that developers can look them up.
+- Number the plan steps, start each with its priority in bold parentheses as in the example below, and merge repeated instances of one issue into a single step. Keep the plan to at most ten steps, the most critical first.
+- Use the category names exactly as written above: one score object per category, in the order listed.
+
+**Before You Answer, Check That:**
+- All five categories are present exactly once, each with an integer score between 0 and 100.
+- Each score agrees with the rubric and with its own feedback (a category described as having critical blockers does not score 70).
+- Every step of the plan addresses an issue named in some category's feedback, and every Critical or High issue in the feedback has a step in the plan.
+- The answer is the JSON object (or the tool call) and nothing else.
+
+---
+
+**Output Format: CRITICAL**
+The report is a single JSON object with exactly two top-level keys: `scores` and `implementation_plan`. If the `submit_accessibility_report` tool is available, call it with this object as its arguments. Otherwise you MUST output the JSON object and nothing else. Do not wrap it in markdown backticks or any other text.
+
+-   The `scores` key must be a JSON list of objects.
+-   Each object in the `scores` list MUST have exactly three keys: `category` (string), `score` (integer 0-100), and `feedback` (string).
+-   The `implementation_plan` key must be a single string containing the prioritized, step-by-step plan.
+
+**Example of the required final JSON structure:**
+```json
+{
+    "scores": [
+        {
+            "category": "Structure & Semantics",
+            "score": 75,
+            "feedback": "The site uses some semantic tags like `<header>` but is missing a `<main>` landmark, and the heading structure skips from an H2 to an H4. This makes navigation for screen reader users less efficient."
+        },
+        {
+            "category": "Readability & Visual Clarity",
+            "score": 45,
+            "feedback": "Critical issue: The light gray text on a white background in the user testimonial section has a very low contrast ratio, making it unreadable for users with low vision. Body text font size is also small."
+        }
+    ],
+    "implementation_plan": "1. **(Critical) Fix Color Contrast:** Immediately change the light gray text color in the testimonial section to a darker shade, ensuring a contrast ratio of at least 4.5:1.\\n2. **(High) Correct Heading Structure:** Restructure the page headings to follow a logical order without skipping levels.\\n3. **(High) Add a `<main>` Landmark:** Wrap the primary content of the page in a `<main>` tag to improve navigation."
+}
+```
+
+The input data for this report follows.""", """**Input Data:**
+
+**1. HTML Analysis Feedback:**
+```
+{html_feedback}
+```
+
+**2. Screenshot Analysis Feedback:**
+```
+{screenshot_feedback}
+```
+
+**3. Deterministic Rule Findings (exact results from an HTML parser and measurements from the screenshot pixels):**
+```
+{rule_findings}
+```
+
+Write the report now.""")
+
+STAGE_PROMPTS = [HTML_PROMPT, SCREENSHOT_PROMPT, REPORT_PROMPT]
+# The prompt each LLM stage sends (HTML triage runs the HTML prompt on the small model)
+PROMPTS_BY_STAGE = {"html_triage": HTML_PROMPT, "html": HTML_PROMPT, "screenshot": SCREENSHOT_PROMPT, "report": REPORT_PROMPT}
+
+# Part of every report cache key: reports from other prompt versions or output modes are not reused.
+PROMPT_VERSION = ",".join(prompt.key for prompt in STAGE_PROMPTS) + ("+tool" if REPORT_STRUCTURED_OUTPUT else "")
+
+
+def image_block(data: str, media_type: str, provider: str) -> dict:
+    """
+    A base64 image as a content block in the provider's format (Claude-style base64
+    source, or an OpenAI data URL).
+    """
+    if provider == "openai":
+        return {"type": "image_url", "image_url": {"url": f"data:{media_type};base64,{data}"}}
+    return {"type": "image", "source": {"type": "base64", "media_type": media_type, "data": data}}
+
+
+def report_tool() -> dict:
+    """
+    The report tool, in the OpenAI function format both providers accept. Its parameters
+    are the model-written fields of AnalysisReport (`scores`, `implementation_plan`),
+    with the categories and the score range of the rubric as constraints.
+    """
+    schema = AnalysisReport.model_json_schema()
+    score_schema = dict(schema["$defs"]["AccessibilityFeedback"])
+    score_schema["properties"] = {
+        **score_schema["properties"],
+        "category": {**score_schema["properties"]["category"], "enum": REPORT_CATEGORIES},
+        "score": {**score_schema["properties"]["score"], "minimum": 0, "maximum": 100},
+    }
+    return {
+        "type": "function",
+        "function": {
+            "name": REPORT_TOOL_NAME,
+            "description": "Submit the finished accessibility report: one score per category and the prioritized implementation plan.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "scores": {"type": "array", "items": score_schema, "minItems": len(REPORT_CATEGORIES)},
+                    "implementation_plan": schema["properties"]["implementation_plan"],
+                },
+                "required": ["scores", "implementation_plan"],
+            },
+        },
+    }
+
+
+def min_cache_prefix_tokens(model: str) -> int:
+    """
+    The shortest prompt prefix `model` caches, in tokens.
+    """
+    for prefix, tokens in CACHE_MIN_PREFIX_TOKENS.items():
+        if (model or "").startswith(prefix):
+            return tokens
+    return DEFAULT_CACHE_MIN_PREFIX_TOKENS
+
+
+def cached_prefix_tokens(prompt: StagePrompt) -> int:
+    """
+    Estimated size of a prompt's cached prefix: its instructions, plus the report
+    tool's definition when the report stage is bound to it.
+    """
+    tokens = estimate_tokens(prompt.instructions)
+    if prompt is REPORT_PROMPT and REPORT_STRUCTURED_OUTPUT:
+        tokens += estimate_tokens(json.dumps(report_tool()))
+    return tokens
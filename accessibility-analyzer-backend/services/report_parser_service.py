@@ -0,0 +1,272 @@
+from typing import List, Optional, Tuple
+import json
+import re
+
+# Decoding of the report JSON produced by the report stage. The decoder follows the
+# output as it streams (so score categories can be shown early), repairs the common
+# defects of model-written JSON (markdown fences, surrounding prose, trailing commas,
+# output cut off mid-string or mid-object), salvages complete score objects when the
+# document is beyond repair, and reports which fields are still missing so only those
+# have to be requested again.
+
+# The five categories the report prompt asks for, in prompt order.
+REPORT_CATEGORIES = [
+    "Structure & Semantics",
+    "Readability & Visual Clarity",
+    "Navigability & Interactivity",
+    "Forms & Inputs",
+    "Media Accessibility",
+]
+
+IMPLEMENTATION_PLAN = "implementation_plan"
+DEFAULT_FEEDBACK = "No specific feedback provided for this category."
+
+_DANGLING_KEY_PATTERN = re.compile(r'([{,])\s*"(?:[^"\\]|\\.)*"\s*(?::\s*)?$')
+_DANGLING_COMMA_PATTERN = re.compile(r",\s*$")
+_PLAN_PATTERN = re.compile(r'"implementation_plan"\s*:\s*"((?:[^"\\]|\\.)*)', re.DOTALL)
+
+
+class ScoreStreamScanner:
+    """
+    Watches the report JSON as it streams in and returns each object of the `scores`
+    array as soon as it is complete, without waiting for the whole report.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = -1  # Scan position inside the scores array; -1 until it is found
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.object_start = None
+        self.finished = False
+
+    def feed(self, text: str) -> List[dict]:
+        self.buffer += text
+        if self.finished:
+            return []
+        if self.position < 0:
+            key = self.buffer.find('"scores"')
+            bracket = self.buffer.find("[", key) if key >= 0 else -1
+            if bracket < 0:
+                return []
+            self.position = bracket + 1
+
+        scores = []
+        while self.position < len(self.buffer):
+            char = self.buffer[self.position]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                if self.depth == 0:
+                    self.object_start = self.position
+                self.depth += 1
+            elif char == "}":
+                self.depth -= 1
+                if self.depth == 0 and self.object_start is not None:
+                    score = _normalize_score(_loads(repair_json(self.buffer[self.object_start:self.position + 1])))
+                    if score is not None:
+                        scores.append(score)
+                    self.object_start = None
+            elif char == "]" and self.depth == 0:
+                self.finished = True
+                self.position += 1
+                break
+            self.position += 1
+        return scores
+
+
+class ReportDecoder:
+    """
+    Incremental decoder for one streamed report: `feed` returns score categories as
+    they complete, `finish` decodes the whole output (see `decode_report`).
+    """
+
+    def __init__(self):
+        self.scanner = ScoreStreamScanner()
+
+    def feed(self, text: str) -> List[dict]:
+        return self.scanner.feed(text)
+
+    def finish(self) -> Tuple[Optional[dict], List[str]]:
+        return decode_report(self.scanner.buffer)
+
+
+def _loads(text: str):
+    try:
+        return json.loads(text, strict=False)  # strict=False accepts raw newlines inside strings
+    except (json.JSONDecodeError, TypeError):
+        return None
+
+
+def _strip_trailing_comma(out: List[str]):
+    index = len(out) - 1
+    while index >= 0 and out[index].isspace():
+        index -= 1
+    if index >= 0 and out[index] == ",":
+        del out[index]
+
+
+def strip_to_json(raw: str) -> str:
+    """
+    Drops markdown fences and any prose around the outermost JSON object.
+    """
+    text = (raw or "").strip()
+    start = text.find("{")
+    if start < 0:
+        return text
+    text = text[start:]
+    try:
+        _, end = json.JSONDecoder(strict=False).raw_decode(text)
+        return text[:end]
+    except json.JSONDecodeError:
+        # Not valid as-is: keep everything up to the last closing brace, or all of it if cut off.
+        fence = text.rfind("```")
+        return text[:fence].rstrip() if fence > 0 else text
+
+
+def repair_json(text: str) -> str:
+    """
+    Best-effort repair of model-written JSON: removes trailing commas, closes an
+    unterminated string, drops a dangling key without a value, and closes any open
+    arrays and objects.
+    """
+    out: List[str] = []
+    stack: List[str] = []
+    in_string = False
+    escaped = False
+    for char in text:
+        if in_string:
+            out.append(char)
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+            out.append(char)
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+            out.append(char)
+        elif char in "}]":
+            _strip_trailing_comma(out)
+            if stack:
+                stack.pop()
+            out.append(char)
+        else:
+            out.append(char)
+
+    if in_string:
+        if escaped:
+            out.pop()  # A lone backslash would escape the closing quote
+        out.append('"')
+    repaired = "".join(out).rstrip()
+    if stack and stack[-1] == "}":
+        repaired = _DANGLING_KEY_PATTERN.sub(r"\1", repaired)
+    elif repaired.endswith(":"):
+        repaired = repaired[:-1]
+    repaired = _DANGLING_COMMA_PATTERN.sub("", repaired)
+    return repaired + "".join(reversed(stack))
+
+
+def _normalize_score(item) -> Optional[dict]:
+    """
+    A valid score dict (category, integer score 0-100, feedback), or None.
+    """
+    if not isinstance(item, dict) or not item.get("category") or "score" not in item:
+        return None
+    try:
+        score = int(round(float(item["score"])))
+    except (TypeError, ValueError):
+        return None
+    feedback = item.get("feedback")
+    if not isinstance(feedback, str) or not feedback.strip():
+        feedback = DEFAULT_FEEDBACK
+    return {"category": str(item["category"]), "score": max(0, min(100, score)), "feedback": feedback}
+
+
+def _plan_cut_off(text: str) -> bool:
+    """
+    Whether the output ends inside the implementation_plan string, so that repairing
+    it would close the string and pass a truncated plan off as complete.
+    """
+    plan_match = _PLAN_PATTERN.search(text)
+    return plan_match is not None and not text.startswith('"', plan_match.end())
+
+
+def decode_report(raw: str) -> Tuple[Optional[dict], List[str]]:
+    """
+    Decodes the report stage output into `{"scores": [...], "implementation_plan": ...}`.
+
+    Tries the output as-is, then repaired, then salvages complete score objects and
+    the plan text directly. Returns (report or None if nothing usable was found,
+    missing fields), where missing fields are category names and/or
+    "implementation_plan". A plan cut off mid-string is dropped and reported missing
+    rather than repaired. An "Error" category from the service is passed through.
+    """
+    text = strip_to_json(raw)
+    parsed = _loads(text)
+    plan_cut_off = False
+    if not isinstance(parsed, dict):
+        plan_cut_off = _plan_cut_off(text)
+        parsed = _loads(repair_json(text))
+        if isinstance(parsed, dict):
+            print("REPORT_PARSER: Report JSON was malformed and has been repaired.")
+    if not isinstance(parsed, dict):
+        print("REPORT_PARSER_WARNING: Report JSON could not be repaired, salvaging complete fields.")
+        scanner = ScoreStreamScanner()
+        plan_match = _PLAN_PATTERN.search(text)
+        parsed = {
+            "scores": scanner.feed(text),
+            IMPLEMENTATION_PLAN: _loads(repair_json(f'"{plan_match.group(1)}')) if plan_match else None,
+        }
+
+    scores = [score for score in map(_normalize_score, parsed.get("scores") or []) if score is not None]
+    plan = None if plan_cut_off else parsed.get(IMPLEMENTATION_PLAN)
+    if not scores and not isinstance(plan, str):
+        return None, REPORT_CATEGORIES + [IMPLEMENTATION_PLAN]
+    report = {"scores": scores, IMPLEMENTATION_PLAN: plan if isinstance(plan, str) and plan.strip() else None}
+    return report, missing_report_fields(report)
+
+
+def missing_report_fields(report: dict) -> List[str]:
+    """
+    Category names without a score and "implementation_plan" if the plan is empty.
+    A report carrying the service's "Error" category is never incomplete.
+    """
+    scores = report.get("scores") or []
+    if any(score["category"] == "Error" for score in scores):
+        return []
+    present = {score["category"].lower() for score in scores}
+    missing = [category for category in REPORT_CATEGORIES if category.lower() not in present] if len(scores) < len(REPORT_CATEGORIES) else []
+    if not report.get(IMPLEMENTATION_PLAN):
+        missing.append(IMPLEMENTATION_PLAN)
+    return missing
+
+
+def merge_report_completion(report: Optional[dict], completion_raw: str) -> dict:
+    """
+    Adds the fields returned by a completion request to a partial report.
+    Existing fields are never overwritten.
+    """
+    report = report or {"scores": [], IMPLEMENTATION_PLAN: None}
+    completion, _ = decode_report(completion_raw)
+    if not completion:
+        return report
+    present = {score["category"].lower() for score in report["scores"]}
+    for score in completion["scores"]:
+        if score["category"].lower() not in present:
+            report["scores"].append(score)
+            present.add(score["category"].lower())
+    if not report.get(IMPLEMENTATION_PLAN) and completion.get(IMPLEMENTATION_PLAN):
+        report[IMPLEMENTATION_PLAN] = completion[IMPLEMENTATION_PLAN]
+    return report
@@ -0,0 +1,422 @@
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+from dotenv import load_dotenv
+from services.cache_service import normalize_url
+from services.metrics_service import register_collector
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+load_dotenv()
+
+# Persistent history of analyses. Every finished analysis (computed, cached, carried
+# over or offline) is stored in a local SQLite file with its run metadata, per-category
+# scores and rule findings, so questions like "what did this page score last week" or
+# "which pages of a site score below 50 on Forms & Inputs" are answered from indexes
+# instead of new scrapes. Analyses are buffered and written in one transaction per
+# batch (every REPORT_STORE_FLUSH_SECONDS, or as soon as REPORT_STORE_BATCH_SIZE are
+# waiting), so batch and crawl runs never wait on a write per page.
+#
+# The store is off unless REPORT_STORE_PATH is set; a relative path is resolved against
+# the working directory once, when the FastAPI lifespan opens the store.
+
+REPORT_STORE_PATH = os.getenv("REPORT_STORE_PATH", "")  # Store disabled if empty
+REPORT_STORE_FLUSH_SECONDS = float(os.getenv("REPORT_STORE_FLUSH_SECONDS", "1.0"))
+REPORT_STORE_BATCH_SIZE = int(os.getenv("REPORT_STORE_BATCH_SIZE", "200"))
+REPORT_STORE_MAX_PAGE_SIZE = 500
+
+TREND_BUCKETS = {"day": 1, "week": 7}
+_DAY_SECONDS = 86400
+# The Unix epoch was a Thursday; shifting by 3 days makes weekly buckets start on Monday
+_WEEK_OFFSET_DAYS = 3
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        url TEXT NOT NULL,
+        origin TEXT NOT NULL,
+        analyzed_at REAL NOT NULL,
+        outcome TEXT NOT NULL,
+        mode TEXT NOT NULL,
+        viewports TEXT,
+        scores TEXT NOT NULL,
+        mean_score REAL,
+        findings_count INTEGER NOT NULL,
+        total_ms REAL,
+        prompt_tokens INTEGER,
+        completion_tokens INTEGER,
+        cost_usd REAL,
+        models TEXT,
+        report BLOB NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_runs_url ON runs(url, id)",
+    "CREATE INDEX IF NOT EXISTS idx_runs_origin ON runs(origin, analyzed_at)",
+    "CREATE INDEX IF NOT EXISTS idx_runs_analyzed_at ON runs(analyzed_at)",
+    """CREATE TABLE IF NOT EXISTS scores (
+        run_id INTEGER NOT NULL,
+        url TEXT NOT NULL,
+        origin TEXT NOT NULL,
+        category TEXT NOT NULL,
+        score INTEGER NOT NULL,
+        analyzed_at REAL NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_scores_url ON scores(url, analyzed_at)",
+    "CREATE INDEX IF NOT EXISTS idx_scores_origin ON scores(origin, analyzed_at)",
+    "CREATE INDEX IF NOT EXISTS idx_scores_category ON scores(category, analyzed_at)",
+    # Latest score per page and category, for worst-page queries over a whole site
+    """CREATE TABLE IF NOT EXISTS latest_scores (
+        url TEXT NOT NULL,
+        category TEXT NOT NULL,
+        origin TEXT NOT NULL,
+        score INTEGER NOT NULL,
+        run_id INTEGER NOT NULL,
+        analyzed_at REAL NOT NULL,
+        PRIMARY KEY (url, category)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_latest_scores_category ON latest_scores(category, score, url)",
+    "CREATE INDEX IF NOT EXISTS idx_latest_scores_origin ON latest_scores(origin, category, score, url)",
+    """CREATE TABLE IF NOT EXISTS findings (
+        run_id INTEGER NOT NULL,
+        url TEXT NOT NULL,
+        origin TEXT NOT NULL,
+        guideline TEXT NOT NULL,
+        severity TEXT NOT NULL,
+        issue TEXT NOT NULL,
+        path TEXT,
+        source TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_findings_run ON findings(run_id)",
+    "CREATE INDEX IF NOT EXISTS idx_findings_origin ON findings(origin, guideline)",
+)
+
+RUN_COLUMNS = "id, url, origin, analyzed_at, outcome, mode, viewports, scores, mean_score, findings_count, total_ms, prompt_tokens, completion_tokens, cost_usd, models"
+
+
+def page_origin(url: str) -> str:
+    """
+    scheme://host[:port] of a URL, normalized like the cache keys.
+    """
+    parts = urlsplit(normalize_url(url))
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _iso(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec="seconds")
+
+
+def _run_row(row: tuple) -> dict:
+    (run_id, url, origin, analyzed_at, outcome, mode, viewports, scores, mean_score,
+     findings_count, total_ms, prompt_tokens, completion_tokens, cost_usd, models) = row
+    return {
+        "id": run_id,
+        "url": url,
+        "origin": origin,
+        "analyzed_at": _iso(analyzed_at),
+        "outcome": outcome,
+        "mode": mode,
+        "viewports": viewports.split(",") if viewports else None,
+        "scores": json.loads(scores),
+        "mean_score": mean_score,
+        "findings_count": findings_count,
+        "total_ms": total_ms,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cost_usd": cost_usd,
+        "models": models.split(",") if models else [],
+    }
+
+
+def build_run(url: str, report: dict, mode: str, viewports: Optional[List[str]] = None, analyzed_at: Optional[float] = None) -> dict:
+    """
+    The stored form of one finished analysis: run metadata, per-category scores and
+    findings pulled out of the report for the indexes, and the report itself.
+    """
+    normalized = normalize_url(url)
+    timings = report.get("timings") or {}
+    scores = {entry["category"]: int(entry["score"]) for entry in report.get("scores") or []}
+    models = sorted({part["model"] for part in report.get("models") or [] if part.get("model")})
+    return {
+        "url": normalized,
+        "origin": page_origin(normalized),
+        "analyzed_at": analyzed_at if analyzed_at is not None else time.time(),
+        "outcome": timings.get("outcome") or "computed",
+        "mode": mode,
+        "viewports": ",".join(viewports) if viewports else None,
+        "scores": scores,
+        "mean_score": round(sum(scores.values()) / len(scores), 2) if scores else None,
+        "findings": report.get("findings") or [],
+        "total_ms": timings.get("total_ms"),
+        "prompt_tokens": timings.get("prompt_tokens"),
+        "completion_tokens": timings.get("completion_tokens"),
+        "cost_usd": timings.get("estimated_cost_usd"),
+        "models": ",".join(models) or None,
+        "report": report,
+    }
+
+
+class ReportStore:
+    """
+    SQLite store of analysis runs. WAL mode lets all workers read while one writes;
+    writes are buffered in memory and flushed in bulk by a background task.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.local = threading.local()
+        self.pending: List[dict] = []
+        self.flush_lock = asyncio.Lock()
+        self.batch_full = asyncio.Event()
+        self.flush_task: Optional[asyncio.Task] = None
+        self.stats = {"recorded": 0, "written": 0, "batches": 0, "write_errors": 0, "dropped": 0, "last_batch_size": 0, "last_batch_ms": 0.0}
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        for statement in SCHEMA:
+            conn.execute(statement)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def record(self, run: dict):
+        """
+        Queues a run (see build_run) for the next bulk write.
+        """
+        self.pending.append(run)
+        self.stats["recorded"] += 1
+        if len(self.pending) >= REPORT_STORE_BATCH_SIZE:
+            self.batch_full.set()
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self._flush_soon())
+
+    async def _flush_soon(self):
+        try:
+            await asyncio.wait_for(self.batch_full.wait(), REPORT_STORE_FLUSH_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        self.batch_full.clear()
+        await self.flush()
+        self.flush_task = None
+        if self.pending:
+            self.flush_task = asyncio.create_task(self._flush_soon())
+
+    async def flush(self):
+        """
+        Writes everything queued so far in one transaction. Queries call this first,
+        so a run is visible as soon as its analysis has finished.
+        """
+        async with self.flush_lock:
+            batch, self.pending = self.pending, []
+            if not batch:
+                return
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except sqlite3.Error as e:
+                self.stats["write_errors"] += 1
+                self.stats["dropped"] += len(batch)
+                print(f"REPORT_STORE_ERROR: Writing {len(batch)} run(s) failed: {e}")
+                return
+            self.stats["written"] += len(batch)
+            self.stats["batches"] += 1
+            self.stats["last_batch_size"] = len(batch)
+            self.stats["last_batch_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    async def close(self):
+        if self.flush_task is not None and not self.flush_task.done():
+            self.flush_task.cancel()
+        await self.flush()
+
+    def _write(self, batch: List[dict]):
+        conn = self._connect()
+        score_rows, finding_rows = [], []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for run in batch:
+                report_blob = zlib.compress(json.dumps(run["report"], separators=(",", ":")).encode("utf-8"))
+                run_id = conn.execute(
+                    "INSERT INTO runs (url, origin, analyzed_at, outcome, mode, viewports, scores, mean_score, findings_count, "
+                    "total_ms, prompt_tokens, completion_tokens, cost_usd, models, report) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (run["url"], run["origin"], run["analyzed_at"], run["outcome"], run["mode"], run["viewports"],
+                     json.dumps(run["scores"]), run["mean_score"], len(run["findings"]), run["total_ms"],
+                     run["prompt_tokens"], run["completion_tokens"], run["cost_usd"], run["models"], report_blob)
+                ).lastrowid
+                score_rows.extend(
+                    (run_id, run["url"], run["origin"], category, score, run["analyzed_at"])
+                    for category, score in run["scores"].items()
+                )
+                finding_rows.extend(
+                    (run_id, run["url"], run["origin"], finding.get("guideline", ""), finding.get("severity", ""),
+                     finding.get("issue", ""), finding.get("path"), finding.get("source"))
+                    for finding in run["findings"]
+                )
+            conn.executemany("INSERT INTO scores (run_id, url, origin, category, score, analyzed_at) VALUES (?, ?, ?, ?, ?, ?)", score_rows)
+            conn.executemany(
+                "INSERT INTO latest_scores (run_id, url, origin, category, score, analyzed_at) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(url, category) DO UPDATE SET origin = excluded.origin, score = excluded.score, "
+                "run_id = excluded.run_id, analyzed_at = excluded.analyzed_at WHERE excluded.analyzed_at >= latest_scores.analyzed_at",
+                score_rows
+            )
+            conn.executemany("INSERT INTO findings (run_id, url, origin, guideline, severity, issue, path, source) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", finding_rows)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def url_history(self, url: str, limit: int, before: Optional[int] = None) -> Tuple[List[dict], Optional[int]]:
+        """
+        Runs of one page, newest first, and the cursor (run id) for the next page.
+        """
+        sql = f"SELECT {RUN_COLUMNS} FROM runs WHERE url = ?"
+        params: List[Any] = [normalize_url(url)]
+        if before is not None:
+            sql += " AND id < ?"
+            params.append(before)
+        rows = self._connect().execute(sql + " ORDER BY id DESC LIMIT ?", (*params, limit + 1)).fetchall()
+        runs = [_run_row(row) for row in rows[:limit]]
+        return runs, (runs[-1]["id"] if len(rows) > limit else None)
+
+    def get_report(self, run_id: int) -> Optional[dict]:
+        row = self._connect().execute("SELECT report FROM runs WHERE id = ?", (run_id,)).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row else None
+
+    def worst_pages(self, category: str, limit: int, origin: Optional[str] = None, max_score: Optional[int] = None,
+                    after: Optional[Tuple[int, str]] = None) -> Tuple[List[dict], Optional[Tuple[int, str]]]:
+        """
+        Pages by their latest score in a category, lowest first (ties by URL), and the
+        cursor (score, url) for the next page.
+        """
+        sql = "SELECT url, origin, score, run_id, analyzed_at FROM latest_scores WHERE category = ?"
+        params: List[Any] = [category]
+        if origin:
+            sql += " AND origin = ?"
+            params.append(page_origin(origin))
+        if max_score is not None:
+            sql += " AND score <= ?"
+            params.append(max_score)
+        if after is not None:
+            sql += " AND (score > ? OR (score = ? AND url > ?))"
+            params.extend((after[0], after[0], after[1]))
+        rows = self._connect().execute(sql + " ORDER BY score, url LIMIT ?", (*params, limit + 1)).fetchall()
+        pages = [
+            {"url": url, "origin": site, "category": category, "score": score, "run_id": run_id, "analyzed_at": _iso(analyzed_at)}
+            for url, site, score, run_id, analyzed_at in rows[:limit]
+        ]
+        return pages, ((pages[-1]["score"], pages[-1]["url"]) if len(rows) > limit else None)
+
+    def trends(self, days: int, bucket: str, url: Optional[str] = None, origin: Optional[str] = None, category: Optional[str] = None) -> List[dict]:
+        """
+        Score statistics per category and day (or week) over the last `days` days, for
+        one page or all pages of an origin.
+        """
+        bucket_days = TREND_BUCKETS[bucket]
+        period = f"CAST((analyzed_at / {_DAY_SECONDS} + {_WEEK_OFFSET_DAYS if bucket_days > 1 else 0}) / {bucket_days} AS INTEGER)"
+        column, value = ("url", normalize_url(url)) if url else ("origin", page_origin(origin))
+        sql = (
+            f"SELECT category, {period} AS period, AVG(score), MIN(score), MAX(score), COUNT(*), COUNT(DISTINCT url) "
+            f"FROM scores WHERE {column} = ? AND analyzed_at >= ?"
+        )
+        params: List[Any] = [value, time.time() - days * _DAY_SECONDS]
+        if category:
+            sql += " AND category = ?"
+            params.append(category)
+        rows = self._connect().execute(sql + " GROUP BY category, period ORDER BY category, period", params).fetchall()
+        offset = _WEEK_OFFSET_DAYS if bucket_days > 1 else 0
+        return [
+            {
+                "category": row_category,
+                "period_start": _iso((period_index * bucket_days - offset) * _DAY_SECONDS)[:10],
+                "mean_score": round(mean, 2),
+                "min_score": minimum,
+                "max_score": maximum,
+                "runs": runs,
+                "pages": pages,
+            }
+            for row_category, period_index, mean, minimum, maximum, runs, pages in rows
+        ]
+
+    def counts(self) -> Dict[str, int]:
+        conn = self._connect()
+        return {
+            "runs": conn.execute("SELECT COUNT(*) FROM runs").fetchone()[0],
+            "pages": conn.execute("SELECT COUNT(DISTINCT url) FROM latest_scores").fetchone()[0],
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "pending": len(self.pending), "path": self.path}
+
+
+report_store: Optional[ReportStore] = None
+
+
+def open_report_store(path: str = REPORT_STORE_PATH) -> Optional[ReportStore]:
+    """
+    Opens the report store at `path` (called from the FastAPI lifespan). Returns None
+    and leaves the store disabled when no path is configured.
+    """
+    global report_store
+    if not path:
+        print("REPORT_STORE: Disabled (REPORT_STORE_PATH is not set).")
+        return None
+    if report_store is None:
+        report_store = ReportStore(os.path.abspath(path))
+        print(f"REPORT_STORE: Opened {report_store.path}")
+    return report_store
+
+
+async def close_report_store():
+    """
+    Writes the queued runs and detaches the store.
+    """
+    global report_store
+    if report_store is not None:
+        store, report_store = report_store, None
+        await store.close()
+
+
+def get_report_store() -> Optional[ReportStore]:
+    return report_store
+
+
+def record_report(url: str, report: dict, mode: str, viewports: Optional[List[str]] = None):
+    """
+    Queues a finished analysis for the report store (no-op when the store is disabled).
+    """
+    if report_store is None:
+        return
+    try:
+        report_store.record(build_run(url, report, mode, viewports))
+    except Exception as e:
+        print(f"REPORT_STORE_ERROR: Could not record the report for {url}: {e}")
+
+
+async def query_store(method: str, *args, **kwargs):
+    """
+    Runs a ReportStore query off the event loop, after flushing queued runs.
+    """
+    await report_store.flush()
+    return await asyncio.to_thread(getattr(report_store, method), *args, **kwargs)
+
+
+def _store_metrics():
+    if report_store is None:
+        return []
+    return [
+        ("analyzer_report_store_runs_total", "counter", "Analysis runs recorded, written and dropped by the report store.", [
+            ({"result": result}, report_store.stats[result]) for result in ("recorded", "written", "dropped")
+        ]),
+        ("analyzer_report_store_batches_total", "counter", "Bulk write transactions of the report store.", [
+            ({}, report_store.stats["batches"]),
+        ]),
+    ]
+
+
+register_collector(_store_metrics)
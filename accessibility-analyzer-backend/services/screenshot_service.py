@@ -0,0 +1,144 @@
+from io import BytesIO
+from typing import Optional
+from dotenv import load_dotenv
+from PIL import Image
+from services.visual_metrics_service import measure_contrast
+import base64
+import hashlib
+import numpy as np
+import os
+
+load_dotenv()
+
+# Screenshot preprocessing for the visual analysis stage. A full-page screenshot is
+# decoded once, scaled down to the width the provider actually analyzes at, and split
+# into overlapping viewport-sized tiles that are analyzed in parallel. Vision models
+# downscale oversized images anyway, so sending one tall image loses exactly the small
+# text and controls we need to see, while costing the most memory and image tokens.
+
+# Tile size (width, height) per provider: Claude works best up to ~1.15 megapixels with
+# a long edge of at most 1568px; OpenAI's high-detail mode rescales the short side to 768px.
+TILE_SIZES = {
+    "anthropic": (1232, 924),
+    "openai": (1024, 768),
+}
+SCREENSHOT_TILE_OVERLAP = float(os.getenv("SCREENSHOT_TILE_OVERLAP", "0.15"))  # Fraction of tile height
+SCREENSHOT_MAX_TILES = int(os.getenv("SCREENSHOT_MAX_TILES", "6"))
+
+# Visual fingerprint: the page as a FINGERPRINT_COLUMNS-wide grid of 16-level grey cells.
+# Two screenshots differ perceptually when at least SCREENSHOT_CHANGE_CELLS cells moved by
+# two or more levels (one level is resampling/antialiasing noise at a band boundary).
+FINGERPRINT_COLUMNS = 64
+FINGERPRINT_MAX_ROWS = 256
+SCREENSHOT_CHANGE_CELLS = int(os.getenv("SCREENSHOT_CHANGE_CELLS", "2"))
+_HEX_DIGITS = np.array(list("0123456789abcdef"))
+
+
+def tile_offsets(page_height: int, tile_height: int, overlap: float, max_tiles: int) -> list:
+    """
+    Top offsets of overlapping tiles covering the page; the last tile is aligned to the bottom.
+    """
+    if page_height <= tile_height:
+        return [0]
+    stride = max(1, int(tile_height * (1 - overlap)))
+    offsets = list(range(0, page_height - tile_height, stride))[:max_tiles]
+    if len(offsets) < max_tiles:
+        offsets.append(page_height - tile_height)
+    return offsets
+
+
+def visual_fingerprint(image: Image.Image) -> str:
+    """
+    Coarse greyscale thumbnail of the whole page as "<rows>:<one hex digit per cell>".
+    Sensitive to layout, colour and contrast changes, not to re-encoding.
+    """
+    rows = max(1, min(FINGERPRINT_MAX_ROWS, round(FINGERPRINT_COLUMNS * image.height / image.width)))
+    with image.convert("L").resize((FINGERPRINT_COLUMNS, rows), Image.BOX) as thumbnail:
+        levels = np.asarray(thumbnail) >> 4
+    return f"{rows}:" + "".join(_HEX_DIGITS[levels.ravel()])
+
+
+def screenshot_changed(previous: Optional[str], current: Optional[str]) -> bool:
+    """
+    Whether two visual fingerprints differ perceptually (see SCREENSHOT_CHANGE_CELLS).
+    Several space-separated fingerprints (one per viewport, "<viewport>=<fingerprint>")
+    are compared pairwise. A missing fingerprint or a different page height counts as changed.
+    """
+    if previous is None or current is None:
+        return previous != current
+    previous_parts, current_parts = previous.split(), current.split()
+    if len(previous_parts) != len(current_parts):
+        return True
+    for before, after in zip(previous_parts, current_parts):
+        if before.split(":", 1)[0] != after.split(":", 1)[0]:
+            return True
+        before, after = (np.frombuffer(fingerprint.split(":", 1)[1].encode("ascii"), dtype=np.uint8).astype(np.int16) for fingerprint in (before, after))
+        # Hex digits to levels: '0'-'9' are 48-57, 'a'-'f' are 97-102.
+        before, after = (np.where(codes >= 97, codes - 87, codes - 48) for codes in (before, after))
+        if int(np.count_nonzero(np.abs(before - after) >= 2)) >= SCREENSHOT_CHANGE_CELLS:
+            return True
+    return False
+
+
+def prepare_screenshot(image_bytes: bytes, provider: str) -> Optional[dict]:
+    """
+    Decodes a screenshot once and returns it as provider-sized PNG tiles (base64), plus
+    the page geometry. Only the resized image and the encoded tiles are kept in memory.
+    Pages taller than SCREENSHOT_MAX_TILES tiles are cut off and marked `truncated`.
+    While the full-resolution image is decoded, text contrast is measured over the
+    covered area (`visual_findings`, coordinates in original screenshot pixels).
+    The `fingerprint` (see visual_fingerprint) lets a re-analysis tell whether the page
+    looks different. Returns None if the image cannot be decoded.
+    """
+    tile_width, tile_height = TILE_SIZES.get(provider, TILE_SIZES["anthropic"])
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    try:
+        with Image.open(BytesIO(image_bytes)) as decoded:
+            original_width, original_height = decoded.size
+            image = decoded.convert("RGB")
+    except Exception as e:
+        print(f"SCREENSHOT_SERVICE_ERROR: Could not decode screenshot: {e}")
+        return None
+
+    scale = max(1.0, original_width / tile_width)
+    width, height = min(original_width, tile_width), max(1, round(original_height / scale))
+    offsets = tile_offsets(height, tile_height, SCREENSHOT_TILE_OVERLAP, SCREENSHOT_MAX_TILES)
+    truncated = offsets[-1] + tile_height < height
+
+    # Contrast is measured at full resolution (resampling blurs thin text) over the area the tiles cover.
+    covered_height = min(original_height, round((offsets[-1] + tile_height) * scale))
+    contrast = measure_contrast(np.asarray(image.crop((0, 0, original_width, covered_height))))
+
+    if scale > 1.0:
+        resized = image.resize((width, height), Image.LANCZOS, reducing_gap=2.0)
+        image.close()
+        image = resized
+
+    fingerprint = visual_fingerprint(image)
+    tiles = []
+    for index, top in enumerate(offsets):
+        bottom = min(height, top + tile_height)
+        buffer = BytesIO()
+        image.crop((0, top, width, bottom)).save(buffer, format="PNG", optimize=False)
+        tiles.append({
+            "index": index,
+            "top": top,
+            "bottom": bottom,
+            "data": base64.b64encode(buffer.getbuffer()).decode("ascii"),
+        })
+        buffer.close()
+    image.close()
+    print(f"SCREENSHOT_SERVICE: {original_width}x{original_height} screenshot -> {len(tiles)} tile(s) at {width}px wide{' (truncated)' if truncated else ''}.")
+    print(f"SCREENSHOT_SERVICE: Measured {contrast['text_blocks']} text block(s), {len(contrast['findings'])} low-contrast region(s) in {contrast['elapsed_ms']} ms.")
+    return {
+        "digest": digest,
+        "fingerprint": fingerprint,
+        "media_type": "image/png",
+        "width": width,
+        "height": height,
+        "original_width": original_width,
+        "original_height": original_height,
+        "truncated": truncated,
+        "tiles": tiles,
+        "visual_findings": contrast["findings"],
+    }
@@ -0,0 +1,151 @@
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from services.cache_service import snapshot_cache, normalize_url, content_hash
+from services.html_condenser_service import chunk_html
+from services.screenshot_service import screenshot_changed
+import os
+
+# Incremental re-analysis. An incremental analysis splits the page into sections along
+# element boundaries (the same splitting as oversized pages, at a smaller size) and
+# stores a snapshot per URL: each section's content hash and HTML findings, the
+# screenshot's visual fingerprint and findings, and the resulting scores. The next
+# incremental analysis of the URL diffs its sections against the snapshot, runs the
+# HTML stage only for sections whose content is new, the visual stage only if the page
+# looks different, and reports the score deltas against the previous run.
+
+SNAPSHOT_SECTION_TOKENS = int(os.getenv("SNAPSHOT_SECTION_TOKENS", "6000"))
+SNAPSHOT_MAX_SECTIONS = int(os.getenv("SNAPSHOT_MAX_SECTIONS", "40"))
+# New findings listed in a regression report (the count is always complete)
+REGRESSION_MAX_NEW_FINDINGS = 50
+
+
+def split_sections(page_html: str, token_budget: int) -> Tuple[List[dict], bool]:
+    """
+    Splits the page into sections of at most SNAPSHOT_SECTION_TOKENS (and `token_budget`)
+    tokens, each with the `hash` of its content. Returns the sections and whether
+    sections beyond SNAPSHOT_MAX_SECTIONS had to be dropped.
+    """
+    sections, dropped = chunk_html(page_html, min(SNAPSHOT_SECTION_TOKENS, token_budget), SNAPSHOT_MAX_SECTIONS)
+    for section in sections:
+        section["hash"] = content_hash(section["html"])
+    return sections, dropped
+
+
+def finding_key(finding: dict) -> str:
+    return f"{finding['guideline']}|{finding['issue']}|{finding.get('path', '')}"
+
+
+async def load_snapshot(url: str) -> Optional[dict]:
+    return await snapshot_cache.get(normalize_url(url))
+
+
+async def save_snapshot(url: str, snapshot: dict):
+    await snapshot_cache.set(normalize_url(url), snapshot)
+
+
+def diff_sections(previous: List[dict], current: List[dict]) -> dict:
+    """
+    Structural diff of two section lists. Sections are matched by content hash, so
+    content that only moved keeps its findings. New content is `changed` where a
+    previous section had the same ancestor path, `added` otherwise; previous content
+    that is gone and whose path no longer exists is `removed`.
+    """
+    previous_hashes = {section["hash"] for section in previous}
+    current_hashes = {section["hash"] for section in current}
+    previous_paths = {section["path"] for section in previous}
+    current_paths = {section["path"] for section in current}
+    new = [section for section in current if section["hash"] not in previous_hashes]
+    return {
+        "unchanged": len(current) - len(new),
+        "changed": [section["path"] for section in new if section["path"] in previous_paths],
+        "added": [section["path"] for section in new if section["path"] not in previous_paths],
+        "removed": [section["path"] for section in previous if section["hash"] not in current_hashes and section["path"] not in current_paths],
+    }
+
+
+def plan_reanalysis(previous: dict, sections: List[dict], screenshot: Optional[dict], template_fingerprints: List[str], findings: List[dict], model_key: str) -> dict:
+    """
+    Decides what an incremental analysis can take over from the previous snapshot.
+    `carried` has the HTML findings of unchanged sections (by hash) and, if the page
+    looks the same, the visual findings; nothing is carried over when the model or
+    prompts changed. `unchanged` means no model call is needed at all.
+    """
+    diff = diff_sections(previous["sections"], sections)
+    visual_change = screenshot_changed(previous.get("screenshot_fingerprint"), (screenshot or {}).get("fingerprint"))
+    carried: Dict[str, object] = {}
+    if previous.get("model_key") == model_key:
+        carried["html"] = {section["hash"]: section["feedback"] for section in previous["sections"]}
+        if not visual_change and previous.get("screenshot_feedback") is not None:
+            carried["screenshot"] = previous["screenshot_feedback"]
+    unchanged = (
+        bool(carried)
+        and not (diff["changed"] or diff["added"] or diff["removed"])
+        and "screenshot" in carried
+        and previous.get("template_fingerprints", []) == list(template_fingerprints)
+        and set(previous.get("findings", [])) == {finding_key(finding) for finding in findings}
+    )
+    return {
+        "diff": diff,
+        "screenshot_changed": visual_change,
+        "carried": carried,
+        "sections_to_analyze": sum(1 for section in sections if section["hash"] not in carried.get("html", {})),
+        "unchanged": unchanged,
+    }
+
+
+def build_snapshot(url: str, model_key: str, sections: List[dict], stage_feedback: dict, screenshot: Optional[dict], template_fingerprints: List[str], report: dict) -> dict:
+    """
+    The snapshot stored after an incremental analysis, from its sections, the stage
+    outputs collected by analyze_accessibility_async and the final report.
+    """
+    section_feedback = stage_feedback.get("html", {})
+    return {
+        "url": normalize_url(url),
+        "analyzed_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "model_key": model_key,
+        "sections": [
+            {"path": section["path"], "hash": section["hash"], "feedback": section_feedback.get(section["hash"], "")}
+            for section in sections
+        ],
+        "screenshot_fingerprint": (screenshot or {}).get("fingerprint"),
+        "screenshot_feedback": stage_feedback.get("screenshot"),
+        "template_fingerprints": list(template_fingerprints),
+        "findings": sorted({finding_key(finding) for finding in report.get("findings") or []}),
+        "scores": report["scores"],
+        "implementation_plan": report["implementation_plan"],
+    }
+
+
+def regression_report(previous: dict, report: dict, plan: dict, sections_total: int) -> dict:
+    """
+    Score deltas and finding changes of `report` against the previous snapshot.
+    """
+    previous_scores = {score["category"]: score["score"] for score in previous.get("scores", [])}
+    score_deltas = []
+    for score in report["scores"]:
+        before = previous_scores.get(score["category"])
+        score_deltas.append({
+            "category": score["category"],
+            "previous": before,
+            "current": score["score"],
+            "delta": score["score"] - before if before is not None else None,
+        })
+    previous_findings = set(previous.get("findings", []))
+    findings = report.get("findings") or []
+    current_findings = {finding_key(finding) for finding in findings}
+    new_findings = [finding for finding in findings if finding_key(finding) not in previous_findings]
+    return {
+        "previous_analyzed_at": previous["analyzed_at"],
+        "sections_total": sections_total,
+        "sections_reanalyzed": 0 if plan["unchanged"] else plan["sections_to_analyze"],
+        "sections_changed": plan["diff"]["changed"],
+        "sections_added": plan["diff"]["added"],
+        "sections_removed": plan["diff"]["removed"],
+        "screenshot_changed": plan["screenshot_changed"],
+        "score_deltas": score_deltas,
+        "regressed_categories": [delta["category"] for delta in score_deltas if (delta["delta"] or 0) < 0],
+        "improved_categories": [delta["category"] for delta in score_deltas if (delta["delta"] or 0) > 0],
+        "new_findings_count": len(new_findings),
+        "new_findings": new_findings[:REGRESSION_MAX_NEW_FINDINGS],
+        "resolved_findings_count": len(previous_findings - current_findings),
+    }
@@ -0,0 +1,60 @@
+from contextlib import contextmanager
+from typing import Dict, Iterator
+from services.metrics_service import register_collector
+import resource
+import sys
+import time
+
+# Startup cost of a worker process: how long the application imports took, the provider
+# SDK imports and client creation (done lazily, on first use or during warm-up), and the
+# time until the app was ready to serve. Printed once at startup, served on
+# /startup/stats and exported as gauges on /metrics.
+
+phase_seconds: Dict[str, float] = {}
+
+
+def record_phase(phase: str, seconds: float):
+    """
+    Records a startup phase once; later calls for the same phase (e.g. an import that
+    is already cached) are ignored.
+    """
+    phase_seconds.setdefault(phase, seconds)
+
+
+@contextmanager
+def timed_phase(phase: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(phase, time.perf_counter() - started)
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)  # bytes on macOS, KB on Linux
+
+
+def get_startup_report() -> dict:
+    return {
+        "phases_ms": {phase: round(seconds * 1000, 1) for phase, seconds in phase_seconds.items()},
+        "modules_loaded": len(sys.modules),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def print_startup_report():
+    report = get_startup_report()
+    phases = ", ".join(f"{phase} {ms:.0f} ms" for phase, ms in report["phases_ms"].items())
+    print(f"STARTUP: {phases}; {report['modules_loaded']} modules loaded, peak RSS {report['peak_rss_mb']} MB.")
+
+
+def _startup_metrics():
+    return [
+        ("analyzer_startup_phase_seconds", "gauge", "Duration of startup phases (imports, client creation, warm-up, ready).", [
+            ({"phase": phase}, seconds) for phase, seconds in phase_seconds.items()
+        ]),
+    ]
+
+
+register_collector(_startup_metrics)
@@ -0,0 +1,212 @@
+from collections import OrderedDict
+from html.parser import HTMLParser
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+from services.cache_service import normalize_url
+from services.html_condenser_service import PRESERVED_COMMENT_PREFIX
+import hashlib
+import re
+
+# Shared-template detection for multi-page analysis. Site chrome (header, navigation,
+# footer, cookie banner) is usually identical on every page of an origin. Candidate
+# components are fingerprinted by a hash of their normalized subtree; once the same
+# fingerprint has been seen on two different pages of the origin it is treated as a
+# shared template component: it is cut out of the page HTML, analyzed once, and its
+# findings are attached to every page that contains it.
+
+# Landmark-like elements that are candidates for site chrome.
+CANDIDATE_TAGS = {"header", "nav", "footer", "aside"}
+CANDIDATE_ROLES = {"banner", "navigation", "contentinfo", "complementary", "dialog", "alertdialog"}
+CANDIDATE_MARKER_PATTERN = re.compile(r"cookie|consent|gdpr|site-header|site-footer|masthead", re.IGNORECASE)
+
+# Attributes and class tokens that legitimately vary between pages for the same component.
+VOLATILE_ATTRIBUTES = {"nonce", "aria-current", "style"}
+VOLATILE_CLASS_TOKENS = {"active", "current", "is-active", "is-current", "selected", "open"}
+
+VOID_ELEMENTS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input",
+    "link", "meta", "param", "source", "track", "wbr",
+}
+
+MIN_COMPONENT_BYTES = 200  # Not worth cutting out tiny components
+MIN_PAGES_FOR_SHARED = 2
+MAX_ORIGINS = 256
+MAX_FINGERPRINTS_PER_ORIGIN = 1000
+
+
+class _ComponentFinder(HTMLParser):
+    """
+    Single pass that finds outermost candidate components with their source span and fingerprint.
+    """
+
+    def __init__(self, html: str):
+        super().__init__(convert_charrefs=True)
+        self.html = html
+        self.line_offsets = [0]
+        for match in re.finditer("\n", html):
+            self.line_offsets.append(match.end())
+        self.stack: List[str] = []
+        self.components: List[dict] = []
+        self.current: Optional[dict] = None  # Candidate being recorded
+
+    def _offset(self) -> int:
+        line, column = self.getpos()
+        return self.line_offsets[line - 1] + column
+
+    def _is_candidate(self, tag: str, attrs: Dict[str, Optional[str]]) -> bool:
+        if tag in CANDIDATE_TAGS:
+            return True
+        if (attrs.get("role") or "").lower() in CANDIDATE_ROLES:
+            return True
+        marker = f"{attrs.get('id') or ''} {attrs.get('class') or ''}"
+        return bool(CANDIDATE_MARKER_PATTERN.search(marker))
+
+    def _normalized_start(self, tag: str, attrs_list) -> str:
+        parts = []
+        for name, value in sorted(attrs_list, key=lambda item: item[0]):
+            name = name.lower()
+            if name in VOLATILE_ATTRIBUTES or name.startswith("data-"):
+                continue
+            if name == "class":
+                value = " ".join(sorted(token for token in (value or "").split() if token not in VOLATILE_CLASS_TOKENS))
+                if not value:
+                    continue
+            parts.append(f"{name}={' '.join((value or '').split())}")
+        return f"<{tag} {' '.join(parts)}>"
+
+    def handle_starttag(self, tag, attrs_list):
+        attrs = {name.lower(): value for name, value in attrs_list}
+        if self.current is None and tag not in VOID_ELEMENTS and self._is_candidate(tag, attrs):
+            label = tag
+            if attrs.get("id"):
+                label += f"#{attrs['id']}"
+            elif attrs.get("class"):
+                label += "." + ".".join(attrs["class"].split()[:2])
+            self.current = {
+                "tag": tag,
+                "label": label,
+                "start": self._offset(),
+                "depth": len(self.stack),
+                "tokens": [],
+            }
+        if self.current is not None:
+            self.current["tokens"].append(self._normalized_start(tag, attrs_list))
+        if tag not in VOID_ELEMENTS:
+            self.stack.append(tag)
+
+    def handle_startendtag(self, tag, attrs_list):
+        self.handle_starttag(tag, attrs_list)
+        if tag not in VOID_ELEMENTS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag not in self.stack:
+            return
+        while self.stack:
+            open_tag = self.stack.pop()
+            if self.current is not None:
+                self.current["tokens"].append(f"</{open_tag}>")
+                if len(self.stack) == self.current["depth"]:
+                    self._close_current()
+            if open_tag == tag:
+                break
+
+    def _close_current(self):
+        offset = self._offset()
+        end = self.html.find(">", offset)
+        end = len(self.html) if end == -1 else end + 1
+        component = self.current
+        self.current = None
+        if end - component["start"] < MIN_COMPONENT_BYTES:
+            return
+        fingerprint = hashlib.sha256("".join(component["tokens"]).encode("utf-8")).hexdigest()[:32]
+        self.components.append({
+            "fingerprint": fingerprint,
+            "tag": component["tag"],
+            "label": component["label"],
+            "start": component["start"],
+            "end": end,
+        })
+
+    def handle_data(self, data):
+        if self.current is not None:
+            text = " ".join(data.split())
+            if text:
+                self.current["tokens"].append(text)
+
+
+def find_components(html: str) -> List[dict]:
+    """
+    Returns the outermost chrome-like components of a page with fingerprint, label and source span.
+    """
+    finder = _ComponentFinder(html or "")
+    finder.feed(html or "")
+    finder.close()
+    return finder.components
+
+
+def _origin(url: str) -> str:
+    parts = urlsplit(normalize_url(url))
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+class TemplateRegistry:
+    """
+    Remembers, per origin, which pages each component fingerprint has been seen on.
+    Bounded in both origins and fingerprints per origin (least recently used go first).
+    """
+
+    def __init__(self):
+        self.origins: "OrderedDict[str, OrderedDict[str, Set[str]]]" = OrderedDict()
+
+    def observe(self, url: str, components: List[dict]):
+        origin = _origin(url)
+        page = normalize_url(url)
+        fingerprints = self.origins.setdefault(origin, OrderedDict())
+        self.origins.move_to_end(origin)
+        for component in components:
+            pages = fingerprints.setdefault(component["fingerprint"], set())
+            pages.add(page)
+            fingerprints.move_to_end(component["fingerprint"])
+        while len(fingerprints) > MAX_FINGERPRINTS_PER_ORIGIN:
+            fingerprints.popitem(last=False)
+        while len(self.origins) > MAX_ORIGINS:
+            self.origins.popitem(last=False)
+
+    def pages_seen(self, url: str, fingerprint: str) -> int:
+        return len(self.origins.get(_origin(url), {}).get(fingerprint, ()))
+
+    def split_page(self, url: str, html: str) -> Tuple[str, List[dict]]:
+        """
+        Records the page's components and cuts out the ones shared with other pages of
+        the origin. Returns the page-unique HTML (shared components replaced by a short
+        comment) and the shared components with their HTML.
+        """
+        components = find_components(html)
+        self.observe(url, components)
+        shared = []
+        for component in components:
+            pages = self.pages_seen(url, component["fingerprint"])
+            if pages >= MIN_PAGES_FOR_SHARED:
+                shared.append({**component, "pages_seen": pages, "html": html[component["start"]:component["end"]]})
+        if not shared:
+            return html, []
+
+        parts = []
+        cursor = 0
+        for component in shared:
+            parts.append(html[cursor:component["start"]])
+            parts.append(f"<!-- {PRESERVED_COMMENT_PREFIX} <{component['label']}> analyzed separately -->")
+            cursor = component["end"]
+        parts.append(html[cursor:])
+        return "".join(parts), shared
+
+    def get_stats(self) -> dict:
+        shared = sum(
+            1 for fingerprints in self.origins.values()
+            for pages in fingerprints.values() if len(pages) >= MIN_PAGES_FOR_SHARED
+        )
+        return {"origins": len(self.origins), "shared_components": shared}
+
+
+template_registry = TemplateRegistry()
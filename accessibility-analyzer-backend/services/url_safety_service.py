@@ -0,0 +1,123 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List
+from urllib.parse import urljoin, urlsplit
+from dotenv import load_dotenv
+import asyncio
+import httpx
+import ipaddress
+import os
+import socket
+
+load_dotenv()
+
+# Guard for requests the backend itself makes to user-supplied URLs (direct page
+# fetches, sitemap and link discovery). A URL is only fetched when its host resolves
+# exclusively to public addresses, so /analyze and /crawl cannot be pointed at
+# loopback, private networks, link-local or cloud metadata endpoints. The connection
+# is made to the address that was checked (with the original Host header and TLS server
+# name), so a second DNS answer cannot send it elsewhere. Redirects are followed by
+# hand and every hop is checked again.
+#
+# Set ALLOW_PRIVATE_ADDRESSES=true only for local development and benchmarks that
+# analyze pages served from this machine.
+
+ALLOW_PRIVATE_ADDRESSES = os.getenv("ALLOW_PRIVATE_ADDRESSES", "false").lower() == "true"
+HTTP_MAX_REDIRECTS = int(os.getenv("HTTP_MAX_REDIRECTS", "5"))
+
+
+class UnsafeURLError(Exception):
+    """
+    Raised for URLs the backend must not fetch. The message is safe to show to the user.
+    """
+
+
+def is_public_address(address: str) -> bool:
+    """
+    Whether an IP address is globally routable (not loopback, private, link-local,
+    shared, reserved or multicast). IPv4-mapped IPv6 addresses are judged by their IPv4 part.
+    """
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+async def resolve_host(host: str, port: int) -> List[str]:
+    """
+    Every address `host` resolves to (an IP literal resolves to itself).
+    """
+    try:
+        return [str(ipaddress.ip_address(host))]
+    except ValueError:
+        pass
+    infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    return sorted({info[4][0] for info in infos})
+
+
+async def check_public_url(url: str) -> List[str]:
+    """
+    Raises UnsafeURLError unless `url` is http(s) and its host resolves only to
+    public addresses. Returns those addresses (none when ALLOW_PRIVATE_ADDRESSES is set).
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https"):
+        raise UnsafeURLError(f"Only http and https URLs can be analyzed (got {parts.scheme or 'no scheme'}).")
+    host = parts.hostname
+    if not host:
+        raise UnsafeURLError("The URL has no host.")
+    if ALLOW_PRIVATE_ADDRESSES:
+        return []
+    try:
+        addresses = await resolve_host(host, parts.port or (443 if parts.scheme == "https" else 80))
+    except (socket.gaierror, UnicodeError) as e:
+        raise UnsafeURLError(f"Could not resolve {host}: {e}")
+    private = [address for address in addresses if not is_public_address(address)]
+    if not addresses or private:
+        raise UnsafeURLError(f"{host} resolves to a non-public address ({', '.join(private) or 'none'}) and cannot be fetched.")
+    return addresses
+
+
+def pin_address(request: httpx.Request, address: str):
+    """
+    Points `request` at `address` instead of its host name. The Host header keeps the
+    name, and for https so do the TLS server name and certificate check.
+    """
+    host = request.url.host
+    request.url = request.url.copy_with(host=address)
+    if request.url.scheme == "https":
+        request.extensions["sni_hostname"] = host
+
+
+async def send_public(client: httpx.AsyncClient, method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Sends a request with `client` (streaming; the caller closes the response),
+    following up to HTTP_MAX_REDIRECTS redirects by hand and checking every hop with
+    check_public_url. Each hop connects to the address that was checked (see
+    pin_address). `kwargs` go to client.build_request (headers, timeout, ...).
+    """
+    for _ in range(HTTP_MAX_REDIRECTS + 1):
+        addresses = await check_public_url(url)
+        request = client.build_request(method, url, **kwargs)
+        if addresses:
+            pin_address(request, addresses[0])
+        response = await client.send(request, stream=True, follow_redirects=False)
+        location = response.headers.get("location")
+        if not response.is_redirect or not location:
+            return response
+        await response.aclose()
+        url = urljoin(url, location)  # Relative to the URL by name, not the pinned address
+        if response.status_code == 303:
+            method = "GET"
+    raise httpx.TooManyRedirects(f"More than {HTTP_MAX_REDIRECTS} redirects", request=request)
+
+
+@asynccontextmanager
+async def stream_public(client: httpx.AsyncClient, method: str, url: str, **kwargs) -> AsyncIterator[httpx.Response]:
+    """
+    send_public as a context manager that closes the response, like client.stream.
+    """
+    response = await send_public(client, method, url, **kwargs)
+    try:
+        yield response
+    finally:
+        await response.aclose()
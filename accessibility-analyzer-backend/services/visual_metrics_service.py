@@ -0,0 +1,207 @@
+from typing import List, Optional
+import numpy as np
+import time
+
+# Measured visual checks from the screenshot pixels. Contrast is computed with the
+# WCAG relative-luminance formula over the whole image in vectorized form: the image
+# is cut into small blocks, blocks that look like text (two dominant colours with
+# stroke-like transitions) are kept, and the ratio between their darkest and lightest
+# colour is their contrast. Failing blocks are merged into regions with coordinates.
+
+GUIDELINE_CONTRAST = "Color Contrast"
+
+BLOCK_SIZE = 16  # Pixels per block side
+BAND_ROWS = 512  # Rows processed at once, to bound temporary memory
+MIN_VISIBLE_RATIO = 1.25  # Below this a block is flat background, not text
+MIN_FOREGROUND_FRACTION = 0.04
+MAX_FOREGROUND_FRACTION = 0.45
+MIN_TWO_COLOUR_FRACTION = 0.85  # Share of pixels close to one of the two extremes
+MIN_STROKE_LINES = 3  # Rows and columns that cross at least one glyph stroke
+MIN_REGION_BLOCKS = 2
+MAX_CONTRAST_REGIONS = 30
+
+REQUIRED_TEXT_CONTRAST = 4.5  # WCAG AA, normal text
+REQUIRED_LARGE_TEXT_CONTRAST = 3.0  # WCAG AA, large text
+
+# sRGB channel value -> linear light, for the relative-luminance formula.
+_channel = np.arange(256, dtype=np.float64) / 255.0
+_LINEAR = np.where(_channel <= 0.04045, _channel / 12.92, ((_channel + 0.055) / 1.055) ** 2.4)
+# Per-channel lookup tables with the luminance weights folded in.
+_RED, _GREEN, _BLUE = ((_LINEAR * weight).astype(np.float32) for weight in (0.2126, 0.7152, 0.0722))
+
+
+def relative_luminance(rgb: np.ndarray) -> np.ndarray:
+    """
+    WCAG relative luminance (0-1) for an array of uint8 RGB triples (last axis).
+    """
+    return _RED[rgb[..., 0]] + _GREEN[rgb[..., 1]] + _BLUE[rgb[..., 2]]
+
+
+def contrast_ratio(luminance_a, luminance_b):
+    lighter = np.maximum(luminance_a, luminance_b)
+    darker = np.minimum(luminance_a, luminance_b)
+    return (lighter + 0.05) / (darker + 0.05)
+
+
+def _hex(rgb) -> str:
+    return "#" + "".join(f"{int(round(channel)):02x}" for channel in rgb)
+
+
+def _measure_band(band: np.ndarray) -> tuple:
+    """
+    Per-block text detection and contrast for one horizontal band of whole blocks.
+    Returns (text_like, ratio, foreground_rgb, background_rgb) arrays over the block grid;
+    colours are only computed for failing text blocks (zero elsewhere).
+    """
+    block_rows, block_cols = band.shape[0] // BLOCK_SIZE, band.shape[1] // BLOCK_SIZE
+    blocks = band.reshape(block_rows, BLOCK_SIZE, block_cols, BLOCK_SIZE, 3).swapaxes(1, 2)
+    blocks = blocks.reshape(block_rows, block_cols, BLOCK_SIZE * BLOCK_SIZE, 3)
+
+    text_like = np.zeros((block_rows, block_cols), dtype=bool)
+    ratio = np.ones((block_rows, block_cols), dtype=np.float32)
+    foreground_rgb = np.zeros((block_rows, block_cols, 3), dtype=np.float32)
+    background_rgb = np.zeros((block_rows, block_cols, 3), dtype=np.float32)
+
+    # Most of a page is flat background; only blocks with more than one colour are measured.
+    packed = (band[..., 0].astype(np.uint32) << 16) | (band[..., 1].astype(np.uint32) << 8) | band[..., 2]
+    packed = packed.reshape(block_rows, BLOCK_SIZE, block_cols, BLOCK_SIZE)
+    candidates = packed.max(axis=(1, 3)) != packed.min(axis=(1, 3))
+    if not candidates.any():
+        return text_like, ratio, foreground_rgb, background_rgb
+    pixels = blocks[candidates]  # (blocks, pixels, 3)
+    luminance = relative_luminance(pixels)
+
+    low = luminance.min(axis=-1)
+    high = luminance.max(axis=-1)
+    spread = (high - low)[..., None]
+    near_low = luminance <= low[..., None] + 0.25 * spread
+    near_high = luminance >= high[..., None] - 0.25 * spread
+    low_fraction = near_low.mean(axis=-1)
+    high_fraction = near_high.mean(axis=-1)
+
+    # Text covers the minority of a block; the majority colour is the background.
+    foreground_is_low = low_fraction < high_fraction
+    foreground = np.where(foreground_is_low[..., None], near_low, near_high)
+    foreground_fraction = np.minimum(low_fraction, high_fraction)
+
+    strokes = foreground.reshape(-1, BLOCK_SIZE, BLOCK_SIZE).astype(np.int8)
+    row_strokes = (np.abs(np.diff(strokes, axis=-1)).sum(axis=-1) >= 2).sum(axis=-1)
+    column_strokes = (np.abs(np.diff(strokes, axis=-2)).sum(axis=-2) >= 2).sum(axis=-1)
+
+    candidate_ratio = contrast_ratio(low, high)
+    candidate_text = (
+        (candidate_ratio >= MIN_VISIBLE_RATIO)
+        & (low_fraction + high_fraction >= MIN_TWO_COLOUR_FRACTION)
+        & (foreground_fraction >= MIN_FOREGROUND_FRACTION)
+        & (foreground_fraction <= MAX_FOREGROUND_FRACTION)
+        & (row_strokes >= MIN_STROKE_LINES)
+        & (column_strokes >= MIN_STROKE_LINES)
+    )
+    text_like[candidates] = candidate_text
+    ratio[candidates] = candidate_ratio
+
+    failing = candidate_text & (candidate_ratio < REQUIRED_TEXT_CONTRAST)
+    if failing.any():
+        failing_pixels = pixels[failing].astype(np.float32)
+        foreground_mask = foreground[failing][..., None]
+        background_mask = np.where(foreground_is_low[failing][..., None], near_high[failing], near_low[failing])[..., None]
+        failing_blocks = tuple(index[failing] for index in np.nonzero(candidates))
+        foreground_rgb[failing_blocks] = (failing_pixels * foreground_mask).sum(axis=1) / np.maximum(foreground_mask.sum(axis=1), 1)
+        background_rgb[failing_blocks] = (failing_pixels * background_mask).sum(axis=1) / np.maximum(background_mask.sum(axis=1), 1)
+    return text_like, ratio, foreground_rgb, background_rgb
+
+
+def _regions(failing: np.ndarray) -> List[List[tuple]]:
+    """
+    Groups failing blocks into 8-connected regions (lists of (row, column) blocks).
+    """
+    remaining = set(zip(*np.nonzero(failing)))
+    regions = []
+    while remaining:
+        start = remaining.pop()
+        region, pending = [start], [start]
+        while pending:
+            row, column = pending.pop()
+            for neighbour in ((row + dr, column + dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1)):
+                if neighbour in remaining:
+                    remaining.remove(neighbour)
+                    region.append(neighbour)
+                    pending.append(neighbour)
+        regions.append(region)
+    return regions
+
+
+def measure_contrast(rgb: np.ndarray, scale: float = 1.0) -> dict:
+    """
+    Finds text-like regions whose contrast is below WCAG AA (4.5:1) in an RGB image.
+
+    `scale` converts image pixels back to the original screenshot's coordinates.
+    Returns `text_blocks` (blocks measured as text), `elapsed_ms`, and `findings`
+    (one per low-contrast region, same shape as the HTML rule findings).
+    """
+    started = time.perf_counter()
+    height, width = rgb.shape[:2]
+    block_cols = width // BLOCK_SIZE
+    text_like_rows, ratio_rows, foreground_rows, background_rows = [], [], [], []
+    for top in range(0, height - BLOCK_SIZE + 1, BAND_ROWS):
+        band = rgb[top:min(height, top + BAND_ROWS)]
+        band = band[:(band.shape[0] // BLOCK_SIZE) * BLOCK_SIZE, :block_cols * BLOCK_SIZE]
+        text_like, ratio, foreground_rgb, background_rgb = _measure_band(band)
+        text_like_rows.append(text_like)
+        ratio_rows.append(ratio)
+        foreground_rows.append(foreground_rgb)
+        background_rows.append(background_rgb)
+
+    if not ratio_rows:
+        return {"text_blocks": 0, "elapsed_ms": 0.0, "findings": []}
+    text_like = np.concatenate(text_like_rows)
+    ratio = np.concatenate(ratio_rows)
+    foreground_rgb = np.concatenate(foreground_rows)
+    background_rgb = np.concatenate(background_rows)
+
+    findings = []
+    for region in _regions(text_like & (ratio < REQUIRED_TEXT_CONTRAST)):
+        if len(region) < MIN_REGION_BLOCKS:
+            continue
+        rows, columns = zip(*region)
+        worst = min(region, key=lambda block: ratio[block])
+        worst_ratio = float(ratio[worst])
+        x, y = int(min(columns) * BLOCK_SIZE * scale), int(min(rows) * BLOCK_SIZE * scale)
+        region_width = int((max(columns) - min(columns) + 1) * BLOCK_SIZE * scale)
+        region_height = int((max(rows) - min(rows) + 1) * BLOCK_SIZE * scale)
+        findings.append({
+            "guideline": GUIDELINE_CONTRAST,
+            "severity": "High" if worst_ratio < REQUIRED_LARGE_TEXT_CONTRAST else "Medium",
+            "issue": (
+                "Text contrast below 3:1 (fails for all text sizes)" if worst_ratio < REQUIRED_LARGE_TEXT_CONTRAST
+                else "Text contrast below 4.5:1 (fails for normal-size text)"
+            ),
+            "path": f"screenshot x={x} y={y} {region_width}x{region_height}",
+            "snippet": f"{worst_ratio:.2f}:1, {_hex(foreground_rgb[worst])} on {_hex(background_rgb[worst])}",
+            "line": None,
+            "source": "screenshot",
+            "contrast_ratio": round(worst_ratio, 2),
+        })
+    findings.sort(key=lambda finding: finding["contrast_ratio"])
+    for finding in findings:
+        del finding["contrast_ratio"]
+
+    return {
+        "text_blocks": int(text_like.sum()),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        "findings": findings[:MAX_CONTRAST_REGIONS],
+    }
+
+
+def format_visual_findings_for_prompt(findings: Optional[List[dict]], max_findings: int = 15) -> str:
+    """
+    Renders measured visual findings as a compact text block for the LLM prompts.
+    """
+    if not findings:
+        return "[Measured visual checks] No low-contrast text measured in the screenshot."
+    lines = [f"[Measured visual checks] {len(findings)} issue(s) measured from the screenshot pixels:"]
+    for finding in findings[:max_findings]:
+        lines.append(f"- ({finding['severity']}) {finding['guideline']}: {finding['issue']} at {finding['path']} ({finding['snippet']})")
+    if len(findings) > max_findings:
+        lines.append(f"- ... and {len(findings) - max_findings} more of the same kind.")
+    return "\n".join(lines)
@@ -0,0 +1,63 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import threading
+
+import pytest
+
+# Services read their configuration at import time, so the test configuration is set
+# before any of them is imported: the fake chat model, no API keys, nothing on disk.
+os.environ.update({
+    "MODEL_PROVIDER": "fake",
+    "LLM_PROVIDER": "fake",
+    "LLM_MODEL": "fake",
+    "LLM_FALLBACK_PROVIDER": "",
+    "FIRECRAWL_API_KEY": "test",
+    "CACHE_SQLITE_PATH": "",
+    "REPORT_STORE_PATH": "",
+    "FAKE_LLM_FIRST_TOKEN_SECONDS": "0",
+    "FAKE_LLM_TOKENS_PER_SECOND": "100000",
+    "FAKE_LLM_RATE_LIMIT_RATE": "0",
+    "FAKE_LLM_ERROR_RATE": "0",
+    "FAKE_LLM_LOW_CONFIDENCE_RATE": "0",
+})
+
+
+@pytest.fixture
+def serve_routes():
+    """
+    Starts a local HTTP server for a {path: (status, headers, body bytes)} mapping and
+    returns its base URL. Responses carry a Content-Length unless the headers set it to None.
+    POST bodies are recorded in `serve_routes.posted` as (path, body bytes).
+    """
+    servers = []
+    posted = []
+
+    def start(routes: dict) -> str:
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                posted.append((self.path, self.rfile.read(int(self.headers.get("Content-Length") or 0))))
+                self.do_GET()
+
+            def do_GET(self):
+                status, headers, body = routes.get(self.path, (404, {}, b"not found"))
+                self.send_response(status)
+                headers = {"Content-Length": str(len(body)), **headers}
+                for name, value in headers.items():
+                    if value is not None:
+                        self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    start.posted = posted
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
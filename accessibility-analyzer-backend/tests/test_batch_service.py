@@ -0,0 +1,105 @@
+import asyncio
+import uuid
+
+import pytest
+
+from services import analysis_pipeline, url_safety_service
+from services.batch_service import batch_analysis_events
+from services.http_client_service import close_http_clients
+from services.report_parser_service import REPORT_CATEGORIES
+
+
+def page(title: str) -> str:
+    return f"<!DOCTYPE html><html lang='en'><body><nav><a href='/'>Home page</a></nav><main><h1>{title}</h1><img src='{title}.png'><p>{title} content.</p></main></body></html>"
+
+
+@pytest.fixture
+def site(monkeypatch):
+    """
+    Stubs fetch_page for a fresh set of URLs: {path: seconds to wait, or "fail"/"raise"}.
+    Returns a function mapping a path to its URL; `site.peak` is the most scrapes in progress at once.
+    """
+    host = f"https://batch-{uuid.uuid4().hex[:8]}.test"
+    delays = {}
+    state = {"running": 0, "peak": 0}
+
+    async def fetch_page(url, include_screenshot=True, provider="anthropic"):
+        path = url[len(host):]
+        state["running"] += 1
+        state["peak"] = max(state["peak"], state["running"])
+        try:
+            delay = delays.get(path, 0)
+            if delay == "raise":
+                raise RuntimeError("connection reset")
+            if delay == "fail":
+                return None
+            await asyncio.sleep(delay)
+            return {"html": page(path.strip("/") or "home"), "screenshot": None}
+        finally:
+            state["running"] -= 1
+
+    monkeypatch.setattr(analysis_pipeline, "fetch_page", fetch_page)
+    monkeypatch.setattr(url_safety_service, "ALLOW_PRIVATE_ADDRESSES", True)
+
+    def url(path: str, delay=0) -> str:
+        delays[path] = delay
+        return host + path
+
+    url.state = state
+    return url
+
+
+def run_batch(urls, concurrency: int, **options) -> list:
+    async def main():
+        try:
+            return [event async for event in batch_analysis_events(urls, concurrency, **options)]
+        finally:
+            await close_http_clients()
+    return asyncio.run(main())
+
+
+def test_results_stream_in_completion_order(site):
+    urls = [site("/slow", 0.4), site("/medium", 0.2), site("/fast", 0)]
+    events = run_batch(urls, concurrency=3)
+    results = events[:-1]
+    assert [result["index"] for result in results] == [2, 1, 0]
+    assert [result["completed"] for result in results] == [1, 2, 3]
+    assert all(result["type"] == "result" and result["total"] == 3 and result["status"] == "ok" for result in results)
+    assert results[0]["url"] == urls[2]
+    assert [score["category"] for score in results[0]["report"]["scores"]] == REPORT_CATEGORIES
+
+
+def test_one_failing_url_does_not_affect_the_others(site):
+    urls = [site("/ok-1"), site("/no-html", "fail"), site("/broken", "raise"), site("/ok-2")]
+    events = run_batch(urls, concurrency=4)
+    by_index = {event["index"]: event for event in events[:-1]}
+    assert [by_index[index]["status"] for index in range(4)] == ["ok", "error", "error", "ok"]
+    assert "HTML" in by_index[1]["error"]
+    assert by_index[2]["error"] and "report" not in by_index[2]
+    summary = events[-1]
+    assert summary["type"] == "summary"
+    assert (summary["total"], summary["succeeded"], summary["failed"]) == (4, 2, 2)
+    assert sorted(summary["failed_urls"]) == sorted([urls[1], urls[2]])
+
+
+def test_concurrency_cap(site):
+    urls = [site(f"/page-{index}", 0.1) for index in range(6)]
+    events = run_batch(urls, concurrency=2)
+    assert site.state["peak"] == 2
+    assert events[-1]["succeeded"] == 6
+
+
+def test_summary_and_score_only_results(site):
+    urls = [site("/a"), site("/b"), site("/c", "fail")]
+    events = run_batch(urls, concurrency=3, include_reports=False)
+    results = [event for event in events if event["type"] == "result" and event["status"] == "ok"]
+    assert len(results) == 2
+    for result in results:
+        assert "report" not in result
+        assert set(result["scores"]) == set(REPORT_CATEGORIES)
+    summary = events[-1]
+    assert summary["failed_urls"] == [urls[2]]
+    assert set(summary["mean_scores"]) == set(REPORT_CATEGORIES)
+    for category, mean in summary["mean_scores"].items():
+        assert mean == round(sum(result["scores"][category] for result in results) / 2, 1)
+    assert summary["elapsed_seconds"] >= 0
@@ -0,0 +1,75 @@
+import asyncio
+
+from services.cache_service import MemoryLRU, SQLiteStore, TwoLevelCache, content_hash, normalize_url
+
+
+def test_normalize_url():
+    assert normalize_url("Example.COM/Path/?utm_source=x&b=2&a=1#top") == "https://example.com/Path?a=1&b=2"
+    assert normalize_url("http://example.com:80/") == "http://example.com/"
+    assert normalize_url("https://example.com:8443") == "https://example.com:8443/"
+
+
+def test_content_hash_separates_parts():
+    assert content_hash("ab", "c") != content_hash("a", "bc")
+    assert content_hash(None, "x") == content_hash("", "x")
+
+
+def test_memory_lru_evicts_least_recently_used():
+    lru = MemoryLRU(max_bytes=10)
+    lru.set("a", b"aaaa", 60)
+    lru.set("b", b"bbbb", 60)
+    lru.get("a")
+    lru.set("c", b"cccc", 60)
+    assert lru.get("b") is None and lru.get("a") == b"aaaa"
+    assert lru.total_bytes == 8
+    lru.set("huge", b"x" * 11, 60)
+    assert lru.get("huge") is None
+
+
+def test_sqlite_store_sums_sizes_only_when_needed(tmp_path):
+    store = SQLiteStore(str(tmp_path / "cache.sqlite3"), max_bytes=1000, size_check_writes=10)
+    checks = store.size_checks
+    for index in range(5):
+        store.set(f"k{index}", b"x" * 10, 60)
+    assert store.size_checks == checks
+    for index in range(5, 10):
+        store.set(f"k{index}", b"x" * 10, 60)
+    assert store.size_checks > checks
+    assert store.known_bytes == 100
+
+
+def test_sqlite_store_evicts_least_recently_used_past_the_limit(tmp_path):
+    store = SQLiteStore(str(tmp_path / "cache.sqlite3"), max_bytes=250, size_check_writes=1000)
+    for index in range(3):
+        store.set(f"k{index}", b"x" * 100, 60)
+        store.get("k0")
+    assert store.get("k0") is not None
+    assert store.get("k1") is None
+    assert store.get("k2") is not None
+    assert store.known_bytes == 200
+
+
+def test_sqlite_store_picks_up_an_existing_file(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    SQLiteStore(path, max_bytes=1000).set("k", b"x" * 40, 60)
+    assert SQLiteStore(path, max_bytes=1000).known_bytes == 40
+
+
+def test_two_level_cache_round_trip_and_disk_promotion(tmp_path):
+    disk = SQLiteStore(str(tmp_path / "cache.sqlite3"), max_bytes=10_000_000)
+    value = {"html": "<html>" + "x" * 100_000 + "</html>", "screenshot": None}
+
+    async def main():
+        writer = TwoLevelCache("scrape", 60, MemoryLRU(10_000_000), disk)
+        await writer.set("page", value)
+        assert await writer.get("page") == value
+        # A fresh process: empty memory, same disk.
+        reader = TwoLevelCache("scrape", 60, MemoryLRU(10_000_000), disk)
+        assert await reader.get("page") == value
+        assert await reader.get("page") == value
+        assert await reader.get("other") is None
+        return writer.stats, reader.stats
+
+    writer_stats, reader_stats = asyncio.run(main())
+    assert writer_stats == {"memory_hits": 1, "disk_hits": 0, "misses": 0, "writes": 1}
+    assert reader_stats == {"memory_hits": 1, "disk_hits": 1, "misses": 1, "writes": 0}
@@ -0,0 +1,95 @@
+import asyncio
+
+import httpx
+import pytest
+
+from services import url_safety_service
+from services.crawl_service import _fetch_text, _parse_sitemap, crawl_site_events, discover_pages
+from services.http_client_service import close_http_clients
+from services.url_safety_service import UnsafeURLError
+
+
+def page(*links: str) -> tuple:
+    body = "<html><body>" + "".join(f"<a href='{link}'>{link}</a>" for link in links) + "</body></html>"
+    return 200, {"Content-Type": "text/html"}, body.encode("utf-8")
+
+
+def run(coroutine):
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await close_http_clients()
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def allow_local(monkeypatch):
+    monkeypatch.setattr(url_safety_service, "ALLOW_PRIVATE_ADDRESSES", True)
+
+
+def test_parse_sitemap_and_sitemap_index():
+    urlset = "<urlset xmlns='http://www.sitemaps.org/schemas/sitemap/0.9'><url><loc> https://a.test/x </loc></url><url><loc>https://a.test/y</loc></url></urlset>"
+    index = "<sitemapindex xmlns='http://www.sitemaps.org/schemas/sitemap/0.9'><sitemap><loc>https://a.test/s1.xml</loc></sitemap></sitemapindex>"
+    assert _parse_sitemap(urlset) == (["https://a.test/x", "https://a.test/y"], [])
+    assert _parse_sitemap(index) == ([], ["https://a.test/s1.xml"])
+    assert _parse_sitemap("not xml") == ([], [])
+
+
+def test_discovery_follows_same_origin_links(serve_routes, allow_local):
+    site = serve_routes({
+        "/": page("/a", "/b", "https://elsewhere.test/c", "/logo.png", "mailto:x@y.test"),
+        "/a": page("/a/deeper", "/"),
+        "/b": page(),
+        "/a/deeper": page(),
+    })
+    pages = run(discover_pages(f"{site}/", max_pages=10))
+    assert pages == [f"{site}/", f"{site}/a", f"{site}/b", f"{site}/a/deeper"]
+
+
+def test_discovery_uses_the_sitemap_and_drops_other_origins(serve_routes, allow_local):
+    routes = {}
+    site = serve_routes(routes)
+    sitemap = f"<urlset><url><loc>{site}/one</loc></url><url><loc>https://elsewhere.test/two</loc></url><url><loc>{site}/three</loc></url></urlset>"
+    routes["/sitemap.xml"] = (200, {"Content-Type": "application/xml"}, sitemap.encode("utf-8"))
+    pages = run(discover_pages(site, max_pages=10))
+    assert pages == [f"{site}/", f"{site}/one", f"{site}/three"]
+
+
+def test_sitemap_on_another_origin_is_refused(allow_local):
+    with pytest.raises(UnsafeURLError):
+        run(discover_pages("https://site.test/", max_pages=5, sitemap_url="https://other.test/sitemap.xml"))
+
+
+def test_crawl_of_a_private_host_is_refused():
+    events = []
+
+    async def collect():
+        async for event in crawl_site_events("http://127.0.0.1:9/", max_pages=5, concurrency=2):
+            events.append(event)
+
+    run(collect())
+    assert len(events) == 1
+    assert events[0]["type"] == "error" and events[0]["error"]
+
+
+def test_discovery_does_not_follow_redirects_to_private_addresses(monkeypatch):
+    requested = []
+
+    def handler(request):
+        requested.append(request.headers["host"])
+        return httpx.Response(301, headers={"Location": "http://10.0.0.5/admin"})
+
+    original_resolve = url_safety_service.resolve_host
+
+    async def resolve_host(host, port):
+        return ["93.184.216.34"] if host == "public.example" else await original_resolve(host, port)
+
+    monkeypatch.setattr(url_safety_service, "resolve_host", resolve_host)
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await _fetch_text(client, "http://public.example/sitemap.xml")
+
+    assert asyncio.run(main()) is None
+    assert requested == ["public.example"]
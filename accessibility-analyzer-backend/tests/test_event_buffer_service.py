@@ -0,0 +1,144 @@
+import asyncio
+
+from services.coalescing_service import SingleFlight
+from services.event_buffer_service import EventBuffer
+from services.job_service import JobQueue
+
+
+def delta(text: str, stage: str = "html", **labels) -> dict:
+    return {"type": "llm_stream", "stage": stage, **labels, "delta": text, "tokens": len(text), "done": False, "error": False}
+
+
+def analysis_events(deltas: int = 50) -> list:
+    events = [{"type": "progress", "message": "Scraping", "progress": 10, "error": False}]
+    events += [delta(f"h{index} ") for index in range(deltas)]
+    events += [delta(f"c{index} ", chunk=1) for index in range(deltas)]
+    events += [{"type": "score", "category": "Semantic HTML Structure", "score": 80, "error": False}]
+    events += [{"type": "report", "data": {"scores": []}, "error": False}]
+    return events
+
+
+def stream_text(events: list, **labels) -> str:
+    return "".join(event["delta"] for event in events if event["type"] == "llm_stream" and all(event.get(name) == value for name, value in labels.items()))
+
+
+def test_deltas_are_compacted_per_stream_but_replay_keeps_the_text():
+    buffer = EventBuffer(max_stream_deltas=5)
+    events = analysis_events()
+    for event in events:
+        buffer.append(event)
+    replay = [event for _, event in buffer.since(-1)]
+    assert len(buffer) == len(events)
+    assert len(replay) == 1 + 2 * (1 + 5) + 2
+    assert stream_text(replay, chunk=None) == stream_text(events, chunk=None)
+    assert stream_text(replay, chunk=1) == stream_text(events, chunk=1)
+    assert replay[0] == events[0] and replay[-2:] == events[-2:]
+
+
+def test_ids_stay_stable_for_resumption():
+    buffer = EventBuffer(max_stream_deltas=2)
+    for event in analysis_events(10):
+        buffer.append(event)
+    ids = [event_id for event_id, _ in buffer.since(-1)]
+    assert ids == sorted(ids) and ids[-1] == len(buffer) - 1
+    # Resuming after the last delta only returns what follows it.
+    assert [event["type"] for _, event in buffer.since(len(buffer) - 3)] == ["score", "report"]
+
+
+def test_a_job_replays_compacted_events():
+    async def run_job(url, offline, incremental, viewports):
+        for event in analysis_events():
+            yield event
+
+    async def main():
+        queue = JobQueue(run_job, workers=1, max_size=5)
+        queue.start()
+        job = queue.submit("https://example.com")
+        while not job.done:
+            await asyncio.sleep(0.01)
+        replay = [event async for _, event in job.events_since(-1)]
+        await queue.stop()
+        return job, replay
+
+    job, replay = asyncio.run(main())
+    assert job.status == "completed" and job.report == {"scores": []}
+    assert len(replay) < len(analysis_events()) / 4
+    assert stream_text(replay) == stream_text(analysis_events())
+
+
+def test_late_subscriber_of_a_coalesced_flight_gets_the_full_text():
+    flight = SingleFlight("test")
+
+    async def main():
+        release = asyncio.Event()
+
+        async def job():
+            for event in analysis_events()[:-1]:
+                yield event
+            await release.wait()
+            yield analysis_events()[-1]
+
+        async def collect():
+            return [event async for event in flight.subscribe("key", job)]
+
+        first = asyncio.create_task(collect())
+        while not flight.flights or len(flight.flights["key"].events) < len(analysis_events()) - 1:
+            await asyncio.sleep(0.01)
+        late = asyncio.create_task(collect())
+        await asyncio.sleep(0.01)
+        release.set()
+        return await first, await late
+
+    first, late = asyncio.run(main())
+    assert stream_text(late) == stream_text(first) == stream_text(analysis_events())
+    assert len(late) < len(analysis_events()) / 4
+    assert late[-1]["type"] == "report"
+
+
+def test_resuming_inside_a_compacted_range_returns_only_the_unseen_text():
+    buffer = EventBuffer(max_stream_deltas=3)
+    events = [delta(f"{index} ") for index in range(10)]
+    for event in events[:3]:
+        buffer.append(event)
+    seen = buffer.since(-1)
+    assert stream_text([event for _, event in seen]) == "0 1 2 "
+    for event in events[3:]:
+        buffer.append(event)
+    assert buffer.compacted == 6
+    for last_seen in range(-1, 10):
+        resumed = [event for _, event in buffer.since(last_seen)]
+        assert stream_text(resumed) == stream_text(events[last_seen + 1:]), last_seen
+    assert len(buffer.since(-1)) == 4
+
+
+def test_a_lagging_subscriber_of_a_coalesced_flight_gets_the_full_text():
+    flight = SingleFlight("test")
+    events = analysis_events(30)
+
+    async def main():
+        resume = asyncio.Event()
+
+        async def job():
+            for event in events:
+                yield event
+                await asyncio.sleep(0)
+
+        async def collect(lagging: bool):
+            received = []
+            async for event in flight.subscribe("key", job):
+                received.append(event)
+                if lagging and len(received) == 3:
+                    # Stop reading while the job runs on and compacts what this subscriber is in the middle of.
+                    await resume.wait()
+            return received
+
+        slow = asyncio.create_task(collect(lagging=True))
+        fast = asyncio.create_task(collect(lagging=False))
+        fast_events = await fast
+        resume.set()
+        return fast_events, await slow
+
+    fast, slow = asyncio.run(main())
+    assert stream_text(fast) == stream_text(slow) == stream_text(events)
+    assert stream_text(slow, chunk=1) == stream_text(events, chunk=1)
+    assert slow[-1]["type"] == "report"
@@ -0,0 +1,188 @@
+import asyncio
+
+import httpx
+import pytest
+
+from services import fetch_service, url_safety_service
+from services.fetch_service import detect_encoding, direct_fetch, fetch_page, needs_js_rendering
+from services.http_client_service import close_http_clients
+from services.url_safety_service import UnsafeURLError, check_public_url, is_public_address, send_public
+
+STATIC_PAGE = (
+    "<!DOCTYPE html><html lang='en'><head><meta charset='utf-8'><title>Static</title></head><body>"
+    "<main><h1>Opening hours</h1>" + "<p>We are open every weekday from nine to five, and on Saturdays until noon.</p>" * 5
+    + "</main><script src='/analytics.js'></script></body></html>"
+)
+JS_SHELL = "<!DOCTYPE html><html><head><title>App</title></head><body><div id='root'></div><script src='/app.js'></script></body></html>"
+LATIN1_PAGE = ("<html><body><p>" + "Café crème brûlée. " * 20 + "</p></body></html>").encode("iso-8859-1")
+LARGE_PAGE = ("<html><body>" + "<p>filler text</p>" * 20000 + "</body></html>").encode("utf-8")
+
+ROUTES = {
+    "/static": (200, {"Content-Type": "text/html; charset=utf-8"}, STATIC_PAGE.encode("utf-8")),
+    "/shell": (200, {"Content-Type": "text/html"}, JS_SHELL.encode("utf-8")),
+    "/latin1": (200, {"Content-Type": "text/html; charset=iso-8859-1"}, LATIN1_PAGE),
+    "/large": (200, {"Content-Type": "text/html"}, LARGE_PAGE),
+    "/large-unsized": (200, {"Content-Type": "text/html", "Content-Length": None}, LARGE_PAGE),
+    "/json": (200, {"Content-Type": "application/json"}, b"{}"),
+    "/redirect": (302, {"Location": "/static"}, b""),
+}
+
+
+@pytest.fixture
+def site(serve_routes):
+    return serve_routes(ROUTES)
+
+
+@pytest.fixture
+def local_site(site, monkeypatch):
+    """The local test site, with the private-address guard relaxed for it."""
+    monkeypatch.setattr(url_safety_service, "ALLOW_PRIVATE_ADDRESSES", True)
+    return site
+
+
+@pytest.fixture
+def firecrawl_calls(monkeypatch):
+    calls = []
+
+    async def fake_scrape_website(url, include_screenshot=True, provider="anthropic", include_html=True, scrape_options=None):
+        calls.append({"url": url, "include_screenshot": include_screenshot, "include_html": include_html})
+        return {"html": "<html>rendered</html>" if include_html else None, "screenshot": {"tiles": ["tile"]} if include_screenshot else None}
+
+    monkeypatch.setattr(fetch_service, "scrape_website", fake_scrape_website)
+    return calls
+
+
+def run(coroutine):
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await close_http_clients()
+    return asyncio.run(main())
+
+
+def test_detect_encoding_prefers_bom_then_header_then_meta():
+    assert detect_encoding(b"\xef\xbb\xbf<html>", "text/html; charset=iso-8859-1") == "utf-8-sig"
+    assert detect_encoding(b"<html>", "text/html; charset=ISO-8859-1") == "iso8859-1"
+    assert detect_encoding(b"<html><head><meta charset='windows-1252'>", "text/html") == "cp1252"
+    assert detect_encoding(b'<meta http-equiv="Content-Type" content="text/html; charset=shift_jis">') == "shift_jis"
+    assert detect_encoding(b"<html>", "text/html; charset=bogus") == "utf-8"
+
+
+def test_needs_js_rendering():
+    assert needs_js_rendering(STATIC_PAGE) is None
+    assert "framework root" in needs_js_rendering(JS_SHELL)
+    assert "noscript" in needs_js_rendering(STATIC_PAGE.replace("</main>", "</main><noscript>Please enable JavaScript to continue.</noscript>"))
+    assert "near-empty body" in needs_js_rendering("<html><body><p>Loading</p><script src='/bundle.js'></script></body></html>")
+
+
+def test_direct_fetch_decodes_non_utf8_pages(local_site):
+    page_html, outcome = run(direct_fetch(f"{local_site}/latin1"))
+    assert "Café crème brûlée" in page_html
+    assert "iso8859-1" in outcome
+
+
+def test_direct_fetch_cuts_off_oversized_bodies(local_site, monkeypatch):
+    monkeypatch.setattr(fetch_service, "DIRECT_FETCH_MAX_BYTES", 64 * 1024)
+    for path in ("/large", "/large-unsized"):
+        page_html, outcome = run(direct_fetch(f"{local_site}{path}"))
+        assert page_html is None
+        assert outcome.startswith("too large")
+
+
+def test_direct_fetch_rejects_non_html(local_site):
+    page_html, outcome = run(direct_fetch(f"{local_site}/json"))
+    assert page_html is None and outcome.startswith("not HTML")
+
+
+def test_static_page_is_fetched_directly_without_firecrawl(local_site, firecrawl_calls):
+    scraped = run(fetch_page(f"{local_site}/redirect", include_screenshot=False))
+    assert scraped == {"html": STATIC_PAGE, "screenshot": None}
+    assert firecrawl_calls == []
+
+
+def test_screenshot_scrapes_go_to_firecrawl_in_one_call(local_site, firecrawl_calls, monkeypatch):
+    async def no_direct_fetch(url):
+        raise AssertionError("a screenshot scrape must not wait for a direct fetch")
+
+    monkeypatch.setattr(fetch_service, "direct_fetch", no_direct_fetch)
+    scraped = run(fetch_page(f"{local_site}/static", include_screenshot=True))
+    assert scraped == {"html": "<html>rendered</html>", "screenshot": {"tiles": ["tile"]}}
+    assert firecrawl_calls == [{"url": f"{local_site}/static", "include_screenshot": True, "include_html": True}]
+
+
+@pytest.mark.parametrize("path", ["/shell", "/missing", "/json"])
+def test_js_shells_and_failed_fetches_fall_back_to_firecrawl(local_site, firecrawl_calls, path):
+    scraped = run(fetch_page(f"{local_site}{path}", include_screenshot=False))
+    assert scraped["html"] == "<html>rendered</html>"
+    assert firecrawl_calls == [{"url": f"{local_site}{path}", "include_screenshot": False, "include_html": True}]
+
+
+def test_public_address_check():
+    assert is_public_address("93.184.216.34")
+    assert is_public_address("2606:2800:220:1:248:1893:25c8:1946")
+    for address in ("127.0.0.1", "10.1.2.3", "172.16.0.1", "192.168.1.1", "169.254.169.254", "100.64.0.1", "0.0.0.0", "::1", "fe80::1", "fd00::1", "::ffff:10.0.0.1", "224.0.0.1"):
+        assert not is_public_address(address), address
+
+
+@pytest.mark.parametrize("url", ["http://127.0.0.1:8000/", "http://169.254.169.254/latest/meta-data/", "http://[::1]/", "http://localhost/", "file:///etc/passwd"])
+def test_private_and_non_http_urls_are_rejected(url):
+    with pytest.raises(UnsafeURLError):
+        asyncio.run(check_public_url(url))
+
+
+def test_direct_fetch_to_private_address_is_rejected_without_firecrawl(site, firecrawl_calls):
+    for include_screenshot in (False, True):
+        with pytest.raises(UnsafeURLError):
+            run(fetch_page(f"{site}/static", include_screenshot=include_screenshot))
+    assert firecrawl_calls == []
+
+
+def test_every_redirect_hop_is_checked(monkeypatch):
+    requested = []
+
+    def handler(request):
+        requested.append(str(request.url))
+        return httpx.Response(302, headers={"Location": "http://169.254.169.254/latest/meta-data/"})
+
+    async def resolve_host(host, port):
+        return ["93.184.216.34"] if host == "public.example" else await original_resolve(host, port)
+
+    original_resolve = url_safety_service.resolve_host
+    monkeypatch.setattr(url_safety_service, "resolve_host", resolve_host)
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            await send_public(client, "GET", "http://public.example/start")
+
+    with pytest.raises(UnsafeURLError):
+        asyncio.run(main())
+    assert requested == ["http://93.184.216.34/start"]
+
+
+def test_connections_go_to_the_checked_address(monkeypatch):
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        if request.url.path == "/start":
+            return httpx.Response(302, headers={"Location": "/next"})
+        return httpx.Response(200, text="ok")
+
+    async def resolve_host(host, port):
+        return ["93.184.216.34"] if host == "public.example" else ["10.0.0.5"]
+
+    monkeypatch.setattr(url_safety_service, "resolve_host", resolve_host)
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            response = await send_public(client, "GET", "https://public.example/start")
+            await response.aclose()
+            return response
+
+    assert asyncio.run(main()).status_code == 200
+    # Both hops connect to the address that was checked, not to a second DNS answer,
+    # while the server and the TLS handshake still see the host name.
+    assert [str(request.url) for request in requests] == ["https://93.184.216.34/start", "https://93.184.216.34/next"]
+    assert [request.headers["host"] for request in requests] == ["public.example", "public.example"]
+    assert [request.extensions["sni_hostname"] for request in requests] == ["public.example", "public.example"]
@@ -0,0 +1,92 @@
+import asyncio
+import io
+import json
+
+import pytest
+from PIL import Image
+
+from services import firecrawl_service
+from services.firecrawl_service import VIEWPORTS, close_firecrawl_app, get_firecrawl_app, scrape_website
+from services.http_client_service import close_http_clients, get_http_client
+
+
+def png(width: int = 400, height: int = 300) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "white").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def firecrawl(serve_routes, monkeypatch):
+    """A local stand-in for the Firecrawl v2 scrape API; returns its recorded scrape requests."""
+    routes = {"/shot.png": (200, {"Content-Type": "image/png"}, png())}
+    base_url = serve_routes(routes)
+    scrape = {"success": True, "data": {"rawHtml": "<html><body>Rendered</body></html>", "screenshot": f"{base_url}/shot.png"}}
+    routes["/v2/scrape"] = (200, {"Content-Type": "application/json"}, json.dumps(scrape).encode("utf-8"))
+    monkeypatch.setattr(firecrawl_service, "FIRECRAWL_API_URL", base_url)
+    monkeypatch.setattr(firecrawl_service, "_firecrawl_app", None)
+    return serve_routes.posted
+
+
+def run(coroutine):
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await close_firecrawl_app()
+            await close_http_clients()
+    return asyncio.run(main())
+
+
+def test_scrape_goes_through_the_sdk(firecrawl):
+    scraped = run(scrape_website("https://example.com/", scrape_options=VIEWPORTS["mobile"]["options"]))
+    assert scraped["html"] == "<html><body>Rendered</body></html>"
+    assert scraped["screenshot"]["tiles"]
+    [(path, body)] = firecrawl
+    request = json.loads(body)
+    assert path == "/v2/scrape"
+    assert request["url"] == "https://example.com/"
+    assert request["formats"] == ["rawHtml", "screenshot"]
+    assert request["mobile"] is True and request["maxAge"] == 0
+
+
+def test_screenshot_only_scrape(firecrawl):
+    run(scrape_website("https://example.com/", include_html=False))
+    assert json.loads(firecrawl[0][1])["formats"] == ["screenshot"]
+
+
+def test_one_client_is_reused_until_closed(firecrawl):
+    async def main():
+        first = get_firecrawl_app()
+        await scrape_website("https://example.com/a", include_screenshot=False)
+        await scrape_website("https://example.com/b", include_screenshot=False)
+        return first, get_firecrawl_app()
+
+    first, second = run(main())
+    assert first is second
+    assert firecrawl_service._firecrawl_app is None
+    assert len(firecrawl) == 2
+
+
+def test_failed_scrape_returns_none(serve_routes, monkeypatch):
+    monkeypatch.setattr(firecrawl_service, "FIRECRAWL_API_URL", serve_routes({}))
+    monkeypatch.setattr(firecrawl_service, "_firecrawl_app", None)
+    assert run(scrape_website("https://example.com/")) is None
+
+
+def test_the_sdk_sends_through_the_shared_pooled_client(firecrawl):
+    async def main():
+        await scrape_website("https://example.com/", include_screenshot=False)
+        return get_firecrawl_app().async_http_client._client, get_http_client("firecrawl")
+
+    sdk_client, pooled = run(main())
+    assert sdk_client is pooled
+    assert pooled.headers["Authorization"] == "Bearer test"
+    assert len(firecrawl) == 1
+
+
+def test_failed_scrapes_are_not_retried_inside_the_sdk(serve_routes, monkeypatch):
+    monkeypatch.setattr(firecrawl_service, "FIRECRAWL_API_URL", serve_routes({"/v2/scrape": (502, {}, b"bad gateway")}))
+    monkeypatch.setattr(firecrawl_service, "_firecrawl_app", None)
+    assert run(scrape_website("https://example.com/")) is None
+    assert len(serve_routes.posted) == 1
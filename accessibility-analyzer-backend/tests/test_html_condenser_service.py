@@ -0,0 +1,64 @@
+import re
+
+from services.html_condenser_service import chunk_html, condense_html, estimate_tokens
+
+
+def paragraphs(section: int, count: int) -> str:
+    # Distinct classes keep the paragraphs from being collapsed as repeated siblings.
+    return "".join(f"<p class='p{index}'>Paragraph {index} of section {section} talks about topic number {section * 100 + index}.</p>" for index in range(count))
+
+
+def section(index: int, count: int) -> str:
+    return f"<section id='s{index}'><h2>Section {index}</h2>{paragraphs(index, count)}</section>"
+
+
+def page(*sections: str) -> str:
+    return f"<html lang='en'><body><header><a href='/'>Home</a></header><main>{''.join(sections)}</main><footer>Footer text</footer></body></html>"
+
+
+def balanced(html: str, tag: str) -> bool:
+    return len(re.findall(f"<{tag}[ >]", html)) == html.count(f"</{tag}>")
+
+
+SECTIONS_PAGE = page(*(section(index, 2 + index) for index in range(8)))  # Differently sized, so not collapsed
+
+
+def test_small_page_is_one_chunk():
+    html = page(section(0, 2))
+    chunks, dropped = chunk_html(html, 10_000, 10)
+    assert not dropped
+    assert len(chunks) == 1 and chunks[0]["path"] == "document"
+    assert chunks[0]["html"] == condense_html(html)[0]
+
+
+def test_chunks_fit_the_budget_and_split_between_sections():
+    chunks, dropped = chunk_html(SECTIONS_PAGE, 400, 20)
+    assert not dropped and len(chunks) > 1
+    for chunk in chunks:
+        assert estimate_tokens(chunk["html"]) <= 400
+        assert chunk["path"] == "html > body > main"
+        for tag in ("html", "body", "main", "section"):
+            assert balanced(chunk["html"], tag), (tag, chunk["html"])
+    # Every section is in exactly one chunk, in page order.
+    headings = [heading for chunk in chunks for heading in re.findall(r"<h2>(Section \d+)</h2>", chunk["html"])]
+    assert headings == [f"Section {index}" for index in range(8)]
+
+
+def test_small_content_around_a_split_subtree_joins_its_neighbours():
+    chunks, _ = chunk_html(SECTIONS_PAGE, 400, 20)
+    assert [index for index, chunk in enumerate(chunks) if "<header>" in chunk["html"]] == [0]
+    assert [index for index, chunk in enumerate(chunks) if "<footer>" in chunk["html"]] == [len(chunks) - 1]
+
+
+def test_an_oversized_section_is_split_into_its_children_with_context():
+    chunks, _ = chunk_html(page(section(0, 40)), 300, 20)
+    assert len(chunks) > 2
+    assert all(chunk["path"] == "html > body > main > section#s0" for chunk in chunks)
+    assert all("<section id=\"s0\">" in chunk["html"] and balanced(chunk["html"], "section") for chunk in chunks)
+    assert [paragraph for chunk in chunks for paragraph in re.findall(r"Paragraph (\d+) of", chunk["html"])] == [str(index) for index in range(40)]
+
+
+def test_chunks_beyond_the_maximum_are_dropped():
+    chunks, dropped = chunk_html(SECTIONS_PAGE, 200, 2)
+    assert dropped and len(chunks) == 2
+    assert [chunk["index"] for chunk in chunks] == [0, 1]
@@ -0,0 +1,123 @@
+from services.html_rules_service import (
+    GUIDELINE_FORMS, GUIDELINE_HEADINGS, GUIDELINE_IMAGES, GUIDELINE_LANGUAGE, GUIDELINE_LINKS, GUIDELINE_SEMANTICS, GUIDELINES,
+    analyze_html_rules, build_offline_report, format_findings_for_prompt,
+)
+from services.report_parser_service import REPORT_CATEGORIES
+
+CLEAN_PAGE = (
+    "<!DOCTYPE html><html lang='en'><body><header><nav><a href='/pricing'>Pricing plans</a></nav></header>"
+    "<main><h1>Welcome</h1><h2>About us</h2><img src='team.jpg' alt='Our team at the 2024 offsite'>"
+    "<img src='divider.png' alt=''><form><label for='email'>E-mail</label><input id='email' type='email'>"
+    "<label>Name <input type='text'></label><input type='hidden' name='token'><input type='submit' value='Send'></form></main></body></html>"
+)
+
+
+def body(content: str, lang: str = "en") -> str:
+    return f"<html lang='{lang}'><body><nav><a href='/'>Home page</a></nav><main><h1>Title</h1>{content}</main></body></html>"
+
+
+def issues(html: str, guideline: str) -> list:
+    return [(finding["severity"], finding["issue"]) for finding in analyze_html_rules(html)["findings"] if finding["guideline"] == guideline]
+
+
+def test_clean_page_has_no_findings():
+    results = analyze_html_rules(CLEAN_PAGE)
+    assert results["findings"] == []
+    assert results["summary"] == {guideline: 0 for guideline in GUIDELINES}
+    assert results["counts"] == {"images": 2, "links": 1, "form_controls": 2, "headings": 2, "elements": 17}
+    assert results["landmarks"] == ["header", "main", "nav"]
+
+
+def test_missing_and_placeholder_alt_text():
+    html = body(
+        "<img src='a.png'><a href='/x'><img src='icon.png'></a><img src='b.png' alt='IMG_0042.jpg'>"
+        "<img src='c.png' alt='image'><img src='d.png' aria-hidden='true'>"
+    )
+    assert issues(html, GUIDELINE_IMAGES) == [
+        ("High", "Image is missing an alt attribute."),
+        ("Critical", "Image is missing an alt attribute."),
+        ("Medium", "Alt text 'IMG_0042.jpg' is a placeholder or filename, not a description."),
+        ("Medium", "Alt text 'image' is a placeholder or filename, not a description."),
+    ]
+    finding = analyze_html_rules(html)["findings"][0]
+    assert finding["path"] == "html > body > main > img" and finding["snippet"] == "<img src='a.png'>" and finding["line"] == 1
+
+
+def test_heading_level_skips_and_h1_count():
+    assert issues(body("<h2>A</h2><h4>B</h4><h3>C</h3><h1>D</h1>"), GUIDELINE_HEADINGS) == [
+        ("Medium", "Heading level skips from <h2> to <h4>."),
+        ("Medium", "The page has more than one <h1>."),
+    ]
+    no_h1 = "<html lang='en'><body><nav></nav><main><h2>Only a subheading</h2></main></body></html>"
+    assert issues(no_h1, GUIDELINE_HEADINGS) == [("Medium", "The page has headings but no <h1>.")]
+
+
+def test_generic_and_empty_link_text():
+    html = body(
+        "<a href='/a'>Click here</a><a href='/b'>Read more »</a><a href='/c'></a>"
+        "<a href='/d' aria-label='Read the annual report'>more</a><a href='/e'><img src='x.png' alt='Company logo, home'></a>"
+        "<a href='/f' aria-labelledby='f-label'></a><a name='anchor'></a>"
+    )
+    assert issues(html, GUIDELINE_LINKS) == [
+        ("Medium", "Link text 'Click here' does not describe its destination."),
+        ("Medium", "Link text 'Read more »' does not describe its destination."),
+        ("High", "Link has no accessible text."),
+    ]
+
+
+def test_unlabeled_form_controls():
+    html = body(
+        "<input type='text' id='q'><textarea></textarea><select id='s'></select><label for='s'>Size</label>"
+        "<input type='search' aria-label='Search'><input type='image' src='go.png'><input type='checkbox' id='late'>"
+        "<label for='late'>Subscribe</label>"
+    )
+    found = [finding for finding in analyze_html_rules(html)["findings"] if finding["guideline"] == GUIDELINE_FORMS]
+    assert [finding["snippet"] for finding in found] == ["<input type='text' id='q'>", "<textarea>"]
+    assert {finding["severity"] for finding in found} == {"High"}
+
+
+def test_missing_landmarks_and_language():
+    html = "<html><body><div><h1>Title</h1><a href='/about'>About the company</a></div></body></html>"
+    assert issues(html, GUIDELINE_SEMANTICS) == [
+        ("High", "The page has no <main> landmark."),
+        ("Medium", "The page has links but no <nav> landmark."),
+    ]
+    assert issues(html, GUIDELINE_LANGUAGE) == [("High", "The <html> element has no lang attribute.")]
+    # ARIA landmark roles count like the elements.
+    with_roles = "<html lang='en'><body><div role='navigation'><a href='/about'>About the company</a></div><div role='main'><h1>T</h1></div></body></html>"
+    assert issues(with_roles, GUIDELINE_SEMANTICS) == []
+    assert issues(body("", lang="english language"), GUIDELINE_LANGUAGE) == [("Medium", "The lang value 'english language' is not a valid IETF language tag.")]
+    assert issues("<body><main><p>Fragment</p></main></body>", GUIDELINE_LANGUAGE) == [("High", "No <html> element with a lang attribute was found.")]
+
+
+def test_findings_across_parse_chunks():
+    html = body("<p>" + "filler " * 20000 + "</p><img src='late.png'>")
+    assert issues(html, GUIDELINE_IMAGES) == [("High", "Image is missing an alt attribute.")]
+
+
+def test_findings_for_the_prompt():
+    results = analyze_html_rules(body("<img src='a.png'>" * 3))
+    text = format_findings_for_prompt(results, max_per_guideline=2)
+    assert text.startswith("Page totals: 3 images, 1 links, 0 form controls, 1 headings. Landmarks present: main, nav.")
+    assert "[Image Accessibility] 3 issue(s):" in text
+    assert "- ... and 1 more of the same kind." in text
+    assert "[Link Text Clarity] No issues detected by rules." in text
+    assert format_findings_for_prompt({}) == "No deterministic findings available."
+
+
+def test_offline_report_shape():
+    report = build_offline_report(analyze_html_rules(body("<img src='a.png'><img src='b.png'><a href='/x'>click here</a>", lang="")))
+    assert set(report) == {"scores", "implementation_plan"}
+    scores = {score["category"]: score for score in report["scores"]}
+    # Every category the rules can judge; the visual one needs a screenshot.
+    assert set(scores) == set(REPORT_CATEGORIES) - {"Readability & Visual Clarity"}
+    assert scores["Media Accessibility"] == {"category": "Media Accessibility", "score": 76, "feedback": "Rule checks found: Image is missing an alt attribute. (x2)"}
+    assert scores["Structure & Semantics"]["score"] == 88
+    assert scores["Navigability & Interactivity"]["score"] == 94
+    assert scores["Forms & Inputs"] == {"category": "Forms & Inputs", "score": 100, "feedback": "No issues detected by the automated rule checks."}
+    plan = report["implementation_plan"].split("\n")
+    # One step per distinct issue, the most severe first, then a pointer to the full analysis.
+    assert plan[0].startswith("1. **(High)")
+    assert plan[-2] == "3. **(Medium) Link Text Clarity:** Link text 'click here' does not describe its destination."
+    assert plan[-1].startswith("4. Run a full analysis")
+    assert build_offline_report(analyze_html_rules(CLEAN_PAGE))["implementation_plan"].startswith("No rule-detectable issues were found.")
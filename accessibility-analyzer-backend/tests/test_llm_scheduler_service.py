@@ -0,0 +1,198 @@
+from types import SimpleNamespace
+import asyncio
+import time
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from services import llm_scheduler_service
+from services.fake_llm_service import FakeChatModel, FakeRateLimitError, FakeServerError
+from services.llm_scheduler_service import LLMScheduler, RateBudget, ScheduledModel, retry_delay
+
+
+class ScriptedFakeModel(FakeChatModel):
+    """The fake model, raising the queued errors on its next calls (after first_token_seconds, before any output)."""
+
+    failures: list = []
+
+    async def _astream(self, messages, *args, **kwargs):
+        if self.failures:
+            await asyncio.sleep(self.first_token_seconds)
+            raise self.failures.pop(0)
+        async for chunk in super()._astream(messages, *args, **kwargs):
+            yield chunk
+
+
+class MidStreamFailureModel(FakeChatModel):
+    """The fake model, failing after its first chunk."""
+
+    def _chunks(self, text, tools):
+        yield from list(super()._chunks(text, tools))[:1]
+        raise FakeServerError("Connection dropped mid-stream.")
+
+
+class RetryAfterRateLimitError(FakeRateLimitError):
+    def __init__(self, seconds: float):
+        super().__init__("Rate limited")
+        self.response = SimpleNamespace(headers={"retry-after": str(seconds)})
+
+
+def scheduled(model: FakeChatModel, name: str = "fake") -> ScheduledModel:
+    return ScheduledModel("fake", name, lambda: model)
+
+
+def build(target: ScheduledModel) -> tuple:
+    return target.llm, [HumanMessage(content="Describe the accessibility of this page.")]
+
+
+async def collect(scheduler: LLMScheduler, stage: str = "html") -> str:
+    return "".join([chunk.content async for chunk in scheduler.astream(build, stage)])
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(llm_scheduler_service, "LLM_BACKOFF_BASE_SECONDS", 0.01)
+    monkeypatch.setattr(llm_scheduler_service, "LLM_BACKOFF_MAX_SECONDS", 0.05)
+
+
+@pytest.fixture
+def hedging(monkeypatch):
+    monkeypatch.setattr(llm_scheduler_service, "LLM_HEDGE_ENABLED", True)
+    monkeypatch.setattr(llm_scheduler_service, "LLM_HEDGE_MIN_SAMPLES", 3)
+
+
+def with_fast_history(target: ScheduledModel, stage: str = "html", seconds: float = 0.02) -> ScheduledModel:
+    for _ in range(5):
+        target.record_latency(stage, seconds)
+    return target
+
+
+def test_budget_waits_for_request_budget():
+    async def main():
+        budget = RateBudget(requests_per_minute=600, tokens_per_minute=10_000_000)  # 10 requests/s
+        budget.requests.level = 0
+        started = time.monotonic()
+        await budget.acquire(10)
+        return time.monotonic() - started, budget.waited_seconds
+
+    elapsed, waited = asyncio.run(main())
+    assert 0.07 <= elapsed < 0.5
+    assert waited > 0
+
+
+def test_budget_waits_for_token_budget_and_caps_oversized_calls():
+    async def main():
+        budget = RateBudget(requests_per_minute=6000, tokens_per_minute=60_000)  # 1000 tokens/s
+        await budget.acquire(60_000)
+        started = time.monotonic()
+        await budget.acquire(200)
+        return time.monotonic() - started, budget
+
+    elapsed, budget = asyncio.run(main())
+    assert 0.15 <= elapsed < 0.6
+    # A call bigger than the whole budget waits for a full bucket instead of forever.
+    assert budget.tokens.wait_time(10_000_000) <= 60.0
+
+
+def test_usage_correction_returns_unused_reservation():
+    budget = RateBudget(requests_per_minute=60, tokens_per_minute=6000)
+    budget.tokens.take(3000)
+    budget.record_usage(estimated_tokens=3000, actual_tokens=1000)
+    assert budget.tokens.level == pytest.approx(5000, abs=5)
+
+
+def test_retry_delay():
+    assert retry_delay(ValueError("bad request"), 0) is None
+    assert 0 <= retry_delay(FakeServerError("boom"), 2) <= 0.05
+    assert retry_delay(RetryAfterRateLimitError(5), 0) == 5.0
+    assert retry_delay(asyncio.TimeoutError(), 0) is not None
+
+
+def test_rate_limit_with_retry_after_is_retried_and_pauses_the_budget():
+    model = ScriptedFakeModel(first_token_seconds=0, failures=[RetryAfterRateLimitError(0.3)])
+    primary = scheduled(model)
+    scheduler = LLMScheduler(primary)
+
+    async def main():
+        started = time.monotonic()
+        text = await collect(scheduler)
+        return text, time.monotonic() - started
+
+    text, elapsed = asyncio.run(main())
+    assert "Semantic HTML Structure" in text
+    assert elapsed >= 0.3
+    assert primary.stats == {"calls": 2, "retries": 1, "errors": 1, "hedges_won": 0}
+    # Retry-After paused the budget for every caller of the model, not just this retry.
+    assert primary.budget.paused_until > 0
+
+
+def test_non_retryable_errors_are_raised_immediately():
+    primary = scheduled(ScriptedFakeModel(first_token_seconds=0, failures=[ValueError("invalid request")]))
+    with pytest.raises(ValueError):
+        asyncio.run(collect(LLMScheduler(primary)))
+    assert primary.stats["calls"] == 1 and primary.stats["retries"] == 0 and primary.stats["errors"] == 1
+
+
+def test_no_retry_after_the_first_chunk():
+    primary = scheduled(MidStreamFailureModel(first_token_seconds=0))
+    chunks = []
+
+    async def main():
+        async for chunk in LLMScheduler(primary).astream(build, "html"):
+            chunks.append(chunk)
+
+    with pytest.raises(FakeServerError):
+        asyncio.run(main())
+    assert len(chunks) == 1
+    assert primary.stats["calls"] == 1 and primary.stats["retries"] == 0
+
+
+def test_hedge_wins_when_the_primary_is_slow(hedging):
+    primary = with_fast_history(scheduled(FakeChatModel(first_token_seconds=2.0), "slow"))
+    fallback = scheduled(FakeChatModel(first_token_seconds=0), "fast")
+
+    async def main():
+        started = time.monotonic()
+        text = await collect(LLMScheduler(primary, fallback))
+        return text, time.monotonic() - started
+
+    text, elapsed = asyncio.run(main())
+    assert text
+    assert elapsed < 1.0
+    assert fallback.stats["hedges_won"] == 1 and fallback.stats["calls"] == 1
+
+
+def test_hedge_loses_when_the_primary_answers_first(hedging):
+    primary = with_fast_history(scheduled(FakeChatModel(first_token_seconds=0.1), "primary"))
+    fallback = scheduled(FakeChatModel(first_token_seconds=2.0), "fallback")
+
+    async def main():
+        started = time.monotonic()
+        text = await collect(LLMScheduler(primary, fallback))
+        return text, time.monotonic() - started
+
+    text, elapsed = asyncio.run(main())
+    assert text
+    assert elapsed < 1.0
+    assert fallback.stats["calls"] == 1 and fallback.stats["hedges_won"] == 0
+
+
+def test_a_failed_hedge_is_counted_on_the_fallback(hedging):
+    primary = with_fast_history(scheduled(FakeChatModel(first_token_seconds=0.2), "primary"))
+    fallback = scheduled(ScriptedFakeModel(first_token_seconds=0, failures=[FakeServerError("fallback down")]), "fallback")
+    text = asyncio.run(collect(LLMScheduler(primary, fallback)))
+    assert text
+    assert primary.stats["errors"] == 0
+    assert fallback.stats["errors"] == 1 and fallback.stats["hedges_won"] == 0
+
+
+def test_rate_limited_hedge_pauses_only_the_fallback(hedging):
+    primary = with_fast_history(scheduled(ScriptedFakeModel(first_token_seconds=0.2, failures=[ValueError("invalid request")]), "primary"))
+    fallback = scheduled(ScriptedFakeModel(first_token_seconds=0, failures=[RetryAfterRateLimitError(0.1)]), "fallback")
+    # The fallback's 429 comes first, the primary's error last: both fail, and the
+    # non-retryable primary error is what the caller sees.
+    with pytest.raises(ValueError):
+        asyncio.run(collect(LLMScheduler(primary, fallback)))
+    assert fallback.stats["errors"] == 1 and primary.stats["errors"] == 1
+    assert fallback.budget.paused_until > 0
+    assert primary.budget.paused_until == 0.0
@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+
+from services import metrics_service
+from services.metrics_service import (
+    STAGE_ERRORS, Counter, Histogram, estimate_cost, finish_trace, record_llm_usage, register_collector, render_metrics, span, start_trace,
+)
+
+
+def test_counter_rendering_and_label_escaping():
+    counter = Counter("test_requests_total", "Requests.")
+    counter.inc(stage="html")
+    counter.inc(2, stage="html")
+    counter.inc(0.5, stage='say "hi"\\\n')
+    assert counter.render() == [
+        "# HELP test_requests_total Requests.",
+        "# TYPE test_requests_total counter",
+        'test_requests_total{stage="html"} 3',
+        'test_requests_total{stage="say \\"hi\\"\\\\\\n"} 0.5',
+    ]
+
+
+def test_histogram_bucket_placement():
+    histogram = Histogram("test_seconds", "Durations.", (0.1, 1, 10))
+    for value in (0.05, 0.1, 0.5, 1, 50):
+        histogram.observe(value, stage="html")
+    # A value equal to a bound counts in that bucket (le); values above every bound only in +Inf.
+    assert histogram.values[(("stage", "html"),)] == [2, 2, 0, 51.65, 5]
+    assert histogram.render()[2:] == [
+        'test_seconds_bucket{stage="html",le="0.1"} 2',
+        'test_seconds_bucket{stage="html",le="1"} 4',
+        'test_seconds_bucket{stage="html",le="10"} 4',
+        'test_seconds_bucket{stage="html",le="+Inf"} 5',
+        'test_seconds_sum{stage="html"} 51.65',
+        'test_seconds_count{stage="html"} 5',
+    ]
+
+
+def test_render_metrics_includes_collectors(monkeypatch):
+    monkeypatch.setattr(metrics_service, "_collectors", [])
+    register_collector(lambda: [("test_cache_entries", "gauge", "Entries.", [({"cache": "report"}, 7), ({}, 1)])])
+    text = render_metrics()
+    assert text.endswith("\n")
+    assert "# TYPE analyzer_stage_duration_seconds histogram" in text
+    assert "# HELP test_cache_entries Entries.\n# TYPE test_cache_entries gauge\ntest_cache_entries{cache=\"report\"} 7\ntest_cache_entries 1\n" in text
+
+
+def test_estimate_cost_matches_the_longest_model_prefix():
+    # gpt-4o-mini, not gpt-4o
+    assert estimate_cost("gpt-4o-mini-2024-07-18", 1_000_000, 1_000_000) == pytest.approx(0.75)
+    assert estimate_cost("gpt-4o-2024-08-06", 1_000_000, 0) == pytest.approx(2.5)
+    assert estimate_cost("claude-3-5-haiku-20241022", 1_000_000, 1_000_000) == pytest.approx(4.8)
+    assert estimate_cost("some-unknown-model", 1_000_000, 1_000_000) == 0.0
+
+
+def test_estimate_cost_prices_cached_prompt_tokens():
+    # 1M prompt tokens on Sonnet ($3/M): 600k uncached, 300k cache reads at 10%, 100k cache writes at 125%.
+    assert estimate_cost("claude-3-5-sonnet-20241022", 1_000_000, 0, cache_read_tokens=300_000, cache_write_tokens=100_000, provider="anthropic") == pytest.approx(1.8 + 0.09 + 0.375)
+    # OpenAI bills cache reads at half price and has no write surcharge.
+    assert estimate_cost("gpt-4o", 1_000_000, 0, cache_read_tokens=400_000, provider="openai") == pytest.approx(1.5 + 0.5)
+    # Unknown providers: cached tokens at the full prompt price.
+    assert estimate_cost("gpt-4o", 1_000_000, 0, cache_read_tokens=400_000) == pytest.approx(2.5)
+
+
+def test_spans_from_child_tasks_and_threads_land_in_the_analysis_trace():
+    def condense():
+        with span("condense", bytes_in=2048) as record:
+            record["bytes_out"] = 512
+
+    async def llm_stage(stage: str):
+        with span(f"llm_{stage}", detail="chunk=1"):
+            await asyncio.sleep(0.01)
+            record_llm_usage("anthropic", "claude-3-5-sonnet-20241022", stage, 1000, 200, cache_read_tokens=800)
+
+    async def analysis():
+        trace = start_trace()
+        await asyncio.to_thread(condense)
+        await asyncio.gather(llm_stage("html"), llm_stage("screenshot"))
+        finish_trace(trace, "computed")
+        return trace.summary("computed")
+
+    async def other_analysis():
+        trace = start_trace()
+        with span("scrape"):
+            pass
+        return trace.summary("computed")
+
+    async def main():
+        return await asyncio.gather(analysis(), other_analysis())
+
+    summary, other = asyncio.run(main())
+    stages = {record["stage"]: record for record in summary["stages"]}
+    assert set(stages) == {"condense", "llm_html", "llm_screenshot"}
+    assert [record["stage"] for record in other["stages"]] == ["scrape"]
+    assert stages["condense"]["bytes_in"] == 2048 and stages["condense"]["bytes_out"] == 512
+    html = stages["llm_html"]
+    assert html["model"] == "anthropic:claude-3-5-sonnet-20241022" and html["detail"] == "chunk=1"
+    assert (html["prompt_tokens"], html["cached_prompt_tokens"], html["completion_tokens"]) == (1000, 800, 200)
+    assert html["duration_ms"] >= 10
+    assert (summary["prompt_tokens"], summary["cached_prompt_tokens"], summary["completion_tokens"]) == (2000, 1600, 400)
+    assert summary["estimated_cost_usd"] == pytest.approx(2 * estimate_cost("claude-3-5-sonnet-20241022", 1000, 200, 800, 0, "anthropic"), abs=1e-6)
+
+
+def test_failed_spans_are_counted_and_marked():
+    before = STAGE_ERRORS.values.get((("stage", "test_failing"),), 0)
+
+    async def main():
+        trace = start_trace()
+        with pytest.raises(ValueError):
+            with span("test_failing"):
+                raise ValueError("boom")
+        return trace.summary("error")
+
+    summary = asyncio.run(main())
+    assert summary["outcome"] == "error"
+    assert summary["stages"][0]["stage"] == "test_failing" and summary["stages"][0]["error"] is True
+    assert STAGE_ERRORS.values[(("stage", "test_failing"),)] == before + 1
+
+
+def test_spans_outside_an_analysis_only_feed_the_metrics():
+    async def main():
+        with span("test_untraced") as record:
+            record["bytes_out"] = 10
+        return record
+
+    record = asyncio.run(main())
+    assert "start_ms" not in record
+    assert metrics_service.STAGE_DURATION.values[(("stage", "test_untraced"),)][-1] >= 1
@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+from services import langchain_service, model_cascade_service
+from services.html_rules_service import GUIDELINE_HEADINGS, GUIDELINE_IMAGES, GUIDELINE_LINKS
+from services.model_cascade_service import _states_no_issues, collect_model_parts, escalation_reason, record_model_part, section_rule_guidelines, split_confidence
+
+IMAGE_ISSUE = (
+    "- **Guideline Violated:** Image Accessibility\n"
+    "- **Severity:** High\n"
+    "- **Issue Description:** The hero image has no alt attribute.\n"
+    "- **Code Snippet:** `<img src='hero.jpg'>`\n"
+    "- **Recommendation:** Describe the image in its alt attribute.\n"
+)
+
+
+@pytest.mark.parametrize("line, level", [
+    ("Confidence: high", "high"),
+    ("**Confidence:** Low", "low"),
+    ("> **Confidence: medium** (the HTML is mostly templating placeholders)", "medium"),
+    ("- Confidence low", "low"),
+])
+def test_split_confidence(line, level):
+    feedback, confidence = split_confidence(f"{IMAGE_ISSUE}\n{line}\n")
+    assert confidence == level
+    assert feedback == IMAGE_ISSUE.strip()
+
+
+def test_split_confidence_without_a_stated_level():
+    assert split_confidence(IMAGE_ISSUE) == (IMAGE_ISSUE, None)
+    assert split_confidence("My confidence is high.") == ("My confidence is high.", None)
+    # With several lines the last one counts, and all of them are removed.
+    assert split_confidence("Confidence: low\nText\nConfidence: high") == ("Text", "high")
+
+
+def test_states_no_issues_only_within_the_guideline_section():
+    feedback = f"**{GUIDELINE_IMAGES}:** Three images lack alt text.\n\n**{GUIDELINE_HEADINGS}:** No issues found."
+    assert not _states_no_issues(feedback, GUIDELINE_IMAGES)
+    assert _states_no_issues(feedback, GUIDELINE_HEADINGS)
+    assert not _states_no_issues(feedback, GUIDELINE_LINKS)
+    # A later mention of the guideline is checked as well.
+    assert _states_no_issues(f"{GUIDELINE_IMAGES} is covered below.\n\n{GUIDELINE_IMAGES}: no significant issues found", GUIDELINE_IMAGES)
+
+
+def test_escalation_for_a_missing_or_low_confidence():
+    assert escalation_reason(IMAGE_ISSUE, None, set()) == "no confidence stated"
+    assert escalation_reason(IMAGE_ISSUE, "low", set()) == "low confidence"
+    assert escalation_reason(IMAGE_ISSUE, "medium", set()) is None
+
+
+def test_escalation_levels_are_configurable(monkeypatch):
+    monkeypatch.setattr(model_cascade_service, "LLM_ESCALATE_CONFIDENCE", {"low", "medium"})
+    assert escalation_reason(IMAGE_ISSUE, "medium", set()) == "medium confidence"
+
+
+def test_escalation_when_the_answer_contradicts_the_rule_findings():
+    feedback = f"**{GUIDELINE_IMAGES}:** No issues found.\n\n**{GUIDELINE_LINKS}:** No issues found."
+    assert escalation_reason(feedback, "high", {GUIDELINE_IMAGES, GUIDELINE_HEADINGS}) == f"contradicts rule findings ({GUIDELINE_IMAGES})"
+    assert escalation_reason(feedback, "high", {GUIDELINE_IMAGES, GUIDELINE_LINKS}) == f"contradicts rule findings ({GUIDELINE_IMAGES}, {GUIDELINE_LINKS})"
+
+
+def test_clean_answers_are_kept():
+    # Reports the rule-found issue, even if it also says "no issues found" for it elsewhere.
+    assert escalation_reason(f"{IMAGE_ISSUE}\n{GUIDELINE_IMAGES}: no further issues found.", "high", {GUIDELINE_IMAGES}) is None
+    # Says "no issues" only for guidelines without rule findings.
+    assert escalation_reason(f"{IMAGE_ISSUE}\n**{GUIDELINE_LINKS}:** No issues found.", "high", {GUIDELINE_IMAGES}) is None
+
+
+def test_section_rule_guidelines():
+    rule_results = {"findings": [
+        {"guideline": GUIDELINE_IMAGES, "snippet": "<img src='hero.jpg'>"},
+        {"guideline": GUIDELINE_HEADINGS, "snippet": "<h4 class='teaser-title'>"},
+        {"guideline": GUIDELINE_LINKS, "snippet": ""},
+    ]}
+    assert section_rule_guidelines(rule_results) == {GUIDELINE_IMAGES, GUIDELINE_HEADINGS, GUIDELINE_LINKS}
+    assert section_rule_guidelines(rule_results, "<main><img src='hero.jpg'><p>Text</p></main>") == {GUIDELINE_IMAGES}
+    assert section_rule_guidelines({}, "<main></main>") == set()
+
+
+def test_model_parts_are_only_recorded_while_collecting():
+    async def main():
+        record_model_part("html", "fake:fake")  # Outside a collection: ignored
+        parts = collect_model_parts()
+        record_model_part("html", "fake:fake-small", "chunk=2", confidence="high", escalated_from=None)
+        return parts
+
+    assert asyncio.run(main()) == [{"part": "html", "model": "fake:fake-small", "detail": "chunk=2", "confidence": "high"}]
+
+
+def analyze_html(rule_guidelines: set) -> list:
+    async def main():
+        parts = collect_model_parts()
+        feedback = await langchain_service._analyze_html_section("<html><body><p>Hello</p></body></html>", "none", rule_guidelines)
+        return feedback, parts
+
+    feedback, parts = asyncio.run(main())
+    assert feedback and "Confidence:" not in feedback
+    return parts
+
+
+def test_a_clean_triage_answer_is_not_escalated():
+    assert langchain_service.HTML_TRIAGE
+    assert analyze_html(set()) == [{"part": "html", "model": "fake:fake-small", "detail": None, "confidence": "high"}]
+
+
+def test_an_escalated_section_is_redone_on_the_large_model(monkeypatch):
+    monkeypatch.setattr(model_cascade_service, "LLM_ESCALATE_CONFIDENCE", {"high"})
+    assert analyze_html(set()) == [{
+        "part": "html", "model": "fake:fake", "detail": None, "confidence": "high",
+        "escalated_from": "fake:fake-small", "escalation_reason": "high confidence",
+    }]
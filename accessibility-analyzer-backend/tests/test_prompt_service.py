@@ -0,0 +1,101 @@
+import asyncio
+import json
+
+import pytest
+
+from services import prompt_service
+from services.fake_llm_service import FakeChatModel
+from services.langchain_service import SMALL_MODEL_DEFAULTS, STAGE_TIERS, _chunk_text, generate_report_async, report_model
+from services.llm_scheduler_service import ScheduledModel
+from services.prompt_service import HTML_PROMPT, PROMPTS_BY_STAGE, REPORT_PROMPT, REPORT_TOOL_NAME, cached_prefix_tokens, min_cache_prefix_tokens, report_tool
+from services.report_parser_service import REPORT_CATEGORIES
+
+REPORT_INPUT = {"html_feedback": "Images lack alt text.", "screenshot_feedback": "Low contrast footer.", "rule_findings": "2 images without alt"}
+
+
+def test_cache_marker_only_for_providers_that_need_it():
+    for provider in ("anthropic", "fake"):
+        system = HTML_PROMPT.system_message(provider)
+        assert system.content == [{"type": "text", "text": HTML_PROMPT.instructions, "cache_control": {"type": "ephemeral"}}]
+    # OpenAI caches long prefixes automatically and takes no marker.
+    assert HTML_PROMPT.system_message("openai").content == HTML_PROMPT.instructions
+
+
+def test_cache_marker_can_be_disabled(monkeypatch):
+    monkeypatch.setattr(prompt_service, "PROMPT_CACHE", False)
+    assert HTML_PROMPT.system_message("anthropic").content == HTML_PROMPT.instructions
+
+
+def test_prefix_is_byte_identical_across_calls():
+    first = HTML_PROMPT.messages("anthropic", rule_findings="none", html_content="<html lang='en'></html>")
+    second = HTML_PROMPT.messages("anthropic", rule_findings="1 image without alt", html_content="<html><img src='a.png'></html>")
+    assert first[0] == second[0]
+    assert first[1] != second[1]
+    assert HTML_PROMPT.fingerprint == prompt_service.hashlib.sha256(first[0].content[0]["text"].encode("utf-8")).hexdigest()[:12]
+    # The per-page input never leaks into the cached system prefix.
+    assert "a.png" not in second[0].content[0]["text"]
+
+
+def test_fake_model_reads_the_marked_prefix_from_cache_on_the_second_call():
+    model = FakeChatModel(first_token_seconds=0)
+    messages = REPORT_PROMPT.messages("fake", **REPORT_INPUT)
+    model.invoke(messages)
+    second = model.invoke(REPORT_PROMPT.messages("fake", **{**REPORT_INPUT, "rule_findings": "none"})).usage_metadata["input_token_details"]
+    assert second["cache_read"] > 0
+
+
+def test_report_tool_constrains_categories_and_scores():
+    parameters = report_tool()["function"]["parameters"]
+    assert report_tool()["function"]["name"] == REPORT_TOOL_NAME
+    assert set(parameters["required"]) >= {"scores", "implementation_plan"}
+    scores = parameters["properties"]["scores"]
+    assert scores["minItems"] == len(REPORT_CATEGORIES)
+    score = scores["items"]["properties"]
+    assert score["category"]["enum"] == REPORT_CATEGORIES
+    assert (score["score"]["minimum"], score["score"]["maximum"]) == (0, 100)
+    assert {"category", "score", "feedback"} <= set(scores["items"]["required"])
+
+
+def test_cache_minimum_per_model():
+    assert min_cache_prefix_tokens("claude-3-5-haiku-20241022") == 2048
+    assert min_cache_prefix_tokens("claude-3-haiku-20240307") == 2048
+    assert min_cache_prefix_tokens("claude-3-5-sonnet-20241022") == 1024
+    assert min_cache_prefix_tokens("gpt-4o-mini") == 1024
+
+
+@pytest.mark.parametrize("provider, large_model", [("anthropic", "claude-3-5-sonnet-20241022"), ("openai", "gpt-4o")])
+def test_every_stage_prefix_is_long_enough_to_be_cached_by_its_default_model(provider, large_model):
+    models = {"small": SMALL_MODEL_DEFAULTS[provider], "large": large_model}
+    for stage, prompt in PROMPTS_BY_STAGE.items():
+        model = models[STAGE_TIERS[stage]]
+        # Some headroom, since the size is an estimate (characters / 4).
+        assert cached_prefix_tokens(prompt) >= 1.05 * min_cache_prefix_tokens(model), (stage, model)
+
+
+def test_report_prefix_includes_the_tool_definition(monkeypatch):
+    with_tool = cached_prefix_tokens(REPORT_PROMPT)
+    monkeypatch.setattr(prompt_service, "REPORT_STRUCTURED_OUTPUT", False)
+    assert cached_prefix_tokens(REPORT_PROMPT) < with_tool
+
+
+def test_report_is_decoded_from_the_bound_tool_call():
+    target = ScheduledModel("fake", "tool-test", lambda: FakeChatModel(first_token_seconds=0))
+    bound = report_model(target)
+    assert bound is report_model(target)
+
+    async def stream():
+        return [chunk async for chunk in bound.astream(REPORT_PROMPT.messages("fake", **REPORT_INPUT))]
+
+    chunks = asyncio.run(stream())
+    assert all(chunk.content == "" for chunk in chunks)
+    assert chunks[0].tool_call_chunks[0]["name"] == REPORT_TOOL_NAME
+    report = json.loads("".join(_chunk_text(chunk) for chunk in chunks))
+    assert report["scores"] and report["implementation_plan"]
+
+
+def test_generate_report_streams_scores_from_tool_arguments():
+    events = []
+    report = json.loads(asyncio.run(generate_report_async(**REPORT_INPUT, on_event=events.append)))
+    scored = [event["category"] for event in events if event["type"] == "score"]
+    assert scored == [score["category"] for score in report["scores"]]
+    assert report["implementation_plan"]
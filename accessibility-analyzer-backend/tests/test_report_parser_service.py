@@ -0,0 +1,109 @@
+import json
+
+from services.report_parser_service import (
+    DEFAULT_FEEDBACK, IMPLEMENTATION_PLAN, REPORT_CATEGORIES, ReportDecoder, decode_report, merge_report_completion, repair_json,
+)
+
+SCORES = [{"category": category, "score": 70 + index, "feedback": f"Feedback for {category}."} for index, category in enumerate(REPORT_CATEGORIES)]
+PLAN = "1. Add alt text to all images.\n2. Fix the heading order."
+REPORT = {"scores": SCORES, IMPLEMENTATION_PLAN: PLAN}
+REPORT_JSON = json.dumps(REPORT, indent=2)
+
+
+def test_complete_report():
+    assert decode_report(REPORT_JSON) == (REPORT, [])
+
+
+def test_markdown_fences_and_prose_are_stripped():
+    raw = f"Here is the report:\n```json\n{REPORT_JSON}\n```\nLet me know if you need more."
+    assert decode_report(raw) == (REPORT, [])
+
+
+def test_unclosed_fence_is_stripped():
+    assert decode_report(f"```json\n{REPORT_JSON}\n```")[0] == REPORT
+    assert decode_report(f"```json\n{REPORT_JSON[:-1]}\n```")[0] == REPORT
+
+
+def test_trailing_commas_are_repaired():
+    raw = REPORT_JSON.replace('."\n    }', '.",\n    }').replace("}\n  ]", "},\n  ]")
+    assert raw != REPORT_JSON
+    assert decode_report(raw) == (REPORT, [])
+
+
+def test_truncation_mid_string_in_the_plan_marks_the_plan_missing():
+    cut = REPORT_JSON.index("Fix the heading")
+    report, missing = decode_report(REPORT_JSON[:cut])
+    assert report["scores"] == SCORES
+    assert report[IMPLEMENTATION_PLAN] is None
+    assert missing == [IMPLEMENTATION_PLAN]
+
+
+def test_truncation_right_after_a_backslash_in_the_plan():
+    cut = REPORT_JSON.index("\\n2.") + 1
+    report, missing = decode_report(REPORT_JSON[:cut])
+    assert report[IMPLEMENTATION_PLAN] is None and missing == [IMPLEMENTATION_PLAN]
+
+
+def test_truncation_after_the_plan_keeps_it():
+    raw = json.dumps({IMPLEMENTATION_PLAN: PLAN, "scores": SCORES}, indent=2)
+    cut = raw.index('"Forms & Inputs"')
+    report, missing = decode_report(raw[:cut])
+    assert report[IMPLEMENTATION_PLAN] == PLAN
+    assert missing == ["Forms & Inputs", "Media Accessibility"]
+
+
+def test_truncation_mid_object_drops_the_incomplete_score():
+    cut = REPORT_JSON.index('"score": 73')
+    report, missing = decode_report(REPORT_JSON[:cut])
+    assert report["scores"] == SCORES[:3]
+    assert missing == REPORT_CATEGORIES[3:] + [IMPLEMENTATION_PLAN]
+
+
+def test_missing_feedback_gets_the_default():
+    raw = json.dumps({"scores": [{"category": "Forms & Inputs", "score": "85.4"}, {"category": "Media Accessibility", "score": 140, "feedback": "  "}], IMPLEMENTATION_PLAN: PLAN})
+    report, _ = decode_report(raw)
+    assert report["scores"] == [
+        {"category": "Forms & Inputs", "score": 85, "feedback": DEFAULT_FEEDBACK},
+        {"category": "Media Accessibility", "score": 100, "feedback": DEFAULT_FEEDBACK},
+    ]
+
+
+def test_unrepairable_output_is_salvaged():
+    # Missing commas between the score objects are beyond repair; the objects and the plan survive.
+    raw = REPORT_JSON.replace("},\n", "}\n")
+    assert raw != REPORT_JSON
+    report, missing = decode_report(raw)
+    assert report["scores"] == SCORES
+    assert report[IMPLEMENTATION_PLAN] == PLAN
+    assert missing == []
+
+
+def test_nothing_usable():
+    assert decode_report("I cannot produce a report for this page.") == (None, REPORT_CATEGORIES + [IMPLEMENTATION_PLAN])
+
+
+def test_error_category_is_never_incomplete():
+    raw = json.dumps({"scores": [{"category": "Error", "score": 0, "feedback": "boom"}], IMPLEMENTATION_PLAN: "n/a"})
+    assert decode_report(raw)[1] == []
+
+
+def test_repair_json_closes_strings_and_containers_and_drops_dangling_keys():
+    assert json.loads(repair_json('{"a": [1, 2, {"b": "x')) == {"a": [1, 2, {"b": "x"}]}
+    assert json.loads(repair_json('{"a": 1, "b":')) == {"a": 1}
+    assert json.loads(repair_json('{"a": 1, "b"')) == {"a": 1}
+
+
+def test_streaming_decoder_returns_scores_as_they_complete():
+    decoder = ReportDecoder()
+    streamed = []
+    for index in range(0, len(REPORT_JSON), 7):
+        streamed.extend(decoder.feed(REPORT_JSON[index:index + 7]))
+    assert streamed == SCORES
+    assert decoder.finish() == (REPORT, [])
+
+
+def test_completion_fills_only_missing_fields():
+    partial = {"scores": SCORES[:3], IMPLEMENTATION_PLAN: None}
+    completion = json.dumps({"scores": [{**SCORES[0], "score": 1}, *SCORES[3:]], IMPLEMENTATION_PLAN: PLAN})
+    merged = merge_report_completion(partial, completion)
+    assert merged == REPORT
@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+from services import report_store_service
+from services.report_store_service import build_run, close_report_store, get_report_store, open_report_store, query_store, record_report
+
+DAY = 86400
+
+
+def report(scores: dict, findings: int = 0) -> dict:
+    return {
+        "scores": [{"category": category, "score": score, "feedback": "..."} for category, score in scores.items()],
+        "implementation_plan": "Fix it.",
+        "findings": [{"guideline": "Image Accessibility", "severity": "High", "issue": "Missing alt"}] * findings,
+        "timings": {"outcome": "computed", "total_ms": 1200.0},
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = report_store_service.ReportStore(str(tmp_path / "reports.sqlite3"))
+    yield store
+    store._connect().close()
+
+
+def write(store, *runs):
+    async def main():
+        for run in runs:
+            store.record(run)
+        await store.flush()
+    asyncio.run(main())
+
+
+def test_store_is_disabled_without_a_path():
+    assert report_store_service.REPORT_STORE_PATH == ""
+    assert open_report_store("") is None
+    assert get_report_store() is None
+    record_report("https://example.com", report({"Forms & Inputs": 50}), "full")  # A no-op, not an error
+
+
+def test_store_is_opened_and_closed_by_the_lifespan(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    async def main():
+        store = open_report_store("reports.sqlite3")
+        assert open_report_store("reports.sqlite3") is store
+        record_report("https://example.com/a", report({"Forms & Inputs": 50}), "full")
+        runs, _ = await query_store("url_history", "https://example.com/a", 10)
+        await close_report_store()
+        return store, runs
+
+    store, runs = asyncio.run(main())
+    assert store.path == str(tmp_path / "reports.sqlite3")
+    assert [run["scores"] for run in runs] == [{"Forms & Inputs": 50}]
+    assert get_report_store() is None
+
+
+def test_build_run():
+    run = build_run("Example.com/page/?utm_source=x", report({"Forms & Inputs": 40, "Media Accessibility": 90}, findings=2), "full", ["desktop", "mobile"], analyzed_at=1000.0)
+    assert run["url"] == "https://example.com/page"
+    assert run["origin"] == "https://example.com"
+    assert run["mean_score"] == 65.0
+    assert run["viewports"] == "desktop,mobile"
+    assert len(run["findings"]) == 2
+
+
+def test_history_is_newest_first_and_paginated(store):
+    write(store, *[build_run("https://example.com/a", report({"Forms & Inputs": 50 + index}), "full", analyzed_at=1000.0 + index) for index in range(5)])
+    runs, cursor = store.url_history("https://example.com/a", 3)
+    assert [run["scores"]["Forms & Inputs"] for run in runs] == [54, 53, 52]
+    older, cursor = store.url_history("https://example.com/a", 3, before=cursor)
+    assert [run["scores"]["Forms & Inputs"] for run in older] == [51, 50] and cursor is None
+    assert store.get_report(runs[0]["id"])["scores"][0]["score"] == 54
+
+
+def test_worst_pages_use_the_latest_score_per_page(store):
+    write(
+        store,
+        build_run("https://example.com/a", report({"Forms & Inputs": 20}), "full", analyzed_at=1000.0),
+        build_run("https://example.com/a", report({"Forms & Inputs": 80}), "full", analyzed_at=2000.0),
+        build_run("https://example.com/b", report({"Forms & Inputs": 30}), "full", analyzed_at=1500.0),
+        build_run("https://example.com/c", report({"Forms & Inputs": 30}), "full", analyzed_at=1500.0),
+        build_run("https://other.test/d", report({"Forms & Inputs": 10}), "full", analyzed_at=1500.0),
+    )
+    pages, cursor = store.worst_pages("Forms & Inputs", 2, origin="https://example.com")
+    assert [(page["url"], page["score"]) for page in pages] == [("https://example.com/b", 30), ("https://example.com/c", 30)]
+    pages, cursor = store.worst_pages("Forms & Inputs", 2, origin="https://example.com", after=cursor)
+    assert [(page["url"], page["score"]) for page in pages] == [("https://example.com/a", 80)] and cursor is None
+    assert [page["url"] for page in store.worst_pages("Forms & Inputs", 10, max_score=25)[0]] == ["https://other.test/d"]
+
+
+def test_trends_group_by_day_and_week(store, monkeypatch):
+    now = 20_003 * DAY  # A Monday, 00:00 UTC
+    monkeypatch.setattr(report_store_service.time, "time", lambda: now + 3600)
+    write(
+        store,
+        build_run("https://example.com/a", report({"Forms & Inputs": 40}), "full", analyzed_at=now - 2 * DAY),
+        build_run("https://example.com/b", report({"Forms & Inputs": 60}), "full", analyzed_at=now - 2 * DAY),
+        build_run("https://example.com/a", report({"Forms & Inputs": 70}), "full", analyzed_at=now),
+    )
+    daily = store.trends(7, "day", origin="https://example.com")
+    assert [(point["mean_score"], point["runs"], point["pages"]) for point in daily] == [(50.0, 2, 2), (70.0, 1, 1)]
+    weekly = store.trends(7, "week", url="https://example.com/a")
+    assert [(point["min_score"], point["max_score"]) for point in weekly] == [(40, 40), (70, 70)]
+    assert weekly[1]["period_start"] == report_store_service._iso(now)[:10]
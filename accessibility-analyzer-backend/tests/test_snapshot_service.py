@@ -0,0 +1,100 @@
+import pytest
+from PIL import Image, ImageDraw
+
+from services.screenshot_service import screenshot_changed, visual_fingerprint
+from services.snapshot_service import build_snapshot, diff_sections, finding_key, plan_reanalysis, regression_report, split_sections
+
+MODEL_KEY = "fake:fake"
+FINDING = {"guideline": "Image Accessibility", "severity": "High", "issue": "Image without alt", "path": "main > img"}
+
+
+def section(path: str, content: str) -> dict:
+    return {"path": path, "hash": f"hash-{content}", "html": content}
+
+
+def snapshot(sections: list, fingerprint: str = "1:8", findings: list = (), model_key: str = MODEL_KEY) -> dict:
+    stage_feedback = {"html": {entry["hash"]: f"Feedback for {entry['html']}" for entry in sections}, "screenshot": "Visual feedback"}
+    report = {
+        "scores": [{"category": "Forms & Inputs", "score": 60, "feedback": "..."}, {"category": "Media Accessibility", "score": 80, "feedback": "..."}],
+        "implementation_plan": "Fix it.",
+        "findings": list(findings),
+    }
+    return build_snapshot("https://example.com/", model_key, sections, stage_feedback, {"fingerprint": fingerprint}, [], report)
+
+
+def page_image(button_color: str = "black", shift: int = 0) -> Image.Image:
+    image = Image.new("RGB", (640, 960), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((40, 40 + shift, 600, 120 + shift), fill="navy")
+    draw.rectangle((40, 400, 200, 460), fill=button_color)
+    return image
+
+
+def test_sections_are_hashed_by_content():
+    html = "<html><body><main>" + "".join(f"<section id='s{index}'><h2>Part {index}</h2>" + "<p>Text</p>" * (index + 1) + "</section>" for index in range(6)) + "</main></body></html>"
+    first, dropped = split_sections(html, 60)
+    second, _ = split_sections(html.replace("Part 5", "Part five"), 60)
+    assert not dropped and len(first) > 1
+    assert [entry["hash"] for entry in first[:-1]] == [entry["hash"] for entry in second[:-1]]
+    assert first[-1]["hash"] != second[-1]["hash"]
+
+
+def test_diff_matches_sections_by_content():
+    previous = [section("main", "a"), section("main", "b"), section("main > aside", "c")]
+    current = [section("main", "b"), section("main", "a"), section("main", "changed"), section("footer", "new")]
+    assert diff_sections(previous, current) == {"unchanged": 2, "changed": ["main"], "added": ["footer"], "removed": ["main > aside"]}
+
+
+def test_unchanged_page_needs_no_model_call():
+    sections = [section("main", "a"), section("footer", "b")]
+    plan = plan_reanalysis(snapshot(sections, findings=[FINDING]), sections, {"fingerprint": "1:8"}, [], [FINDING], MODEL_KEY)
+    assert plan["unchanged"] and plan["sections_to_analyze"] == 0
+    assert plan["carried"] == {"html": {"hash-a": "Feedback for a", "hash-b": "Feedback for b"}, "screenshot": "Visual feedback"}
+
+
+def test_only_changed_sections_are_reanalyzed():
+    previous = snapshot([section("main", "a"), section("footer", "b")])
+    plan = plan_reanalysis(previous, [section("main", "a2"), section("footer", "b")], {"fingerprint": "1:8"}, [], [], MODEL_KEY)
+    assert not plan["unchanged"]
+    assert plan["sections_to_analyze"] == 1
+    assert plan["diff"]["changed"] == ["main"]
+    assert "screenshot" in plan["carried"]
+
+
+@pytest.mark.parametrize("change", ["visual", "model", "findings"])
+def test_what_else_forces_a_reanalysis(change):
+    sections = [section("main", "a")]
+    previous = snapshot(sections, fingerprint=visual_fingerprint(page_image()), findings=[FINDING])
+    fingerprint = visual_fingerprint(page_image("red") if change == "visual" else page_image())
+    plan = plan_reanalysis(previous, sections, {"fingerprint": fingerprint}, [], [] if change == "findings" else [FINDING], "other:model" if change == "model" else MODEL_KEY)
+    assert not plan["unchanged"]
+    if change == "model":
+        assert plan["carried"] == {} and plan["sections_to_analyze"] == 1
+    if change == "visual":
+        assert plan["screenshot_changed"] and "screenshot" not in plan["carried"]
+
+
+def test_screenshot_change_ignores_re_encoding_noise():
+    image = page_image()
+    noisy = Image.eval(image, lambda value: max(0, value - 3))
+    assert not screenshot_changed(visual_fingerprint(image), visual_fingerprint(noisy))
+    assert screenshot_changed(visual_fingerprint(image), visual_fingerprint(page_image(shift=200)))
+    assert screenshot_changed(visual_fingerprint(image), visual_fingerprint(image.crop((0, 0, 640, 480))))
+    assert screenshot_changed(None, visual_fingerprint(image)) and not screenshot_changed(None, None)
+
+
+def test_regression_report():
+    previous = snapshot([section("main", "a")], findings=[FINDING])
+    plan = plan_reanalysis(previous, [section("main", "b")], {"fingerprint": "1:8"}, [], [], MODEL_KEY)
+    new_finding = {**FINDING, "issue": "Input without label", "guideline": "Form Labeling"}
+    report = {
+        "scores": [{"category": "Forms & Inputs", "score": 45}, {"category": "Media Accessibility", "score": 90}, {"category": "Structure & Semantics", "score": 70}],
+        "findings": [new_finding],
+    }
+    regression = regression_report(previous, report, plan, sections_total=1)
+    assert [(delta["category"], delta["delta"]) for delta in regression["score_deltas"]] == [("Forms & Inputs", -15), ("Media Accessibility", 10), ("Structure & Semantics", None)]
+    assert regression["regressed_categories"] == ["Forms & Inputs"]
+    assert regression["improved_categories"] == ["Media Accessibility"]
+    assert regression["new_findings"] == [new_finding] and regression["resolved_findings_count"] == 1
+    assert regression["sections_reanalyzed"] == 1 and regression["sections_changed"] == ["main"]
+    assert previous["findings"] == [finding_key(FINDING)]
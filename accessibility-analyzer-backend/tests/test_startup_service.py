@@ -0,0 +1,51 @@
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from services import startup_service
+from services.metrics_service import render_metrics
+from services.startup_service import get_startup_report, record_phase, timed_phase
+
+
+@pytest.fixture
+def phases(monkeypatch):
+    monkeypatch.setattr(startup_service, "phase_seconds", {})
+    return startup_service.phase_seconds
+
+
+def test_a_phase_is_recorded_once(phases):
+    record_phase("anthropic_import", 0.25)
+    record_phase("anthropic_import", 0.001)  # Already imported: ignored
+    assert phases == {"anthropic_import": 0.25}
+
+
+def test_timed_phase(phases):
+    with timed_phase("client_creation"):
+        time.sleep(0.02)
+    with pytest.raises(RuntimeError):
+        with timed_phase("llm_warmup"):
+            raise RuntimeError("no API key")
+    with timed_phase("client_creation"):
+        time.sleep(0.05)
+    assert 0.02 <= phases["client_creation"] < 0.05
+    assert "llm_warmup" in phases
+
+
+def test_report_shape(phases):
+    record_phase("app_import", 1.23456)
+    report = get_startup_report()
+    assert set(report) == {"phases_ms", "modules_loaded", "peak_rss_mb"}
+    assert report["phases_ms"] == {"app_import": 1234.6}
+    assert report["modules_loaded"] > 100 and report["peak_rss_mb"] > 0
+    assert 'analyzer_startup_phase_seconds{phase="app_import"} 1.23456' in render_metrics()
+
+
+def test_startup_stats_endpoint():
+    from main import app
+
+    with TestClient(app) as client:
+        stats = client.get("/startup/stats").json()
+    assert set(stats) == {"phases_ms", "modules_loaded", "peak_rss_mb"}
+    assert {"app_import", "ready"} <= set(stats["phases_ms"])
+    assert stats["phases_ms"]["ready"] >= stats["phases_ms"]["app_import"]
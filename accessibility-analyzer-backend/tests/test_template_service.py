@@ -0,0 +1,61 @@
+from services.html_condenser_service import PRESERVED_COMMENT_PREFIX
+from services.template_service import TemplateRegistry, find_components
+
+NAV_LINKS = "".join(f"<li><a href='/section-{index}'>Section number {index}</a></li>" for index in range(8))
+
+
+def nav(current: int = 0, extra_attributes: str = "") -> str:
+    links = NAV_LINKS.replace(f"<li><a href='/section-{current}'", f"<li class='active'><a aria-current='page' href='/section-{current}'")
+    return f"<nav class='main-nav' {extra_attributes}><ul>{links}</ul></nav>"
+
+
+FOOTER = "<footer id='site-footer'><p>Example Ltd, 1 High Street, Springfield. All rights reserved.</p>" + "<a href='/legal'>Legal notice and imprint</a>" * 4 + "</footer>"
+
+
+def page(body: str, current: int = 0, extra_attributes: str = "") -> str:
+    return f"<html><body>{nav(current, extra_attributes)}<main>{body}</main>{FOOTER}</body></html>"
+
+
+def test_components_are_found_with_their_source_span():
+    html = page("<h1>Home</h1>")
+    components = find_components(html)
+    assert [component["label"] for component in components] == ["nav.main-nav", "footer#site-footer"]
+    assert html[components[0]["start"]:components[0]["end"]] == nav()
+    assert html[components[1]["start"]:components[1]["end"]] == FOOTER
+
+
+def test_only_outermost_candidates_and_no_tiny_components():
+    html = f"<html><body><header><nav>{NAV_LINKS}</nav></header><aside>Small</aside></body></html>"
+    assert [component["tag"] for component in find_components(html)] == ["header"]
+
+
+def test_fingerprint_ignores_volatile_attributes_and_whitespace():
+    first = find_components(page("<h1>One</h1>", current=0, extra_attributes="data-build='1' style='color: red'"))
+    second = find_components(page("<h1>Two</h1>", current=3, extra_attributes="data-build='2'").replace("<ul>", "<ul>\n   "))
+    assert [component["fingerprint"] for component in first] == [component["fingerprint"] for component in second]
+
+
+def test_fingerprint_changes_with_content():
+    changed = nav().replace("Section number 5", "Renamed section")
+    assert find_components(page(""))[0]["fingerprint"] != find_components(changed)[0]["fingerprint"]
+
+
+def test_components_become_shared_on_the_second_page_of_an_origin():
+    registry = TemplateRegistry()
+    html, shared = registry.split_page("https://example.com/a", page("<h1>A</h1>"))
+    assert shared == [] and "<nav" in html
+    registry.split_page("https://other.test/a", page("<h1>Other site</h1>"))
+
+    html, shared = registry.split_page("https://example.com/b", page("<h1>B</h1>", current=2))
+    assert [component["label"] for component in shared] == ["nav.main-nav", "footer#site-footer"]
+    assert all(component["pages_seen"] == 2 for component in shared)
+    assert "<nav class" not in html and "<footer id" not in html and "<h1>B</h1>" in html
+    assert html.count(PRESERVED_COMMENT_PREFIX) == 2
+    assert registry.get_stats() == {"origins": 2, "shared_components": 2}
+
+
+def test_revisiting_the_same_page_does_not_make_components_shared():
+    registry = TemplateRegistry()
+    registry.split_page("https://example.com/a", page("<h1>A</h1>"))
+    _, shared = registry.split_page("https://example.com/a/?utm_source=newsletter", page("<h1>A</h1>"))
+    assert shared == []
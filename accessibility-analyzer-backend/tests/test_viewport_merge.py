@@ -0,0 +1,66 @@
+import pytest
+
+from services.analysis_pipeline import normalize_viewports, report_cache_key
+from services.feedback_merge_service import merge_viewport_feedback, parse_feedback_issues
+from services.screenshot_service import screenshot_changed
+
+
+def issue(guideline: str, description: str, severity: str = "High") -> str:
+    return (
+        f"- **Guideline Violated:** {guideline}\n"
+        f"- **Severity:** {severity}\n"
+        f"- **Issue Description:** {description}\n"
+        f"- **Recommendation:** Fix it.\n"
+    )
+
+
+CONTRAST = issue("Color Contrast", "The grey footer text on white fails 4.5:1.")
+TARGETS = issue("Interactive Element Clarity & Target Size", "The menu icon is only 20x20px.")
+TYPOGRAPHY = issue("Typography and Readability", "Body text is 12px at this width.", "Medium")
+
+
+def test_normalize_viewports():
+    assert normalize_viewports(None) is None
+    assert normalize_viewports([]) is None
+    assert normalize_viewports(["Desktop"]) is None
+    assert normalize_viewports([" Mobile ", "desktop", "mobile", ""]) == ["mobile", "desktop"]
+    with pytest.raises(ValueError, match="watch"):
+        normalize_viewports(["desktop", "watch"])
+
+
+def test_issues_seen_at_several_viewports_are_kept_once_with_their_labels():
+    merged = merge_viewport_feedback([("desktop", CONTRAST), ("mobile", CONTRAST.replace("- **", "* **") + "\n\n" + TARGETS + "\n" + TYPOGRAPHY)])
+    assert merged.startswith("The page was screenshotted and analyzed at 2 viewports (desktop, mobile)")
+    assert merged.count("Color Contrast") == 2  # The heading and the issue itself
+    assert "(Seen at viewports desktop, mobile)" in merged
+    assert "The menu icon is only 20x20px.\n- **Recommendation:** Fix it.\n(Seen at viewport mobile)" in merged
+    assert [heading for heading in merged.split("\n") if heading.startswith("### ")] == [
+        "### Color Contrast", "### Interactive Element Clarity & Target Size", "### Typography and Readability",
+    ]
+    assert len(parse_feedback_issues(merged)) == 3
+
+
+def test_viewports_without_issues():
+    assert merge_viewport_feedback([("desktop", "No issues found."), ("mobile", "No significant issues found for any guideline.")]) == "No visual issues found at any viewport (desktop, mobile)."
+
+
+def test_free_text_feedback_is_kept_under_its_viewport():
+    merged = merge_viewport_feedback([("desktop", CONTRAST), ("mobile", "The layout looks cramped but I could not judge contrast.")])
+    assert "**Viewport mobile:**\nThe layout looks cramped" in merged
+
+
+def test_report_cache_key_depends_on_every_viewport_screenshot():
+    desktop = {"viewport": "desktop", "digest": "d1"}
+    mobile = {"viewport": "mobile", "digest": "m1"}
+    single = report_cache_key("<html></html>", desktop)
+    matrix = report_cache_key("<html></html>", desktop, viewport_screenshots=[desktop, mobile])
+    assert single != matrix
+    assert matrix != report_cache_key("<html></html>", desktop, viewport_screenshots=[desktop, {**mobile, "digest": "m2"}])
+    assert matrix == report_cache_key("<html></html>", desktop, viewport_screenshots=[desktop, mobile])
+
+
+def test_viewport_fingerprints_are_compared_per_viewport():
+    desktop, mobile = "1:" + "8" * 64, "2:" + "8" * 128
+    assert not screenshot_changed(f"desktop={desktop} mobile={mobile}", f"desktop={desktop} mobile={mobile}")
+    assert screenshot_changed(f"desktop={desktop} mobile={mobile}", f"desktop={desktop} mobile=2:" + "0" * 128)
+    assert screenshot_changed(f"desktop={desktop}", f"desktop={desktop} mobile={mobile}")
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+from services.visual_metrics_service import GUIDELINE_CONTRAST, contrast_ratio, format_visual_findings_for_prompt, measure_contrast, relative_luminance
+
+
+def grey(value: int) -> np.ndarray:
+    return np.array([value, value, value], dtype=np.uint8)
+
+
+def text_page(colour: str, background: str = "white") -> np.ndarray:
+    image = Image.new("RGB", (640, 200), background)
+    draw = ImageDraw.Draw(image)
+    for row in range(3):
+        draw.text((20, 20 + row * 50), "The quick brown fox jumps over the lazy dog", fill=colour, font=ImageFont.load_default(size=24))
+    return np.asarray(image)
+
+
+def test_relative_luminance():
+    assert relative_luminance(grey(255)) == pytest.approx(1.0)
+    assert relative_luminance(grey(0)) == pytest.approx(0.0)
+    # Pure primaries carry the WCAG channel weights.
+    primaries = np.array([[255, 0, 0], [0, 255, 0], [0, 0, 255]], dtype=np.uint8)
+    assert relative_luminance(primaries) == pytest.approx([0.2126, 0.7152, 0.0722], abs=1e-6)
+
+
+@pytest.mark.parametrize("value, expected", [(0x77, 4.48), (0xAA, 2.32), (0x76, 4.54), (0x00, 21.0)])
+def test_contrast_against_white(value, expected):
+    ratio = contrast_ratio(relative_luminance(grey(value)), relative_luminance(grey(255)))
+    assert float(ratio) == pytest.approx(expected, abs=0.005)
+    # The order of the colours does not matter.
+    assert float(contrast_ratio(relative_luminance(grey(255)), relative_luminance(grey(value)))) == pytest.approx(float(ratio))
+
+
+def test_black_text_passes():
+    measured = measure_contrast(text_page("#000000"))
+    assert measured["text_blocks"] > 20
+    assert measured["findings"] == []
+
+
+def test_grey_777_fails_aa_for_normal_text_only():
+    findings = measure_contrast(text_page("#777777"))["findings"]
+    assert findings
+    assert {finding["severity"] for finding in findings} == {"Medium"}
+    assert findings[0]["guideline"] == GUIDELINE_CONTRAST and findings[0]["source"] == "screenshot"
+    assert findings[0]["snippet"].startswith("4.48:1")
+
+
+def test_grey_aaa_fails_for_all_text_sizes():
+    findings = measure_contrast(text_page("#aaaaaa"))["findings"]
+    assert findings and {finding["severity"] for finding in findings} == {"High"}
+    assert findings[0]["snippet"].startswith("2.32:1, #")
+
+
+def test_regions_are_reported_in_original_screenshot_coordinates():
+    unscaled = measure_contrast(text_page("#aaaaaa"))["findings"][0]["path"]
+    scaled = measure_contrast(text_page("#aaaaaa"), scale=2.0)["findings"][0]["path"]
+    x, y, size = unscaled.split()[1:]
+    width, height = (int(value) for value in size.split("x"))
+    assert scaled == f"screenshot x={int(x[2:]) * 2} y={int(y[2:]) * 2} {width * 2}x{height * 2}"
+
+
+def test_flat_and_tiny_images_have_no_text():
+    assert measure_contrast(np.full((300, 300, 3), 200, dtype=np.uint8)) == {"text_blocks": 0, "elapsed_ms": pytest.approx(0, abs=50), "findings": []}
+    assert measure_contrast(np.zeros((8, 8, 3), dtype=np.uint8))["findings"] == []
+
+
+def test_findings_for_the_prompt():
+    assert "No low-contrast text" in format_visual_findings_for_prompt([])
+    findings = measure_contrast(text_page("#aaaaaa"))["findings"]
+    text = format_visual_findings_for_prompt(findings, max_findings=2)
+    assert text.startswith(f"[Measured visual checks] {len(findings)} issue(s)")
+    assert "(High) Color Contrast: Text contrast below 3:1" in text
+    assert text.endswith(f"- ... and {len(findings) - 2} more of the same kind.")
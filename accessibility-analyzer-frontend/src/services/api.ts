@@ -2,9 +2,32 @@ import axios from 'axios';
 
 const API_URL = 'http://localhost:8000'; // FastAPI backend
 
+export interface HtmlStats {
+    original_bytes: number;
+    condensed_bytes: number;
+    original_tokens_estimate: number;
+    condensed_tokens_estimate: number;
+    token_budget?: number | null;
+    collapsed_groups: number;
+    collapsed_elements: number;
+    truncated: boolean;
+}
+
+export interface Finding {
+    guideline: string;
+    severity: string;
+    issue: string;
+    path: string;
+    snippet: string;
+    line?: number | null;
+    source: string;
+}
+
 export interface AnalysisReportData {
     scores: { category: string; score: number; feedback: string }[];
     implementation_plan: string;
+    html_stats?: HtmlStats | null;
+    findings?: Finding[] | null;
 }
 
 export interface ProgressEventData {